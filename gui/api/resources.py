@@ -24,6 +24,7 @@
 #
 #####################################################################
 import base64
+import bisect
 import calendar
 import errno
 import json
@@ -49,7 +50,7 @@ from freenasUI.account.forms import (
 )
 from freenasUI.account.forms import bsdUserToGroupForm
 from freenasUI.account.models import bsdUsers, bsdGroups, bsdGroupMembership
-from freenasUI.api.utils import DojoResource
+from freenasUI.api.utils import CURSOR_PARAM, DojoResource, encode_cursor
 from freenasUI.common import humanize_size, humanize_number_si
 from freenasUI.common.system import (
     get_sw_login_version,
@@ -112,8 +113,8 @@ from freenasUI.system.views import restart_httpd, restart_httpd_all
 from middlewared.client import ClientException
 from tastypie import fields
 from tastypie.http import (
-    HttpAccepted, HttpCreated, HttpMethodNotAllowed, HttpMultipleChoices,
-    HttpNotFound, HttpNoContent,
+    HttpAccepted, HttpBadRequest, HttpCreated, HttpMethodNotAllowed,
+    HttpMultipleChoices, HttpNotFound, HttpNoContent,
 )
 from tastypie.exceptions import ImmediateHttpResponse, NotFound
 from tastypie.utils import trailing_slash
@@ -242,6 +243,9 @@ class AlertResource(DojoResource):
                     results.remove(res)
                     continue
 
+        if CURSOR_PARAM in request.GET or self.wants_ndjson(request):
+            return self.get_list_by_cursor(request, results)
+
         paginator = self._meta.paginator_class(
             request,
             results,
@@ -251,7 +255,17 @@ class AlertResource(DojoResource):
             collection_name=self._meta.collection_name,
         )
         to_be_serialized = paginator.page()
-        to_be_serialized["objects"] = [
+        to_be_serialized["objects"] = self.dehydrate_page(request, to_be_serialized["objects"])
+        response = self.create_response(request, to_be_serialized)
+        response['Content-Range'] = 'items %d-%d/%d' % (
+            paginator.offset,
+            paginator.offset + len(to_be_serialized["objects"]) - 1,
+            len(results)
+        )
+        return response
+
+    def dehydrate_page(self, request, objects):
+        return [
             {
                 "id": alert["id"],
                 "level": alert["level"],
@@ -259,15 +273,8 @@ class AlertResource(DojoResource):
                 "dismissed": alert["dismissed"],
                 "timestamp": alert["timestamp"],
             }
-            for alert in to_be_serialized["objects"]
+            for alert in objects
         ]
-        response = self.create_response(request, to_be_serialized)
-        response['Content-Range'] = 'items %d-%d/%d' % (
-            paginator.offset,
-            paginator.offset + len(to_be_serialized) - 1,
-            len(results)
-        )
-        return response
 
     def dismiss(self, request, **kwargs):
         if request.method != 'PUT':
@@ -1410,16 +1417,21 @@ class VolumeResourceMixin(NestedMixin):
         return bundle
 
     def dispatch_list(self, request, **kwargs):
+        self._uid = Uid(100)
+        return super(VolumeResourceMixin, self).dispatch_list(
+            request, **kwargs
+        )
+
+    def prefetch(self, request, objects):
+        super(VolumeResourceMixin, self).prefetch(request, objects)
         # Only for webclient to do not break API
-        if self.is_webclient(request):
+        if self.is_webclient(request) and objects:
             self.__zfsopts = notifier().zfs_get_options(
+                # Single pool pages do not need to list all the other pools datasets
+                name=objects[0].vol_name if len(objects) == 1 else None,
                 recursive=True,
                 props=['compression', 'compressratio', 'readonly', 'org.freenas:description'],
             )
-        self._uid = Uid(100)
-        return super(VolumeResourceMixin, self).dispatch_list(
-            request, **kwargs
-        )
 
     def dehydrate(self, bundle):
         bundle = super(VolumeResourceMixin, self).dehydrate(bundle)
@@ -1602,10 +1614,13 @@ class ReplicationResourceMixin(object):
     class Meta:
         resource_name = 'storage/replication2'
 
-    def dispatch_list(self, request, **kwargs):
+    def prefetch(self, request, objects):
+        super().prefetch(request, objects)
         with client as c:
-            self.__tasks = {task["id"]: task for task in c.call("replication.query")}
-        return super().dispatch_list(request, **kwargs)
+            self.__tasks = {
+                task["id"]: task
+                for task in c.call("replication.query", [["id", "in", [obj.id for obj in objects]]])
+            }
 
     def dehydrate(self, bundle):
         bundle = super().dehydrate(bundle)
@@ -1637,11 +1652,21 @@ class LegacyReplicationResourceMixin(object):
         resource_name = 'storage/replication'
         allowed_methods = ['get']
 
-    def dispatch_list(self, request, **kwargs):
+    def prefetch(self, request, objects):
+        super().prefetch(request, objects)
         with client as c:
-            self.__tasks = {task["id"]: task for task in c.call("replication.query")}
-            self.__ssh_keypairs = {credential["id"]: credential for credential in c.call("keychaincredential.query")}
-        return super().dispatch_list(request, **kwargs)
+            self.__tasks = {
+                task["id"]: task
+                for task in c.call("replication.query", [["id", "in", [obj.id for obj in objects]]])
+            }
+            self.__ssh_keypairs = {
+                credential["id"]: credential
+                for credential in c.call("keychaincredential.query", [["id", "in", list({
+                    task["ssh_credentials"]["attributes"]["private_key"]
+                    for task in self.__tasks.values()
+                    if task["ssh_credentials"]
+                })]])
+            }
 
     def dehydrate(self, bundle):
         bundle = super().dehydrate(bundle)
@@ -1683,10 +1708,15 @@ class TaskResourceMixin(object):
     class Meta:
         resource_name = 'storage/task2'
 
-    def dispatch_list(self, request, **kwargs):
-        with client as c:
-            self.__tasks = {task["id"]: task for task in c.call("pool.snapshottask.query")}
-        return super().dispatch_list(request, **kwargs)
+    def prefetch(self, request, objects):
+        super().prefetch(request, objects)
+        # Only webclient representation needs middleware data
+        if self.is_webclient(request):
+            with client as c:
+                self.__tasks = {
+                    task["id"]: task
+                    for task in c.call("pool.snapshottask.query", [["id", "in", [obj.id for obj in objects]]])
+                }
 
     def dehydrate(self, bundle):
         bundle = super(TaskResourceMixin, self).dehydrate(bundle)
@@ -2060,10 +2090,13 @@ class LAGGInterfaceMembersResourceMixin(object):
 
 class CloudSyncResourceMixin(NestedMixin):
 
-    def dispatch_list(self, request, **kwargs):
+    def prefetch(self, request, objects):
+        super(CloudSyncResourceMixin, self).prefetch(request, objects)
         with client as c:
-            self.__tasks = {task["id"]: task for task in c.call("cloudsync.query")}
-        return super(CloudSyncResourceMixin, self).dispatch_list(request, **kwargs)
+            self.__tasks = {
+                task["id"]: task
+                for task in c.call("cloudsync.query", [["id", "in", [obj.id for obj in objects]]])
+            }
 
     def dehydrate(self, bundle):
         bundle = super(CloudSyncResourceMixin, self).dehydrate(bundle)
@@ -2596,31 +2629,19 @@ class SnapshotResource(DojoResource):
         return HttpResponse('Snapshot rolled back.', status=202)
 
     def get_list(self, request, **kwargs):
-
-        snapshots = notifier().zfs_snapshot_list()
-
-        results = []
-        for snaps in list(snapshots.values()):
-            results.extend(snaps)
-        FIELD_MAP = {
-            'extra': 'mostrecent',
-        }
-
-        for sfield in self._apply_sorting(request.GET):
-            if sfield.startswith('-'):
-                field = sfield[1:]
-                reverse = True
-            else:
-                field = sfield
-                reverse = False
-            field = FIELD_MAP.get(field, field)
-            apifield = self.fields.get(field)
-            default = ''
-            if apifield and isinstance(apifield, fields.IntegerField):
-                default = 0
-            results.sort(
-                key=lambda item: getattr(item, field) or default,
-                reverse=reverse)
+        if CURSOR_PARAM in request.GET or self.wants_ndjson(request):
+            return self.get_list_by_cursor(request, notifier().zfs_snapshot_names())
+
+        sorting = self._apply_sorting(request.GET)
+        if not sorting or (len(sorting) == 1 and sorting[0].lstrip('-') in ('id', 'fullname')):
+            # Only snapshot names are needed for the default order and to sort by name, properties are retrieved for
+            # the requested page only
+            results, mostrecent = notifier().zfs_snapshot_names(by_dataset=not sorting)
+            if sorting and sorting[0].startswith('-'):
+                results.reverse()
+        else:
+            results = self._get_sorted_snapshots(sorting)
+            mostrecent = None
 
         limit = self._meta.limit
         if 'HTTP_X_RANGE' in request.META:
@@ -2637,12 +2658,12 @@ class SnapshotResource(DojoResource):
             collection_name=self._meta.collection_name,
         )
         to_be_serialized = paginator.page()
-        # Dehydrate the bundles in preparation for serialization.
-        bundles = []
+        objects = to_be_serialized[self._meta.collection_name]
+        if mostrecent is not None:
+            objects = notifier().zfs_snapshot_get(objects, mostrecent)
 
-        for obj in to_be_serialized[self._meta.collection_name]:
-            bundle = self.build_bundle(obj=obj, request=request)
-            bundles.append(self.full_dehydrate(bundle))
+        # Dehydrate the bundles in preparation for serialization.
+        bundles = self.dehydrate_page(request, objects)
 
         length = len(bundles)
         to_be_serialized[self._meta.collection_name] = bundles
@@ -2658,6 +2679,53 @@ class SnapshotResource(DojoResource):
         )
         return response
 
+    def _get_sorted_snapshots(self, sorting):
+        snapshots = notifier().zfs_snapshot_list()
+
+        results = []
+        for snaps in list(snapshots.values()):
+            results.extend(snaps)
+        FIELD_MAP = {
+            'extra': 'mostrecent',
+        }
+
+        for sfield in sorting:
+            if sfield.startswith('-'):
+                field = sfield[1:]
+                reverse = True
+            else:
+                field = sfield
+                reverse = False
+            field = FIELD_MAP.get(field, field)
+            apifield = self.fields.get(field)
+            default = ''
+            if apifield and isinstance(apifield, fields.IntegerField):
+                default = 0
+            results.sort(
+                key=lambda item: getattr(item, field) or default,
+                reverse=reverse)
+
+        return results
+
+    def cursor_pages(self, objects, after, limit):
+        """
+        Snapshots are paged by name so cursors stay valid when snapshots are taken or destroyed.
+        """
+        names, mostrecent = objects
+        if after is not None and 'name' not in after:
+            raise ImmediateHttpResponse(response=HttpBadRequest('Invalid cursor'))
+
+        start = bisect.bisect_right(names, after['name']) if after is not None else 0
+        while True:
+            page = names[start:start + limit]
+            start += len(page)
+            snapshots = notifier().zfs_snapshot_get(page, mostrecent)
+            if start >= len(names):
+                yield snapshots, None
+                return
+
+            yield snapshots, encode_cursor({'name': page[-1]})
+
     def post_list(self, request, **kwargs):
         deserialized = self.deserialize(
             request,
@@ -3018,11 +3086,13 @@ class CertificateAuthorityResourceMixin(object):
             form.save()
         return HttpResponse('Certificate Authority created.', status=201)
 
-    def dispatch_list(self, request, **kwargs):
+    def prefetch(self, request, objects):
+        super(CertificateAuthorityResourceMixin, self).prefetch(request, objects)
         with client as c:
-            self.__certs = {cert['id']: cert for cert in c.call('certificateauthority.query')}
-
-        return super(CertificateAuthorityResourceMixin, self).dispatch_list(request, **kwargs)
+            self.__certs = {
+                cert['id']: cert
+                for cert in c.call('certificateauthority.query', [['id', 'in', [obj.id for obj in objects]]])
+            }
 
     def dehydrate(self, bundle):
         bundle = super(CertificateAuthorityResourceMixin,
@@ -3248,11 +3318,13 @@ class CertificateResourceMixin(object):
             form.save()
         return HttpResponse('Certificate created.', status=201)
 
-    def dispatch_list(self, request, **kwargs):
+    def prefetch(self, request, objects):
+        super(CertificateResourceMixin, self).prefetch(request, objects)
         with client as c:
-            self.__certs = {cert['id']: cert for cert in c.call('certificate.query')}
-
-        return super(CertificateResourceMixin, self).dispatch_list(request, **kwargs)
+            self.__certs = {
+                cert['id']: cert
+                for cert in c.call('certificate.query', [['id', 'in', [obj.id for obj in objects]]])
+            }
 
     def dehydrate(self, bundle):
         bundle = super(CertificateResourceMixin, self).dehydrate(bundle)
@@ -0,0 +1,187 @@
+import json
+from unittest.mock import Mock, patch
+
+from django.test import RequestFactory, SimpleTestCase
+from tastypie.exceptions import ImmediateHttpResponse
+
+from freenasUI.api.resources import SnapshotResource
+from freenasUI.api.utils import DojoResource, decode_cursor, encode_cursor
+from freenasUI.middleware import zfs
+from freenasUI.middleware.notifier import notifier
+
+# Snapshot names as `zfs list -s creation` lists them, oldest first
+SNAPSHOTS_BY_CREATION = [
+    'tank/b@auto-1',
+    'tank/a@auto-1',
+    'tank/b@auto-2',
+    'tank/c@manual',
+    'tank/a@auto-2',
+    'tank/.system@hidden',
+]
+
+
+def snapshot(fullname, mostrecent=False):
+    filesystem, name = fullname.split('@')
+    return zfs.Snapshot(name=name, filesystem=filesystem, used=0, refer=0, mostrecent=mostrecent)
+
+
+def zfs_snapshot_get(names, mostrecent):
+    return [snapshot(name, name in mostrecent) for name in names]
+
+
+def pipeopen(output):
+    def _pipeopen(command, logger=None):
+        _pipeopen.commands.append(command)
+        return Mock(**{'communicate.return_value': (output(command), '')})
+
+    _pipeopen.commands = []
+    return _pipeopen
+
+
+class CursorTestCase(SimpleTestCase):
+
+    def test_decode_cursor(self):
+        self.assertEqual(decode_cursor(encode_cursor({'offset': 10})), {'offset': 10})
+
+    def test_decode_invalid_cursor(self):
+        for cursor in ('not base64!', encode_cursor([1, 2]), encode_cursor('name')):
+            with self.assertRaises(ImmediateHttpResponse) as cm:
+                decode_cursor(cursor)
+
+            self.assertEqual(cm.exception.response.status_code, 400)
+
+    def test_cursor_pages_by_offset(self):
+        resource = DojoResource()
+
+        pages = list(resource.cursor_pages(list(range(5)), None, 2))
+
+        self.assertEqual([page for page, cursor in pages], [[0, 1], [2, 3], [4]])
+        self.assertIsNone(pages[-1][1])
+        self.assertEqual(
+            next(resource.cursor_pages(list(range(5)), decode_cursor(pages[0][1]), 2)),
+            ([2, 3], pages[1][1]),
+        )
+
+    def test_cursor_pages_invalid_cursor(self):
+        with self.assertRaises(ImmediateHttpResponse):
+            next(DojoResource().cursor_pages(list(range(5)), {'name': 'tank@snap'}, 2))
+
+
+class SnapshotCursorTestCase(SimpleTestCase):
+
+    def setUp(self):
+        patcher = patch('freenasUI.api.resources.notifier')
+        self.notifier = patcher.start().return_value
+        self.notifier.zfs_snapshot_get.side_effect = zfs_snapshot_get
+        self.addCleanup(patcher.stop)
+
+    def test_cursor_pages_by_name(self):
+        names = ['tank/a@1', 'tank/a@2', 'tank/b@1']
+        resource = SnapshotResource()
+
+        pages = list(resource.cursor_pages((names, {'tank/a@2'}), None, 2))
+
+        self.assertEqual(
+            [[(s.fullname, s.mostrecent) for s in page] for page, cursor in pages],
+            [[('tank/a@1', False), ('tank/a@2', True)], [('tank/b@1', False)]],
+        )
+        self.assertEqual(decode_cursor(pages[0][1]), {'name': 'tank/a@2'})
+        self.assertIsNone(pages[1][1])
+        # Properties are only retrieved for the snapshots of the page
+        self.assertEqual([c[0][0] for c in self.notifier.zfs_snapshot_get.call_args_list], [names[:2], names[2:]])
+
+    def test_cursor_stays_valid_when_snapshots_are_taken(self):
+        resource = SnapshotResource()
+        after = decode_cursor(encode_cursor({'name': 'tank/a@2'}))
+        names = ['tank/a@0', 'tank/a@1', 'tank/a@2', 'tank/a@3', 'tank/b@1']
+
+        page, cursor = next(resource.cursor_pages((names, set()), after, 10))
+
+        self.assertEqual([s.fullname for s in page], ['tank/a@3', 'tank/b@1'])
+        self.assertIsNone(cursor)
+
+    def test_cursor_pages_invalid_cursor(self):
+        with self.assertRaises(ImmediateHttpResponse):
+            next(SnapshotResource().cursor_pages((['tank/a@1'], set()), {'offset': 1}, 2))
+
+    def test_get_list_orders(self):
+        names = ['tank/b@auto-1', 'tank/b@auto-2', 'tank/a@auto-1', 'tank/a@auto-2']
+        resource = SnapshotResource()
+
+        def zfs_snapshot_names(system=False, by_dataset=False):
+            return list(names) if by_dataset else sorted(names), set()
+
+        self.notifier.zfs_snapshot_names.side_effect = zfs_snapshot_names
+
+        def get_list(query):
+            with patch.object(SnapshotResource, 'dehydrate_page', lambda self, request, objects: [
+                s.fullname for s in objects
+            ]):
+                return resource.get_list(RequestFactory().get('/api/v1.0/storage/snapshot/', query))
+
+        # Default order is the one `zfs_snapshot_list` returns
+        response = get_list({})
+        self.assertEqual(json.loads(response.content.decode('utf-8')), names)
+        self.assertEqual(response['Content-Range'], 'items 0-3/4')
+
+        self.assertEqual(json.loads(get_list({'sort(-id)': ''}).content.decode('utf-8')), sorted(names)[::-1])
+
+        response = get_list({'cursor': '', 'limit': 3})
+        self.assertEqual(json.loads(response.content.decode('utf-8')), sorted(names)[:3])
+        self.assertEqual(decode_cursor(response['X-Next-Cursor']), {'name': sorted(names)[2]})
+
+
+class SnapshotNamesTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.notifier = notifier()
+        self.notifier._zfs_snapshot_filter = lambda system=False: lambda fs: fs != 'tank/.system'
+
+    def test_zfs_snapshot_names(self):
+        self.notifier._pipeopen = pipeopen(lambda command: '\n'.join(SNAPSHOTS_BY_CREATION) + '\n')
+
+        names, mostrecent = self.notifier.zfs_snapshot_names()
+
+        self.assertEqual(names, [
+            'tank/a@auto-1', 'tank/a@auto-2', 'tank/b@auto-1', 'tank/b@auto-2', 'tank/c@manual',
+        ])
+        self.assertEqual(mostrecent, {'tank/a@auto-2', 'tank/b@auto-2', 'tank/c@manual'})
+
+    def test_zfs_snapshot_names_by_dataset(self):
+        self.notifier._pipeopen = pipeopen(lambda command: '\n'.join(SNAPSHOTS_BY_CREATION) + '\n')
+
+        names, mostrecent = self.notifier.zfs_snapshot_names(by_dataset=True)
+
+        # Same order as `zfs_snapshot_list`
+        self.assertEqual(names, [
+            'tank/a@auto-1', 'tank/a@auto-2', 'tank/c@manual', 'tank/b@auto-1', 'tank/b@auto-2',
+        ])
+
+    def test_zfs_snapshot_get(self):
+        def output(command):
+            if '-t volume' in command:
+                return 'tank/vol\n'
+
+            # `zfs list` output is sorted by name, `tank/a@auto-1` was destroyed since its name was listed
+            return ''.join(
+                f"{name}\t1024\t-\t2048\t-\t-\n"
+                for name in sorted(command.replace("'", '').split()[8:])
+                if name != 'tank/a@auto-1'
+            )
+
+        self.notifier._pipeopen = pipeopen(output)
+        names = ['tank/b@auto-2', 'tank/a@auto-1', 'tank/a@auto-2'] + [f'tank/vol@{i:03}' for i in range(600)]
+
+        snapshots = self.notifier.zfs_snapshot_get(names, {'tank/b@auto-2'})
+
+        self.assertEqual([s.fullname for s in snapshots], [name for name in names if name != 'tank/a@auto-1'])
+        self.assertEqual([s.mostrecent for s in snapshots[:2]], [True, False])
+        self.assertEqual([s.parent_type for s in snapshots[1:3]], ['filesystem', 'volume'])
+        self.assertEqual(snapshots[1].used, 1024)
+        # Volume list and two chunks of snapshot names
+        self.assertEqual(len(self.notifier._pipeopen.commands), 3)
+
+    def test_zfs_snapshot_get_empty(self):
+        self.notifier._pipeopen = pipeopen(lambda command: self.fail('zfs must not be called'))
+
+        self.assertEqual(self.notifier.zfs_snapshot_get([], set()), [])
@@ -25,6 +25,9 @@
 #
 #####################################################################
 import base64
+import binascii
+import itertools
+import json
 import logging
 import re
 import six
@@ -34,9 +37,9 @@ import urllib.request, urllib.parse, urllib.error
 
 from django.contrib.auth import authenticate
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
-from django.db.models import FieldDoesNotExist
+from django.db.models import FieldDoesNotExist, QuerySet
 from django.db.models.fields.related import ForeignKey
-from django.http import Http404, QueryDict
+from django.http import Http404, QueryDict, StreamingHttpResponse
 
 from freenasUI.account.models import bsdUsers
 from freenasUI.common.log import log_traceback
@@ -63,6 +66,27 @@ from tastypie.utils import dict_strip_unicode_keys
 RE_SORT = re.compile(r'^sort\((.*)\)$')
 log = logging.getLogger('api.utils')
 
+CURSOR_PARAM = 'cursor'
+NDJSON_FORMAT = 'ndjson'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Objects dehydrated at once when streaming a list
+STREAM_PAGE_SIZE = 100
+
+
+def encode_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, binascii.Error):
+        value = None
+
+    if not isinstance(value, dict):
+        raise ImmediateHttpResponse(response=http.HttpBadRequest('Invalid cursor'))
+    return value
+
 
 class DjangoAuthentication(Authentication):
     def is_authenticated(self, request, **kwargs):
@@ -209,6 +233,9 @@ class ResourceMixin(object):
         )
         sorted_objects = self.apply_sorting(objects, options=request.GET)
 
+        if CURSOR_PARAM in request.GET or self.wants_ndjson(request):
+            return self.get_list_by_cursor(request, sorted_objects)
+
         paginator = self._meta.paginator_class(
             request,
             sorted_objects,
@@ -217,23 +244,153 @@ class ResourceMixin(object):
         )
         to_be_serialized = paginator.page()
 
-        bundles = [
-            self.build_bundle(obj=obj, request=request)
-            for obj in to_be_serialized['objects']
-        ]
-        to_be_serialized['objects'] = [
-            self.full_dehydrate(bundle) for bundle in bundles
-        ]
+        to_be_serialized['objects'] = self.dehydrate_page(request, to_be_serialized['objects'])
         length = len(to_be_serialized['objects'])
+        # Paginator counts querysets with `COUNT(*)` instead of fetching all the rows
+        total_count = to_be_serialized['meta']['total_count']
         to_be_serialized = self.alter_list_data_to_serialize(
             request, to_be_serialized
         )
         response = self.create_response(request, to_be_serialized)
         response['Content-Range'] = 'items %d-%d/%d' % (
-            paginator.offset, paginator.offset + length - 1, len(sorted_objects)
+            paginator.offset, paginator.offset + length - 1, total_count
+        )
+        return response
+
+    def prefetch(self, request, objects):
+        """
+        Called with every page of `objects` before they are dehydrated so lookups `dehydrate` needs can be
+        done once per page (e.g. a single middleware query filtered by the page ids) instead of once per row
+        or for the whole collection.
+        """
+        pass
+
+    def dehydrate_page(self, request, objects):
+        objects = list(objects)
+        if objects:
+            self.prefetch(request, objects)
+        return [
+            self.full_dehydrate(self.build_bundle(obj=obj, request=request), for_list=True)
+            for obj in objects
+        ]
+
+    def full_dehydrate(self, bundle, for_list=False):
+        if not for_list and bundle.obj is not None:
+            # Lists are prefetched a page at a time in `dehydrate_page`
+            self.prefetch(bundle.request, [bundle.obj])
+        return super(ResourceMixin, self).full_dehydrate(bundle, for_list=for_list)
+
+    def wants_ndjson(self, request):
+        return (
+            request.GET.get('format') == NDJSON_FORMAT or
+            NDJSON_MIMETYPE in request.META.get('HTTP_ACCEPT', '')
         )
+
+    def get_cursor_limit(self, request, default=None):
+        limit = request.GET.get('limit')
+        if limit is None:
+            return default or self._meta.limit
+
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = -1
+        if limit < 0:
+            raise ImmediateHttpResponse(response=http.HttpBadRequest('Invalid limit'))
+
+        if self._meta.max_limit:
+            limit = min(limit, self._meta.max_limit)
+        return limit
+
+    def cursor_pages(self, objects, after, limit):
+        """
+        Yields `(objects, cursor)` pages of at most `limit` `objects` starting after the position `after` cursor
+        points to. `cursor` points to the end of its page and is `None` for the last page.
+
+        Querysets are paged by primary key (keyset pagination) so cursors stay valid when objects are added or
+        removed and every page is a single `WHERE pk > ... LIMIT ...` query. Other lists are paged by position.
+        """
+        if isinstance(objects, QuerySet):
+            if not objects.query.order_by:
+                # Only sorted by model default ordering
+                objects = objects.order_by('pk')
+            elif list(objects.query.order_by) not in (['pk'], [objects.model._meta.pk.name]):
+                # Sorting by other fields can't be paged by primary key
+                objects = list(objects)
+
+        if isinstance(objects, QuerySet):
+            if after is not None and 'pk' not in after:
+                raise ImmediateHttpResponse(response=http.HttpBadRequest('Invalid cursor'))
+
+            while True:
+                page_objects = objects
+                if after is not None:
+                    page_objects = page_objects.filter(pk__gt=after['pk'])
+                # Fetch one more object to know whether this is the last page
+                page = list(page_objects[:limit + 1])
+                if len(page) <= limit:
+                    yield page, None
+                    return
+
+                page = page[:limit]
+                after = {'pk': page[-1].pk}
+                yield page, encode_cursor(after)
+        else:
+            if after is not None and 'offset' not in after:
+                raise ImmediateHttpResponse(response=http.HttpBadRequest('Invalid cursor'))
+
+            offset = after['offset'] if after is not None else 0
+            while True:
+                page = objects[offset:offset + limit]
+                offset += len(page)
+                if offset >= len(objects):
+                    yield page, None
+                    return
+
+                yield page, encode_cursor({'offset': offset})
+
+    def get_list_by_cursor(self, request, objects):
+        """
+        Cursor pagination: `?cursor=` (empty for the first page) returns at most `limit` objects and the cursor of
+        the next page in `X-Next-Cursor` header.
+
+        `?format=ndjson` (or `Accept: application/x-ndjson`) streams objects as newline delimited JSON instead,
+        dehydrating `STREAM_PAGE_SIZE` objects at a time, so memory usage does not depend on the collection size.
+        The whole collection (after `cursor`, if given) is streamed unless `limit` is given.
+        """
+        cursor = request.GET.get(CURSOR_PARAM)
+        after = decode_cursor(cursor) if cursor else None
+
+        if self.wants_ndjson(request):
+            limit = self.get_cursor_limit(request, STREAM_PAGE_SIZE)
+            pages = self.cursor_pages(objects, after, limit or STREAM_PAGE_SIZE)
+            # Get the first page now so that errors (e.g. invalid cursor) are reported before streaming starts
+            first_page = next(pages, ([], None))
+            if limit and 'limit' in request.GET:
+                pages = [first_page]
+            else:
+                pages = itertools.chain([first_page], pages)
+            return self.stream_response(request, (page for page, next_cursor in pages))
+
+        limit = self.get_cursor_limit(request)
+        if not limit:
+            raise ImmediateHttpResponse(response=http.HttpBadRequest('Cursor pagination requires a limit'))
+        page, next_cursor = next(self.cursor_pages(objects, after, limit), ([], None))
+
+        bundles = self.dehydrate_page(request, page)
+        response = self.create_response(request, self.alter_list_data_to_serialize(request, {'objects': bundles}))
+        if next_cursor is not None:
+            response['X-Next-Cursor'] = next_cursor
         return response
 
+    def stream_response(self, request, pages):
+        def lines():
+            for page in pages:
+                for bundle in self.dehydrate_page(request, page):
+                    yield self._meta.serializer.to_json(bundle) + '\n'
+
+        return StreamingHttpResponse(lines(), content_type=NDJSON_MIMETYPE)
+
     def _handle_500(self, request, exception, *args, **kwargs):
         log_traceback(log=log)
         if isinstance(exception, (NotFound, ObjectDoesNotExist, Http404, UnsupportedFormat)):
@@ -292,18 +449,32 @@ class DojoModelResource(ResourceMixin, ModelResource):
                 fields = RE_SORT.search(key).group(1)
                 fields = [f.strip() for f in fields.split(',')]
                 break
+        sorting_map = getattr(self, 'SORTING_MAP', {})
+        if (
+            len(fields) == 1 and isinstance(obj_list, QuerySet) and
+            fields[0].lstrip('-') not in sorting_map and self._is_sortable_field(fields[0].lstrip('-'))
+        ):
+            # Let the database sort so the paginator only fetches the rows of the requested page
+            return obj_list.order_by(fields[0], '-pk' if fields[0].startswith('-') else 'pk')
+
         if fields:
             for f in fields:
                 reverse = False
                 if f.startswith('-'):
                     reverse = True
                     f = f[1:]
-                sorting_map = getattr(self, 'SORTING_MAP', {})
                 key = sorting_map.get(f, lambda x: getattr(x, f))
                 obj_list = sorted(obj_list, key=key, reverse=reverse)
 
         return obj_list
 
+    def _is_sortable_field(self, name):
+        try:
+            field = self._meta.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        return field.concrete and not field.is_relation
+
     def is_form_valid(self, bundle, form):
         valid = form.is_valid()
         if not valid:
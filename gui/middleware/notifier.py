@@ -478,8 +478,43 @@ class notifier(metaclass=HookMetaclass):
             log.error("Importing %s [%s] failed with: %s", name, id, stderr)
         return False
 
-    def zfs_snapshot_list(self, path=None, sort=None, system=False):
+    def _zfs_snapshot_filter(self, system=False):
+        """
+        Returns a function that tells whether snapshots of a filesystem are listed
+        """
         from freenasUI.storage.models import Volume
+
+        basename = None
+        if system is False:
+            with client as c:
+                basename = c.call('systemdataset.config')['basename']
+
+        volnames = set([o.vol_name for o in Volume.objects.all()])
+
+        def listed(fs):
+            if basename:
+                if fs == basename or fs.startswith(basename + '/'):
+                    return False
+
+            # Do not list snapshots from the root pool
+            return fs.split('/')[0] in volnames
+
+        return listed
+
+    def _zfs_snapshot_from_line(self, line, zvols, mostrecent):
+        _list = line.split('\t')
+        fs, name = _list[0].split('@')
+        return zfs.Snapshot(
+            name=name,
+            filesystem=fs,
+            used=int(_list[1]),
+            refer=int(_list[3]),
+            mostrecent=mostrecent,
+            parent_type='filesystem' if fs not in zvols else 'volume',
+            vmsynced=(_list[5] == 'Y')
+        )
+
+    def zfs_snapshot_list(self, path=None, sort=None, system=False):
         fsinfo = dict()
 
         if sort is None:
@@ -487,13 +522,10 @@ class notifier(metaclass=HookMetaclass):
         else:
             sort = '-s %s' % sort
 
-        if system is False:
-            with client as c:
-                basename = c.call('systemdataset.config')['basename']
+        listed = self._zfs_snapshot_filter(system)
 
         zfsproc = self._pipeopen("zfs list -t volume -o name %s -H" % sort)
         zvols = set([y for y in zfsproc.communicate()[0].split('\n') if y != ''])
-        volnames = set([o.vol_name for o in Volume.objects.all()])
 
         fieldsflag = '-o name,used,available,referenced,mountpoint,freenas:vmsynced'
         if path:
@@ -503,20 +535,10 @@ class notifier(metaclass=HookMetaclass):
         lines = zfsproc.communicate()[0].split('\n')
         for line in lines:
             if line != '':
-                _list = line.split('\t')
-                snapname = _list[0]
-                used = int(_list[1])
-                refer = int(_list[3])
-                vmsynced = _list[5]
-                fs, name = snapname.split('@')
-
-                if system is False and basename:
-                    if fs == basename or fs.startswith(basename + '/'):
-                        continue
-
-                # Do not list snapshots from the root pool
-                if fs.split('/')[0] not in volnames:
+                fs = line.split('\t', 1)[0].split('@')[0]
+                if not listed(fs):
                     continue
+
                 try:
                     snaplist = fsinfo[fs]
                     mostrecent = False
@@ -524,18 +546,72 @@ class notifier(metaclass=HookMetaclass):
                     snaplist = []
                     mostrecent = True
 
-                snaplist.insert(0, zfs.Snapshot(
-                    name=name,
-                    filesystem=fs,
-                    used=used,
-                    refer=refer,
-                    mostrecent=mostrecent,
-                    parent_type='filesystem' if fs not in zvols else 'volume',
-                    vmsynced=(vmsynced == 'Y')
-                ))
+                snaplist.insert(0, self._zfs_snapshot_from_line(line, zvols, mostrecent))
                 fsinfo[fs] = snaplist
         return fsinfo
 
+    def zfs_snapshot_names(self, system=False, by_dataset=False):
+        """
+        Returns names of the snapshots `zfs_snapshot_list` lists, sorted by name, and a set of names of the most
+        recent snapshot of every filesystem.
+
+        If `by_dataset` is set, names are in the order `zfs_snapshot_list` returns them instead: filesystems with
+        the most recent snapshot first, snapshots of every filesystem oldest first.
+
+        Only snapshot names are retrieved which is much cheaper than `zfs_snapshot_list` when there are
+        thousands of snapshots, use `zfs_snapshot_get` to retrieve a page of them.
+        """
+        listed = self._zfs_snapshot_filter(system)
+
+        zfsproc = self._pipeopen("zfs list -H -t snapshot -o name -s creation", logger=None)
+        names = []
+        mostrecent = {}
+        for line in zfsproc.communicate()[0].split('\n'):
+            if line == '':
+                continue
+
+            fs = line.split('@')[0]
+            if not listed(fs):
+                continue
+
+            names.append(line)
+            mostrecent[fs] = line
+
+        if by_dataset:
+            # Snapshots are listed oldest first so the index of the last snapshot of every filesystem orders them
+            last = {name.split('@')[0]: i for i, name in enumerate(names)}
+            names.sort(key=lambda name: -last[name.split('@')[0]])
+        else:
+            names.sort()
+        return names, set(mostrecent.values())
+
+    def zfs_snapshot_get(self, names, mostrecent):
+        """
+        Returns `zfs.Snapshot` objects for snapshot `names` in the same order (snapshots that no longer exist are
+        skipped). `mostrecent` is a set of names of the most recent snapshots as returned by `zfs_snapshot_names`.
+        """
+        if not names:
+            return []
+
+        zfsproc = self._pipeopen("zfs list -t volume -o name -H")
+        zvols = set([y for y in zfsproc.communicate()[0].split('\n') if y != ''])
+
+        snapshots = {}
+        # Keep command line length reasonable for large pages
+        for i in range(0, len(names), 500):
+            zfsproc = self._pipeopen(
+                "zfs list -p -t snapshot -H -o name,used,available,referenced,mountpoint,freenas:vmsynced %s" % (
+                    ' '.join("'%s'" % name for name in names[i:i + 500])
+                ),
+                logger=None,
+            )
+            for line in zfsproc.communicate()[0].split('\n'):
+                if line != '':
+                    name = line.split('\t', 1)[0]
+                    snapshots[name] = self._zfs_snapshot_from_line(line, zvols, name in mostrecent)
+
+        return [snapshots[name] for name in names if name in snapshots]
+
     def zfs_get_options(self, name=None, recursive=False, props=None, zfstype=None):
         noinherit_fields = ['quota', 'refquota', 'reservation', 'refreservation']
 
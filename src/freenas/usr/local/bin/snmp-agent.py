@@ -3,8 +3,6 @@
 from collections import defaultdict
 import copy
 from datetime import datetime, timedelta
-import os
-import subprocess
 import sys
 import threading
 import time
@@ -16,34 +14,15 @@ import pysnmp.smi
 import sysctl
 
 from middlewared.client import Client
+from middlewared.utils.snmp_agent import (
+    calculate_allocation_units, get_zfs_arc_miss_percent, DatasetsThread, ZilstatThread, fill_dataset_table,
+    invalidate_on_signal,
+)
 
 sys.path.append("/usr/local/www")
 from freenasUI.tools.arc_summary import get_Kstat, get_arc_efficiency
 
 
-def calculate_allocation_units(*args):
-    allocation_units = 4096
-    while True:
-        values = tuple(map(lambda arg: int(arg / allocation_units), args))
-        if all(v < 2 ** 31 for v in values):
-            break
-
-        allocation_units *= 2
-
-    return allocation_units, values
-
-
-def get_zfs_arc_miss_percent(kstat):
-    arc_hits = kstat["kstat.zfs.misc.arcstats.hits"]
-    arc_misses = kstat["kstat.zfs.misc.arcstats.misses"]
-    arc_read = arc_hits + arc_misses
-    if arc_read > 0:
-        hit_percent = float(100 * arc_hits / arc_read)
-        miss_percent = 100 - hit_percent
-        return miss_percent
-    return 0
-
-
 mib_builder = pysnmp.smi.builder.MibBuilder()
 mib_sources = mib_builder.getMibSources() + (pysnmp.smi.builder.DirMibSource("/usr/local/share/pysnmp/mibs"),)
 mib_builder.setMibSources(*mib_sources)
@@ -143,11 +122,12 @@ zfs_zilstat_ops10 = agent.Counter64(oidstr="FREENAS-MIB::zfsZilstatOps10sec")
 
 
 class ZpoolIoThread(threading.Thread):
-    def __init__(self):
+    def __init__(self, zfs_factory=libzfs.ZFS):
         super().__init__()
 
         self.daemon = True
 
+        self.zfs_factory = zfs_factory
         self.stop_event = threading.Event()
 
         self.lock = threading.Lock()
@@ -155,7 +135,7 @@ class ZpoolIoThread(threading.Thread):
         self.values_1s = defaultdict(lambda: defaultdict(lambda: 0))
 
     def run(self):
-        zfs = libzfs.ZFS()
+        zfs = self.zfs_factory()
         while not self.stop_event.wait(1.0):
             with self.lock:
                 previous_values = copy.deepcopy(self.values_overall)
@@ -180,51 +160,6 @@ class ZpoolIoThread(threading.Thread):
             return copy.deepcopy(self.values_overall), copy.deepcopy(self.values_1s)
 
 
-class ZilstatThread(threading.Thread):
-    def __init__(self, interval):
-        super().__init__()
-
-        self.daemon = True
-
-        self.interval = interval
-        self.value = {
-            "NBytes": 0,
-            "NBytespersec": 0,
-            "NMaxRate": 0,
-            "BBytes": 0,
-            "BBytespersec": 0,
-            "BMaxRate": 0,
-            "ops": 0,
-            "lteq4kb": 0,
-            "4to32kb": 0,
-            "gteq4kb": 0,
-        }
-
-    def run(self):
-        zilstatproc = subprocess.Popen(
-            ["/usr/local/bin/zilstat", str(self.interval)],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            preexec_fn=os.setsid,
-        )
-        zilstatproc.stdout.readline().strip()
-        while zilstatproc.poll() is None:
-            output = zilstatproc.stdout.readline().strip().split()
-            value = {
-                "NBytes": output[0],
-                "NBytespersec": output[1],
-                "NMaxRate": output[2],
-                "BBytes": output[3],
-                "BBytespersec": output[4],
-                "BMaxRate": output[5],
-                "ops": int(output[6]),
-                "lteq4kb": output[7],
-                "4to32kb": output[8],
-                "gteq4kb": output[9],
-            }
-            self.value = value
-
-
 class CpuTempThread(threading.Thread):
     def __init__(self, interval):
         super().__init__()
@@ -268,14 +203,13 @@ if __name__ == "__main__":
     zpool_io_thread = ZpoolIoThread()
     zpool_io_thread.start()
 
-    zilstat_1_thread = ZilstatThread(1)
-    zilstat_5_thread = ZilstatThread(5)
-    zilstat_10_thread = ZilstatThread(10)
+    datasets_thread = DatasetsThread(libzfs.ZFS)
+    datasets_thread.start()
+    invalidate_on_signal(datasets_thread)
 
+    zilstat_thread = ZilstatThread()
     if config["zilstat"]:
-        zilstat_1_thread.start()
-        zilstat_5_thread.start()
-        zilstat_10_thread.start()
+        zilstat_thread.start()
 
     cpu_temp_thread = CpuTempThread(10)
     cpu_temp_thread.start()
@@ -283,16 +217,26 @@ if __name__ == "__main__":
     agent.start()
 
     last_update_at = datetime.min
+    pools_key = None
+    datasets_generation = None
     while True:
-        agent.check_and_process()
+        if agent.check_and_process():
+            datasets_thread.polled()
 
         if datetime.utcnow() - last_update_at > timedelta(seconds=1):
             zpool_io_overall, zpool_io_1sec = zpool_io_thread.get_values()
 
-            datasets = []
-            zvols = []
+            zpools = list(zfs.pools)
+
+            # Pool was imported or exported, its datasets need to be walked
+            new_pools_key = [(zpool.name, zpool.guid) for zpool in zpools]
+            if new_pools_key != pools_key:
+                if pools_key is not None:
+                    datasets_thread.invalidate()
+                pools_key = new_pools_key
+
             zpool_table.clear()
-            for i, zpool in enumerate(zfs.pools):
+            for i, zpool in enumerate(zpools):
                 row = zpool_table.addRow([agent.Integer32(i + 1)])
                 row.setRowCell(2, agent.DisplayString(zpool.properties["name"].value))
                 allocation_units, \
@@ -320,47 +264,11 @@ if __name__ == "__main__":
                 row.setRowCell(14, agent.Counter64(zpool_io_1sec[zpool.name]["read_bytes"]))
                 row.setRowCell(15, agent.Counter64(zpool_io_1sec[zpool.name]["write_bytes"]))
 
-                for dataset in zpool.root_dataset.children_recursive:
-                    if dataset.type == libzfs.DatasetType.FILESYSTEM:
-                        datasets.append(dataset)
-                    if dataset.type == libzfs.DatasetType.VOLUME:
-                        zvols.append(dataset)
-
-            dataset_table.clear()
-            for i, dataset in enumerate(datasets):
-                row = dataset_table.addRow([agent.Integer32(i + 1)])
-                row.setRowCell(2, agent.DisplayString(dataset.properties["name"].value))
-                allocation_units, (
-                    size,
-                    used,
-                    available
-                ) = calculate_allocation_units(
-                    int(dataset.properties["used"].rawvalue) + int(dataset.properties["available"].rawvalue),
-                    int(dataset.properties["used"].rawvalue),
-                    int(dataset.properties["available"].rawvalue),
-                )
-                row.setRowCell(3, agent.Integer32(allocation_units))
-                row.setRowCell(4, agent.Integer32(size))
-                row.setRowCell(5, agent.Integer32(used))
-                row.setRowCell(6, agent.Integer32(available))
-
-            zvol_table.clear()
-            for i, zvol in enumerate(zvols):
-                row = zvol_table.addRow([agent.Integer32(i + 1)])
-                row.setRowCell(2, agent.DisplayString(zvol.properties["name"].value))
-                allocation_units, (
-                    volsize,
-                    used,
-                    available
-                ) = calculate_allocation_units(
-                    int(zvol.properties["volsize"].rawvalue),
-                    int(zvol.properties["used"].rawvalue),
-                    int(zvol.properties["available"].rawvalue),
-                )
-                row.setRowCell(3, agent.Integer32(allocation_units))
-                row.setRowCell(4, agent.Integer32(volsize))
-                row.setRowCell(5, agent.Integer32(used))
-                row.setRowCell(6, agent.Integer32(available))
+            generation, datasets, zvols = datasets_thread.get_snapshot()
+            if generation != datasets_generation:
+                fill_dataset_table(agent, dataset_table, datasets)
+                fill_dataset_table(agent, zvol_table, zvols)
+                datasets_generation = generation
 
             temp_sensors_table.clear()
             for i, temp in enumerate(cpu_temp_thread.temperatures.copy()):
@@ -390,6 +298,6 @@ if __name__ == "__main__":
             zfs_l2arc_write.update(int(kstat["kstat.zfs.misc.arcstats.l2_write_bytes"] / 1024 % 2 ** 32))
             zfs_l2arc_size.update(int(kstat["kstat.zfs.misc.arcstats.l2_asize"] / 1024))
 
-            zfs_zilstat_ops1.update(zilstat_1_thread.value["ops"])
-            zfs_zilstat_ops5.update(zilstat_5_thread.value["ops"])
-            zfs_zilstat_ops10.update(zilstat_10_thread.value["ops"])
+            zfs_zilstat_ops1.update(zilstat_thread.get_ops(1))
+            zfs_zilstat_ops5.update(zilstat_thread.get_ops(5))
+            zfs_zilstat_ops10.update(zilstat_thread.get_ops(10))
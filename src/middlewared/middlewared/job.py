@@ -1,5 +1,5 @@
 import asyncio
-from collections import OrderedDict
+from collections import deque, OrderedDict
 import copy
 from datetime import datetime
 import enum
@@ -15,6 +15,10 @@ from middlewared.pipe import Pipes
 
 logger = logging.getLogger(__name__)
 
+LOGS_DIR = "/var/db/middlewared/jobs"
+LOGS_FLUSH_INTERVAL = 5
+LOGS_EXCERPT_CHUNK_SIZE = 16 * 1024
+
 
 class State(enum.Enum):
     WAITING = 1
@@ -24,45 +28,172 @@ class State(enum.Enum):
     ABORTED = 5
 
 
+class JobSharedLockStats(object):
+    """
+    Queue depth and wait time statistics of a shared lock. These are kept for every lock name while the lock itself is
+    dropped as soon as it is idle.
+    """
+
+    __slots__ = ('acquired_count', 'max_queue_depth', 'wait_time_total', 'wait_time_max')
+
+    def __init__(self):
+        self.acquired_count = 0
+        self.max_queue_depth = 0
+        self.wait_time_total = 0
+        self.wait_time_max = 0
+
+    def __encode__(self):
+        return {
+            'max_queue_depth': self.max_queue_depth,
+            'acquired_count': self.acquired_count,
+            'wait_time_avg': self.wait_time_total / self.acquired_count if self.acquired_count else None,
+            'wait_time_max': self.wait_time_max,
+        }
+
+
 class JobSharedLock(object):
     """
     Shared lock for jobs.
     Each job method can specify a lock which will be shared
     among all calls for that job and only one job can run at a time
     for this lock.
+
+    Jobs waiting for the lock are kept in a FIFO queue so releasing the lock
+    hands it directly to the next job instead of rescanning every queued job.
     """
 
-    def __init__(self, queue, name):
+    def __init__(self, queue, name, stats=None):
         self.queue = queue
         self.name = name
-        self.jobs = []
-        self.semaphore = asyncio.Semaphore()
+        self.owner = None
+        self.waiting = deque()
 
-    def add_job(self, job):
-        self.jobs.append(job)
+        self.stats = stats or JobSharedLockStats()
 
-    def get_jobs(self):
-        return self.jobs
+    def locked(self):
+        return self.owner is not None
 
-    def remove_job(self, job):
-        self.jobs.remove(job)
+    def acquire(self, job):
+        assert self.owner is None
+        self.owner = job
+        job.lock = self
 
-    def locked(self):
-        return self.semaphore.locked()
+        wait_time = time.monotonic() - job.queued_at
+        self.stats.acquired_count += 1
+        self.stats.wait_time_total += wait_time
+        self.stats.wait_time_max = max(self.stats.wait_time_max, wait_time)
 
-    async def acquire(self):
-        return await self.semaphore.acquire()
+    def enqueue(self, job):
+        self.waiting.append(job)
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, len(self.waiting))
 
     def release(self):
-        return self.semaphore.release()
+        """
+        Releases the lock and passes it on to the next waiting job (if any).
+        Returns that job.
+        """
+        self.owner = None
+        if self.waiting:
+            job = self.waiting.popleft()
+            self.acquire(job)
+            return job
+
+    def idle(self):
+        return self.owner is None and not self.waiting
+
+    def __encode__(self):
+        return dict({
+            'name': self.name,
+            'running': self.owner.id if self.owner is not None else None,
+            'waiting': [job.id for job in self.waiting],
+            'queue_depth': len(self.waiting),
+        }, **self.stats.__encode__())
+
+
+class JobsIndex(object):
+    """
+    Latest job for each (method, first argument) of job methods flagged with `index=True` (i.e. `cloudsync.sync` or
+    `replication.run` that take task id as their first argument) so task queries do not have to scan all the jobs.
+
+    A running job takes precedence over the jobs that were queued after it.
+    """
+
+    def __init__(self):
+        # (method, argument) -> [last job, running job]
+        # Jobs are either `Job` or already encoded jobs loaded from history.
+        self.jobs = {}
+
+    @staticmethod
+    def key(method, arguments):
+        if not arguments:
+            return None
+
+        try:
+            hash(arguments[0])
+        except TypeError:
+            return None
+
+        return method, arguments[0]
+
+    def add(self, job):
+        key = self.key(job.method_name, job.args)
+        if key is None:
+            return
+
+        self.jobs.setdefault(key, [None, None])[0] = job
+
+    def load(self, encoded):
+        """
+        Adds a job loaded from history unless there is a more recent one.
+        """
+        key = self.key(encoded['method'], encoded['arguments'])
+        if key is None:
+            return
+
+        entry = self.jobs.setdefault(key, [None, None])
+        if entry[0] is None or self._id(entry[0]) < encoded['id']:
+            entry[0] = encoded
+
+    def started(self, job):
+        entry = self.jobs.get(self.key(job.method_name, job.args))
+        if entry is not None:
+            entry[1] = job
+
+    def finished(self, job):
+        entry = self.jobs.get(self.key(job.method_name, job.args))
+        if entry is not None and entry[1] is job:
+            entry[1] = None
+
+    def get(self, method, argument):
+        """
+        Returns encoded latest job for `method` called with first argument `argument` (or `None`).
+        """
+        entry = self.jobs.get((method, argument))
+        if entry is None:
+            return None
+
+        job = entry[1] or entry[0]
+        if isinstance(job, Job):
+            return job.__encode__()
+        return job
+
+    @staticmethod
+    def _id(job):
+        return job.id if isinstance(job, Job) else job['id']
 
 
 class JobsQueue(object):
 
-    def __init__(self, middleware):
+    def __init__(self, middleware, history=None):
         self.middleware = middleware
         self.deque = JobsDeque()
-        self.queue = []
+        # On-disk history of finished jobs (`JobHistory`)
+        self.history = history
+        if self.history is not None:
+            # Keep job ids unique across restarts so they do not clash with the ones stored in history
+            self.deque.count = self.history.last_id()
+        # Jobs that are ready to run (they either need no lock or already hold it)
+        self.queue = deque()
 
         # Event responsible for the job queue schedule loop.
         # This event is set and a new job is potentially ready to run
@@ -70,8 +201,15 @@ class JobsQueue(object):
 
         # Shared lock (JobSharedLock) dict
         self.job_locks = {}
+        # Statistics (JobSharedLockStats) of every shared lock name ever used, including idle ones
+        self.job_locks_stats = {}
+
+        self.index = JobsIndex()
 
         self.middleware.event_register('core.get_jobs', 'Updates on job changes.')
+        self.middleware.event_register(
+            'core.get_jobs_progress', 'Lightweight updates on job changes carrying only `progress` and `state`.'
+        )
 
     def __getitem__(self, item):
         return self.deque[item]
@@ -82,27 +220,113 @@ class JobsQueue(object):
     def all(self):
         return self.deque.all()
 
+    def locks(self):
+        return self.job_locks
+
+    def locks_encoded(self):
+        """
+        Returns encoded locks currently in use along with idle locks that were used before.
+        """
+        locks = []
+        for name, stats in list(self.job_locks_stats.items()):
+            lock = self.job_locks.get(name)
+            if lock is None:
+                lock = JobSharedLock(self, name, stats)
+            locks.append(lock.__encode__())
+        return locks
+
     def add(self, job):
-        if job.options["lock_queue_size"] is not None:
+        try:
             lock = self.get_lock(job)
-            queued_jobs = [another_job for another_job in self.queue if self.get_lock(another_job) is lock]
+        except Exception:
+            logger.error('Failed to get lock for %r', job, exc_info=True)
+            lock = None
+
+        if lock is not None and job.options["lock_queue_size"] is not None:
+            queued_jobs = [another_job for another_job in self.queue if another_job.lock is lock]
+            queued_jobs.extend(lock.waiting)
             if len(queued_jobs) >= job.options["lock_queue_size"]:
+                if lock.idle():
+                    self.job_locks.pop(lock.name)
                 return queued_jobs[-1]
 
         self.deque.add(job)
-        self.queue.append(job)
+        if job.options["index"]:
+            self.index.add(job)
+
+        job.queued_at = time.monotonic()
+        if lock is None:
+            self.queue.append(job)
+        elif lock.locked():
+            lock.enqueue(job)
+        else:
+            lock.acquire(job)
+            self.queue.append(job)
 
         if not job.options["transient"]:
             self.middleware.send_event('core.get_jobs', 'ADDED', id=job.id, fields=job.__encode__())
 
-        # A job has been added to the queue, let the queue scheduler run
-        self.queue_event.set()
+        if self.queue:
+            # A job is ready to run, let the queue scheduler run
+            self.queue_event.set()
 
         return job
 
     def remove(self, job_id):
         self.deque.remove(job_id)
 
+    def query(self, filters=None, options=None):
+        """
+        Returns encoded jobs from the history that are no longer in memory followed by in-memory jobs.
+        History is only pre-filtered using `filters` and `options`, these still need to be applied to the result.
+        """
+        jobs = [i.__encode__() for i in list(self.all().values())]
+        if self.history is not None:
+            jobs = self.history.query(filters, exclude_ids={job['id'] for job in jobs}, options=options) + jobs
+        return jobs
+
+    async def load_index(self):
+        """
+        Loads latest jobs of indexed job methods from history so they are known after middlewared restart.
+        """
+        if self.history is None:
+            return
+
+        methods = []
+        for service_name, service in self.middleware.get_services().items():
+            for attr in dir(service):
+                method = getattr(service, attr)
+                if callable(method) and getattr(method, '_job', {}).get('index'):
+                    methods.append(f'{service_name}.{attr}')
+
+        if not methods:
+            return
+
+        try:
+            jobs = await self.middleware.run_in_thread(self.history.query, [('method', 'in', methods)])
+        except Exception:
+            logger.error('Failed to load jobs index from history', exc_info=True)
+            return
+
+        for job in jobs:
+            self.index.load(job)
+
+    async def store_history(self, job):
+        if self.history is None:
+            return
+
+        encoded = job.__encode__()
+        if not job.options['history_result']:
+            encoded['result'] = None
+
+        try:
+            await self.middleware.run_in_thread(self.history.add, encoded)
+        except Exception:
+            logger.error('Failed to store %r in job history', job, exc_info=True)
+        else:
+            # Logs retention is now handled by job history
+            job.logs_stored = True
+
     def get_lock(self, job):
         """
         Get a shared lock for a job
@@ -113,56 +337,36 @@ class JobsQueue(object):
 
         lock = self.job_locks.get(name)
         if lock is None:
-            lock = JobSharedLock(self, name)
+            stats = self.job_locks_stats.get(name)
+            if stats is None:
+                stats = self.job_locks_stats[name] = JobSharedLockStats()
+            lock = JobSharedLock(self, name, stats)
             self.job_locks[lock.name] = lock
-        lock.add_job(job)
         return lock
 
     def release_lock(self, job):
         lock = job.get_lock()
         if not lock:
             return
-        # Remove job from lock list and release it so another job can use it
-        lock.remove_job(job)
-        lock.release()
 
-        if len(lock.get_jobs()) == 0:
-            self.job_locks.pop(lock.name)
-
-        # Once a lock is released there could be another job in the queue
-        # waiting for the same lock
-        self.queue_event.set()
+        # Hand the lock to the next job waiting for it (if any)
+        next_job = lock.release()
+        if next_job is not None:
+            self.queue.append(next_job)
+            self.queue_event.set()
+        elif lock.idle():
+            self.job_locks.pop(lock.name, None)
 
     async def next(self):
         """
         Returns when there is a new job ready to run.
         """
-        while True:
+        while not self.queue:
             # Awaits a new event to look for a job
+            self.queue_event.clear()
             await self.queue_event.wait()
-            found = None
-            for job in self.queue:
-                try:
-                    lock = self.get_lock(job)
-                except Exception:
-                    logger.error('Failed to get lock for %r', job, exc_info=True)
-                    lock = None
-                # Get job in the queue if it has no lock or its not locked
-                if lock is None or not lock.locked():
-                    found = job
-                    if lock:
-                        await job.set_lock(lock)
-                    break
-            if found:
-                # Unlocked job found to run
-                self.queue.remove(found)
-                # If there are no more jobs in the queue, clear the event
-                if len(self.queue) == 0:
-                    self.queue_event.clear()
-                return found
-            else:
-                # No jobs available to run, clear the event
-                self.queue_event.clear()
+
+        return self.queue.popleft()
 
     async def run(self):
         while True:
@@ -226,6 +430,7 @@ class Job(object):
 
         self.id = None
         self.lock = None
+        self.queued_at = None
         self.result = None
         self.error = None
         self.exception = None
@@ -242,10 +447,22 @@ class Job(object):
         self.time_finished = None
         self.loop = asyncio.get_event_loop()
         self.future = None
+        # Set when the job is aborted so methods running in a thread can stop
+        self.aborted = threading.Event()
+
+        self.encoded_arguments = None
+
+        # Progress updates are coalesced so no more than one update is sent every `progress_interval` seconds
+        self.progress_lock = threading.Lock()
+        self.progress_sent_at = 0
+        self.progress_pending = False
+        self.progress_pending_handle = None
 
         self.logs_path = None
         self.logs_fd = None
         self.logs_excerpt = None
+        self.logs_flush_handle = None
+        self.logs_stored = False
 
         if self.options["check_pipes"]:
             for pipe in self.options["pipes"]:
@@ -267,10 +484,6 @@ class Job(object):
     def get_lock(self):
         return self.lock
 
-    async def set_lock(self, lock):
-        self.lock = lock
-        await self.lock.acquire()
-
     def set_result(self, result):
         self.result = result
 
@@ -289,6 +502,9 @@ class Job(object):
         if self.state in (State.SUCCESS, State.FAILED, State.ABORTED):
             self.time_finished = datetime.now()
 
+        if not self.options['transient']:
+            self.send_progress_event()
+
     def set_progress(self, percent, description=None, extra=None):
         if percent is not None:
             assert isinstance(percent, (int, float))
@@ -297,13 +513,69 @@ class Job(object):
             self.progress['description'] = description
         if extra:
             self.progress['extra'] = extra
+
+        with self.progress_lock:
+            if self.progress_pending:
+                # Update will be sent by already scheduled call with the most recent progress
+                return
+
+            delay = self.progress_sent_at + self.options['progress_interval'] - time.monotonic()
+            if delay > 0:
+                self.progress_pending = True
+            else:
+                self.progress_sent_at = time.monotonic()
+
+        if delay > 0:
+            self.loop.call_soon_threadsafe(self.__schedule_pending_progress, delay)
+        else:
+            self.__send_progress()
+
+    def __schedule_pending_progress(self, delay):
+        with self.progress_lock:
+            if self.progress_pending:
+                self.progress_pending_handle = self.loop.call_later(delay, self.__send_pending_progress)
+
+    def __send_pending_progress(self):
+        with self.progress_lock:
+            self.progress_sent_at = time.monotonic()
+            self.progress_pending = False
+            self.progress_pending_handle = None
+
+        self.__send_progress()
+
+    def __flush_pending_progress(self):
+        """
+        Cancels scheduled progress update. `on_progress_cb` still receives the most recent progress, subscribers
+        will be notified about it with the final job state.
+        """
+        with self.progress_lock:
+            pending = self.progress_pending
+            if self.progress_pending_handle is not None:
+                self.progress_pending_handle.cancel()
+            self.progress_pending = False
+            self.progress_pending_handle = None
+
+        if pending:
+            self.__run_progress_cb(self.__encode__())
+
+    def __send_progress(self):
         encoded = self.__encode__()
+        self.__run_progress_cb(encoded)
+        self.middleware.send_event('core.get_jobs', 'CHANGED', id=self.id, fields=encoded)
+        self.send_progress_event()
+
+    def __run_progress_cb(self, encoded):
         if self.on_progress_cb:
             try:
                 self.on_progress_cb(encoded)
             except Exception:
                 logger.warn('Failed to run on progress callback', exc_info=True)
-        self.middleware.send_event('core.get_jobs', 'CHANGED', id=self.id, fields=encoded)
+
+    def send_progress_event(self):
+        self.middleware.send_event('core.get_jobs_progress', 'CHANGED', id=self.id, fields={
+            'progress': dict(self.progress),
+            'state': self.state.name,
+        })
 
     async def wait(self, timeout=None):
         if timeout is None:
@@ -327,6 +599,7 @@ class Job(object):
         return self.result
 
     def abort(self):
+        self.aborted.set()
         if self.loop is not None and self.future is not None:
             self.loop.call_soon_threadsafe(self.future.cancel)
 
@@ -337,12 +610,15 @@ class Job(object):
         """
 
         if self.options["logs"]:
-            logs_dir = os.path.join("/tmp/middlewared/jobs")
-            os.makedirs(logs_dir, exist_ok=True)
-            self.logs_path = os.path.join(logs_dir, f"{self.id}.log")
-            self.logs_fd = open(self.logs_path, "wb", buffering=0)
+            os.makedirs(LOGS_DIR, exist_ok=True)
+            self.logs_path = os.path.join(LOGS_DIR, f"{self.id}.log")
+            self.logs_fd = JobLogsFile(self.logs_path)
+            self.logs_flush_handle = self.loop.call_later(LOGS_FLUSH_INTERVAL, self.__flush_logs)
 
         self.set_state('RUNNING')
+        if self.options['index']:
+            queue.index.started(self)
+        started = time.monotonic()
         try:
             self.future = asyncio.ensure_future(self.__run_body())
             try:
@@ -361,15 +637,24 @@ class Job(object):
             if self.options['transient']:
                 logger.error("Transient job failed", exc_info=True)
         finally:
+            self.middleware.metrics.observe(
+                self.method_name, 'job', time.monotonic() - started, self.state != State.SUCCESS, self.args, self.method,
+            )
+
+            self.__flush_pending_progress()
+
             await self.__close_logs()
             await self.__close_pipes()
 
             queue.release_lock(self)
+            if self.options['index']:
+                queue.index.finished(self)
             self._finished.set()
             if self.options['transient']:
                 queue.remove(self.id)
             else:
                 self.middleware.send_event('core.get_jobs', 'CHANGED', id=self.id, fields=self.__encode__())
+                await queue.store_history(self)
 
     async def __run_body(self):
         """
@@ -389,26 +674,35 @@ class Job(object):
         self.set_result(rv)
         self.set_state('SUCCESS')
 
+    def __flush_logs(self):
+        try:
+            self.logs_fd.flush()
+        except Exception:
+            logger.warning('Failed to flush logs for %r', self, exc_info=True)
+
+        self.logs_flush_handle = self.loop.call_later(LOGS_FLUSH_INTERVAL, self.__flush_logs)
+
     async def __close_logs(self):
         if self.logs_fd:
+            self.logs_flush_handle.cancel()
             self.logs_fd.close()
 
             def get_logs_excerpt():
-                head = []
-                tail = []
-                lines = 0
-                with open(self.logs_path, "r", encoding="utf-8", errors="ignore") as f:
-                    for line in f:
-                        if len(head) < 10:
-                            head.append(line)
-                        else:
-                            tail.append(line)
-                            tail = tail[-10:]
-
-                        lines += 1
-
-                if lines > 20:
-                    excerpt = "%s... %d more lines ...\n%s" % ("".join(head), lines - 20, "".join(tail))
+                with open(self.logs_path, "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    if self.logs_fd.lines <= 20 or size <= 2 * LOGS_EXCERPT_CHUNK_SIZE:
+                        head = f.read().decode("utf-8", "ignore").splitlines(True)
+                        tail = head[10:][-10:]
+                        head = head[:10]
+                    else:
+                        # Only read the beginning and the end of the file
+                        head = f.read(LOGS_EXCERPT_CHUNK_SIZE).decode("utf-8", "ignore").splitlines(True)[:10]
+                        f.seek(size - LOGS_EXCERPT_CHUNK_SIZE)
+                        # First line is most likely incomplete
+                        tail = f.read().decode("utf-8", "ignore").splitlines(True)[1:][-10:]
+
+                if self.logs_fd.lines > 20:
+                    excerpt = "%s... %d more lines ...\n%s" % ("".join(head), self.logs_fd.lines - 20, "".join(tail))
                 else:
                     excerpt = "".join(head + tail)
 
@@ -449,7 +743,7 @@ class Job(object):
         return {
             'id': self.id,
             'method': self.method_name,
-            'arguments': self.middleware.dump_args(self.args, method=self.method),
+            'arguments': self.__encode_arguments(),
             'logs_path': self.logs_path,
             'logs_excerpt': self.logs_excerpt,
             'progress': self.progress,
@@ -462,6 +756,12 @@ class Job(object):
             'time_finished': self.time_finished,
         }
 
+    def __encode_arguments(self):
+        # Job arguments never change so they only need to be dumped once
+        if self.encoded_arguments is None:
+            self.encoded_arguments = self.middleware.dump_args(self.args, method=self.method)
+        return self.encoded_arguments
+
     async def wrap(self, subjob):
         """
         Wrap a job in another job, proxying progress and result/error.
@@ -478,64 +778,36 @@ class Job(object):
         return subjob.result
 
     def cleanup(self):
-        if self.logs_path:
+        if self.logs_path and not self.logs_stored:
             try:
                 os.unlink(self.logs_path)
             except Exception:
                 pass
 
 
-class JobProgressBuffer:
+class JobLogsFile(object):
     """
-    This wrapper for `job.set_progress` strips too frequent progress updated
-    (more frequent than `interval` seconds) so they don't spam websocket
-    connections.
+    Buffered job logs file (flushed periodically by the job) that counts written
+    lines so logs excerpt does not have to read the whole file.
     """
 
-    def __init__(self, job, interval=1):
-        self.job = job
-
-        self.interval = interval
-
-        self.last_update_at = 0
-
-        self.pending_update_body = None
-        self.pending_update = None
-
-    def set_progress(self, *args, **kwargs):
-        t = time.monotonic()
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.newlines = 0
+        self.incomplete_line = False
 
-        if t - self.last_update_at >= self.interval:
-            if self.pending_update is not None:
-                self.pending_update.cancel()
+    @property
+    def lines(self):
+        return self.newlines + int(self.incomplete_line)
 
-                self.pending_update_body = None
-                self.pending_update = None
-
-            self.last_update_at = t
-            self.job.set_progress(*args, **kwargs)
-        else:
-            self.pending_update_body = args, kwargs
-
-            if self.pending_update is None:
-                self.pending_update = asyncio.get_event_loop().call_later(self.interval, self._do_pending_update)
-
-    def cancel(self):
-        if self.pending_update is not None:
-            self.pending_update.cancel()
-
-            self.pending_update_body = None
-            self.pending_update = None
+    def write(self, data):
+        if data:
+            self.newlines += data.count(b"\n")
+            self.incomplete_line = not data.endswith(b"\n")
+        return self.file.write(data)
 
     def flush(self):
-        if self.pending_update is not None:
-            self.pending_update.cancel()
-
-            self._do_pending_update()
-
-    def _do_pending_update(self):
-        self.last_update_at = time.monotonic()
-        self.job.set_progress(*self.pending_update_body[0], **self.pending_update_body[1])
+        self.file.flush()
 
-        self.pending_update_body = None
-        self.pending_update = None
+    def close(self):
+        self.file.close()
@@ -0,0 +1,249 @@
+from datetime import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from middlewared.client import ejson as json
+
+logger = logging.getLogger(__name__)
+
+JOB_HISTORY_PATH = '/var/db/middlewared/job_history.db'
+
+
+class JobHistory(object):
+    """
+    On-disk history of finished jobs so they can be queried after they were
+    dropped from the in-memory jobs deque (or after middlewared restart).
+
+    Retention is bounded by entries count, age (in seconds) and total size of
+    job logs (in bytes). Logs of pruned jobs are removed as well.
+    """
+
+    SQL_COLUMNS = ('id', 'method', 'state', 'time_started', 'time_finished')
+    SQL_OPERATORS = {
+        '=': '=',
+        '!=': '!=',
+        '>': '>',
+        '>=': '>=',
+        '<': '<',
+        '<=': '<=',
+        'in': 'IN',
+        'nin': 'NOT IN',
+    }
+
+    def __init__(self, path=JOB_HISTORY_PATH, max_entries=10000, max_age=30 * 86400, max_logs_size=256 * 1024 ** 2,
+                 prune_interval=600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.max_logs_size = max_logs_size
+        self.prune_interval = prune_interval
+
+        self.lock = threading.Lock()
+        self.conn = None
+        self.pruned_at = 0
+
+        try:
+            # Job arguments, results and logs may contain sensitive data, only root is allowed to read them
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            os.chmod(os.path.dirname(self.path), 0o700)
+            os.close(os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600))
+            os.chmod(self.path, 0o600)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS job (
+                    id INTEGER PRIMARY KEY,
+                    method TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    time_started REAL,
+                    time_finished REAL,
+                    logs_path TEXT,
+                    logs_size INTEGER NOT NULL DEFAULT 0,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS job_method_time_finished ON job (method, time_finished);
+                CREATE INDEX IF NOT EXISTS job_state ON job (state);
+                CREATE INDEX IF NOT EXISTS job_time_finished ON job (time_finished);
+            """)
+        except Exception:
+            logger.error('Failed to open job history database %r', self.path, exc_info=True)
+            self.conn = None
+
+    def last_id(self):
+        if self.conn is None:
+            return 0
+
+        with self.lock:
+            return self.conn.execute('SELECT MAX(id) FROM job').fetchone()[0] or 0
+
+    def add(self, encoded):
+        """
+        Stores a finished job (as returned by `Job.__encode__`).
+        """
+        if self.conn is None:
+            return
+
+        logs_size = 0
+        if encoded['logs_path']:
+            try:
+                logs_size = os.path.getsize(encoded['logs_path'])
+            except OSError:
+                pass
+
+        data = {k: v for k, v in encoded.items() if k not in ('time_started', 'time_finished')}
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO job VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        encoded['id'], encoded['method'], encoded['state'],
+                        self._timestamp(encoded['time_started']), self._timestamp(encoded['time_finished']),
+                        encoded['logs_path'], logs_size, json.dumps(data),
+                    ),
+                )
+
+        if time.monotonic() - self.pruned_at > self.prune_interval:
+            self.prune()
+
+    def query(self, filters=None, exclude_ids=None, options=None):
+        """
+        Returns stored jobs matching `filters`. Filters on indexed columns are evaluated by the database,
+        the rest of them must be applied by the caller (i.e. using `filter_list`).
+
+        When all `filters` are evaluated by the database and jobs are ordered by `id`, `offset` and `limit` of
+        `options` are used to only read jobs that can make it to the result. The caller still needs to apply
+        `options` to the result.
+        """
+        if self.conn is None:
+            return []
+
+        where = []
+        params = []
+        evaluated = True
+        for f in filters or []:
+            if len(f) != 3:
+                evaluated = False
+                continue
+
+            name, op, value = f
+            if name not in self.SQL_COLUMNS or op not in self.SQL_OPERATORS:
+                evaluated = False
+                continue
+
+            if op in ('in', 'nin'):
+                if not isinstance(value, (list, tuple)):
+                    evaluated = False
+                    continue
+
+                value = [self._sql_value(name, v) for v in value]
+                if None in value:
+                    evaluated = False
+                    continue
+
+                where.append(f'{name} {self.SQL_OPERATORS[op]} ({", ".join(["?"] * len(value))})')
+                params.extend(value)
+            else:
+                value = self._sql_value(name, value)
+                if value is None:
+                    evaluated = False
+                    continue
+
+                where.append(f'{name} {self.SQL_OPERATORS[op]} ?')
+                params.append(value)
+
+        options = options or {}
+        order_by = options.get('order_by') or []
+        descending = order_by == ['-id']
+
+        limit = None
+        if evaluated and order_by in ([], ['id'], ['-id']) and not options.get('count'):
+            if options.get('limit'):
+                limit = (options.get('offset') or 0) + options['limit']
+            elif options.get('get') and not order_by:
+                limit = 1
+
+        sql = 'SELECT id, time_started, time_finished, data FROM job'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY id DESC' if descending else ' ORDER BY id'
+        if limit is not None:
+            # Excluded jobs still take their place in the result of the query
+            sql += ' LIMIT ?'
+            params.append(limit + len(exclude_ids or []))
+
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+
+        if descending:
+            rows.reverse()
+
+        result = []
+        for id, time_started, time_finished, data in rows:
+            if exclude_ids and id in exclude_ids:
+                continue
+
+            job = json.loads(data)
+            job['time_started'] = self._datetime(time_started)
+            job['time_finished'] = self._datetime(time_finished)
+            result.append(job)
+
+        return result
+
+    def prune(self):
+        if self.conn is None:
+            return
+
+        self.pruned_at = time.monotonic()
+
+        with self.lock:
+            ids = set()
+            logs_paths = []
+
+            for id, logs_path in self.conn.execute(
+                'SELECT id, logs_path FROM job WHERE time_finished < ?', (time.time() - self.max_age,)
+            ):
+                ids.add(id)
+                logs_paths.append(logs_path)
+
+            count = 0
+            logs_size = 0
+            for id, logs_path, size in self.conn.execute('SELECT id, logs_path, logs_size FROM job ORDER BY id DESC'):
+                if id in ids:
+                    continue
+
+                count += 1
+                logs_size += size
+                if count > self.max_entries or logs_size > self.max_logs_size:
+                    ids.add(id)
+                    logs_paths.append(logs_path)
+
+            if not ids:
+                return
+
+            with self.conn:
+                self.conn.executemany('DELETE FROM job WHERE id = ?', [(id,) for id in ids])
+
+        for logs_path in filter(None, logs_paths):
+            try:
+                os.unlink(logs_path)
+            except FileNotFoundError:
+                pass
+            except Exception:
+                logger.warning('Failed to remove job logs %r', logs_path, exc_info=True)
+
+    def _sql_value(self, name, value):
+        if name in ('time_started', 'time_finished'):
+            if isinstance(value, datetime):
+                return value.timestamp()
+        elif isinstance(value, (int, str)) and not isinstance(value, bool):
+            return value
+
+    def _timestamp(self, value):
+        if value is not None:
+            return value.timestamp()
+
+    def _datetime(self, value):
+        if value is not None:
+            return datetime.fromtimestamp(value)
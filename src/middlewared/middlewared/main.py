@@ -2,6 +2,8 @@ from .apidocs import app as apidocs_app
 from .client import ejson as json
 from .event import EventSource, Events
 from .job import Job, JobsQueue
+from .job_history import JobHistory
+from .metrics import CallMetrics
 from .pipe import Pipes, Pipe
 from .restful import RESTfulAPI
 from .schema import Error as SchemaError
@@ -10,7 +12,9 @@ from .service_exception import adapt_exception
 from .utils import start_daemon_thread, LoadPluginsMixin
 from .utils.debug import get_frame_details, get_threads_stacks
 from .utils.lock import SoftHardSemaphore, SoftHardSemaphoreLimit
+from .utils.plugins_setup import PluginsSetup
 from .utils.io_thread_pool_executor import IoThreadPoolExecutor
+from .utils.process_pool import ProcessPool
 from .utils.profile import profile_wrap
 from .utils.run_in_thread import RunInThreadMixin
 from .webui_auth import WebUIAuth
@@ -123,6 +127,8 @@ class Application(object):
 
     async def call_method(self, message):
 
+        error = True
+        started = time.monotonic()
         try:
             async with self._softhardsemaphore:
                 result = await self.middleware.call_method(self, message)
@@ -137,6 +143,7 @@ class Application(object):
                 'msg': 'result',
                 'result': result,
             })
+            error = False
         except SoftHardSemaphoreLimit as e:
             self.send_error(
                 message,
@@ -165,6 +172,15 @@ class Application(object):
                         self.middleware.dump_args(message.get('params', []), method_name=message['method'])
                     ), exc_info=True)
                     asyncio.ensure_future(self.__crash_reporting(sys.exc_info()))
+        finally:
+            try:
+                methodobj = self.middleware._method_lookup(message['method'])[1]
+            except CallError:
+                methodobj = None
+            # Includes time spent waiting for the concurrent calls semaphore and sending the result
+            self.middleware.metrics.observe(
+                message['method'], 'websocket', time.monotonic() - started, error, message.get('params'), methodobj,
+            )
 
     async def __crash_reporting(self, exc_info):
         if self.middleware.crash_reporting.is_disabled():
@@ -385,23 +401,27 @@ class FileApplication(object):
             resp.set_status(410)
             return resp
 
-        resp = web.StreamResponse(status=200, reason='OK', headers={
-            'Content-Type': 'application/octet-stream',
-            'Content-Disposition': f'attachment; filename="{filename}"',
-            'Transfer-Encoding': 'chunked',
-        })
-        await resp.prepare(request)
-
-        def do_copy():
-            while True:
-                read = job.pipes.output.r.read(1048576)
-                if read == b'':
-                    break
-                asyncio.run_coroutine_threadsafe(resp.write(read), loop=self.loop).result()
-
         try:
             await self._cleanup_cancel(job_id)
-            await self.middleware.run_in_thread(do_copy)
+
+            # Wait for the job to either start writing to the pipe or hand over a regular file
+            read = await job.pipes.output.read_async(1048576)
+            if read == b'' and job.pipes.output.source_file is not None:
+                # `FileResponse` supports range requests and uses `sendfile`
+                return web.FileResponse(job.pipes.output.source_file, headers={
+                    'Content-Disposition': f'attachment; filename="{filename}"',
+                })
+
+            resp = web.StreamResponse(status=200, reason='OK', headers={
+                'Content-Type': 'application/octet-stream',
+                'Content-Disposition': f'attachment; filename="{filename}"',
+                'Transfer-Encoding': 'chunked',
+            })
+            await resp.prepare(request)
+
+            while read != b'':
+                await resp.write(read)
+                read = await job.pipes.output.read_async(1048576)
         finally:
             await job.pipes.close()
 
@@ -468,17 +488,14 @@ class FileApplication(object):
             resp.set_status(405)
             return resp
 
-        def copy():
+        async def copy():
             try:
                 try:
                     while True:
-                        read = asyncio.run_coroutine_threadsafe(
-                            filepart.read_chunk(1048576),
-                            loop=self.loop,
-                        ).result()
+                        read = await filepart.read_chunk(1048576)
                         if read == b'':
                             break
-                        job.pipes.input.w.write(read)
+                        await job.pipes.input.write_async(read)
                 finally:
                     job.pipes.input.w.close()
             except BrokenPipeError:
@@ -487,7 +504,7 @@ class FileApplication(object):
         try:
             job = await self.middleware.call(data['method'], *(data.get('params') or []),
                                              pipes=Pipes(input=self.middleware.pipe()))
-            await self.middleware.run_in_thread(copy)
+            await copy()
         except CallError as e:
             if e.errno == CallError.ENOMETHOD:
                 status_code = 422
@@ -738,7 +755,8 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin):
         self.startup_seq_path = startup_seq_path
         self.app = None
         self.loop = None
-        self.run_in_thread_executor = IoThreadPoolExecutor('IoThread', 20)
+        # One method can't take more than a quarter of io threads
+        self.run_in_thread_executor = IoThreadPoolExecutor('IoThread', 20, max_workers=200, max_workers_per_caller=50)
         self.__thread_id = threading.get_ident()
         # Spawn new processes for ProcessPool instead of forking
         multiprocessing.set_start_method('spawn')
@@ -746,7 +764,9 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin):
             initializer=lambda: set_thread_name('threadpool_ws'),
             max_workers=10,
         )
-        self.__init_procpool()
+        self.__process_pools = {}
+        self.metrics = CallMetrics(self.dump_args)
+        self.plugins_setup = None
         self.__wsclients = {}
         self.__events = Events()
         self.__event_sources = {}
@@ -756,7 +776,7 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin):
         self.__init_services()
         self.__console_io = False if os.path.exists(self.CONSOLE_ONCE_PATH) else None
         self.__terminate_task = None
-        self.jobs = JobsQueue(self)
+        self.jobs = JobsQueue(self, JobHistory())
 
     def __init_services(self):
         from middlewared.service import CoreService
@@ -774,7 +794,7 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin):
             if not hasattr(mod, 'setup'):
                 return
             setup_plugin = mod.__name__.rsplit('.', 1)[-1]
-            setup_funcs.append((setup_plugin, mod.setup))
+            setup_funcs.append((setup_plugin, mod.setup, getattr(mod, 'setup_depends', None)))
 
         def on_modules_loaded():
             self._console_write(f'resolving plugins schemas')
@@ -789,35 +809,18 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin):
 
     async def __plugins_setup(self, setup_funcs):
 
-        # TODO: Rework it when we have order defined for setup functions
-        def sort_key(plugin__function):
-            plugin, function = plugin__function
-
-            beginning = [
-                # We need to run system plugin setup's function first because when system boots, the right
-                # timezone is not configured. See #72131
-                'system',
-                # We also need to load alerts first because other plugins can issue one-shot alerts during their
-                # initialization
-                'alert',
-            ]
-            try:
-                return beginning.index(plugin)
-            except ValueError:
-                return len(beginning)
-        setup_funcs = sorted(setup_funcs, key=sort_key)
+        def on_start(name, i, setup_total):
+            self._console_write(f'setting up plugins ({name}) [{i}/{setup_total}]')
+            self.__incr_startup_seq()
 
         # Only call setup after all schemas have been resolved because
         # they can call methods with schemas defined.
-        setup_total = len(setup_funcs)
-        for i, setup_func in enumerate(setup_funcs):
-            name, f = setup_func
-            self._console_write(f'setting up plugins ({name}) [{i + 1}/{setup_total}]')
-            self.__incr_startup_seq()
-            call = f(self)
-            # Allow setup to be a coroutine
-            if asyncio.iscoroutinefunction(f):
-                await call
+        # Setups of plugins that declare `setup_depends` run concurrently in the order it defines, the others run one
+        # after another in load order.
+        self.plugins_setup = PluginsSetup(setup_funcs)
+        await self.plugins_setup.run(self, on_start)
+
+        self.logger.debug('Plugins setup took %.2f seconds', self.plugins_setup.__encode__()['duration'])
 
         self.logger.debug('All plugins loaded')
 
@@ -1002,26 +1005,34 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin):
         """
         return await self.run_in_executor(self.__ws_threadpool, method, *args, **kwargs)
 
-    def __init_procpool(self):
-        self.__procpool = concurrent.futures.ProcessPoolExecutor(
-            max_workers=5,
-            initializer=functools.partial(
-                worker_init, self.overlay_dirs, self.debug_level, self.log_handler
-            ),
-        )
+    def get_process_pool(self, name='default'):
+        """
+        Returns process pool `name` creating it if necessary.
+        Services choose their pool using `process_pool` config option (`True` stands for `default` pool).
+        """
+        if name not in self.__process_pools:
+            self.__process_pools[name] = ProcessPool(
+                name,
+                functools.partial(worker_init, self.overlay_dirs, self.debug_level, self.log_handler),
+            )
+        return self.__process_pools[name]
+
+    def get_process_pools(self):
+        return dict(self.__process_pools)
+
+    def _process_pool_name(self, serviceobj):
+        if serviceobj._config.process_pool is True:
+            return 'default'
+        return serviceobj._config.process_pool
 
     async def run_in_proc(self, method, *args, **kwargs):
-        retries = 2
-        for i in range(retries):
-            try:
-                return await self.run_in_executor(self.__procpool, method, *args, **kwargs)
-            except concurrent.futures.process.BrokenProcessPool:
-                if i == retries - 1:
-                    raise
-                self.__init_procpool()
+        return await self.run_in_process_pool('default', 'short', method, *args, **kwargs)
 
-    def pipe(self):
-        return Pipe(self)
+    async def run_in_process_pool(self, pool, lane, method, *args, **kwargs):
+        return await self.get_process_pool(pool).run(lane, method, *args, **kwargs)
+
+    def pipe(self, allow_source_file=False):
+        return Pipe(self, allow_source_file)
 
     async def _call(
         self, name, serviceobj, methodobj, params=None, app=None, pipes=None,
@@ -1039,8 +1050,7 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin):
         # entry to keep track of its state.
         job_options = getattr(methodobj, '_job', None)
         if job_options:
-            # Currently its only a boolean
-            if serviceobj._config.process_pool is True:
+            if serviceobj._config.process_pool:
                 job_options['process'] = True
             # Create a job instance with required args
             job = Job(
@@ -1057,29 +1067,39 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin):
             return job
         else:
 
-            # Currently its only a boolean
-            if serviceobj._config.process_pool is True:
-                return await self._call_worker(name, *args)
-
-            if asyncio.iscoroutinefunction(methodobj):
-                return await methodobj(*args)
-
-            tpool = None
-            if serviceobj._config.thread_pool:
-                tpool = serviceobj._config.thread_pool
-            if hasattr(methodobj, '_thread_pool'):
-                tpool = methodobj._thread_pool
-            if tpool:
-                return await self.run_in_executor(tpool, methodobj, *args)
-
-            if io_thread:
-                run_method = self.run_in_thread
+            if serviceobj._config.process_pool:
+                path, coro = 'process_pool', self._call_worker(name, *args)
+            elif asyncio.iscoroutinefunction(methodobj):
+                path, coro = 'coroutine', methodobj(*args)
             else:
-                run_method = self._run_in_conn_threadpool
-            return await run_method(methodobj, *args)
+                tpool = None
+                if serviceobj._config.thread_pool:
+                    tpool = serviceobj._config.thread_pool
+                if hasattr(methodobj, '_thread_pool'):
+                    tpool = methodobj._thread_pool
+                if tpool:
+                    path, coro = 'thread_pool', self.run_in_executor(tpool, methodobj, *args)
+                elif io_thread:
+                    path, coro = 'io_thread', self.run_in_thread(methodobj, *args)
+                else:
+                    path, coro = 'thread_pool', self._run_in_conn_threadpool(methodobj, *args)
+
+            error = True
+            started = time.monotonic()
+            try:
+                result = await coro
+                error = False
+                return result
+            finally:
+                self.metrics.observe(name, path, time.monotonic() - started, error, params, methodobj)
 
     async def _call_worker(self, name, *args, job=None):
-        return await self.run_in_proc(main_worker, name, args, job)
+        serviceobj, methodobj = self._method_lookup(name)
+        # Jobs are long running by definition
+        lane = getattr(methodobj, '_process_pool_lane', 'long' if job else 'short')
+        return await self.run_in_process_pool(
+            self._process_pool_name(serviceobj), lane, main_worker, name, args, job,
+        )
 
     def _method_lookup(self, name):
         if '.' not in name:
@@ -1331,10 +1351,13 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin):
 
         restful_api = RESTfulAPI(self, app)
         await restful_api.register_resources()
+        await self.jobs.load_index()
         asyncio.ensure_future(self.jobs.run())
 
-        # Start up middleware worker process pool
-        self.__procpool._start_queue_management_thread()
+        # Start up middleware worker process pools so plugins are loaded before the first call
+        self.get_process_pool().start()
+        for name in set(filter(None, map(self._process_pool_name, self.get_services().values()))):
+            self.get_process_pool(name).start()
 
         runner = web.AppRunner(app, handle_signals=False, access_log=None)
         await runner.setup()
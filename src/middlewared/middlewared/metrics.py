@@ -0,0 +1,93 @@
+from bisect import bisect_left
+from collections import deque
+import time
+
+# Upper bounds (in seconds) of call latency histogram buckets. Last bucket holds everything slower.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+SLOW_CALL_THRESHOLD = 1.0
+SLOW_CALLS_BUFFER_SIZE = 100
+# Calls of methods that could not be resolved are all recorded under this name
+UNKNOWN_METHOD = '<unknown>'
+
+
+class MethodMetrics:
+    __slots__ = ('count', 'errors', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def __encode__(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total': self.total,
+            'avg': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'histogram': [
+                {'le': le, 'count': count}
+                for le, count in zip(LATENCY_BUCKETS + (None,), self.buckets)
+            ],
+        }
+
+
+class CallMetrics:
+    """
+    Per-method call counts and latency histograms split by execution path (`coroutine`, `thread_pool`, `io_thread`,
+    `process_pool`, `job`, `websocket`) along with a ring buffer of slowest recent calls.
+
+    Must only be used from the event loop thread.
+    """
+
+    def __init__(self, dump_args, slow_call_threshold=SLOW_CALL_THRESHOLD, slow_calls_size=SLOW_CALLS_BUFFER_SIZE):
+        self.dump_args = dump_args
+        self.slow_call_threshold = slow_call_threshold
+        self.methods = {}
+        self.slow_calls = deque(maxlen=slow_calls_size)
+
+    def observe(self, method, path, duration, error, args, methodobj):
+        if methodobj is None:
+            # Clients can send any method name, do not let them grow metrics (or slow calls) with arbitrary names
+            method = UNKNOWN_METHOD
+            args = None
+
+        key = (method, path)
+        metrics = self.methods.get(key)
+        if metrics is None:
+            metrics = self.methods[key] = MethodMetrics()
+
+        metrics.count += 1
+        if error:
+            metrics.errors += 1
+        metrics.total += duration
+        if duration > metrics.max:
+            metrics.max = duration
+        metrics.buckets[bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+        if duration >= self.slow_call_threshold:
+            try:
+                # Private fields (i.e. passwords) are redacted by method `accepts` schema
+                arguments = self.dump_args(list(args or []), method=methodobj, method_name=method)
+            except Exception:
+                arguments = None
+
+            self.slow_calls.append({
+                'method': method,
+                'path': path,
+                'time': time.time() - duration,
+                'duration': duration,
+                'error': error,
+                'arguments': arguments,
+            })
+
+    def __encode__(self):
+        return {
+            'methods': [
+                dict(metrics.__encode__(), method=method, path=path)
+                for (method, path), metrics in list(self.methods.items())
+            ],
+            'slow_calls': list(self.slow_calls),
+        }
@@ -1,4 +1,6 @@
+import asyncio
 import os
+import shutil
 
 
 class Pipes:
@@ -19,13 +21,73 @@ class Pipes:
 
 
 class Pipe:
-    def __init__(self, middleware):
+    def __init__(self, middleware, allow_source_file=False):
         self.middleware = middleware
 
         r, w = os.pipe()
         self.r = os.fdopen(r, "rb")
         self.w = os.fdopen(w, "wb")
 
+        # Pipe reader is able to send a regular file on its own (i.e. using `sendfile`)
+        self.allow_source_file = allow_source_file
+        self.source_file = None
+
+    def send_file(self, path):
+        """
+        Sends regular file `path` to the pipe reader. If the reader allows that, file contents are not copied
+        through the pipe and the reader sends the file on its own.
+        """
+        if self.allow_source_file:
+            self.source_file = path
+        else:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, self.w)
+
+    async def read_async(self, n):
+        """
+        Reads up to `n` bytes from the pipe without blocking the event loop.
+        """
+        fd = self.r.fileno()
+        os.set_blocking(fd, False)
+        while True:
+            try:
+                return os.read(fd, n)
+            except BlockingIOError:
+                await self._wait_fd(fd, False)
+
+    async def write_async(self, data):
+        """
+        Writes `data` to the pipe without blocking the event loop.
+        """
+        fd = self.w.fileno()
+        os.set_blocking(fd, False)
+        data = memoryview(data)
+        while data:
+            try:
+                data = data[os.write(fd, data):]
+            except BlockingIOError:
+                await self._wait_fd(fd, True)
+
+    async def _wait_fd(self, fd, write):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def ready():
+            if not future.done():
+                future.set_result(None)
+
+        if write:
+            loop.add_writer(fd, ready)
+        else:
+            loop.add_reader(fd, ready)
+        try:
+            await future
+        finally:
+            if write:
+                loop.remove_writer(fd)
+            else:
+                loop.remove_reader(fd)
+
     async def close(self):
         await self.middleware.run_in_thread(self.r.close)
         await self.middleware.run_in_thread(self.w.close)
@@ -21,6 +21,7 @@ from middlewared.schema import accepts, Bool, Dict, Int, List, Str
 from middlewared.service import job, private, ConfigService, Service, ValidationError, ValidationErrors
 from middlewared.service_exception import CallError
 from middlewared.utils import run, Popen
+from middlewared.plugins.cache import CACHE_NAMESPACE_DSCACHE
 from middlewared.plugins.directoryservices import DSStatus, SSL
 from samba.dcerpc.messaging import MSG_WINBIND_ONLINE
 
@@ -1486,10 +1487,10 @@ class ActiveDirectoryService(ConfigService):
         may be revised in the future, but we want to keep things as simple as possible
         here since the list of entries numbers perhaps in the tens of thousands.
         """
-        if self.middleware.call_sync('cache.has_key', 'AD_cache') and not force:
+        if self.middleware.call_sync('cache.has_key', 'AD_cache', CACHE_NAMESPACE_DSCACHE) and not force:
             raise CallError('AD cache already exists. Refusing to generate cache.')
 
-        self.middleware.call_sync('cache.pop', 'AD_cache')
+        self.middleware.call_sync('cache.pop', 'AD_cache', CACHE_NAMESPACE_DSCACHE)
         ad = self.middleware.call_sync('activedirectory.config')
         smb = self.middleware.call_sync('smb.config')
         id_type_both_backends = [
@@ -1622,7 +1623,7 @@ class ActiveDirectoryService(ConfigService):
         sorted_cache['users'] = dict(sorted(cache_data['users'].items()))
         sorted_cache['groups'] = dict(sorted(cache_data['groups'].items()))
 
-        self.middleware.call_sync('cache.put', 'AD_cache', sorted_cache)
+        self.middleware.call_sync('cache.put', 'AD_cache', sorted_cache, 0, CACHE_NAMESPACE_DSCACHE)
         self.middleware.call_sync('dscache.backup')
 
     @private
@@ -1634,11 +1635,11 @@ class ActiveDirectoryService(ConfigService):
         last filled. The cache expires and is refilled every 24 hours, or can be
         manually refreshed by calling fill_cache(True).
         """
-        if not await self.middleware.call('cache.has_key', 'AD_cache'):
+        if not await self.middleware.call('cache.has_key', 'AD_cache', CACHE_NAMESPACE_DSCACHE):
             await self.middleware.call('activedirectory.fill_cache')
             self.logger.debug('cache fill is in progress.')
             return {'users': {}, 'groups': {}}
-        return await self.middleware.call('cache.get', 'AD_cache')
+        return await self.middleware.call('cache.get', 'AD_cache', CACHE_NAMESPACE_DSCACHE)
 
 
 class WBStatusThread(threading.Thread):
@@ -1767,6 +1768,9 @@ class ADMonitorService(Service):
         self.start()
 
 
+setup_depends = ['system']
+
+
 async def setup(middleware):
     """
     During initial boot let smb_configure script start monitoring once samba's
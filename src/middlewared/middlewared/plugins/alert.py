@@ -1013,6 +1013,9 @@ class AlertDefaultSettingsService(Service):
         return await self.config()
 
 
+setup_depends = ['system']
+
+
 async def setup(middleware):
     middleware.event_register("alert.list", "Sent on alert changes.")
 
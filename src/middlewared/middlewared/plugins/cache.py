@@ -1,13 +1,208 @@
-from middlewared.schema import Any, Str, accepts, Int
-from middlewared.service import Service, private
+from middlewared.schema import Any, Dict, Str, accepts, Int
+from middlewared.service import Service, periodic, private
 from middlewared.utils import filter_list
 
-from collections import namedtuple
+from collections import OrderedDict
+from concurrent.futures import Future
+import sys
+import threading
 import time
 import pickle
 import pwd
 import grp
 
+CACHE_NAMESPACE_DEFAULT = 'default'
+# Users and groups caches of directory services (potentially huge, but must not be evicted)
+CACHE_NAMESPACE_DSCACHE = 'dscache'
+# State flags (e.g. `update.applied`) that must never be evicted
+CACHE_NAMESPACE_STATE = 'state'
+# Namespaces that are not bounded (and entries sizes of which are not computed)
+CACHE_NAMESPACES_UNBOUNDED = (CACHE_NAMESPACE_DSCACHE, CACHE_NAMESPACE_STATE)
+CACHE_MAX_ENTRIES = 4096
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def approximate_size(value):
+    """
+    Approximate memory usage of `value` (including the objects it contains) in bytes.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(k) + approximate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(v) for v in value)
+    return size
+
+
+class CacheEntry:
+    __slots__ = ('value', 'timeout', 'size')
+
+    def __init__(self, value, timeout, size):
+        self.value = value
+        self.timeout = timeout
+        self.size = size
+
+    def expired(self, now):
+        return self.timeout > 0 and now >= self.timeout
+
+
+class LRUCache:
+    """
+    Cache bounded both by entry count and approximate size in bytes. Least recently used entries are evicted first.
+
+    `max_entries` and `max_bytes` set to `None` mean that the cache is unbounded (entries sizes are not computed then).
+    """
+
+    def __init__(self, name, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        # Futures of values that are currently being loaded by `get_or_put`
+        self.loading = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.loads = 0
+        self.coalesced = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and not entry.expired(time.monotonic())
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            raise KeyError(key)
+
+        if entry.expired(time.monotonic()):
+            # Bust the cache
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            raise KeyError(f'{key} has expired')
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def put(self, key, value, timeout=0):
+        if timeout != 0:
+            timeout = time.monotonic() + timeout
+
+        entry = CacheEntry(value, timeout, approximate_size(value) if self.max_bytes is not None else 0)
+
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = entry
+            self.bytes += entry.size
+            self._evict()
+
+    def pop(self, key):
+        with self.lock:
+            entry = self._remove(key)
+
+        if entry is not None:
+            return entry.value
+
+    def get_or_put(self, key, timeout, method):
+        """
+        Returns `key` value, calling `method` to load it on cache miss. Concurrent callers of the same cold `key` wait
+        for the first caller to load it instead of calling `method` themselves.
+        """
+        with self.lock:
+            try:
+                return self._get(key)
+            except KeyError:
+                pass
+
+            future = self.loading.get(key)
+            if future is None:
+                future = self.loading[key] = Future()
+                load = True
+            else:
+                self.coalesced += 1
+                load = False
+
+        if not load:
+            return future.result()
+
+        try:
+            self.loads += 1
+            value = method()
+        except BaseException as e:
+            with self.lock:
+                self.loading.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        self.put(key, value, timeout)
+        with self.lock:
+            self.loading.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def evict_expired(self):
+        now = time.monotonic()
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if entry.expired(now)]:
+                self._remove(key)
+                self.expirations += 1
+
+    def configure(self, max_entries=None, max_bytes=None):
+        with self.lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                if self.max_bytes is None:
+                    # Entries sizes were not computed
+                    for entry in self.entries.values():
+                        entry.size = approximate_size(entry.value)
+                    self.bytes = sum(entry.size for entry in self.entries.values())
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+        return entry
+
+    def _evict(self):
+        # Most recently put entry is never evicted even if it does not fit on its own
+        while len(self.entries) > 1 and (
+            (self.max_entries is not None and len(self.entries) > self.max_entries) or
+            (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def __encode__(self):
+        return {
+            'namespace': self.name,
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'loads': self.loads,
+            'coalesced': self.coalesced,
+        }
+
 
 class CacheService(Service):
 
@@ -16,76 +211,85 @@ class CacheService(Service):
 
     def __init__(self, *args, **kwargs):
         super(CacheService, self).__init__(*args, **kwargs)
-        self.__cache = {}
-        self.kv_tuple = namedtuple('Cache', ['value', 'timeout'])
+        self.__namespaces = {}
+        self.__namespaces_lock = threading.Lock()
+
+    def __namespace(self, namespace):
+        with self.__namespaces_lock:
+            if namespace not in self.__namespaces:
+                if namespace in CACHE_NAMESPACES_UNBOUNDED:
+                    self.__namespaces[namespace] = LRUCache(namespace, max_entries=None, max_bytes=None)
+                else:
+                    self.__namespaces[namespace] = LRUCache(namespace)
+            return self.__namespaces[namespace]
 
-    @accepts(Str('key'))
-    def has_key(self, key):
+    @accepts(Str('key'), Str('namespace', default=CACHE_NAMESPACE_DEFAULT))
+    def has_key(self, key, namespace):
         """
         Check if given `key` is in cache.
         """
-        return key in self.__cache
+        return key in self.__namespace(namespace)
 
-    @accepts(Str('key'))
-    def get(self, key):
+    @accepts(Str('key'), Str('namespace', default=CACHE_NAMESPACE_DEFAULT))
+    def get(self, key, namespace):
         """
         Get `key` from cache.
 
         Raises:
             KeyError: not found in the cache
         """
+        return self.__namespace(namespace).get(key)
 
-        if self.__cache[key].timeout > 0:
-            self.get_timeout(key)
-
-        return self.__cache[key].value
-
-    @accepts(Str('key'), Any('value'), Int('timeout', default=0))
-    def put(self, key, value, timeout):
+    @accepts(Str('key'), Any('value'), Int('timeout', default=0), Str('namespace', default=CACHE_NAMESPACE_DEFAULT))
+    def put(self, key, value, timeout, namespace):
         """
         Put `key` of `value` in the cache.
         """
+        self.__namespace(namespace).put(key, value, timeout)
 
-        if timeout != 0:
-            timeout = time.monotonic() + timeout
-
-        v = self.kv_tuple(value=value, timeout=timeout)
-        self.__cache[key] = v
-
-    @accepts(Str('key'))
-    def pop(self, key):
+    @accepts(Str('key'), Str('namespace', default=CACHE_NAMESPACE_DEFAULT))
+    def pop(self, key, namespace):
         """
         Removes and returns `key` from cache.
         """
-        cache = self.__cache.pop(key, None)
-
-        if cache is not None:
-            cache = cache.value
-
-        return cache
+        return self.__namespace(namespace).pop(key)
 
     @private
-    def get_timeout(self, key):
+    def get_or_put(self, key, timeout, method, namespace=CACHE_NAMESPACE_DEFAULT):
+        return self.__namespace(namespace).get_or_put(key, timeout, method)
+
+    @accepts(
+        Str('namespace'),
+        Dict(
+            'cache-namespace-configure',
+            Int('max_entries'),
+            Int('max_bytes'),
+        ),
+    )
+    def configure_namespace(self, namespace, data):
         """
-        Check if 'key' has expired
+        Set maximum number of entries and approximate size in bytes of cache `namespace`.
         """
-        now = time.monotonic()
-        value, timeout = self.__cache[key]
+        self.__namespace(namespace).configure(**data)
 
-        if now >= timeout:
-            # Bust the cache
-            del self.__cache[key]
+    @accepts()
+    def stats(self):
+        """
+        Returns hit, miss and eviction counts along with current size of each cache namespace.
+        """
+        with self.__namespaces_lock:
+            namespaces = list(self.__namespaces.values())
 
-            raise KeyError(f'{key} has expired')
+        return [namespace.__encode__() for namespace in namespaces]
 
+    @periodic(60, run_on_start=False)
     @private
-    def get_or_put(self, key, timeout, method):
-        try:
-            return self.get(key)
-        except KeyError:
-            value = method()
-            self.put(key, value, timeout)
-            return value
+    def evict_expired(self):
+        with self.__namespaces_lock:
+            namespaces = list(self.__namespaces.values())
+
+        for namespace in namespaces:
+            namespace.evict_expired()
 
 
 class DSCache(Service):
@@ -140,7 +344,8 @@ class DSCache(Service):
                 try:
                     with open(f'/var/db/system/.{ds[1]}_cache_backup', 'rb') as f:
                         pickled_cache = pickle.load(f)
-                    self.middleware.call_sync('cache.put', f'{ds[1]}_cache', pickled_cache)
+                    self.middleware.call_sync('cache.put', f'{ds[1]}_cache', pickled_cache, 0,
+                                              CACHE_NAMESPACE_DSCACHE)
                 except FileNotFoundError:
                     self.logger.debug('User cache file for [%s] is not present.', ds[0])
 
@@ -148,7 +353,7 @@ class DSCache(Service):
         for ds in [('activedirectory', 'AD'), ('ldap', 'LDAP'), ('nis', 'NIS')]:
             if self.middleware.call_sync(f'{ds[0]}.get_state') != 'DISABLED':
                 try:
-                    ds_cache = self.middleware.call_sync('cache.get', f'{ds[1]}_cache')
+                    ds_cache = self.middleware.call_sync('cache.get', f'{ds[1]}_cache', CACHE_NAMESPACE_DSCACHE)
                     with open(f'/var/db/system/.{ds[1]}_cache_backup', 'wb') as f:
                         pickle.dump(ds_cache, f)
                 except KeyError:
@@ -216,6 +421,10 @@ class DSCache(Service):
         await self.middleware.call('dscache.backup')
 
 
+# Restoring directory services users/groups caches does not depend on other plugins
+setup_depends = ['system']
+
+
 async def setup(middleware):
     """
     During initial boot, we need to wait for the system dataset to be imported.
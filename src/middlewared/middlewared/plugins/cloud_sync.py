@@ -27,8 +27,14 @@ import shlex
 import subprocess
 import tempfile
 import textwrap
+import time
 
-RE_TRANSF = re.compile(r"Transferred:\s*(?P<progress_1>.+, )(?P<progress>[0-9]+)%, (?P<progress_2>.+)$", re.S)
+# Minimum interval between job progress updates from rclone stats
+RCLONE_PROGRESS_INTERVAL = 1
+RCLONE_TRANSFER_ACTIONS = ("Copied", "Moved", "Updated", "Deleted")
+
+TRANSFER_SUMMARIES_PATH = "/var/db/system/cloudsync"
+TRANSFER_SUMMARIES_KEEP = 10
 
 REMOTES = {}
 
@@ -130,7 +136,7 @@ def check_local_path(path):
         raise CallError(f"Directory {path!r} must reside within volume mount point")
 
 
-async def rclone(middleware, job, cloud_sync):
+async def rclone(middleware, job, cloud_sync, stats):
     await middleware.run_in_thread(check_local_path, cloud_sync["path"])
 
     # Use a temporary file to store rclone file
@@ -140,6 +146,7 @@ async def rclone(middleware, job, cloud_sync):
             "--config", config.config_path,
             "-v",
             "--stats", "1s",
+            "--use-json-log",
         ]
 
         if cloud_sync["attributes"].get("fast_list"):
@@ -203,7 +210,7 @@ async def rclone(middleware, job, cloud_sync):
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
         )
-        check_cloud_sync = asyncio.ensure_future(rclone_check_progress(job, proc))
+        check_cloud_sync = asyncio.ensure_future(rclone_check_progress(job, proc, stats))
         cancelled_error = None
         try:
             try:
@@ -287,19 +294,134 @@ async def run_script_check(job, proc, name):
         job.logs_fd.write(f"[{name}] ".encode("utf-8") + read)
 
 
-async def rclone_check_progress(job, proc):
+class RcloneStats:
+    """
+    Accumulates records of a single rclone run logged with `--use-json-log`: overall stats, byte and throughput
+    counters of every transferred file and errors.
+    """
+
+    FILES_LIMIT = 1000
+    ERRORS_LIMIT = 100
+
+    def __init__(self):
+        self.stats = {}
+        # Files that are being transferred, by name, as reported by the last stats record that listed them
+        self.transferring = {}
+        self.files = []
+        self.files_omitted = 0
+        self.errors = []
+
+    def feed(self, record):
+        """
+        Returns `True` if `record` updated overall transfer stats.
+        """
+        stats = record.get("stats")
+        if stats is not None:
+            self.stats = stats
+            for transfer in stats.get("transferring") or []:
+                self.transferring[transfer["name"]] = transfer
+            return True
+
+        name = record.get("object")
+        message = record.get("msg") or ""
+        if record.get("level") == "error":
+            if len(self.errors) < self.ERRORS_LIMIT:
+                self.errors.append({"name": name, "message": message})
+        elif name and message.startswith(RCLONE_TRANSFER_ACTIONS):
+            transfer = self.transferring.pop(name, {})
+            if len(self.files) < self.FILES_LIMIT:
+                self.files.append({
+                    "name": name,
+                    "action": message,
+                    # Small files may be transferred between two stats records
+                    "size": transfer.get("size"),
+                    "speed": transfer.get("speedAvg"),
+                })
+            else:
+                self.files_omitted += 1
+
+        return False
+
+    def progress(self):
+        transferred = self.stats.get("bytes") or 0
+        total = self.stats.get("totalBytes") or 0
+        description = (
+            f"{format_size(transferred)} / {format_size(total)}, {format_size(self.stats.get('speed') or 0)}/s, "
+            f"{self.stats.get('transfers') or 0} / {self.stats.get('totalTransfers') or 0} files"
+        )
+        if self.stats.get("eta") is not None:
+            description += f", ETA {self.stats['eta']}s"
+        return int(transferred * 100 / total) if total else 0, description
+
+    def counters(self):
+        elapsed = self.stats.get("elapsedTime") or 0
+        return {
+            "bytes": self.stats.get("bytes") or 0,
+            "total_bytes": self.stats.get("totalBytes") or 0,
+            "transfers": self.stats.get("transfers") or 0,
+            "checks": self.stats.get("checks") or 0,
+            "deletes": self.stats.get("deletes") or 0,
+            "errors": self.stats.get("errors") or 0,
+            "elapsed_time": elapsed,
+            "average_speed": int(self.stats.get("bytes", 0) / elapsed) if elapsed else 0,
+        }
+
+    def summary(self):
+        return dict(
+            self.counters(),
+            files=self.files,
+            files_omitted=self.files_omitted,
+            error_messages=self.errors,
+        )
+
+
+def format_size(size):
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if size < 1024 or unit == "TiB":
+            break
+        size /= 1024
+    return f"{size:.2f} {unit}" if unit != "B" else f"{size} B"
+
+
+def format_rclone_log_record(record):
+    # Same layout as rclone text log
+    line = f"{record.get('time', '')} {record.get('level', '').upper():<6}: "
+    if record.get("object"):
+        line += f"{record['object']}: "
+    return line + f"{record.get('msg', '')}\n"
+
+
+async def rclone_check_progress(job, proc, stats, progress_interval=RCLONE_PROGRESS_INTERVAL):
     dropbox__restricted_content = False
+    progress_at = None
+    progress_pending = False
     while True:
-        read = (await proc.stdout.readline()).decode()
+        read = (await proc.stdout.readline()).decode("utf-8", "ignore")
         if read == "":
             break
         if "failed to open source object: path/restricted_content/" in read:
             job.internal_data["dropbox__restricted_content"] = True
             dropbox__restricted_content = True
-        job.logs_fd.write(read.encode("utf-8", "ignore"))
-        reg = RE_TRANSF.search(read)
-        if reg:
-            job.set_progress(int(reg.group("progress")), reg.group("progress_1") + reg.group("progress_2"))
+
+        try:
+            record = json.loads(read)
+        except ValueError:
+            record = None
+
+        if isinstance(record, dict):
+            progress_pending |= stats.feed(record)
+            job.logs_fd.write(format_rclone_log_record(record).encode("utf-8", "ignore"))
+        else:
+            # Not everything rclone prints is a log record (e.g. panics)
+            job.logs_fd.write(read.encode("utf-8", "ignore"))
+
+        if progress_pending and (progress_at is None or time.monotonic() - progress_at >= progress_interval):
+            job.set_progress(*stats.progress())
+            progress_at = time.monotonic()
+            progress_pending = False
+
+    if progress_pending:
+        job.set_progress(*stats.progress())
 
     if dropbox__restricted_content:
         message = "\n" + (
@@ -313,6 +435,38 @@ async def rclone_check_progress(job, proc):
         job.logs_fd.write(message.encode("utf-8", "ignore"))
 
 
+def read_transfer_summaries(task_id):
+    try:
+        with open(os.path.join(TRANSFER_SUMMARIES_PATH, f"{task_id}.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+    except ValueError:
+        logger.warning("Invalid cloud sync task %r transfer summaries", task_id, exc_info=True)
+        return []
+
+
+def write_transfer_summary(task_id, summary):
+    summaries = ([summary] + read_transfer_summaries(task_id))[:TRANSFER_SUMMARIES_KEEP]
+
+    os.makedirs(TRANSFER_SUMMARIES_PATH, exist_ok=True)
+    fd, name = tempfile.mkstemp(dir=TRANSFER_SUMMARIES_PATH)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(summaries, f)
+        os.rename(name, os.path.join(TRANSFER_SUMMARIES_PATH, f"{task_id}.json"))
+    except Exception:
+        os.unlink(name)
+        raise
+
+
+def delete_transfer_summaries(task_id):
+    try:
+        os.unlink(os.path.join(TRANSFER_SUMMARIES_PATH, f"{task_id}.json"))
+    except FileNotFoundError:
+        pass
+
+
 def rclone_encrypt_password(password):
     key = bytes([0x9c, 0x93, 0x5b, 0x48, 0x73, 0x0a, 0x55, 0x4d,
                  0x6b, 0xfd, 0x7c, 0x63, 0xc8, 0x86, 0xa9, 0x2b,
@@ -535,32 +689,31 @@ class CloudSyncService(CRUDService):
     class Config:
         datastore = "tasks.cloudsync"
         datastore_extend = "cloudsync._extend"
+        datastore_encrypted_fields = ["encryption_password", "encryption_salt"]
 
     @filterable
     async def query(self, filters=None, options=None):
         """
         Query all Cloud Sync Tasks with `query-filters` and `query-options`.
-        """
-        tasks_or_task = await super().query(filters, options)
 
-        jobs = {}
-        for j in await self.middleware.call("core.get_jobs", [("method", "=", "cloudsync.sync")],
-                                            {"order_by": ["id"]}):
-            try:
-                task_id = int(j["arguments"][0])
-            except (IndexError, ValueError):
-                continue
+        `query-options.extra.job_state` set to `false` does not retrieve task last `job` (for callers that only
+        need tasks configuration).
+        """
+        options = dict(options or {})
+        extra = dict(options.get("extra") or {})
+        job_state = extra.pop("job_state", True)
+        options["extra"] = extra
 
-            if task_id in jobs and jobs[task_id]["state"] == "RUNNING":
-                continue
+        tasks_or_task = await super().query(filters, options)
 
-            jobs[task_id] = j
+        if not job_state:
+            return tasks_or_task
 
         if isinstance(tasks_or_task, list):
             for task in tasks_or_task:
-                task["job"] = jobs.get(task["id"])
-        else:
-            tasks_or_task["job"] = jobs.get(tasks_or_task["id"])
+                task["job"] = self.middleware.jobs.index.get("cloudsync.sync", task["id"])
+        elif isinstance(tasks_or_task, dict):
+            tasks_or_task["job"] = self.middleware.jobs.index.get("cloudsync.sync", tasks_or_task["id"])
 
         return tasks_or_task
 
@@ -568,13 +721,6 @@ class CloudSyncService(CRUDService):
     async def _extend(self, cloud_sync):
         cloud_sync["credentials"] = cloud_sync.pop("credential")
 
-        cloud_sync["encryption_password"] = await self.middleware.call(
-            "pwenc.decrypt", cloud_sync["encryption_password"]
-        )
-        cloud_sync["encryption_salt"] = await self.middleware.call(
-            "pwenc.decrypt", cloud_sync["encryption_salt"]
-        )
-
         Cron.convert_db_format_to_schedule(cloud_sync)
 
         return cloud_sync
@@ -767,8 +913,7 @@ class CloudSyncService(CRUDService):
         cloud_sync["id"] = await self.middleware.call("datastore.insert", "tasks.cloudsync", cloud_sync)
         await self.middleware.call("service.restart", "cron")
 
-        cloud_sync = await self._extend(cloud_sync)
-        return cloud_sync
+        return await self._get_instance(cloud_sync["id"])
 
     @accepts(Int("id"), Patch("cloud_sync_create", "cloud_sync_update", ("attr", {"update": True})))
     async def do_update(self, id, data):
@@ -800,8 +945,7 @@ class CloudSyncService(CRUDService):
         await self.middleware.call("datastore.update", "tasks.cloudsync", id, cloud_sync)
         await self.middleware.call("service.restart", "cron")
 
-        cloud_sync = await self._extend(cloud_sync)
-        return cloud_sync
+        return await self._get_instance(id)
 
     @accepts(Int("id"))
     async def do_delete(self, id):
@@ -810,6 +954,7 @@ class CloudSyncService(CRUDService):
         """
         await self.middleware.call("datastore.delete", "tasks.cloudsync", id)
         await self.middleware.call("alert.oneshot_delete", "CloudSyncTaskFailed", id)
+        await self.middleware.run_in_thread(delete_transfer_summaries, id)
         await self.middleware.call("service.restart", "cron")
 
     @accepts(Int("credentials_id"))
@@ -879,7 +1024,7 @@ class CloudSyncService(CRUDService):
 
     @item_method
     @accepts(Int("id"))
-    @job(lock=lambda args: "cloud_sync:{}".format(args[-1]), lock_queue_size=1, logs=True)
+    @job(lock=lambda args: "cloud_sync:{}".format(args[-1]), lock_queue_size=1, logs=True, index=True)
     async def sync(self, job, id):
         """
         Run the cloud_sync job `id`, syncing the local data to remote.
@@ -905,15 +1050,54 @@ class CloudSyncService(CRUDService):
             job.set_progress(0, f"Locking remote path {remote_path!r} for {directions[remote_direction]}")
             async with self.remote_fs_lock_manager.lock(f"{credentials['id']}/{remote_path}", remote_direction):
                 job.set_progress(0, "Starting")
+                stats = RcloneStats()
+                started_at = int(time.time())
+                state = "FAILED"
                 try:
-                    await rclone(self.middleware, job, cloud_sync)
+                    await rclone(self.middleware, job, cloud_sync, stats)
                     await self.middleware.call("alert.oneshot_delete", "CloudSyncTaskFailed", cloud_sync["id"])
+                    state = "SUCCESS"
+                except asyncio.CancelledError:
+                    state = "ABORTED"
+                    raise
                 except Exception:
                     await self.middleware.call("alert.oneshot_create", "CloudSyncTaskFailed", {
                         "id": cloud_sync["id"],
                         "name": cloud_sync["description"],
                     })
                     raise
+                finally:
+                    summary = dict(
+                        stats.summary(),
+                        job_id=job.id,
+                        state=state,
+                        started_at=started_at,
+                        finished_at=int(time.time()),
+                    )
+                    try:
+                        await self.middleware.run_in_thread(write_transfer_summary, cloud_sync["id"], summary)
+                    except Exception:
+                        self.logger.warning("Unable to save cloud sync task %r transfer summary", cloud_sync["id"],
+                                            exc_info=True)
+
+                # Per-file details are only available through `cloudsync.transfer_summaries`, job result is
+                # returned with every `cloudsync.query` row and stored in job history.
+                return stats.counters()
+
+    @item_method
+    @accepts(Int("id"))
+    async def transfer_summaries(self, id):
+        """
+        Returns transfer summaries of the last runs of cloud sync task `id`, most recent first.
+
+        Every summary contains run `state` (`SUCCESS`, `FAILED` or `ABORTED`), its `job_id`, `started_at` and
+        `finished_at` timestamps, overall `bytes`, `transfers`, `checks`, `deletes` and `errors` counters,
+        `average_speed` (bytes per second) and the list of transferred `files` with their `size` and `speed`
+        (if rclone reported it).
+        """
+        await self._get_instance(id)
+
+        return await self.middleware.run_in_thread(read_transfer_summaries, id)
 
     @item_method
     @accepts(Int("id"))
@@ -1,12 +1,15 @@
+import copy
 import datetime
 import dateutil
 import dateutil.parser
+import hashlib
 import ipaddress
 import josepy as jose
 import json
 import os
 import random
 import re
+import threading
 
 from middlewared.async_validators import validate_country
 from middlewared.schema import accepts, Bool, Dict, Int, List, Patch, Ref, Str
@@ -15,6 +18,7 @@ from middlewared.validators import Email, IpAddress, Range
 
 from acme import client, errors, messages
 from OpenSSL import crypto, SSL
+from collections import Counter, OrderedDict
 from contextlib import suppress
 
 from cryptography import x509
@@ -34,6 +38,7 @@ CERT_TYPE_CSR = 0x20
 CERT_ROOT_PATH = '/etc/certificates'
 CERT_CA_ROOT_PATH = '/etc/certificates/CA'
 RE_CERTIFICATE = re.compile(r"(-{5}BEGIN[\s\w]+-{5}[^-]+-{5}END[\s\w]+-{5})+", re.M | re.S)
+PARSED_CERTIFICATES_CACHE_SIZE = 4096
 
 
 def get_cert_info_from_data(data):
@@ -212,6 +217,13 @@ class CryptoKeyService(Service):
                 'Key size must be greater than or equal to 1024 bits.'
             )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Parsed certificates keyed by PEM digest. Certificate contents never change for a given digest so entries
+        # do not need to be invalidated, only evicted when the cache grows too big.
+        self.parsed_certificates = OrderedDict()
+        self.parsed_certificates_lock = threading.Lock()
+
     def parse_cert_date_string(self, date_value):
         t1 = dateutil.parser.parse(date_value)
         t2 = t1.astimezone(dateutil.tz.tzlocal())
@@ -221,6 +233,32 @@ class CryptoKeyService(Service):
         Str('certificate', required=True, max_length=None)
     )
     def load_certificate(self, certificate):
+        digest = hashlib.sha256(certificate.encode()).digest()
+        with self.parsed_certificates_lock:
+            parsed = self.parsed_certificates.get(digest)
+            if parsed is not None:
+                self.parsed_certificates.move_to_end(digest)
+
+        if parsed is None:
+            parsed = self.parse_certificate(certificate)
+            with self.parsed_certificates_lock:
+                self.parsed_certificates[digest] = parsed
+                while len(self.parsed_certificates) > PARSED_CERTIFICATES_CACHE_SIZE:
+                    self.parsed_certificates.popitem(last=False)
+
+        cert_info, not_before, not_after = parsed
+        if not cert_info:
+            return {}
+
+        cert_info = copy.deepcopy(cert_info)
+        # Local timezone might change between calls so these are not cached
+        cert_info.update({
+            'from': not_before.astimezone(dateutil.tz.tzlocal()).ctime(),
+            'until': not_after.astimezone(dateutil.tz.tzlocal()).ctime(),
+        })
+        return cert_info
+
+    def parse_certificate(self, certificate):
         try:
             # digest_algorithm, lifetime, country, state, city, organization, organizational_unit,
             # email, common, san, serial, chain, fingerprint
@@ -229,7 +267,7 @@ class CryptoKeyService(Service):
                 certificate
             )
         except crypto.Error:
-            return {}
+            return {}, None, None
         else:
             cert_info = self.get_x509_subject(cert)
 
@@ -250,18 +288,16 @@ class CryptoKeyService(Service):
                 # Let's log this please
                 self.logger.debug(f'Failed to parse signature algorithm {signature_algorithm} for {certificate}')
 
+            not_before = dateutil.parser.parse(cert.get_notBefore())
+            not_after = dateutil.parser.parse(cert.get_notAfter())
             cert_info.update({
-                'lifetime': (
-                    dateutil.parser.parse(cert.get_notAfter()) - dateutil.parser.parse(cert.get_notBefore())
-                ).days,
-                'from': self.parse_cert_date_string(cert.get_notBefore()),
-                'until': self.parse_cert_date_string(cert.get_notAfter()),
+                'lifetime': (not_after - not_before).days,
                 'serial': cert.get_serial_number(),
                 'chain': len(RE_CERTIFICATE.findall(certificate)) > 1,
                 'fingerprint': cert.digest('sha1').decode()
             })
 
-            return cert_info
+            return cert_info, not_before, not_after
 
     def get_x509_subject(self, obj):
         cert_info = {
@@ -659,6 +695,7 @@ class CertificateService(CRUDService):
     class Config:
         datastore = 'system.certificate'
         datastore_extend = 'certificate.cert_extend'
+        datastore_extend_context = 'certificate.cert_extend_context'
         datastore_prefix = 'cert_'
 
     def __init__(self, *args, **kwargs):
@@ -672,25 +709,48 @@ class CertificateService(CRUDService):
         }
 
     @private
-    async def cert_extend(self, cert):
+    async def cert_extend_context(self):
+        # Certificate authorities are fetched once so that signing chains can be resolved without querying the
+        # database for every certificate
+        cas = {
+            ca['id']: ca
+            for ca in await self.middleware.call(
+                'datastore.query', 'system.certificateauthority', [], {'prefix': 'cert_'}
+            )
+        }
+
+        signed_certificates = Counter(
+            cert['signedby']['id']
+            for cert in await self.middleware.call(
+                'datastore.query', 'system.certificate', [], {'prefix': 'cert_', 'select': ['signedby']}
+            )
+            if cert['signedby']
+        )
+
+        return {
+            'cas': cas,
+            'extended_cas': {},
+            'signed_certificates': signed_certificates,
+        }
+
+    @private
+    async def cert_extend(self, cert, context=None):
         """Extend certificate with some useful attributes."""
 
+        if context is None:
+            context = await self.cert_extend_context()
+
         if cert.get('signedby'):
 
-            # We query for signedby again to make sure it's keys do not have the "cert_" prefix and it has gone through
-            # the cert_extend method
-            # Datastore query is used instead of certificate.query to stop an infinite recursive loop
-
-            cert['signedby'] = await self.middleware.call(
-                'datastore.query',
-                'system.certificateauthority',
-                [('id', '=', cert['signedby']['id'])],
-                {
-                    'prefix': 'cert_',
-                    'extend': 'certificate.cert_extend',
-                    'get': True
-                }
-            )
+            # We replace signedby with the signing CA from the context to make sure it's keys do not have the "cert_"
+            # prefix and it has gone through the cert_extend method
+            # Each CA is only extended once per context as the same CA usually signs many certificates
+
+            ca_id = cert['signedby']['id']
+            if ca_id not in context['extended_cas']:
+                context['extended_cas'][ca_id] = await self.cert_extend(copy.deepcopy(context['cas'][ca_id]), context)
+
+            cert['signedby'] = copy.deepcopy(context['extended_cas'][ca_id])
 
         # Remove ACME related keys if cert is not an ACME based cert
         if not cert.get('acme'):
@@ -718,14 +778,7 @@ class CertificateService(CRUDService):
 
         if cert['cert_type'] == 'CA':
             # TODO: Should we look for intermediate ca's as well which this ca has signed ?
-            cert['signed_certificates'] = len((
-                await self.middleware.call(
-                    'datastore.query',
-                    'system.certificate',
-                    [['signedby', '=', cert['id']]],
-                    {'prefix': 'cert_'}
-                )
-            ))
+            cert['signed_certificates'] = context['signed_certificates'][cert['id']]
 
         if not os.path.exists(root_path):
             os.makedirs(root_path, 0o755, exist_ok=True)
@@ -1135,7 +1188,7 @@ class CertificateService(CRUDService):
             register=True
         )
     )
-    @job(lock='cert_create')
+    @job(lock='cert_create', history_result=False)
     async def do_create(self, job, data):
         """
         Create a new Certificate
@@ -1474,7 +1527,7 @@ class CertificateService(CRUDService):
             Str('name')
         )
     )
-    @job(lock='cert_update')
+    @job(lock='cert_update', history_result=False)
     async def do_update(self, job, id, data):
         """
         Update certificate of `id`
@@ -1632,6 +1685,7 @@ class CertificateAuthorityService(CRUDService):
     class Config:
         datastore = 'system.certificateauthority'
         datastore_extend = 'certificate.cert_extend'
+        datastore_extend_context = 'certificate.cert_extend_context'
         datastore_prefix = 'cert_'
 
     def __init__(self, *args, **kwargs):
@@ -1671,7 +1725,8 @@ class CertificateAuthorityService(CRUDService):
                         [('signedby', '=', ca_id)],
                         {
                             'prefix': self._config.datastore_prefix,
-                            'extend': self._config.datastore_extend
+                            'extend': self._config.datastore_extend,
+                            'extend_context': self._config.datastore_extend_context,
                         }
                     )
                 ]
@@ -1686,7 +1741,8 @@ class CertificateAuthorityService(CRUDService):
                     [('signedby', '=', ca_id)],
                     {
                         'prefix': self._config.datastore_prefix,
-                        'extend': self._config.datastore_extend
+                        'extend': self._config.datastore_extend,
+                        'extend_context': self._config.datastore_extend_context,
                     }
                 )
 
@@ -2129,6 +2185,9 @@ class CertificateAuthorityService(CRUDService):
         return response
 
 
+setup_depends = ['system']
+
+
 async def setup(middlewared):
     failure = False
     try:
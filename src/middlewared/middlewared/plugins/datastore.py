@@ -25,7 +25,8 @@ from django.db.models.fields.related import ForeignKey, ManyToManyField
 from freenasUI.freeadmin.sqlite3_ha import base as sqlite3_ha_base
 sqlite3_ha_base.execute_sync = True
 
-from middlewared.utils import django_modelobj_serialize
+from middlewared.plugins.pwenc import decrypt, PWEncService
+from middlewared.utils import django_modelobj_serialize, django_queryset_prefetch_related
 from middlewared.service_exception import MatchNotFound
 
 
@@ -87,15 +88,54 @@ class DatastoreService(Service):
         app, model = name.split('.', 1)
         return apps.get_model(app, model)
 
-    def __queryset_serialize(self, qs, extend, extend_context, field_prefix, select):
+    def __related_fields(self, model, field_prefix, select):
+        related = []
+        for field in chain(model._meta.fields, model._meta.many_to_many):
+            if not isinstance(field, (ForeignKey, ManyToManyField)):
+                continue
+
+            name = field.name
+            if field_prefix and name.startswith(field_prefix):
+                name = name[len(field_prefix):]
+            if select and name not in select:
+                continue
+
+            related.append(field.name)
+        return related
+
+    def __queryset_serialize(self, qs, extend, extend_context, field_prefix, select, encrypted_fields, related):
         if extend_context:
             extend_context_value = self.middleware.call_sync(extend_context)
         else:
             extend_context_value = None
+
+        decrypt_field = None
+        if select:
+            encrypted_fields = [field for field in encrypted_fields if field in select]
+        if encrypted_fields:
+            secret = None
+
+            def decrypt_field(value):
+                nonlocal secret
+                if not value:
+                    return ''
+                if secret is None:
+                    # Only read secret once for the whole query
+                    try:
+                        secret = PWEncService.get_secret()
+                    except Exception:
+                        return ''
+                return decrypt(value, secret=secret)
+
+        if related:
+            # Fetch related objects with a query per relation instead of a query per row
+            qs = django_queryset_prefetch_related(qs, related)
+
         for i in qs:
             yield django_modelobj_serialize(self.middleware, i, extend=extend, extend_context=extend_context,
                                             extend_context_value=extend_context_value, field_prefix=field_prefix,
-                                            select=select)
+                                            select=select, encrypted_fields=encrypted_fields,
+                                            decrypt=decrypt_field)
 
     @accepts(
         Str('name'),
@@ -105,11 +145,13 @@ class DatastoreService(Service):
             Str('extend', default=None, null=True),
             Str('extend_context', default=None, null=True),
             Str('prefix', default=None, null=True),
+            List('encrypted_fields', default=[]),
             Dict('extra', additional_attrs=True),
             List('order_by', default=[]),
             List('select', default=[]),
             Bool('count', default=False),
             Bool('get', default=False),
+            Bool('prefetch_related', default=False),
             Int('limit', default=0),
             Int('offset', default=0),
             default=None,
@@ -187,9 +229,15 @@ class DatastoreService(Service):
         if options.get('limit'):
             qs = qs[:options['limit']]
 
+        if options.get('prefetch_related'):
+            related = self.__related_fields(model, prefix, options.get('select'))
+        else:
+            related = []
+
         result = []
         for i in self.__queryset_serialize(
             qs, options.get('extend'), options.get('extend_context'), options.get('prefix'), options.get('select'),
+            options.get('encrypted_fields') or [], related,
         ):
             result.append(i)
 
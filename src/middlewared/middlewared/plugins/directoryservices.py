@@ -1,4 +1,5 @@
 import enum
+from middlewared.plugins.cache import CACHE_NAMESPACE_STATE
 from middlewared.schema import accepts
 from middlewared.service import Service, private
 from samba.dcerpc.messaging import MSG_WINBIND_OFFLINE, MSG_WINBIND_ONLINE
@@ -67,7 +68,7 @@ class DirectoryServices(Service):
         `HEALTHY` Directory Service is enabled, and last status check has passed.
         """
         try:
-            return (await self.middleware.call('cache.get', 'DS_State'))
+            return (await self.middleware.call('cache.get', 'DS_State', CACHE_NAMESPACE_STATE))
         except KeyError:
             ds_state = {}
             for srv in DSType:
@@ -77,7 +78,7 @@ class DirectoryServices(Service):
                 except Exception:
                     ds_state[srv.value] = DSStatus.FAULTED.name
 
-            await self.middleware.call('cache.put', 'DS_STATE', ds_state)
+            await self.middleware.call('cache.put', 'DS_STATE', ds_state, 0, CACHE_NAMESPACE_STATE)
             return ds_state
 
     @private
@@ -90,7 +91,7 @@ class DirectoryServices(Service):
         ds_state.update(await self.get_state())
         ds_state.update(new)
         self.middleware.send_event('directoryservices.status', 'CHANGED', fields=ds_state)
-        return await self.middleware.call('cache.put', 'DS_STATE', ds_state)
+        return await self.middleware.call('cache.put', 'DS_STATE', ds_state, 0, CACHE_NAMESPACE_STATE)
 
     @private
     async def dstype_choices(self):
@@ -92,11 +92,11 @@ class DiskService(CRUDService):
         datastore_prefix = 'disk_'
         datastore_extend = 'disk.disk_extend'
         datastore_filters = [('expiretime', '=', None)]
+        datastore_encrypted_fields = ['passwd']
 
     @private
     async def disk_extend(self, disk):
         disk.pop('enabled', None)
-        disk['passwd'] = await self.middleware.call('pwenc.decrypt', disk['passwd'])
         for key in ['acousticlevel', 'advpowermgmt', 'hddstandby']:
             disk[key] = disk[key].upper()
         try:
@@ -1914,6 +1914,9 @@ async def _event_system_ready(middleware, event_type, args):
     asyncio.ensure_future(middleware.call('disk.configure_power_management'))
 
 
+setup_depends = ['system']
+
+
 def setup(middleware):
     # Listen to DEVFS events so we can sync on disk attach/detach
     middleware.register_hook('devd.devfs', devd_devfs_hook)
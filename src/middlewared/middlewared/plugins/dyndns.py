@@ -8,10 +8,10 @@ class DynDNSService(SystemServiceService):
         service = "dynamicdns"
         datastore_extend = "dyndns.dyndns_extend"
         datastore_prefix = "ddns_"
+        datastore_encrypted_fields = ["password"]
 
     @private
     async def dyndns_extend(self, dyndns):
-        dyndns["password"] = await self.middleware.call("pwenc.decrypt", dyndns["password"])
         dyndns["domain"] = dyndns["domain"].replace(',', ' ').replace(';', ' ').split()
         return dyndns
 
@@ -110,6 +110,4 @@ class DynDNSService(SystemServiceService):
 
         await self._update_service(old, new)
 
-        await self.dyndns_extend(new)
-
         return await self.config()
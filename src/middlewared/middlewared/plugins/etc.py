@@ -1,5 +1,6 @@
 from mako import exceptions
 from mako.lookup import TemplateLookup
+from middlewared.plugins.service import Coalescer
 from middlewared.service import Service
 from middlewared.utils.io import write_if_changed
 
@@ -218,12 +219,17 @@ class EtcService(Service):
             'mako': MakoRenderer(self),
             'py': PyRenderer(self),
         }
+        # Concurrent requests to generate the same group are merged
+        self.coalescer = Coalescer()
 
     async def generate(self, name):
         group = self.GROUPS.get(name)
         if group is None:
             raise ValueError('{0} group not found'.format(name))
 
+        await self.coalescer.run(name, self._generate, group)
+
+    async def _generate(self, group):
         for entry in group:
 
             renderer = self._renderers.get(entry['type'])
@@ -8,12 +8,12 @@ import os
 import pwd
 import select
 import shutil
-import subprocess
 
 from middlewared.main import EventSource
 from middlewared.schema import Bool, Dict, Int, Ref, List, Str, UnixPerm, accepts
 from middlewared.service import private, CallError, Service, job
 from middlewared.utils import filter_list
+from middlewared.utils.permissions import inherited_acls, PermissionsWalker
 
 
 class ACLDefault(enum.Enum):
@@ -265,8 +265,7 @@ class FilesystemService(Service):
         if not os.path.isfile(path):
             raise CallError(f'{path} is not a file')
 
-        with open(path, 'rb') as f:
-            await self.middleware.run_in_thread(shutil.copyfileobj, f, job.pipes.output.w)
+        await self.middleware.run_in_thread(job.pipes.output.send_file, path)
 
     @accepts(
         Str('path'),
@@ -378,19 +377,46 @@ class FilesystemService(Service):
 
         return flagset
 
-    def _winacl(self, path, action, uid, gid, options):
-        chroot_dir = os.path.dirname(path)
-        target = os.path.basename(path)
-        winacl = subprocess.run([
-            '/usr/local/bin/winacl',
-            '-a', action,
-            '-O', str(uid), '-G', str(gid),
-            '-rx' if options['traverse'] else '-r',
-            '-c', chroot_dir,
-            '-p', target], check=False, capture_output=True
-        )
-        if winacl.returncode != 0:
-            CallError(f"Winacl {action} on path {path} failed with error: [{winacl.stderr.decode().strip()}]")
+    def _apply_recursively(self, job, path, apply, options, description):
+        job.set_progress(10, f'{description} {path}.')
+
+        def progress(processed, files_per_second):
+            job.set_progress(
+                10,
+                f'{description} {path}: {processed} files processed ({int(files_per_second)} files/s).',
+                {'processed': processed, 'files_per_second': files_per_second},
+            )
+
+        def errors(batch):
+            job.logs_fd.write(''.join(f'{p}: {error}\n' for p, error in batch).encode('utf-8', 'ignore'))
+
+        walker = PermissionsWalker(
+            path, apply, traverse=options['traverse'], progress=progress, errors=errors, aborted=job.aborted.is_set,
+        ).run()
+
+        if walker.failed and not job.aborted.is_set():
+            raise CallError(
+                f'Failed to change permissions of {walker.failed} entries under {path}. See job logs for details.'
+            )
+
+    def _chown_entry(self, entry, uid, gid):
+        if uid != -1 or gid != -1:
+            entry.chown(uid, gid)
+
+    def _strip_acl_entry(self, entry, mode, uid, gid):
+        if entry.is_dir or entry.is_file:
+            # Descriptor is opened with `O_NOFOLLOW` so a swapped in symlink fails instead of being followed
+            with entry.open() as fd:
+                a = acl.ACL(fd=fd)
+                a.strip()
+                a.apply(fd=fd)
+
+                if mode:
+                    os.fchmod(fd, mode)
+        elif mode and not entry.is_symlink:
+            os.chmod(entry.name, mode, dir_fd=entry.dir_fd, follow_symlinks=False)
+
+        self._chown_entry(entry, uid, gid)
 
     def _common_perm_path_validate(self, path):
         if not os.path.exists(path):
@@ -434,7 +460,7 @@ class FilesystemService(Service):
             )
         )
     )
-    @job(lock="perm_change")
+    @job(lock="perm_change", logs=True)
     def chown(self, job, data):
         """
         Change owner or group of file at `path`.
@@ -461,8 +487,11 @@ class FilesystemService(Service):
             job.set_progress(100, 'Finished changing owner.')
             os.chown(data['path'], uid, gid)
         else:
-            job.set_progress(10, f'Recursively changing owner of {data["path"]}.')
-            self._winacl(data['path'], 'chown', uid, gid, options)
+            os.chown(data['path'], uid, gid)
+            self._apply_recursively(
+                job, data['path'], lambda entry, depth: self._chown_entry(entry, uid, gid), options,
+                'Recursively changing owner of',
+            )
             job.set_progress(100, 'Finished changing owner.')
 
     @accepts(
@@ -480,7 +509,7 @@ class FilesystemService(Service):
             )
         )
     )
-    @job(lock="perm_change")
+    @job(lock="perm_change", logs=True)
     def setperm(self, job, data):
         """
         Remove extended ACL from specified path.
@@ -540,9 +569,10 @@ class FilesystemService(Service):
             job.set_progress(100, 'Finished setting permissions.')
             return
 
-        action = 'clone' if mode else 'strip'
-        job.set_progress(10, f'Recursively setting permissions on {data["path"]}.')
-        self._winacl(data['path'], action, uid, gid, options)
+        self._apply_recursively(
+            job, data['path'], lambda entry, depth: self._strip_acl_entry(entry, mode, uid, gid), options,
+            'Recursively setting permissions on',
+        )
         job.set_progress(100, 'Finished setting permissions.')
 
     @accepts()
@@ -766,7 +796,7 @@ class FilesystemService(Service):
             )
         )
     )
-    @job(lock="perm_change")
+    @job(lock="perm_change", logs=True)
     def setacl(self, job, data):
         """
         Set ACL of a given path. Takes the following parameters:
@@ -852,8 +882,34 @@ class FilesystemService(Service):
             job.set_progress(100, 'Finished setting ACL.')
             return
 
-        job.set_progress(10, f'Recursively setting ACL on {data["path"]}.')
-        self._winacl(data['path'], 'clone', uid, gid, options)
+        os.chown(data['path'], uid, gid)
+
+        if options['stripacl']:
+            def apply(entry, depth):
+                self._strip_acl_entry(entry, None, uid, gid)
+        else:
+            acls = {}
+            for key, entries in inherited_acls(acl.ACL(file=data['path']).__getstate__()).items():
+                if entries:
+                    acls[key] = acl.ACL()
+                    acls[key].__setstate__(entries)
+                else:
+                    # Nothing is inherited, such entries get a trivial ACL
+                    acls[key] = None
+
+            def apply(entry, depth):
+                a = acls[(entry.is_dir, depth == 1)]
+                if a is None:
+                    self._strip_acl_entry(entry, None, uid, gid)
+                    return
+
+                if entry.is_dir or entry.is_file:
+                    with entry.open() as fd:
+                        a.apply(fd=fd)
+
+                self._chown_entry(entry, uid, gid)
+
+        self._apply_recursively(job, data['path'], apply, options, 'Recursively setting ACL on')
         job.set_progress(100, 'Finished setting ACL.')
 
 
@@ -167,6 +167,10 @@ class IPMIService(CRUDService):
         await run('ipmitool', 'chassis', 'identify', cmd)
 
 
+# Scanning IPMI channels is slow and does not depend on other plugins
+setup_depends = ['system']
+
+
 async def setup(middleware):
 
     try:
@@ -11,6 +11,7 @@ from middlewared.utils import filter_list, run
 from middlewared.utils.path import is_child
 from middlewared.validators import IpAddress, Range
 
+from collections import defaultdict
 import bidict
 import errno
 import hashlib
@@ -505,6 +506,7 @@ class iSCSITargetExtentService(CRUDService):
         datastore = 'services.iscsitargetextent'
         datastore_prefix = 'iscsi_target_extent_'
         datastore_extend = 'iscsi.extent.extend'
+        datastore_extend_context = 'iscsi.extent.extend_context'
 
     @accepts(Dict(
         'iscsi_extent_create',
@@ -660,7 +662,14 @@ class iSCSITargetExtentService(CRUDService):
         return data
 
     @private
-    async def extend(self, data):
+    async def extend_context(self):
+        return {
+            # Retrieved on the first `DISK` extent
+            'disks': None,
+        }
+
+    @private
+    async def extend(self, data, context):
         extent_type = data['type'].upper()
         extent_rpm = data['rpm'].upper()
 
@@ -670,11 +679,11 @@ class iSCSITargetExtentService(CRUDService):
             extent_type = 'DISK'
             # If extent is set to a disk ( not ZVOL and HAST ) - let's reflect this in the output
 
-            disk = await self.middleware.call('disk.query', [['identifier', '=', data['path']]])
-            if disk:
-                data['disk'] = disk[0]['name']
-            else:
-                data['disk'] = data['path']
+            if context['disks'] is None:
+                context['disks'] = {
+                    disk['identifier']: disk['name'] for disk in await self.middleware.call('disk.query')
+                }
+            data['disk'] = context['disks'].get(data['path'], data['path'])
         else:
             extent_size = data['filesize']
 
@@ -1069,15 +1078,23 @@ class iSCSITargetService(CRUDService):
         datastore = 'services.iscsitarget'
         datastore_prefix = 'iscsi_target_'
         datastore_extend = 'iscsi.target.extend'
+        datastore_extend_context = 'iscsi.target.extend_context'
 
     @private
-    async def extend(self, data):
+    async def extend_context(self):
+        groups = defaultdict(list)
+        for group in await self.middleware.call('datastore.query', 'services.iscsitargetgroups'):
+            if group['iscsi_target'] is not None:
+                groups[group['iscsi_target']['id']].append(group)
+
+        return {
+            'groups': groups,
+        }
+
+    @private
+    async def extend(self, data, context):
         data['mode'] = data['mode'].upper()
-        data['groups'] = await self.middleware.call(
-            'datastore.query',
-            'services.iscsitargetgroups',
-            [('iscsi_target', '=', data['id'])],
-        )
+        data['groups'] = context['groups'].get(data['id'], [])
         for group in data['groups']:
             group.pop('id')
             group.pop('iscsi_target')
@@ -1333,6 +1350,7 @@ class iSCSITargetToExtentService(CRUDService):
         datastore = 'services.iscsitargettoextent'
         datastore_prefix = 'iscsi_'
         datastore_extend = 'iscsi.targetextent.extend'
+        datastore_prefetch_related = True
 
     @accepts(Dict(
         'iscsi_targetextent_create',
@@ -8,6 +8,7 @@ import pathlib
 import json
 import sqlite3
 import re
+import time
 
 import iocage_lib.iocage as ioc
 import iocage_lib.ioc_exceptions as ioc_exceptions
@@ -33,6 +34,25 @@ from collections import deque, Iterable
 BRANCH_REGEX = re.compile(r'\d+\.\d-RELEASE')
 
 SHUTDOWN_LOCK = asyncio.Lock()
+# Pools can also be imported without any pool hook being called (i.e. on failover)
+IOCAGE_SET_UP_CACHE_TTL = 30
+
+
+def parse_jls(output):
+    """
+    Parse `jls -v --libxo json` output into a dict of running jails keyed by jail name.
+    """
+    return {
+        jail['name']: jail
+        for jail in json.loads(output).get('jail-information', {}).get('jail', [])
+    }
+
+
+def parse_ifconfig_inet(output):
+    """
+    Parse `ifconfig <interface> inet` output and return the first IPv4 address of the interface.
+    """
+    return output.splitlines()[2].split()[1]
 
 
 def validate_ips(middleware, verrors, options, schema='options.props', exclude=None):
@@ -548,6 +568,10 @@ class JailService(CRUDService):
         # We want debug for jails starting/stopping
         os.environ['IOCAGE_DEBUG'] = 'TRUE'
 
+        # Cached until pool configuration changes, iocage is activated on another pool or cache expires
+        self.__iocage_set_up = None
+        self.__iocage_set_up_at = None
+
     @filterable
     def query(self, filters=None, options=None):
         """
@@ -576,23 +600,29 @@ class JailService(CRUDService):
                 jail_dicts['host_hostuuid'] = 'default'
                 jails.append(jail_dicts)
             else:
+                running_jails = None
                 for jail in jail_dicts:
                     jail = list(jail.values())[0]
                     jail['id'] = jail['host_hostuuid']
-                    if jail['dhcp']:
-                        uuid = jail['host_hostuuid'].replace('.', '_')
+                    name = f'ioc-{jail["host_hostuuid"].replace(".", "_")}'
 
+                    if jail['state'] == 'up' and running_jails is None:
+                        # Retrieve all running jails at once instead of running `jls` for each of them
+                        running_jails = self.running_jails()
+
+                    if jail['dhcp']:
                         if jail['state'] == 'up':
                             interface = jail['interfaces'].split(',')[0].split(
                                 ':')[0]
                             if interface == 'vnet0':
                                 # Inside jails they are epair0b
                                 interface = 'epair0b'
-                            ip4_cmd = ['jexec', f'ioc-{uuid}', 'ifconfig',
+
+                            # DHCP jails have their own network stack so the address is only visible inside them
+                            ip4_cmd = ['jexec', name, 'ifconfig',
                                        interface, 'inet']
                             try:
-                                out = su.check_output(ip4_cmd)
-                                out = out.splitlines()[2].split()[1].decode()
+                                out = parse_ifconfig_inet(su.check_output(ip4_cmd).decode())
                                 jail['ip4_addr'] = f'{interface}|{out}'
                             except (su.CalledProcessError, IndexError):
                                 jail['ip4_addr'] = f'{interface}|ERROR'
@@ -600,16 +630,16 @@ class JailService(CRUDService):
                             jail['ip4_addr'] = 'DHCP (not running)'
 
                     if jail['state'] == 'up':
-                        try:
-                            jail['jid'] = su.check_output(
-                                [
-                                    'jls', '-j',
-                                    f'ioc-{jail["host_hostuuid"].replace(".", "_")}',
-                                    'jid'
-                                ]
-                            ).decode().strip()
-                        except su.CalledProcessError:
-                            jail['jid'] = 'ERROR'
+                        if name in running_jails:
+                            jail['jid'] = str(running_jails[name]['jid'])
+                        else:
+                            # Jail might have been started after we have listed running jails
+                            try:
+                                jail['jid'] = su.check_output(
+                                    ['jls', '-j', name, 'jid']
+                                ).decode().strip()
+                            except su.CalledProcessError:
+                                jail['jid'] = 'ERROR'
                     else:
                         jail['jid'] = None
 
@@ -623,16 +653,38 @@ class JailService(CRUDService):
 
         return filter_list(jails, filters, options)
 
+    @private
+    def running_jails(self):
+        """
+        Returns all running jails keyed by jail name.
+        """
+        try:
+            return parse_jls(su.check_output(['jls', '-v', '--libxo', 'json']).decode())
+        except (su.CalledProcessError, ValueError):
+            self.logger.debug('Failed to list running jails', exc_info=True)
+            return {}
+
     @private
     def iocage_set_up(self):
-        datasets = self.middleware.call_sync(
-            'zfs.dataset.query',
-            [['properties.org\\.freebsd\\.ioc:active.value', '=', 'yes']],
-            {'extra': {'properties': [], 'flat': False}}
-        )
-        return not (not datasets or not any(
-            d['name'].endswith('/iocage') for root_dataset in datasets for d in root_dataset['children']
-        ))
+        if (
+            self.__iocage_set_up is None or
+            time.monotonic() - self.__iocage_set_up_at > IOCAGE_SET_UP_CACHE_TTL
+        ):
+            datasets = self.middleware.call_sync(
+                'zfs.dataset.query',
+                [['properties.org\\.freebsd\\.ioc:active.value', '=', 'yes']],
+                {'extra': {'properties': [], 'flat': False}}
+            )
+            self.__iocage_set_up = not (not datasets or not any(
+                d['name'].endswith('/iocage') for root_dataset in datasets for d in root_dataset['children']
+            ))
+            self.__iocage_set_up_at = time.monotonic()
+
+        return self.__iocage_set_up
+
+    @private
+    def iocage_set_up_clear_cache(self):
+        self.__iocage_set_up = None
 
     @accepts()
     def default_configuration(self):
@@ -1296,6 +1348,7 @@ class JailService(CRUDService):
         except Exception as e:
             raise CallError(f'Failed to activate {pool["name"]}: {e}')
         else:
+            self.iocage_set_up_clear_cache()
             self.check_dataset_existence()
             return True
 
@@ -1488,6 +1541,10 @@ async def jail_pool_pre_lock(middleware, pool):
             await middleware.call('jail.stop', j['host_hostuuid'])
 
 
+async def pool_configuration_change(middleware, *args, **kwargs):
+    await middleware.call('jail.iocage_set_up_clear_cache')
+
+
 async def __event_system(middleware, event_type, args):
     """
     Method called when system is ready or shutdown, supposed to start/stop jails
@@ -1553,5 +1610,9 @@ class JailFSAttachmentDelegate(FSAttachmentDelegate):
 async def setup(middleware):
     await middleware.call('pool.dataset.register_attachment_delegate', JailFSAttachmentDelegate(middleware))
     middleware.register_hook('pool.pre_lock', jail_pool_pre_lock)
+    for hook in (
+        'pool.post_import', 'pool.post_import_on_boot', 'pool.post_export', 'pool.post_lock', 'pool.post_unlock',
+    ):
+        middleware.register_hook(hook, pool_configuration_change, sync=True)
     middleware.event_subscribe('system', __event_system)
     ioc_common.set_interactive(False)
@@ -7,6 +7,7 @@ import os
 import shutil
 import subprocess
 import time
+from middlewared.plugins.cache import CACHE_NAMESPACE_STATE
 from middlewared.schema import accepts, Dict, Int, List, Patch, Str
 from middlewared.service import CallError, ConfigService, CRUDService, job, periodic, private, ValidationErrors
 from middlewared.utils import run, Popen
@@ -285,8 +286,8 @@ class KerberosService(ConfigService):
         Try to get retrieve cached kerberos tgt info. If it hasn't been cached,
         perform klist, parse it, put it in cache, then return it.
         """
-        if await self.middleware.call('cache.has_key', 'KRB_TGT_INFO'):
-            return (await self.middleware.call('cache.get', 'KRB_TGT_INFO'))
+        if await self.middleware.call('cache.has_key', 'KRB_TGT_INFO', CACHE_NAMESPACE_STATE):
+            return (await self.middleware.call('cache.get', 'KRB_TGT_INFO', CACHE_NAMESPACE_STATE))
         ad = await self.middleware.call('activedirectory.config')
         ldap = await self.middleware.call('ldap.config')
         ad_TGT = []
@@ -353,7 +354,9 @@ class KerberosService(ConfigService):
                         })
 
         if ad_TGT or ldap_TGT:
-            await self.middleware.call('cache.put', 'KRB_TGT_INFO', {'ad_TGT': ad_TGT, 'ldap_TGT': ldap_TGT})
+            await self.middleware.call(
+                'cache.put', 'KRB_TGT_INFO', {'ad_TGT': ad_TGT, 'ldap_TGT': ldap_TGT}, 0, CACHE_NAMESPACE_STATE
+            )
         return {'ad_TGT': ad_TGT, 'ldap_TGT': ldap_TGT}
 
     @private
@@ -402,13 +405,13 @@ class KerberosService(ConfigService):
                 if kinit.returncode != 0:
                     raise CallError(f'kinit -R failed with error: {kinit.stderr.decode()}')
                 self.logger.debug(f'Successfully renewed kerberos TGT')
-                await self.middleware.call('cache.pop', 'KRB_TGT_INFO')
+                await self.middleware.call('cache.pop', 'KRB_TGT_INFO', CACHE_NAMESPACE_STATE)
             except asyncio.TimeoutError:
                 self.logger.debug('Attempt to renew kerberos TGT failed after 15 seconds.')
 
         if must_reinit:
             ret = await self.start()
-            await self.middleware.call('cache.pop', 'KRB_TGT_INFO')
+            await self.middleware.call('cache.pop', 'KRB_TGT_INFO', CACHE_NAMESPACE_STATE)
 
         return ret
 
@@ -429,7 +432,7 @@ class KerberosService(ConfigService):
 
     @private
     async def stop(self):
-        await self.middleware.call('cache.pop', 'KRB_TGT_INFO')
+        await self.middleware.call('cache.pop', 'KRB_TGT_INFO', CACHE_NAMESPACE_STATE)
         kdestroy = await run(['/usr/bin/kdestroy'], check=False)
         if kdestroy.returncode != 0:
             raise CallError(f'kdestroy failed with error: {kdestroy.stderr.decode()}')
@@ -563,14 +566,9 @@ class KerberosKeytabService(CRUDService):
     class Config:
         datastore = 'directoryservice.kerberoskeytab'
         datastore_prefix = 'keytab_'
-        datastore_extend = 'kerberos.keytab.kerberos_keytab_extend'
+        datastore_encrypted_fields = ['file']
         namespace = 'kerberos.keytab'
 
-    @private
-    async def kerberos_keytab_extend(self, data):
-        data['file'] = await self.middleware.call('pwenc.decrypt', data['file'])
-        return data
-
     @private
     async def kerberos_keytab_compress(self, data):
         data['file'] = await self.middleware.call('pwenc.encrypt', data['file'])
@@ -899,8 +897,8 @@ class KerberosKeytabService(CRUDService):
         ad_state = await self.middleware.call('activedirectory.get_state')
         if ad_state == 'DISABLED' or not os.path.exists(keytab['SYSTEM'].value):
             return
-        if await self.middleware.call('cache.has_key', 'KEYTAB_MTIME'):
-            old_mtime = await self.middleware.call('cache.get', 'KEYTAB_MTIME')
+        if await self.middleware.call('cache.has_key', 'KEYTAB_MTIME', CACHE_NAMESPACE_STATE):
+            old_mtime = await self.middleware.call('cache.get', 'KEYTAB_MTIME', CACHE_NAMESPACE_STATE)
 
         new_mtime = (os.stat(keytab['SYSTEM'].value)).st_mtime
         if old_mtime == new_mtime:
@@ -911,5 +909,7 @@ class KerberosKeytabService(CRUDService):
         await self.middleware.call(
             'cache.put',
             'KEYTAB_MTIME',
-            (os.stat(keytab['SYSTEM'].value)).st_mtime
+            (os.stat(keytab['SYSTEM'].value)).st_mtime,
+            0,
+            CACHE_NAMESPACE_STATE,
         )
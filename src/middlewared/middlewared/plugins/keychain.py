@@ -162,7 +162,8 @@ class ReplicationTaskSSHCredentialsUsedByDelegate(KeychainCredentialUsedByDelega
     unbind_method = KeychainCredentialUsedByDelegateUnbindMethod.DISABLE
 
     async def query(self, id):
-        return await self.middleware.call("replication.query", [["ssh_credentials.id", "=", id]])
+        return await self.middleware.call("replication.query", [["ssh_credentials.id", "=", id]],
+                                          {"extra": {"job_state": False}})
 
     async def get_title(self, row):
         return f"Replication task {row['name']}"
@@ -16,6 +16,7 @@ from middlewared.schema import accepts, Bool, Dict, Int, List, Str
 from middlewared.service import job, private, ConfigService, ValidationError, ValidationErrors
 from middlewared.service_exception import CallError
 from middlewared.utils import run
+from middlewared.plugins.cache import CACHE_NAMESPACE_DSCACHE
 from middlewared.plugins.directoryservices import DSStatus, SSL
 
 
@@ -795,7 +796,7 @@ class LDAPService(ConfigService):
         if ldap['has_samba_schema']:
             await self.middleware.call('etc.generate', 'smb')
             await self.middleware.call('service.restart', 'cifs')
-        await self.middleware.call('cache.pop', 'LDAP_cache')
+        await self.middleware.call('cache.pop', 'LDAP_cache', CACHE_NAMESPACE_DSCACHE)
         await self.nslcd_cmd('onestop')
         await self.set_state(DSStatus['DISABLED'])
 
@@ -805,13 +806,13 @@ class LDAPService(ConfigService):
         user_next_index = group_next_index = 100000000
         cache_data = {'users': {}, 'groups': {}}
 
-        if self.middleware.call_sync('cache.has_key', 'LDAP_cache') and not force:
+        if self.middleware.call_sync('cache.has_key', 'LDAP_cache', CACHE_NAMESPACE_DSCACHE) and not force:
             raise CallError('LDAP cache already exists. Refusing to generate cache.')
 
-        self.middleware.call_sync('cache.pop', 'LDAP_cache')
+        self.middleware.call_sync('cache.pop', 'LDAP_cache', CACHE_NAMESPACE_DSCACHE)
 
         if (self.middleware.call_sync('ldap.config'))['disable_freenas_cache']:
-            self.middleware.call_sync('cache.put', 'LDAP_cache', cache_data)
+            self.middleware.call_sync('cache.put', 'LDAP_cache', cache_data, 0, CACHE_NAMESPACE_DSCACHE)
             self.logger.debug('LDAP cache is disabled. Bypassing cache fill.')
             return
 
@@ -865,13 +866,13 @@ class LDAPService(ConfigService):
             }})
             group_next_index += 1
 
-        self.middleware.call_sync('cache.put', 'LDAP_cache', cache_data)
+        self.middleware.call_sync('cache.put', 'LDAP_cache', cache_data, 0, CACHE_NAMESPACE_DSCACHE)
         self.middleware.call_sync('dscache.backup')
 
     @private
     async def get_cache(self):
-        if not await self.middleware.call('cache.has_key', 'LDAP_cache'):
+        if not await self.middleware.call('cache.has_key', 'LDAP_cache', CACHE_NAMESPACE_DSCACHE):
             await self.middleware.call('ldap.fill_cache')
             self.logger.debug('cache fill is in progress.')
             return {'users': {}, 'groups': {}}
-        return await self.middleware.call('cache.get', 'LDAP_cache')
+        return await self.middleware.call('cache.get', 'LDAP_cache', CACHE_NAMESPACE_DSCACHE)
@@ -2457,6 +2457,9 @@ async def devd_ifnet_hook(middleware, data):
     await middleware.call('interface.sync_interface', iface['name'])
 
 
+setup_depends = ['system']
+
+
 async def setup(middleware):
     # Configure http proxy on startup and on network.config events
     asyncio.ensure_future(configure_http_proxy(middleware))
@@ -1,9 +1,11 @@
 import asyncio
+from collections import defaultdict
 import contextlib
 import ipaddress
 import os
 import socket
 import subprocess
+import time
 
 import sysctl
 
@@ -15,6 +17,86 @@ from middlewared.utils.asyncio_ import asyncio_map
 from middlewared.utils.path import is_child
 
 
+class HostnameCache:
+    """
+    Caches `resolve(hostname)` results (`None` for hosts that could not be resolved) for `ttl` seconds (`negative_ttl`
+    seconds for failures) so NFS share validations do not resolve hostnames of every share on every edit.
+    Concurrent lookups of the same hostname share a single `resolve` call.
+    """
+
+    def __init__(self, resolve, ttl=300, negative_ttl=30, clock=time.monotonic):
+        self.resolve = resolve
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+
+        # hostname -> (address, expires_at)
+        self.cache = {}
+        # hostname -> future of a lookup in progress
+        self.pending = {}
+
+    async def get(self, hostname):
+        cached = self.cache.get(hostname)
+        if cached is not None and cached[1] > self.clock():
+            return cached[0]
+
+        future = self.pending.get(hostname)
+        if future is None:
+            future = self.pending[hostname] = asyncio.ensure_future(self._resolve(hostname))
+
+        return await asyncio.shield(future)
+
+    async def _resolve(self, hostname):
+        try:
+            address = await self.resolve(hostname)
+            self.cache[hostname] = (address, self.clock() + (self.ttl if address is not None else self.negative_ttl))
+            return address
+        finally:
+            self.pending.pop(hostname, None)
+
+    async def get_many(self, hostnames, limit=8):
+        hostnames = list(set(hostnames))
+        return dict(zip(hostnames, await asyncio_map(self.get, hostnames, limit)))
+
+
+class ExportsIndex:
+    """
+    NFS shares grouped by the device (dataset) of their first path. Only shares exporting the same dataset can
+    conflict with each other.
+
+    Shares which first path can't be stat'ed (i.e. their pool is locked) are kept aside and retried on every lookup
+    so they are not missed once their dataset becomes available.
+    """
+
+    def __init__(self, shares, stat=None, logger=None):
+        self.stat = stat or os.stat
+
+        self.built_at = time.monotonic()
+        self.devices = defaultdict(list)
+        self.unresolved = []
+        for share in shares:
+            self._add(share, logger)
+
+    def shares(self, dev, exclude_id=None):
+        if self.unresolved:
+            unresolved, self.unresolved = self.unresolved, []
+            for share in unresolved:
+                self._add(share)
+
+        return [share for share in self.devices.get(dev, []) if share["id"] != exclude_id]
+
+    def _add(self, share, logger=None):
+        try:
+            dev = self.stat(share["paths"][0]).st_dev
+        except Exception:
+            if logger is not None:
+                logger.warning("Failed to stat first path for %r", share, exc_info=True)
+            self.unresolved.append(share)
+            return
+
+        self.devices[dev].append(share)
+
+
 class NFSService(SystemServiceService):
 
     class Config:
@@ -188,6 +270,14 @@ class SharingNFSService(CRUDService):
         datastore_prefix = "nfs_"
         datastore_extend = "sharing.nfs.extend"
 
+    exports_index_ttl = 300
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hostname_cache = HostnameCache(self._resolve_hostname)
+        self.exports_index = None
+        self.exports_index_lock = asyncio.Lock()
+
     @accepts(Dict(
         "sharingnfs_create",
         List("paths", items=[Dir("path")], empty=False),
@@ -249,6 +339,7 @@ class SharingNFSService(CRUDService):
             )
         await self.extend(data)
 
+        self.invalidate_exports_index()
         await self._service_change("nfs", "reload")
 
         return data
@@ -297,6 +388,7 @@ class SharingNFSService(CRUDService):
         await self.extend(new)
         new["paths"] = paths
 
+        self.invalidate_exports_index()
         await self._service_change("nfs", "reload")
 
         return new
@@ -307,6 +399,7 @@ class SharingNFSService(CRUDService):
         Delete NFS Share of `id`.
         """
         await self.middleware.call("datastore.delete", self._config.datastore, id)
+        self.invalidate_exports_index()
         await self._service_change("nfs", "reload")
 
     @private
@@ -316,10 +409,7 @@ class SharingNFSService(CRUDService):
 
         await self.middleware.run_in_thread(self.validate_paths, data, schema_name, verrors)
 
-        filters = []
-        if old:
-            filters.append(["id", "!=", old["id"]])
-        other_shares = await self.middleware.call("sharing.nfs.query", filters)
+        other_shares = await self.candidate_shares(data, old)
         dns_cache = await self.resolve_hostnames(
             sum([share["hosts"] for share in other_shares], []) + data["hosts"]
         )
@@ -369,60 +459,79 @@ class SharingNFSService(CRUDService):
                                 "Paths for a NFS share must reside within the same filesystem")
 
     @private
-    async def resolve_hostnames(self, hostnames):
-        hostnames = list(set(hostnames))
+    def invalidate_exports_index(self):
+        self.exports_index = None
+
+    @private
+    async def candidate_shares(self, data, old=None):
+        """
+        Returns other shares that export the same dataset as `data` (the only ones it can conflict with).
+        """
+        try:
+            dev = (await self.middleware.run_in_thread(os.stat, data["paths"][0])).st_dev
+        except OSError:
+            return []
+
+        async with self.exports_index_lock:
+            if (
+                self.exports_index is None or
+                time.monotonic() - self.exports_index.built_at > self.exports_index_ttl
+            ):
+                shares = await self.middleware.call("sharing.nfs.query")
+                self.exports_index = await self.middleware.run_in_thread(
+                    ExportsIndex, shares, logger=self.logger,
+                )
 
-        async def resolve(hostname):
-            try:
-                return (
-                    await asyncio.wait_for(self.middleware.run_in_thread(socket.getaddrinfo, hostname, None), 5)
-                )[0][4][0]
-            except Exception as e:
-                self.logger.warning("Unable to resolve host %r: %r", hostname, e)
-                return None
+            # Lookup may stat shares that were unavailable when the index was built
+            return await self.middleware.run_in_thread(
+                self.exports_index.shares, dev, old["id"] if old else None,
+            )
 
-        resolved_hostnames = await asyncio_map(resolve, hostnames, 8)
+    async def _resolve_hostname(self, hostname):
+        try:
+            return (
+                await asyncio.wait_for(self.middleware.run_in_thread(socket.getaddrinfo, hostname, None), 5)
+            )[0][4][0]
+        except Exception as e:
+            self.logger.warning("Unable to resolve host %r: %r", hostname, e)
+            return None
 
-        return dict(zip(hostnames, resolved_hostnames))
+    @private
+    async def resolve_hostnames(self, hostnames):
+        return await self.hostname_cache.get_many(hostnames)
 
     @private
     def validate_hosts_and_networks(self, other_shares, data, schema_name, verrors, dns_cache):
-        dev = os.stat(data["paths"][0]).st_dev
-
+        """
+        `other_shares` must only contain shares that export the same dataset as `data` (see `candidate_shares`).
+        """
         used_networks = set()
         for share in other_shares:
-            try:
-                share_dev = os.stat(share["paths"][0]).st_dev
-            except Exception:
-                self.logger.warning("Failed to stat first path for %r", share, exc_info=True)
-                continue
-
-            if share_dev == dev:
-                for host in share["hosts"]:
-                    host = dns_cache[host]
-                    if host is None:
-                        continue
-
-                    try:
-                        network = ipaddress.ip_network(host)
-                    except Exception:
-                        self.logger.warning("Got invalid host %r", host)
-                        continue
-                    else:
-                        used_networks.add(network)
-
-                for network in share["networks"]:
-                    try:
-                        network = ipaddress.ip_network(network, strict=False)
-                    except Exception:
-                        self.logger.warning("Got invalid network %r", network)
-                        continue
-                    else:
-                        used_networks.add(network)
-
-                if not share["hosts"] and not share["networks"]:
-                    used_networks.add(ipaddress.ip_network("0.0.0.0/0"))
-                    used_networks.add(ipaddress.ip_network("::/0"))
+            for host in share["hosts"]:
+                host = dns_cache[host]
+                if host is None:
+                    continue
+
+                try:
+                    network = ipaddress.ip_network(host)
+                except Exception:
+                    self.logger.warning("Got invalid host %r", host)
+                    continue
+                else:
+                    used_networks.add(network)
+
+            for network in share["networks"]:
+                try:
+                    network = ipaddress.ip_network(network, strict=False)
+                except Exception:
+                    self.logger.warning("Got invalid network %r", network)
+                    continue
+                else:
+                    used_networks.add(network)
+
+            if not share["hosts"] and not share["networks"]:
+                used_networks.add(ipaddress.ip_network("0.0.0.0/0"))
+                used_networks.add(ipaddress.ip_network("::/0"))
 
         for i, host in enumerate(data["hosts"]):
             host = dns_cache[host]
@@ -478,6 +587,8 @@ async def pool_post_import(middleware, pool):
     """
     Makes sure to reload NFS if a pool is imported and there are shares configured for it.
     """
+    await middleware.call('sharing.nfs.invalidate_exports_index')
+
     path = f'/mnt/{pool["name"]}'
     for share in await middleware.call('sharing.nfs.query'):
         if any(filter(lambda x: x == path or x.startswith(f'{path}/'), share['paths'])):
@@ -485,6 +596,14 @@ async def pool_post_import(middleware, pool):
             break
 
 
+async def pool_post_lock_unlock_export(middleware, *args, **kwargs):
+    """
+    Datasets of a pool that was locked, unlocked or exported change their devices (or disappear), so exports index
+    needs to be rebuilt.
+    """
+    await middleware.call('sharing.nfs.invalidate_exports_index')
+
+
 class NFSFSAttachmentDelegate(FSAttachmentDelegate):
     name = 'nfs'
     title = 'NFS Share'
@@ -507,6 +626,7 @@ class NFSFSAttachmentDelegate(FSAttachmentDelegate):
         for attachment in attachments:
             await self.middleware.call('datastore.delete', 'sharing.nfs_share', attachment['id'])
 
+        await self.middleware.call('sharing.nfs.invalidate_exports_index')
         await self._service_change('nfs', 'reload')
 
     async def toggle(self, attachments, enabled):
@@ -514,9 +634,12 @@ class NFSFSAttachmentDelegate(FSAttachmentDelegate):
             await self.middleware.call('datastore.update', 'sharing.nfs_share', attachment['id'],
                                        {'nfs_enabled': enabled})
 
+        await self.middleware.call('sharing.nfs.invalidate_exports_index')
         await self._service_change('nfs', 'reload')
 
 
 async def setup(middleware):
     await middleware.call('pool.dataset.register_attachment_delegate', NFSFSAttachmentDelegate(middleware))
     middleware.register_hook('pool.post_import', pool_post_import, sync=True)
+    for hook in ('pool.post_lock', 'pool.post_unlock', 'pool.post_export'):
+        middleware.register_hook(hook, pool_post_lock_unlock_export, sync=True)
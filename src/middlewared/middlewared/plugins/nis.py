@@ -7,6 +7,7 @@ from middlewared.schema import accepts, Bool, Dict, List, Str
 from middlewared.service import job, private, ConfigService
 from middlewared.service_exception import CallError
 from middlewared.utils import run
+from middlewared.plugins.cache import CACHE_NAMESPACE_DSCACHE, CACHE_NAMESPACE_STATE
 from middlewared.plugins.directoryservices import DSStatus
 
 
@@ -169,7 +170,7 @@ class NISService(ConfigService):
             if 'ypbind not running' not in errmsg:
                 raise CallError(f'ypbind failed to stop: [{ypbind.stderr.decode().strip()}]')
 
-        await self.middleware.call('cache.pop', 'NIS_State')
+        await self.middleware.call('cache.pop', 'NIS_State', CACHE_NAMESPACE_STATE)
         await self.middleware.call('etc.generate', 'rc')
         await self.middleware.call('etc.generate', 'pam')
         await self.middleware.call('etc.generate', 'hostname')
@@ -182,10 +183,10 @@ class NISService(ConfigService):
     @job(lock=lambda args: 'fill_nis_cache')
     def fill_cache(self, job, force=False):
         user_next_index = group_next_index = 200000000
-        if self.middleware.call_sync('cache.has_key', 'NIS_cache') and not force:
+        if self.middleware.call_sync('cache.has_key', 'NIS_cache', CACHE_NAMESPACE_DSCACHE) and not force:
             raise CallError('NIS cache already exists. Refusing to generate cache.')
 
-        self.middleware.call_sync('cache.pop', 'NIS_cache')
+        self.middleware.call_sync('cache.pop', 'NIS_cache', CACHE_NAMESPACE_DSCACHE)
         pwd_list = pwd.getpwall()
         grp_list = grp.getgrall()
 
@@ -237,13 +238,13 @@ class NISService(ConfigService):
             }})
             group_next_index += 1
 
-        self.middleware.call_sync('cache.put', 'NIS_cache', cache_data)
+        self.middleware.call_sync('cache.put', 'NIS_cache', cache_data, 0, CACHE_NAMESPACE_DSCACHE)
         self.middleware.call_sync('dscache.backup')
 
     @private
     async def get_cache(self):
-        if not await self.middleware.call('cache.has_key', 'NIS_cache'):
+        if not await self.middleware.call('cache.has_key', 'NIS_cache', CACHE_NAMESPACE_DSCACHE):
             await self.middleware.call('nis.fill_cache')
             self.logger.debug('cache fill is in progress.')
             return {'users': [], 'groups': []}
-        return await self.middleware.call('cache.get', 'nis_cache')
+        return await self.middleware.call('cache.get', 'NIS_cache', CACHE_NAMESPACE_DSCACHE)
@@ -17,7 +17,6 @@ import psutil
 
 from libzfs import ZFSException
 from middlewared.alert.base import AlertCategory, AlertClass, AlertLevel, SimpleOneShotAlertClass
-from middlewared.job import JobProgressBuffer
 from middlewared.schema import (accepts, Attribute, Bool, Cron, Dict, EnumMixin, Int, List, Patch,
                                 Str, UnixPerm)
 from middlewared.service import (
@@ -2021,7 +2020,6 @@ class PoolService(CRUDService):
                         line, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0, preexec_fn=os.setsid,
                     )
                     try:
-                        progress_buffer = JobProgressBuffer(job)
                         while True:
                             line = await rsync_proc.stdout.readline()
                             job.logs_fd.write(line)
@@ -2030,19 +2028,18 @@ class PoolService(CRUDService):
                                     line = line.decode("utf-8", "ignore").strip()
                                     bits = re.split(r"\s+", line)
                                     if len(bits) == 6 and bits[1].endswith("%") and bits[1][:-1].isdigit():
-                                        progress_buffer.set_progress(int(bits[1][:-1]))
+                                        job.set_progress(int(bits[1][:-1]))
                                     elif not line.endswith('/'):
                                         if (
                                             line not in ['sending incremental file list'] and
                                             'xfr#' not in line
                                         ):
-                                            progress_buffer.set_progress(None, extra=line)
+                                            job.set_progress(None, extra=line)
                                 except Exception:
                                     logger.warning('Parsing error in rsync task', exc_info=True)
                             else:
                                 break
 
-                        progress_buffer.flush()
                         await rsync_proc.wait()
                         if rsync_proc.returncode != 0:
                             raise Exception("rsync failed with exit code %r" % rsync_proc.returncode)
@@ -2484,6 +2481,9 @@ class PoolService(CRUDService):
         # stage of the boot process.
         self.middleware.run_coroutine(self.middleware.call('disk.swaps_configure'), wait=False)
 
+        # Pools were imported without `pool.post_import` hook
+        self.middleware.call_hook_sync('pool.post_import_on_boot')
+
         job.set_progress(100, 'Pools import completed')
 
     """
@@ -2494,7 +2494,10 @@ class PoolService(CRUDService):
 
     @private
     async def get_current_import_disk_job(self):
-        import_jobs = await self.middleware.call('core.get_jobs', [('method', '=', 'pool.import_disk')])
+        # Only jobs of this middlewared run, `core.get_jobs` would also return finished ones from job history
+        import_jobs = [
+            job.__encode__() for job in self.middleware.jobs.all().values() if job.method == 'pool.import_disk'
+        ]
         not_dismissed_import_jobs = [job for job in import_jobs if job["id"] not in self.dismissed_import_disk_jobs]
         if not_dismissed_import_jobs:
             return not_dismissed_import_jobs[0]
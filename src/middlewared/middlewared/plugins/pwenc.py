@@ -1,5 +1,6 @@
 import base64
 import os
+import threading
 
 from Crypto.Cipher import AES
 from Crypto.Util import Counter
@@ -12,6 +13,10 @@ PWENC_FILE_SECRET = '/data/pwenc_secret'
 PWENC_PADDING = b'{'
 PWENC_CHECK = 'Donuts!'
 
+# Secret is kept in memory as long as the file it was read from does not change
+secret_cache = None
+secret_cache_lock = threading.Lock()
+
 
 class PWEncService(Service):
 
@@ -26,6 +31,7 @@ class PWEncService(Service):
         with open(PWENC_FILE_SECRET, 'wb') as f:
             os.chmod(PWENC_FILE_SECRET, 0o600)
             f.write(secret)
+        reset_secret_cache()
 
         settings = self.middleware.call_sync('datastore.config', 'system.settings')
         self.middleware.call_sync('datastore.update', 'system.settings', settings['id'], {
@@ -56,8 +62,22 @@ class PWEncService(Service):
 
     @staticmethod
     def get_secret():
-        with open(PWENC_FILE_SECRET, 'rb') as f:
-            return f.read()
+        global secret_cache
+
+        # Another process (i.e. django) may have rewritten it
+        st = os.stat(PWENC_FILE_SECRET)
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+        cache = secret_cache
+        if cache is not None and cache[0] == key:
+            return cache[1]
+
+        with secret_cache_lock:
+            with open(PWENC_FILE_SECRET, 'rb') as f:
+                secret = f.read()
+
+            secret_cache = (key, secret)
+            return secret
 
     def encrypt(self, data):
         return encrypt(data)
@@ -66,11 +86,21 @@ class PWEncService(Service):
         return decrypt(encrypted, _raise)
 
 
+setup_depends = ['system']
+
+
 async def setup(middleware):
     if not await middleware.call('pwenc.check'):
         await middleware.call('pwenc.generate_secret')
 
 
+def reset_secret_cache():
+    global secret_cache
+
+    with secret_cache_lock:
+        secret_cache = None
+
+
 def encrypt(data):
     data = data.encode('utf8')
 
@@ -83,14 +113,17 @@ def encrypt(data):
     return encoded.decode()
 
 
-def decrypt(encrypted, _raise=False):
+def decrypt(encrypted, _raise=False, secret=None):
+    """
+    `secret` can be passed when decrypting many values at once so it is not looked up for each of them.
+    """
     if not encrypted:
         return ''
     try:
         encrypted = base64.b64decode(encrypted)
         nonce = encrypted[:8]
         encrypted = encrypted[8:]
-        cipher = AES.new(PWEncService.get_secret(), AES.MODE_CTR, counter=Counter.new(64, prefix=nonce))
+        cipher = AES.new(secret or PWEncService.get_secret(), AES.MODE_CTR, counter=Counter.new(64, prefix=nonce))
         return cipher.decrypt(encrypted).rstrip(PWENC_PADDING).decode('utf8')
     except Exception:
         if _raise:
@@ -8,7 +8,8 @@ import psutil
 
 from middlewared.common.attachment import FSAttachmentDelegate
 from middlewared.schema import accepts, Bool, Cron, Dict, Int, List, Patch, Path, Str
-from middlewared.service import item_method, job, private, CallError, CRUDService, ValidationErrors
+from middlewared.service import filterable, item_method, job, private, CallError, CRUDService, ValidationErrors
+from middlewared.utils import filter_list
 from middlewared.utils.path import is_child
 from middlewared.validators import Port, Range, ReplicationSnapshotNamingSchema, Unique
 
@@ -23,6 +24,35 @@ class ReplicationService(CRUDService):
         datastore_extend = "replication.extend"
         datastore_extend_context = "replication.extend_context"
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # (mtime, legacy_result, legacy_result_datetime) of last read `/tmp/.repl-result`
+        self.legacy_result_cache = None
+
+    @filterable
+    async def query(self, filters=None, options=None):
+        """
+        Query all Replication Tasks with `query-filters` and `query-options`.
+
+        `query-options.extra.job_state` set to `false` does not retrieve tasks `state` and last `job` (for callers
+        that only need tasks configuration).
+        """
+        options = dict(options or {})
+        extra = dict(options.get("extra") or {})
+        job_state = extra.pop("job_state", True)
+        options["extra"] = extra
+
+        if job_state:
+            return await super().query(filters, options)
+
+        datastore_options = dict(options, extend=self._config.datastore_extend, extend_context=None,
+                                 prefix=self._config.datastore_prefix)
+        datastore_options.pop("count", None)
+        datastore_options.pop("get", None)
+        result = await self.middleware.call("datastore.query", self._config.datastore, [], datastore_options)
+        return await self.middleware.run_in_thread(filter_list, result, filters or [], options)
+
     @private
     async def extend_context(self):
         legacy_result, legacy_result_datetime = await self.middleware.run_in_thread(self._legacy_extend_context)
@@ -34,19 +64,31 @@ class ReplicationService(CRUDService):
         }
 
     def _legacy_extend_context(self):
+        try:
+            mtime = os.stat("/tmp/.repl-result").st_mtime
+        except Exception:
+            mtime = None
+
+        # Only unpickle legacy replication results when they change
+        cache = self.legacy_result_cache
+        if mtime is not None and cache is not None and cache[0] == mtime:
+            return cache[1], cache[2]
+
         try:
             with open("/tmp/.repl-result", "rb") as f:
                 data = f.read()
                 legacy_result = pickle.loads(data)
-                legacy_result_datetime = datetime.fromtimestamp(os.stat("/tmp/.repl-result").st_mtime)
+                legacy_result_datetime = datetime.fromtimestamp(mtime)
         except Exception:
             legacy_result = defaultdict(dict)
             legacy_result_datetime = None
+            mtime = None
 
+        self.legacy_result_cache = (mtime, legacy_result, legacy_result_datetime)
         return legacy_result, legacy_result_datetime
 
     @private
-    async def extend(self, data, context):
+    async def extend(self, data, context=None):
         data["periodic_snapshot_tasks"] = [
             {k.replace("task_", ""): v for k, v in task.items()}
             for task in data["periodic_snapshot_tasks"]
@@ -64,6 +106,10 @@ class ReplicationService(CRUDService):
         Cron.convert_db_format_to_schedule(data, "schedule", key_prefix="schedule_", begin_end=True)
         Cron.convert_db_format_to_schedule(data, "restrict_schedule", key_prefix="restrict_schedule_", begin_end=True)
 
+        if context is None:
+            # `job_state` is disabled
+            return data
+
         if data["transport"] == "LEGACY":
             if data["id"] in context["legacy_result"]:
                 legacy_result = context["legacy_result"][data["id"]]
@@ -293,7 +339,7 @@ class ReplicationService(CRUDService):
         await self._set_periodic_snapshot_tasks(id, periodic_snapshot_tasks)
 
         await self.middleware.call("service.restart", "cron")
-        await self.middleware.call("zettarepl.update_tasks")
+        await self.middleware.call("zettarepl.update_replication_tasks", [id])
 
         return await self._get_instance(id)
 
@@ -376,7 +422,7 @@ class ReplicationService(CRUDService):
         await self._set_periodic_snapshot_tasks(id, periodic_snapshot_tasks)
 
         await self.middleware.call("service.restart", "cron")
-        await self.middleware.call("zettarepl.update_tasks")
+        await self.middleware.call("zettarepl.update_replication_tasks", [id])
 
         return await self._get_instance(id)
 
@@ -407,13 +453,13 @@ class ReplicationService(CRUDService):
         )
 
         await self.middleware.call("service.restart", "cron")
-        await self.middleware.call("zettarepl.update_tasks")
+        await self.middleware.call("zettarepl.update_replication_tasks", [id])
 
         return response
 
     @item_method
     @accepts(Int("id"), Bool("really_run", default=True, hidden=True))
-    @job(logs=True)
+    @job(logs=True, index=True)
     async def run(self, job, id, really_run):
         """
         Run Replication Task of `id`.
@@ -690,7 +736,7 @@ class ReplicationService(CRUDService):
         naming_schemas = []
         for snapshottask in await self.middleware.call("pool.snapshottask.query"):
             naming_schemas.append(snapshottask["naming_schema"])
-        for replication in await self.middleware.call("replication.query"):
+        for replication in await self.middleware.call("replication.query", [], {"extra": {"job_state": False}}):
             naming_schemas.extend(replication["naming_schema"])
             naming_schemas.extend(replication["also_include_naming_schema"])
         return sorted(set(naming_schemas))
@@ -790,7 +836,8 @@ class ReplicationFSAttachmentDelegate(FSAttachmentDelegate):
 
     async def query(self, path, enabled):
         results = []
-        for replication in await self.middleware.call('replication.query', [['enabled', '=', enabled]]):
+        for replication in await self.middleware.call('replication.query', [['enabled', '=', enabled]],
+                                                      {'extra': {'job_state': False}}):
             if replication['direction'] == 'PUSH':
                 if any(is_child(os.path.join('/mnt', source_dataset), path)
                        for source_dataset in replication['source_datasets']):
@@ -810,7 +857,8 @@ class ReplicationFSAttachmentDelegate(FSAttachmentDelegate):
             await self.middleware.call('datastore.delete', 'storage.replication', attachment['id'])
 
         await self.middleware.call('service.restart', 'cron')
-        await self.middleware.call('zettarepl.update_tasks')
+        await self.middleware.call('zettarepl.update_replication_tasks',
+                                   [attachment['id'] for attachment in attachments])
 
     async def toggle(self, attachments, enabled):
         for attachment in attachments:
@@ -818,7 +866,8 @@ class ReplicationFSAttachmentDelegate(FSAttachmentDelegate):
                                        {'repl_enabled': enabled})
 
         await self.middleware.call('service.restart', 'cron')
-        await self.middleware.call('zettarepl.update_tasks')
+        await self.middleware.call('zettarepl.update_replication_tasks',
+                                   [attachment['id'] for attachment in attachments])
 
 
 async def setup(middleware):
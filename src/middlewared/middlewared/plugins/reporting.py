@@ -8,11 +8,11 @@ import os
 import psutil
 import re
 import shutil
-import statistics
 import subprocess
 import sysctl
 import tarfile
 import textwrap
+import threading
 import time
 
 from middlewared.event import EventSource
@@ -30,6 +30,10 @@ RE_RRDPLUGIN = re.compile(r'^(?P<name>.+)Plugin$')
 RE_SPACES = re.compile(r'\s{2,}')
 RRD_BASE_PATH = '/var/db/collectd/rrd/localhost'
 RRD_PLUGINS = {}
+# Maximum number of graphs exported by a single `rrdtool xport` invocation
+RRD_EXPORT_BATCH_SIZE = 50
+# For how long (in seconds) exported graphs data is reused
+RRD_EXPORT_CACHE_TTL = 10
 
 
 def get_members(tar, prefix):
@@ -39,6 +43,65 @@ def get_members(tar, prefix):
             yield tarinfo
 
 
+def prefix_rrd_args(args, prefix):
+    """
+    Prefix all variable names defined in `DEF`/`CDEF`/`VDEF`/`XPORT` rrdtool arguments so arguments
+    of different graphs can be used in a single `rrdtool xport` invocation.
+    """
+    names = set()
+    result = []
+    for arg in args:
+        kind, rest = arg.split(':', 1)
+        if kind in ('DEF', 'CDEF', 'VDEF'):
+            name, value = rest.split('=', 1)
+            names.add(name)
+            if kind != 'DEF':
+                value = ','.join(prefix + token if token in names else token for token in value.split(','))
+            result.append(f'{kind}:{prefix}{name}={value}')
+        elif kind == 'XPORT':
+            name, legend = rest.split(':', 1)
+            result.append(f'XPORT:{prefix}{name}:{legend}')
+        else:
+            result.append(arg)
+    return result
+
+
+def export_batch(items, starttime, endtime, aggregate=True):
+    """
+    Export data of multiple graphs (list of `(rrd, identifier)`) using a single `rrdtool xport` invocation.
+    """
+    args = [
+        'rrdtool',
+        'xport',
+        '--daemon', 'unix:/var/run/rrdcached.sock',
+        '--json',
+        '--end', endtime,
+        '--start', starttime,
+    ]
+    columns = []
+    for i, (rrd, identifier) in enumerate(items):
+        defs = prefix_rrd_args(rrd.get_defs(identifier), f'g{i}_')
+        args.extend(defs)
+        columns.append(len([arg for arg in defs if arg.startswith('XPORT:')]))
+
+    cp = subprocess.run(args, capture_output=True)
+    if cp.returncode != 0:
+        raise RuntimeError(f'Failed to export RRD data: {cp.stderr.decode()}')
+
+    data = json.loads(cp.stdout)
+
+    result = []
+    offset = 0
+    for (rrd, identifier), count in zip(items, columns):
+        meta = dict(data['meta'], legend=data['meta']['legend'][offset:offset + count])
+        result.append(rrd.format_export(
+            identifier, [row[offset:offset + count] for row in data['data']], meta, aggregate,
+        ))
+        offset += count
+
+    return result
+
+
 class RRDMeta(type):
 
     def __new__(cls, name, bases, dct):
@@ -71,7 +134,7 @@ class RRDBase(object, metaclass=RRDMeta):
 
     AGG_MAP = {
         'min': min,
-        'mean': statistics.mean,
+        'mean': lambda values: sum(values) / len(values),
         'max': max,
     }
 
@@ -194,31 +257,20 @@ class RRDBase(object, metaclass=RRDMeta):
         return args
 
     def export(self, identifier, starttime, endtime, aggregate=True):
-        args = [
-            'rrdtool',
-            'xport',
-            '--daemon', 'unix:/var/run/rrdcached.sock',
-            '--json',
-            '--end', endtime,
-            '--start', starttime,
-        ]
-        args.extend(self.get_defs(identifier))
-        cp = subprocess.run(args, capture_output=True)
-        if cp.returncode != 0:
-            raise RuntimeError(f'Failed to export RRD data: {cp.stderr.decode()}')
+        return export_batch([(self, identifier)], starttime, endtime, aggregate)[0]
 
-        data = json.loads(cp.stdout)
+    def format_export(self, identifier, rows, meta, aggregate=True):
         data = dict(
             name=self.name,
             identifier=identifier,
-            data=data['data'],
-            **data['meta'],
+            data=rows,
+            **meta,
             aggregations=dict(),
         )
 
         if self.aggregations and aggregate:
             # Transpose the data matrix and remove null values
-            transposed = [list(filter(None.__ne__, i)) for i in zip(*data['data'])]
+            transposed = [list(filter(None.__ne__, i)) for i in zip(*rows)]
             for agg in self.aggregations:
                 if agg in self.AGG_MAP:
                     data['aggregations'][agg] = [
@@ -723,6 +775,10 @@ class ReportingService(ConfigService):
         for name, klass in RRD_PLUGINS.items():
             self.__rrds[name] = klass(self.middleware)
 
+        # Exported graphs data shared by all clients for `RRD_EXPORT_CACHE_TTL` seconds
+        self.__export_cache = {}
+        self.__export_cache_lock = threading.Lock()
+
     @accepts(
         Dict(
             'reporting_update',
@@ -817,6 +873,8 @@ class ReportingService(ConfigService):
 
         await self.middleware.call('service.restart', 'collectd')
 
+        self.__clear_export_cache()
+
         return await self.config()
 
     @private
@@ -977,29 +1035,61 @@ class ReportingService(ConfigService):
 
         """
         starttime, endtime = self.__rquery_to_start_end(query)
-        rv = []
+        items = []
         for i in graphs:
             try:
                 rrd = self.__rrds[i['name']]
             except KeyError:
                 raise CallError(f'Graph {i["name"]!r} not found.', errno.ENOENT)
-            rv.append(
-                rrd.export(i['identifier'], starttime, endtime, aggregate=query['aggregate'])
-            )
-        return rv
+            items.append((rrd, i['identifier']))
+        return self.__export(items, starttime, endtime, query['aggregate'])
 
     @private
     @accepts(Ref('reporting_query'))
     def get_all(self, query):
         starttime, endtime = self.__rquery_to_start_end(query)
-        rv = []
+        items = []
         for rrd in self.__rrds.values():
             idents = rrd.get_identifiers()
             if idents is None:
                 idents = [None]
             for ident in idents:
-                rv.append(rrd.export(ident, starttime, endtime, aggregate=query['aggregate']))
-        return rv
+                items.append((rrd, ident))
+        return self.__export(items, starttime, endtime, query['aggregate'])
+
+    def __export(self, items, starttime, endtime, aggregate):
+        """
+        Export graphs data using as few `rrdtool xport` invocations as possible, reusing recently exported data.
+        """
+        now = time.monotonic()
+        keys = [(rrd.name, identifier, starttime, endtime, aggregate) for rrd, identifier in items]
+        with self.__export_cache_lock:
+            for key in [k for k, v in self.__export_cache.items() if v[0] < now]:
+                self.__export_cache.pop(key)
+            result = {key: self.__export_cache[key][1] for key in keys if key in self.__export_cache}
+
+        missing = [(key, item) for key, item in zip(keys, items) if key not in result]
+        for i in range(0, len(missing), RRD_EXPORT_BATCH_SIZE):
+            batch = missing[i:i + RRD_EXPORT_BATCH_SIZE]
+            try:
+                data = export_batch([item for key, item in batch], starttime, endtime, aggregate)
+            except Exception:
+                if len(batch) == 1:
+                    raise
+
+                # Export graphs one by one to find out which one is failing
+                data = [rrd.export(identifier, starttime, endtime, aggregate) for key, (rrd, identifier) in batch]
+
+            with self.__export_cache_lock:
+                for (key, item), graph_data in zip(batch, data):
+                    result[key] = graph_data
+                    self.__export_cache[key] = (now + RRD_EXPORT_CACHE_TTL, graph_data)
+
+        return [result[key] for key in keys]
+
+    def __clear_export_cache(self):
+        with self.__export_cache_lock:
+            self.__export_cache.clear()
 
 
 class RealtimeEventSource(EventSource):
@@ -11,9 +11,74 @@ import time
 import subprocess
 
 from middlewared.schema import accepts, Bool, Dict, Int, Ref, Str
-from middlewared.service import filterable, CallError, CRUDService, private
+from middlewared.service import filterable, CallError, CRUDService, DEFERRED, private, service_actions_scope
 from middlewared.utils import Popen, filter_list, run
 
+# Service reload/restart requests for the same service made within `ServiceActionsScope` that arrive within this many
+# seconds are merged
+RELOAD_DEBOUNCE = 0.1
+
+
+class Coalescer:
+    """
+    Merges requests to run the same action.
+
+    `run(key, func, *args)` requests that `func(*args)` is run. Requests for the same `key` that arrive before the
+    action starts (it starts `delay` seconds after the first one, `delay` can be overridden for a single request) are
+    satisfied by a single run and all of them get its result. If the action for `key` is already running, it will be run once more after it finishes (the running
+    one might have missed the changes that caused the new request).
+    """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        # key -> (future, requests count) of the run that has not started yet
+        self.pending = {}
+        # key -> future of the run in progress
+        self.running = {}
+        self.runs = 0
+        self.requests = 0
+
+    async def run(self, key, func, *args, delay=None):
+        self.requests += 1
+
+        pending = self.pending.get(key)
+        if pending is None:
+            future = asyncio.get_event_loop().create_future()
+            self.pending[key] = [future, 1]
+            asyncio.ensure_future(self._run(key, future, func, args, self.delay if delay is None else delay))
+        else:
+            future = pending[0]
+            pending[1] += 1
+
+        return await asyncio.shield(future)
+
+    async def _run(self, key, future, func, args, delay):
+        # Requests made at the same time are merged even without delay
+        await asyncio.sleep(delay)
+
+        running = self.running.get(key)
+        if running is not None:
+            await asyncio.wait([running])
+
+        # Requests that arrive from now on might not be satisfied by this run
+        self.pending.pop(key)
+        self.running[key] = future
+        self.runs += 1
+        try:
+            future.set_result(await func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            self.running.pop(key)
+
+    def __encode__(self):
+        return {
+            'runs': self.runs,
+            'requests': self.requests,
+            'pending': len(self.pending),
+            'running': len(self.running),
+        }
+
 
 class ServiceDefinition:
     def __init__(self, *args):
@@ -105,6 +170,10 @@ class ServiceService(CRUDService):
         'webdav': ServiceDefinition('httpd', '/var/run/httpd.pid'),
     }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.coalescer = Coalescer()
+
     @filterable
     async def query(self, filters=None, options=None):
         """
@@ -239,11 +308,12 @@ class ServiceService(CRUDService):
         Restart the service specified by `service`.
 
         The helper will use method self._restart_[service]() to restart the service.
-        If the method does not exist, it would fallback using service(8)."""
-        await self.middleware.call_hook('service.pre_action', service, 'restart', options)
-        sn = self._started_notify("restart", service)
-        await self._simplecmd("restart", service, options)
-        return await self.started(service, sn)
+        If the method does not exist, it would fallback using service(8).
+
+        Restart requests for the same service that arrive at the same time are merged and the service
+        is only restarted once. Restart requested by `core.bulk` calls is only run once after all of them
+        and its result is reported for every call that requested it."""
+        return await self._coalesce('restart', service, options, self._restart)
 
     @accepts(
         Str('service'),
@@ -255,11 +325,35 @@ class ServiceService(CRUDService):
 
         The helper will use method self._reload_[service]() to reload the service.
         If the method does not exist, the helper will try self.restart of the
-        service instead."""
+        service instead.
+
+        Reload requests are merged the same way as restart requests."""
+        return await self._coalesce('reload', service, options, self._reload)
+
+    async def _coalesce(self, verb, service, options, func):
+        scope = service_actions_scope.get()
+        if scope is not None:
+            if scope.defer(f'service.{verb} {service}', self.middleware.call, f'service.{verb}', service, options):
+                return DEFERRED
+
+            # Scope has already ended, merge with requests made by other calls that were run in it
+            delay = RELOAD_DEBOUNCE
+        else:
+            delay = 0
+
+        return await self.coalescer.run((verb, service, repr(options)), func, service, options, delay=delay)
+
+    async def _restart(self, service, options):
+        await self.middleware.call_hook('service.pre_action', service, 'restart', options)
+        sn = self._started_notify("restart", service)
+        await self._simplecmd("restart", service, options)
+        return await self.started(service, sn)
+
+    async def _reload(self, service, options):
         await self.middleware.call_hook('service.pre_action', service, 'reload', options)
         try:
             await self._simplecmd("reload", service, options)
-        except Exception as e:
+        except Exception:
             await self.restart(service, options)
         return await self.started(service)
 
@@ -3,6 +3,7 @@ from middlewared.schema import Bool, Dict, IPAddr, List, Str, Int, Patch
 from middlewared.service import (SystemServiceService, ValidationErrors,
                                  accepts, filterable, private, periodic, CRUDService)
 from middlewared.async_validators import check_path_resides_within_volume
+from middlewared.plugins.cache import CACHE_NAMESPACE_STATE
 from middlewared.service_exception import CallError
 from middlewared.utils import Popen, run, filter_list
 from middlewared.utils.path import is_child
@@ -222,12 +223,12 @@ class SMBService(SystemServiceService):
 
         verrors = ValidationErrors()
         if check_deferred:
-            is_deferred = await self.middleware.call('cache.has_key', 'SMB_SET_ADMIN')
+            is_deferred = await self.middleware.call('cache.has_key', 'SMB_SET_ADMIN', CACHE_NAMESPACE_STATE)
             if not is_deferred:
                 self.logger.debug("No cache entry indicating delayed action to add admin_group was found.")
                 return True
             else:
-                await self.middleware.call('cache.pop', 'SMB_SET_ADMIN')
+                await self.middleware.call('cache.pop', 'SMB_SET_ADMIN', CACHE_NAMESPACE_STATE)
 
         if not admin_group:
             smb = await self.middleware.call('smb.config')
@@ -242,7 +243,7 @@ class SMBService(SystemServiceService):
         sid = await self.wbinfo_gidtosid(group['gr_gid'])
         if sid == "WBC_ERR_WINBIND_NOT_AVAILABLE":
             self.logger.debug("Delaying admin group add until winbind starts")
-            await self.middleware.call('cache.put', 'SMB_SET_ADMIN', True)
+            await self.middleware.call('cache.put', 'SMB_SET_ADMIN', True, 0, CACHE_NAMESPACE_STATE)
             return True
 
         must_add_sid = await self.validate_admin_groups(sid)
@@ -503,8 +504,8 @@ class SMBService(SystemServiceService):
 
     @private
     async def get_smb_ha_mode(self):
-        if await self.middleware.call('cache.has_key', 'SMB_HA_MODE'):
-            return await self.middleware.call('cache.get', 'SMB_HA_MODE')
+        if await self.middleware.call('cache.has_key', 'SMB_HA_MODE', CACHE_NAMESPACE_STATE):
+            return await self.middleware.call('cache.get', 'SMB_HA_MODE', CACHE_NAMESPACE_STATE)
 
         if not await self.middleware.call('system.is_freenas') and await self.middleware.call('failover.licensed'):
             system_dataset = await self.middleware.call('systemdataset.config')
@@ -515,12 +516,12 @@ class SMBService(SystemServiceService):
         else:
             hamode = SMBHAMODE['STANDALONE'].name
 
-        await self.middleware.call('cache.put', 'SMB_HA_MODE', hamode)
+        await self.middleware.call('cache.put', 'SMB_HA_MODE', hamode, 0, CACHE_NAMESPACE_STATE)
         return hamode
 
     @private
     async def reset_smb_ha_mode(self):
-        await self.middleware.call('cache.pop', 'SMB_HA_MODE')
+        await self.middleware.call('cache.pop', 'SMB_HA_MODE', CACHE_NAMESPACE_STATE)
         return await self.get_smb_ha_mode()
 
     @accepts(Dict(
@@ -1137,14 +1138,15 @@ class ShareSec(CRUDService):
                 await self._flush_share_info()
                 return
 
-        if await self.middleware.call('cache.has_key', 'SHAREINFO_MTIME'):
-            old_mtime = await self.middleware.call('cache.get', 'SHAREINFO_MTIME')
+        if await self.middleware.call('cache.has_key', 'SHAREINFO_MTIME', CACHE_NAMESPACE_STATE):
+            old_mtime = await self.middleware.call('cache.get', 'SHAREINFO_MTIME', CACHE_NAMESPACE_STATE)
 
         if old_mtime == (os.stat(shareinfo)).st_mtime:
             return
 
         await self.middleware.call('smb.sharesec.synchronize_acls')
-        await self.middleware.call('cache.put', 'SHAREINFO_MTIME', (os.stat(shareinfo)).st_mtime)
+        await self.middleware.call('cache.put', 'SHAREINFO_MTIME', (os.stat(shareinfo)).st_mtime, 0,
+                                   CACHE_NAMESPACE_STATE)
 
     @accepts()
     async def synchronize_acls(self):
@@ -133,7 +133,7 @@ class PeriodicSnapshotTaskService(CRUDService):
         )
 
         await self.middleware.call('service.restart', 'cron')
-        await self.middleware.call('zettarepl.update_tasks')
+        await self.middleware.call('zettarepl.update_periodic_snapshot_tasks', [data['id']])
 
         return await self._get_instance(data['id'])
 
@@ -186,7 +186,8 @@ class PeriodicSnapshotTaskService(CRUDService):
         verrors.add_child('periodic_snapshot_update', await self._validate(new))
 
         if not new['enabled']:
-            for replication_task in await self.middleware.call('replication.query', [['enabled', '=', True]]):
+            for replication_task in await self.middleware.call('replication.query', [['enabled', '=', True]],
+                                                               {'extra': {'job_state': False}}):
                 if any(periodic_snapshot_task['id'] == id
                        for periodic_snapshot_task in replication_task['periodic_snapshot_tasks']):
                     verrors.add(
@@ -227,7 +228,7 @@ class PeriodicSnapshotTaskService(CRUDService):
         )
 
         await self.middleware.call('service.restart', 'cron')
-        await self.middleware.call('zettarepl.update_tasks')
+        await self.middleware.call('zettarepl.update_periodic_snapshot_tasks', [id])
 
         return await self._get_instance(id)
 
@@ -256,7 +257,7 @@ class PeriodicSnapshotTaskService(CRUDService):
             ['transport', '!=', 'LEGACY'],
             ['also_include_naming_schema', '=', []],
             ['enabled', '=', True],
-        ]):
+        ], {'extra': {'job_state': False}}):
             if len(replication_task['periodic_snapshot_tasks']) == 1:
                 if replication_task['periodic_snapshot_tasks'][0]['id'] == id:
                     raise CallError(
@@ -272,7 +273,7 @@ class PeriodicSnapshotTaskService(CRUDService):
         )
 
         await self.middleware.call('service.restart', 'cron')
-        await self.middleware.call('zettarepl.update_tasks')
+        await self.middleware.call('zettarepl.update_periodic_snapshot_tasks', [id])
 
         return response
 
@@ -349,7 +350,8 @@ class PeriodicSnapshotTaskService(CRUDService):
         return f'auto-%Y%m%d.%H%M-{data["lifetime_value"]}{data["lifetime_unit"].lower()[0]}'
 
     async def _legacy_replication_tasks(self):
-        return await self.middleware.call('replication.query', [['transport', '=', 'LEGACY']])
+        # Kept up to date by zettarepl definition builder
+        return await self.middleware.call('zettarepl.get_legacy_replication_tasks')
 
 
 class PeriodicSnapshotTaskFSAttachmentDelegate(FSAttachmentDelegate):
@@ -372,14 +374,16 @@ class PeriodicSnapshotTaskFSAttachmentDelegate(FSAttachmentDelegate):
             await self.middleware.call('datastore.delete', 'storage.task', attachment['id'])
 
         await self.middleware.call('service.restart', 'cron')
-        await self.middleware.call('zettarepl.update_tasks')
+        await self.middleware.call('zettarepl.update_periodic_snapshot_tasks',
+                                   [attachment['id'] for attachment in attachments])
 
     async def toggle(self, attachments, enabled):
         for attachment in attachments:
             await self.middleware.call('datastore.update', 'storage.task', attachment['id'], {'task_enabled': enabled})
 
         await self.middleware.call('service.restart', 'cron')
-        await self.middleware.call('zettarepl.update_tasks')
+        await self.middleware.call('zettarepl.update_periodic_snapshot_tasks',
+                                   [attachment['id'] for attachment in attachments])
 
 
 async def setup(middleware):
@@ -9,9 +9,9 @@ from middlewared.utils import Popen, run, start_daemon_thread, sw_buildtime, sw_
 from middlewared.validators import Range
 
 import csv
-import io
 import os
 import psutil
+import queue
 import re
 import requests
 import shutil
@@ -21,7 +21,9 @@ import subprocess
 import sysctl
 import syslog
 import tarfile
+import tempfile
 import textwrap
+import threading
 import time
 import uuid
 
@@ -531,71 +533,91 @@ class SystemService(Service):
                                                                 encoded['progress']['description'])
         )
 
-        standby_debug = None
         is_freenas = self.middleware.call_sync('system.is_freenas')
-        if not is_freenas and self.middleware.call_sync('failover.licensed'):
-            try:
-                standby_debug = self.middleware.call_sync(
-                    'failover.call_remote', 'system.debug_generate', [], {'job': True}
-                )
-            except Exception:
-                self.logger.warn('Failed to get debug from standby node', exc_info=True)
-            else:
-                remote_ip = self.middleware.call_sync('failover.remote_ip')
-                url = self.middleware.call_sync(
-                    'failover.call_remote', 'core.download', ['filesystem.get', [standby_debug], 'debug.txz'],
-                )[1]
-
-                url = f'http://{remote_ip}:6000{url}'
-                standby_debug = io.BytesIO()
-                with requests.get(url, stream=True) as r:
-                    for i in r.iter_content(chunk_size=1048576):
-                        if standby_debug.tell() > 20971520:
-                            raise CallError(f'Standby debug file is bigger than 20MiB.')
-                        standby_debug.write(i)
+        if is_freenas or not self.middleware.call_sync('failover.licensed'):
+            self.__wait_debug_generate(debug_job)
 
-        debug_job.wait_sync()
-        if debug_job.error:
-            raise CallError(debug_job.error)
+            job.set_progress(90, 'Preparing debug file for streaming')
 
-        job.set_progress(90, 'Preparing debug file for streaming')
+            with open(debug_job.result, 'rb') as f:
+                shutil.copyfileobj(f, job.pipes.output.w)
+            job.pipes.output.w.close()
+            return
 
-        if standby_debug:
-            # Debug file cannot be big on HA because we put both debugs in memory
-            # so they can be downloaded at once.
-            try:
-                if os.stat(debug_job.result).st_size > 20971520:
-                    raise CallError(f'Debug file is bigger than 20MiB.')
-            except FileNotFoundError:
-                raise CallError('Debug file was not found, try again.')
+        network = self.middleware.call_sync('network.configuration.config')
+        node = self.middleware.call_sync('failover.node')
+        if node == 'A':
+            my_hostname = network['hostname']
+            remote_hostname = network['hostname_b']
+        else:
+            my_hostname = network['hostname_b']
+            remote_hostname = network['hostname']
 
-            network = self.middleware.call_sync('network.configuration.config')
-            node = self.middleware.call_sync('failover.node')
+        # Both nodes generate their debugs in parallel, each of them is streamed as soon as it is available
+        available = queue.Queue()
 
-            tario = io.BytesIO()
-            with tarfile.open(fileobj=tario, mode='w') as tar:
+        def local_debug():
+            try:
+                self.__wait_debug_generate(debug_job)
+                available.put((f'{my_hostname}.txz', os.stat(debug_job.result).st_size, open(debug_job.result, 'rb')))
+            except Exception as e:
+                available.put(e)
 
-                if node == 'A':
-                    my_hostname = network['hostname']
-                    remote_hostname = network['hostname_b']
-                else:
-                    my_hostname = network['hostname_b']
-                    remote_hostname = network['hostname']
+        start_daemon_thread(target=local_debug)
+        start_daemon_thread(target=lambda: available.put(self.__standby_debug(f'{remote_hostname}.txz')))
 
-                tar.add(debug_job.result, f'{my_hostname}.txz')
+        def members():
+            for i in range(2):
+                member = available.get()
+                if isinstance(member, Exception):
+                    raise member
+                if member is None:
+                    # Standby debug is not available
+                    continue
 
-                tarinfo = tarfile.TarInfo(f'{remote_hostname}.txz')
-                tarinfo.size = standby_debug.tell()
-                standby_debug.seek(0)
-                tar.addfile(tarinfo, fileobj=standby_debug)
+                job.set_progress(90, f'Streaming {member[0]}')
+                yield member
 
-            tario.seek(0)
-            shutil.copyfileobj(tario, job.pipes.output.w)
-        else:
-            with open(debug_job.result, 'rb') as f:
-                shutil.copyfileobj(f, job.pipes.output.w)
+        write_debug_tar(job.pipes.output.w, members())
         job.pipes.output.w.close()
 
+    def __wait_debug_generate(self, debug_job):
+        debug_job.wait_sync()
+        if debug_job.error:
+            raise CallError(debug_job.error)
+
+        if not os.path.exists(debug_job.result):
+            raise CallError('Debug file was not found, try again.')
+
+    def __standby_debug(self, name):
+        """
+        Generate debug on the standby node and return `(name, size, fileobj)` to read it from.
+        """
+        try:
+            standby_debug = self.middleware.call_sync(
+                'failover.call_remote', 'system.debug_generate', [], {'job': True}
+            )
+
+            remote_ip = self.middleware.call_sync('failover.remote_ip')
+            url = self.middleware.call_sync(
+                'failover.call_remote', 'core.download', ['filesystem.get', [standby_debug], 'debug.txz'],
+            )[1]
+
+            r = requests.get(f'http://{remote_ip}:6000{url}', stream=True)
+            r.raise_for_status()
+            if 'Content-Length' in r.headers:
+                return name, int(r.headers['Content-Length']), r.raw
+
+            # Tar member size must be known before it can be written
+            f = tempfile.TemporaryFile()
+            with r:
+                shutil.copyfileobj(r.raw, f)
+            size = f.tell()
+            f.seek(0)
+            return name, size, f
+        except Exception:
+            self.logger.warn('Failed to get debug from standby node', exc_info=True)
+
 
 class SystemGeneralService(ConfigService):
 
@@ -1095,28 +1117,80 @@ async def devd_zfs_hook(middleware, data):
         await middleware.call('cache.pop', CACHE_POOLS_STATUSES)
 
 
-class SystemHealthEventSource(EventSource):
+def write_debug_tar(fileobj, members):
+    """
+    Stream a tar archive of `members` (an iterable of `(name, size, fileobj)`) to `fileobj`.
+    Each member is written as soon as it is yielded and closed afterwards.
+    """
+    with tarfile.open(fileobj=fileobj, mode='w|') as tar:
+        for name, size, f in members:
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = size
+            tarinfo.mtime = time.time()
+            try:
+                tar.addfile(tarinfo, fileobj=f)
+            finally:
+                f.close()
+
 
+class SystemHealthUpdateChecker(object):
     """
-    Notifies of current system health which include statistics about consumption of memory and CPU, pools and
-    if updates are available. An integer `delay` argument can be specified to determine the delay
-    on when the periodic event should be generated.
+    Process-wide cached update availability status for `system.health` event.
+    It is refreshed once a day by a single thread regardless of the number of subscribers.
     """
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._check_update = None
-        start_daemon_thread(target=self.check_update)
+    interval = 60 * 60 * 24
+    retry_interval = 60 * 60
+
+    def __init__(self):
+        self.status = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def get(self, middleware):
+        with self.lock:
+            if self.thread is None:
+                self.thread = start_daemon_thread(target=self.run, args=(middleware,))
 
-    def check_update(self):
-        while not self._cancel.is_set():
+        return self.status
+
+    def run(self, middleware):
+        while True:
             try:
-                self._check_update = self.middleware.call_sync('update.check_available')['status']
-                self._cancel.wait(timeout=60 * 60 * 24)
+                self.status = middleware.call_sync('update.check_available')['status']
             except Exception:
-                self.middleware.logger.warn(
-                    'Failed to check avaiable update for system.health event', exc_info=True,
-                )
+                middleware.logger.warn('Failed to check available update for system.health event', exc_info=True)
+                time.sleep(self.retry_interval)
+            else:
+                time.sleep(self.interval)
+
+
+class SystemHealthProducer(object):
+    """
+    Samples system health every `delay` seconds and sends it to all subscribers of that delay.
+    Sampling thread is started for the first subscriber and exits once the last one unsubscribes.
+    """
+
+    def __init__(self, middleware, delay):
+        self.middleware = middleware
+        self.delay = delay
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.add(callback)
+            if self.thread is None:
+                self.wakeup.clear()
+                self.thread = start_daemon_thread(target=self.run)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.subscribers.discard(callback)
+            if not self.subscribers:
+                self.wakeup.set()
 
     def pools_statuses(self):
         return {
@@ -1124,6 +1198,80 @@ class SystemHealthEventSource(EventSource):
             for p in self.middleware.call_sync('pool.query')
         }
 
+    def cp_time(self):
+        return sysctl.filter('kern.cp_time')[0].value
+
+    def sample(self, cp_diff):
+        cpu_percent = round((sum(cp_diff[:3]) / sum(cp_diff)) * 100, 2)
+
+        pools = self.middleware.call_sync(
+            'cache.get_or_put',
+            CACHE_POOLS_STATUSES,
+            1800,
+            self.pools_statuses,
+        )
+
+        return {
+            'cpu_percent': cpu_percent,
+            'memory': psutil.virtual_memory()._asdict(),
+            'pools': pools,
+            'update': SYSTEM_HEALTH_UPDATE_CHECKER.get(self.middleware),
+        }
+
+    def run(self):
+        cp_old = self.cp_time()
+
+        while True:
+            self.wakeup.wait(self.delay)
+
+            with self.lock:
+                subscribers = list(self.subscribers)
+                if not subscribers:
+                    self.thread = None
+                    return
+                # Someone has subscribed again before we noticed all previous subscribers were gone
+                self.wakeup.clear()
+
+            cp_time = self.cp_time()
+            cp_diff = list(map(lambda x: x[0] - x[1], zip(cp_time, cp_old)))
+            cp_old = cp_time
+
+            try:
+                fields = self.sample(cp_diff)
+            except Exception:
+                self.middleware.logger.warn('Failed to sample system health', exc_info=True)
+                continue
+
+            for callback in subscribers:
+                try:
+                    callback(fields)
+                except Exception:
+                    self.middleware.logger.warn('Failed to send system.health event', exc_info=True)
+
+
+SYSTEM_HEALTH_UPDATE_CHECKER = SystemHealthUpdateChecker()
+SYSTEM_HEALTH_PRODUCERS = {}
+SYSTEM_HEALTH_PRODUCERS_LOCK = threading.Lock()
+
+
+def get_system_health_producer(middleware, delay):
+    with SYSTEM_HEALTH_PRODUCERS_LOCK:
+        if delay not in SYSTEM_HEALTH_PRODUCERS:
+            SYSTEM_HEALTH_PRODUCERS[delay] = SystemHealthProducer(middleware, delay)
+        return SYSTEM_HEALTH_PRODUCERS[delay]
+
+
+class SystemHealthEventSource(EventSource):
+
+    """
+    Notifies of current system health which include statistics about consumption of memory and CPU, pools and
+    if updates are available. An integer `delay` argument can be specified to determine the delay
+    on when the periodic event should be generated.
+    """
+
+    def send_health(self, fields):
+        self.send_event('ADDED', fields=fields)
+
     def run(self):
 
         try:
@@ -1138,31 +1286,13 @@ class SystemHealthEventSource(EventSource):
         if delay < 5:
             return
 
-        cp_time = sysctl.filter('kern.cp_time')[0].value
-        cp_old = cp_time
-
-        while not self._cancel.is_set():
-            time.sleep(delay)
-
-            cp_time = sysctl.filter('kern.cp_time')[0].value
-            cp_diff = list(map(lambda x: x[0] - x[1], zip(cp_time, cp_old)))
-            cp_old = cp_time
-
-            cpu_percent = round((sum(cp_diff[:3]) / sum(cp_diff)) * 100, 2)
-
-            pools = self.middleware.call_sync(
-                'cache.get_or_put',
-                CACHE_POOLS_STATUSES,
-                1800,
-                self.pools_statuses,
-            )
-
-            self.send_event('ADDED', fields={
-                'cpu_percent': cpu_percent,
-                'memory': psutil.virtual_memory()._asdict(),
-                'pools': pools,
-                'update': self._check_update,
-            })
+        # All subscribers with the same delay share a single producer
+        producer = get_system_health_producer(self.middleware, delay)
+        producer.subscribe(self.send_health)
+        try:
+            self._cancel.wait()
+        finally:
+            producer.unsubscribe(self.send_health)
 
 
 async def firstboot(middleware):
@@ -1211,6 +1341,10 @@ async def update_timeout_value(middleware, *args):
         )
 
 
+# Timezone has to be configured before anything else, see #72131
+setup_depends = []
+
+
 async def setup(middleware):
     global SYSTEM_BOOT_ID, SYSTEM_READY
 
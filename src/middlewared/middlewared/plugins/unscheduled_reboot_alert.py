@@ -33,6 +33,9 @@ class UnscheduledRebootAlertService(Service):
             os.unlink(SENTINEL_PATH)
 
 
+setup_depends = ['system', 'alert']
+
+
 async def setup(middleware):
     if os.path.exists(SENTINEL_PATH):
         # We want to emit the mail only if the machine truly rebooted
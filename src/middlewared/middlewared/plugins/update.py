@@ -1,5 +1,6 @@
 from bsd import geom
 from middlewared.schema import accepts, Bool, Dict, Str
+from middlewared.plugins.cache import CACHE_NAMESPACE_STATE
 from middlewared.service import job, private, CallError, Service
 
 from datetime import datetime
@@ -382,7 +383,7 @@ class UpdateService(Service):
         """
 
         try:
-            applied = self.middleware.call_sync('cache.get', 'update.applied')
+            applied = self.middleware.call_sync('cache.get', 'update.applied', CACHE_NAMESPACE_STATE)
         except Exception:
             applied = False
         if applied is True:
@@ -537,7 +538,7 @@ class UpdateService(Service):
             location,
             install_handler=handler.install_handler,
         )
-        await self.middleware.call('cache.put', 'update.applied', True)
+        await self.middleware.call('cache.put', 'update.applied', True, 0, CACHE_NAMESPACE_STATE)
 
         if (
             await self.middleware.call('system.is_freenas') or
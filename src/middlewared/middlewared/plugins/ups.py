@@ -337,6 +337,9 @@ class UPSService(SystemServiceService):
             self.middleware.logger.debug(f'Unrecognized UPS notification event: {notify_type}')
 
 
+setup_depends = ['system', 'alert']
+
+
 async def setup(middleware):
     # Let's delete all UPS related alerts when starting middlewared ensuring we don't have any leftovers
     await middleware.call('ups.dismiss_alerts')
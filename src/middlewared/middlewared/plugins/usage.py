@@ -416,6 +416,9 @@ class UsageService(Service):
         return {'vms': vm_list}
 
 
+setup_depends = ['system']
+
+
 async def setup(middleware):
     now = datetime.utcnow()
     event_loop = asyncio.get_event_loop()
@@ -1,9 +1,12 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import errno
 import os
 import socket
 import ssl
+import threading
+import time
 import uuid
 
 from middlewared.async_validators import resolve_hostname
@@ -13,17 +16,23 @@ from middlewared.service import CallError, CRUDService, private, ValidationError
 from pyVim import connect, task as VimTask
 from pyVmomi import vim, vmodl
 
+# Maximum number of VMware snapshot tasks (and logins) that are running at the same time
+VMWARE_SNAPSHOT_CONCURRENCY = 8
+# Sessions of snapshots that were never finished with `snapshot_end` are closed after this many seconds
+VMWARE_SNAPSHOT_SESSION_TIMEOUT = 3600
+
 
 class VMWareService(CRUDService):
 
     class Config:
         datastore = 'storage.vmwareplugin'
-        datastore_extend = 'vmware.item_extend'
+        datastore_encrypted_fields = ['password']
 
-    @private
-    async def item_extend(self, item):
-        item['password'] = await self.middleware.call('pwenc.decrypt', item['password'])
-        return item
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # VMware sessions opened by `snapshot_begin` that will be reused by `snapshot_end`, keyed by snapshot name
+        self.snapshot_sessions = {}
+        self.snapshot_sessions_lock = threading.Lock()
 
     @private
     async def validate_data(self, data, schema_name):
@@ -400,12 +409,14 @@ class VMWareService(CRUDService):
     def snapshot_begin(self, dataset, recursive):
         # If there's a VMWare Plugin object for this filesystem
         # snapshot the VMs before taking the ZFS snapshot.
-        # Once we've taken the ZFS snapshot we're going to log back in
-        # to VMWare and destroy all the VMWare snapshots we created.
+        # Once we've taken the ZFS snapshot we're going to destroy all the VMWare snapshots we created
+        # (reusing the sessions we've opened here).
         # We do this because having VMWare snapshots in existence impacts
         # the performance of your VMs.
         qs = self._dataset_get_vms(dataset, recursive)
 
+        self._close_stale_snapshot_sessions()
+
         # Generate a unique snapshot name that (hopefully) won't collide with anything
         # that exists on the VMWare side.
         vmsnapname = str(uuid.uuid4())
@@ -415,137 +426,146 @@ class VMWareService(CRUDService):
         # help determine where it came from.
         vmsnapdescription = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} FreeNAS Created Snapshot"
 
-        # We keep track of snapshots per VMWare "task" because we are going to iterate
-        # over all the VMWare tasks for a given ZFS filesystem, do all the VMWare snapshotting
-        # then take the ZFS snapshot, then iterate again over all the VMWare "tasks" and undo
-        # all the snaps we created in the first place.
-        vmsnapobjs = []
+        # Several VMWare "tasks" might point to different datastores of the same host. We only log in to each host
+        # once and look up its VMs once.
+        hosts = defaultdict(list)
         for vmsnapobj in qs:
-            # Data structures that will be used to keep track of VMs that are snapped,
-            # as wel as VMs we tried to snap and failed, and VMs we realized we couldn't
-            # snapshot.
-            snapvms = []
-            snapvmfails = []
-            snapvmskips = []
+            hosts[self._snapshot_session_key(vmsnapobj)].append(vmsnapobj)
 
-            try:
-                ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-                ssl_context.verify_mode = ssl.CERT_NONE
-                si = connect.SmartConnect(host=vmsnapobj["hostname"], user=vmsnapobj["username"],
-                                          pwd=vmsnapobj["password"], sslContext=ssl_context)
-                content = si.RetrieveContent()
-            except Exception as e:
-                self.logger.warn("VMware login to %s failed", vmsnapobj["hostname"], exc_info=True)
-                self._alert_vmware_login_failed(vmsnapobj, e)
-                continue
+        timings = {}
+        with ThreadPoolExecutor(max_workers=VMWARE_SNAPSHOT_CONCURRENCY) as executor:
+            started = time.monotonic()
+            sessions = dict(zip(hosts.keys(), executor.map(
+                lambda vmsnapobjs: self._snapshot_login(vmsnapobjs[0]), hosts.values(),
+            )))
+            sessions = {key: si for key, si in sessions.items() if si is not None}
+            timings["login"] = time.monotonic() - started
 
-            # There's no point to even consider VMs that are paused or powered off.
-            vm_view = content.viewManager.CreateContainerView(content.rootFolder, [vim.VirtualMachine], True)
-            for vm in vm_view.view:
-                if vm.summary.runtime.powerState != "poweredOn":
-                    continue
+            started = time.monotonic()
+            vms = dict(zip(sessions.keys(), executor.map(self._snapshot_index_vms, sessions.values())))
+            timings["index"] = time.monotonic() - started
 
-                if self._doesVMDependOnDataStore(vm, vmsnapobj["datastore"]):
-                    try:
-                        if self._canSnapshotVM(vm):
-                            if not self._doesVMSnapshotByNameExists(vm, vmsnapname):
-                                # have we already created a snapshot of the VM for this volume
-                                # iteration? can happen if the VM uses two datasets (a and b)
-                                # where both datasets are mapped to the same ZFS volume in FreeNAS.
-                                VimTask.WaitForTask(vm.CreateSnapshot_Task(
-                                    name=vmsnapname,
-                                    description=vmsnapdescription,
-                                    memory=False, quiesce=True,
-                                ))
-                            else:
-                                self.logger.debug("Not creating snapshot %s for VM %s because it "
-                                                  "already exists", vmsnapname, vm)
-                        else:
-                            # TODO:
-                            # we can try to shutdown the VM, if the user provided us an ok to do
-                            # so (might need a new list property in obj to know which VMs are
-                            # fine to shutdown and a UI to specify such exceptions)
-                            # otherwise can skip VM snap and then make a crash-consistent zfs
-                            # snapshot for this VM
-                            self.logger.info("Can't snapshot VM %s that depends on "
-                                             "datastore %s and filesystem %s. "
-                                             "Possibly using PT devices. Skipping.",
-                                             vm.name, vmsnapobj["datastore"], dataset)
-                            snapvmskips.append(vm.config.uuid)
-                    except Exception as e:
-                        self.logger.warning("Snapshot of VM %s failed", vm.name, exc_info=True)
-                        self.middleware.call("alert.oneshot_create", "VMWareSnapshotCreateFailed", {
-                            "hostname": vmsnapobj["hostname"],
-                            "vm": vm.name,
-                            "snapshot": vmsnapname,
-                            "error": self._vmware_exception_message(e),
-                        })
-                        snapvmfails.append([vm.config.uuid, vm.name])
-
-                    snapvms.append(vm.config.uuid)
-
-            connect.Disconnect(si)
-
-            vmsnapobjs.append({
-                "vmsnapobj": vmsnapobj,
-                "snapvms": snapvms,
-                "snapvmfails": snapvmfails,
-                "snapvmskips": snapvmskips,
-            })
+            # Data structures that will be used to keep track of VMs that are snapped,
+            # as wel as VMs we tried to snap and failed, and VMs we realized we couldn't
+            # snapshot.
+            vmsnapobjs = []
+            # A VM might depend on more than one datastore so we make sure to only snapshot it once.
+            started = time.monotonic()
+            snapshots = {}
+            for key, si in sessions.items():
+                for vmsnapobj in hosts[key]:
+                    snapvms = []
+                    for vm in vms[key]:
+                        if self._doesVMDependOnDataStore(vm, vmsnapobj["datastore"]):
+                            snapvms.append(vm)
+                            if (key, vm["uuid"]) not in snapshots:
+                                snapshots[(key, vm["uuid"])] = executor.submit(
+                                    self._snapshot_vm, vmsnapobj, vm, dataset, vmsnapname, vmsnapdescription,
+                                )
+
+                    vmsnapobjs.append((key, vmsnapobj, snapvms))
+
+            results = {k: future.result() for k, future in snapshots.items()}
+            timings["snapshot"] = time.monotonic() - started
 
         # At this point we've completed snapshotting VMs.
 
+        self.logger.debug("VMware snapshot %s of %d VM(s) on %d host(s) timings: %r", vmsnapname, len(snapshots),
+                          len(sessions), timings)
+
         if not vmsnapobjs:
+            for si in sessions.values():
+                connect.Disconnect(si)
+
             return None
 
+        with self.snapshot_sessions_lock:
+            self.snapshot_sessions[vmsnapname] = {
+                "created": time.monotonic(),
+                "sessions": sessions,
+            }
+
+        vmsnapobjs = [
+            {
+                "vmsnapobj": vmsnapobj,
+                "snapvms": [vm["uuid"] for vm in snapvms],
+                "snapvmfails": [[vm["uuid"], vm["name"]] for vm in snapvms
+                                if results[(key, vm["uuid"])] == "failed"],
+                "snapvmskips": [vm["uuid"] for vm in snapvms
+                                if results[(key, vm["uuid"])] == "skipped"],
+            }
+            for key, vmsnapobj, snapvms in vmsnapobjs
+        ]
+
         return {
             "vmsnapname": vmsnapname,
             "vmsnapobjs": vmsnapobjs,
             "vmsynced": vmsnapobjs and all(len(vmsnapobj["snapvms"]) > 0 and len(vmsnapobj["snapvmfails"]) == 0
-                                           for vmsnapobj in vmsnapobjs)
+                                           for vmsnapobj in vmsnapobjs),
+            "timings": timings,
         }
 
     @private
     def snapshot_end(self, context):
         vmsnapname = context["vmsnapname"]
 
+        with self.snapshot_sessions_lock:
+            begin_sessions = self.snapshot_sessions.pop(vmsnapname, {"sessions": {}})["sessions"]
+
+        hosts = defaultdict(list)
         for elem in context["vmsnapobjs"]:
-            vmsnapobj = elem["vmsnapobj"]
+            hosts[self._snapshot_session_key(elem["vmsnapobj"])].append(elem)
+
+        timings = {}
+        with ThreadPoolExecutor(max_workers=VMWARE_SNAPSHOT_CONCURRENCY) as executor:
+            started = time.monotonic()
+            # Sessions opened by `snapshot_begin` might have expired (or middleware might have been restarted), in that
+            # case we log in again.
+            sessions = dict(zip(hosts.keys(), executor.map(
+                lambda key: (
+                    begin_sessions[key] if key in begin_sessions and self._snapshot_session_alive(begin_sessions[key])
+                    else self._snapshot_login(hosts[key][0]["vmsnapobj"])
+                ),
+                hosts.keys(),
+            )))
+            timings["login"] = time.monotonic() - started
+
+            started = time.monotonic()
+            removals = []
+            for key, elems in hosts.items():
+                si = sessions[key]
+                if si is None:
+                    continue
 
-            try:
-                ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-                ssl_context.verify_mode = ssl.CERT_NONE
-                si = connect.SmartConnect(host=vmsnapobj["hostname"], user=vmsnapobj["username"],
-                                          pwd=vmsnapobj["password"], sslContext=ssl_context)
-                self._delete_vmware_login_failed_alert(vmsnapobj)
-            except Exception as e:
-                self.logger.warning("VMware login failed to %s", vmsnapobj["hostname"])
-                self._alert_vmware_login_failed(vmsnapobj, e)
-                continue
+                self._delete_vmware_login_failed_alert(elems[0]["vmsnapobj"])
 
-            # vm is an object, so we'll dereference that object anywhere it's user facing.
-            for vm_uuid in elem["snapvms"]:
-                vm = si.content.searchIndex.FindByUuid(None, vm_uuid, True)
-                if not vm:
-                    self.logger.debug("Could not find VM %s", vm_uuid)
-                    continue
-                if [vm_uuid, vm.name] not in elem["snapvmfails"] and vm_uuid not in elem["snapvmskips"]:
-                    # The test above is paranoia.  It shouldn't be possible for a vm to
-                    # be in more than one of the three dictionaries.
-                    snap = self._doesVMSnapshotByNameExists(vm, vmsnapname)
-                    try:
-                        if snap is not False:
-                            VimTask.WaitForTask(snap.RemoveSnapshot_Task(True))
-                    except Exception as e:
-                        self.logger.debug("Exception removing snapshot %s on %s", vmsnapname, vm.name, exc_info=True)
-                        self.middleware.call("alert.oneshot_create", "VMWareSnapshotDeleteFailed", {
-                            "hostname": vmsnapobj["hostname"],
-                            "vm": vm.name,
-                            "snapshot": vmsnapname,
-                            "error": self._vmware_exception_message(e),
-                        })
-
-            connect.Disconnect(si)
+                content = si.RetrieveContent()
+                vm_uuids = set()
+                for elem in elems:
+                    snapvmfails = {vm_uuid for vm_uuid, vm_name in elem["snapvmfails"]}
+                    for vm_uuid in elem["snapvms"]:
+                        if vm_uuid in snapvmfails or vm_uuid in elem["snapvmskips"]:
+                            # The test above is paranoia.  It shouldn't be possible for a vm to
+                            # be in more than one of the three dictionaries.
+                            continue
+                        if vm_uuid in vm_uuids:
+                            # VM depends on more than one datastore, we've already scheduled its snapshot removal
+                            continue
+
+                        vm_uuids.add(vm_uuid)
+                        removals.append(executor.submit(
+                            self._snapshot_remove, content, elem["vmsnapobj"], vm_uuid, vmsnapname,
+                        ))
+
+            for future in removals:
+                future.result()
+            timings["remove"] = time.monotonic() - started
+
+        for si in sessions.values():
+            if si is not None:
+                connect.Disconnect(si)
+
+        self.logger.debug("VMware snapshot %s removal of %d VM(s) timings: %r", vmsnapname, len(removals), timings)
 
     @private
     def periodic_snapshot_task_begin(self, task_id):
@@ -557,42 +577,163 @@ class VMWareService(CRUDService):
 
     @private
     async def periodic_snapshot_task_end(self, context):
-        return self.snapshot_end(context)
+        return await self.middleware.call("vmware.snapshot_end", context)
 
-    # Check if a VM is using a certain datastore
-    def _doesVMDependOnDataStore(self, vm, dataStore):
+    def _snapshot_session_key(self, vmsnapobj):
+        return vmsnapobj["hostname"], vmsnapobj["username"], vmsnapobj["password"]
+
+    def _snapshot_login(self, vmsnapobj):
+        try:
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            ssl_context.verify_mode = ssl.CERT_NONE
+            si = connect.SmartConnect(host=vmsnapobj["hostname"], user=vmsnapobj["username"],
+                                      pwd=vmsnapobj["password"], sslContext=ssl_context)
+            si.RetrieveContent()
+            return si
+        except Exception as e:
+            self.logger.warning("VMware login to %s failed", vmsnapobj["hostname"], exc_info=True)
+            self._alert_vmware_login_failed(vmsnapobj, e)
+            return None
+
+    def _snapshot_session_alive(self, si):
+        try:
+            return si.RetrieveContent().sessionManager.currentSession is not None
+        except Exception:
+            return False
+
+    def _close_stale_snapshot_sessions(self):
+        with self.snapshot_sessions_lock:
+            stale = [
+                vmsnapname for vmsnapname, v in self.snapshot_sessions.items()
+                if v["created"] < time.monotonic() - VMWARE_SNAPSHOT_SESSION_TIMEOUT
+            ]
+            stale = [self.snapshot_sessions.pop(vmsnapname) for vmsnapname in stale]
+
+        for v in stale:
+            for si in v["sessions"].values():
+                try:
+                    connect.Disconnect(si)
+                except Exception:
+                    self.logger.debug("Error closing stale VMware session", exc_info=True)
+
+    def _snapshot_index_vms(self, si):
+        # There's no point to even consider VMs that are paused or powered off.
+        # All the properties that we need are retrieved once per VM, no matter how many datastores we check it against.
+        content = si.RetrieveContent()
+        vm_view = content.viewManager.CreateContainerView(content.rootFolder, [vim.VirtualMachine], True)
+        try:
+            vms = []
+            for vm in vm_view.view:
+                try:
+                    if vm.summary.runtime.powerState != "poweredOn":
+                        continue
+
+                    vms.append({
+                        "vm": vm,
+                        "name": vm.name,
+                        "uuid": vm.config.uuid,
+                        **self._vm_datastores(vm),
+                    })
+                except Exception:
+                    self.logger.debug("Exception indexing VM %r", vm, exc_info=True)
+
+            return vms
+        finally:
+            vm_view.Destroy()
+
+    def _snapshot_vm(self, vmsnapobj, vm, dataset, vmsnapname, vmsnapdescription):
+        try:
+            if vm["can_snapshot"]:
+                if not self._doesVMSnapshotByNameExists(vm["vm"], vmsnapname):
+                    VimTask.WaitForTask(vm["vm"].CreateSnapshot_Task(
+                        name=vmsnapname,
+                        description=vmsnapdescription,
+                        memory=False, quiesce=True,
+                    ))
+                else:
+                    self.logger.debug("Not creating snapshot %s for VM %s because it "
+                                      "already exists", vmsnapname, vm["name"])
+
+                return "snapped"
+            else:
+                # TODO:
+                # we can try to shutdown the VM, if the user provided us an ok to do
+                # so (might need a new list property in obj to know which VMs are
+                # fine to shutdown and a UI to specify such exceptions)
+                # otherwise can skip VM snap and then make a crash-consistent zfs
+                # snapshot for this VM
+                self.logger.info("Can't snapshot VM %s that depends on "
+                                 "datastore %s and filesystem %s. "
+                                 "Possibly using PT devices. Skipping.",
+                                 vm["name"], vmsnapobj["datastore"], dataset)
+                return "skipped"
+        except Exception as e:
+            self.logger.warning("Snapshot of VM %s failed", vm["name"], exc_info=True)
+            self.middleware.call_sync("alert.oneshot_create", "VMWareSnapshotCreateFailed", {
+                "hostname": vmsnapobj["hostname"],
+                "vm": vm["name"],
+                "snapshot": vmsnapname,
+                "error": self._vmware_exception_message(e),
+            })
+            return "failed"
+
+    def _snapshot_remove(self, content, vmsnapobj, vm_uuid, vmsnapname):
+        # vm is an object, so we'll dereference that object anywhere it's user facing.
+        vm = content.searchIndex.FindByUuid(None, vm_uuid, True)
+        if not vm:
+            self.logger.debug("Could not find VM %s", vm_uuid)
+            return
+
+        snap = self._doesVMSnapshotByNameExists(vm, vmsnapname)
+        try:
+            if snap is not False:
+                VimTask.WaitForTask(snap.RemoveSnapshot_Task(True))
+        except Exception as e:
+            self.logger.debug("Exception removing snapshot %s on %s", vmsnapname, vm.name, exc_info=True)
+            self.middleware.call_sync("alert.oneshot_create", "VMWareSnapshotDeleteFailed", {
+                "hostname": vmsnapobj["hostname"],
+                "vm": vm.name,
+                "snapshot": vmsnapname,
+                "error": self._vmware_exception_message(e),
+            })
+
+    # Get names of datastores VM depends on
+    def _vm_datastores(self, vm):
+        datastores = []
+        disk_datastores = []
+        can_snapshot = True
         try:
             # simple case, VM config data is on a datastore.
             # not sure how critical it is to snapshot the store that has config data, but best to do so
             for i in vm.datastore:
-                if i.info.name.startswith(dataStore):
-                    return True
+                datastores.append(i.info.name)
             # check if VM has disks on the data store
             # we check both "diskDescriptor" and "diskExtent" types of files
             for device in vm.config.hardware.device:
+                # check for PCI pass-through devices
+                # consider supporting more cases of VMs that can't be snapshoted
+                # https://kb.vmware.com/selfservice/microsites/search.do?language=en_US&cmd=displayKC&externalId=1006392
+                if isinstance(device, vim.VirtualPCIPassthrough):
+                    can_snapshot = False
                 if device.backing is None:
                     continue
                 if hasattr(device.backing, 'fileName'):
-                    if device.backing.datastore.info.name == dataStore:
-                        return True
+                    disk_datastores.append(device.backing.datastore.info.name)
         except Exception:
-            self.logger.debug('Exception in doesVMDependOnDataStore', exc_info=True)
-
-        return False
+            self.logger.debug('Exception in vmDataStores', exc_info=True)
 
-    # check if VMware can snapshot a VM
-    def _canSnapshotVM(self, vm):
-        try:
-            # check for PCI pass-through devices
-            for device in vm.config.hardware.device:
-                if isinstance(device, vim.VirtualPCIPassthrough):
-                    return False
-            # consider supporting more cases of VMs that can't be snapshoted
-            # https://kb.vmware.com/selfservice/microsites/search.do?language=en_US&cmd=displayKC&externalId=1006392
-        except Exception:
-            self.logger.debug('Exception in canSnapshotVM', exc_info=True)
+        return {
+            "datastores": datastores,
+            "disk_datastores": disk_datastores,
+            "can_snapshot": can_snapshot,
+        }
 
-        return True
+    # Check if a VM is using a certain datastore
+    def _doesVMDependOnDataStore(self, vm, dataStore):
+        return (
+            any(name.startswith(dataStore) for name in vm["datastores"]) or
+            dataStore in vm["disk_datastores"]
+        )
 
     # check if there is already a snapshot by a given name
     def _doesVMSnapshotByNameExists(self, vm, snapshotName):
@@ -1,3 +1,4 @@
+import asyncio
 from collections import defaultdict
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
@@ -96,6 +97,232 @@ def zettarepl_schedule(schedule):
     return schedule
 
 
+def hold_task_reason(pools, dataset):
+    pool = dataset.split("/")[0]
+
+    if pool not in pools:
+        return f"Pool {pool} does not exist"
+
+    if pools[pool]["status"] == "OFFLINE":
+        return f"Pool {pool} is offline"
+
+    if not pools[pool]["is_decrypted"]:
+        return f"Pool {pool} is locked"
+
+
+def periodic_snapshot_task_definition(periodic_snapshot_task):
+    return {
+        "dataset": periodic_snapshot_task["dataset"],
+
+        "recursive": periodic_snapshot_task["recursive"],
+        "exclude": periodic_snapshot_task["exclude"],
+
+        "lifetime": lifetime_iso8601(periodic_snapshot_task["lifetime_value"],
+                                     periodic_snapshot_task["lifetime_unit"]),
+
+        "naming-schema": periodic_snapshot_task["naming_schema"],
+
+        "schedule": zettarepl_schedule(periodic_snapshot_task["schedule"]),
+
+        "allow-empty": periodic_snapshot_task["allow_empty"],
+    }
+
+
+def replication_task_definition(replication_task, transport, legacy_periodic_snapshot_tasks_ids):
+    my_periodic_snapshot_tasks = [f"task_{periodic_snapshot_task['id']}"
+                                  for periodic_snapshot_task in replication_task["periodic_snapshot_tasks"]
+                                  if periodic_snapshot_task["id"] not in legacy_periodic_snapshot_tasks_ids]
+    my_schedule = replication_task["schedule"]
+
+    # All my periodic snapshot tasks are legacy
+    if (
+            replication_task["direction"] == "PUSH" and
+            replication_task["auto"] and
+            replication_task["periodic_snapshot_tasks"] and
+            not my_periodic_snapshot_tasks
+    ):
+        my_schedule = replication_task["periodic_snapshot_tasks"][0]["schedule"]
+
+    definition = {
+        "direction": replication_task["direction"].lower(),
+        "transport": transport,
+        "source-dataset": replication_task["source_datasets"],
+        "target-dataset": replication_task["target_dataset"],
+        "recursive": replication_task["recursive"],
+        "exclude": replication_task_exclude(replication_task["source_datasets"],
+                                            replication_task["recursive"],
+                                            replication_task["exclude"]),
+        "properties": replication_task["properties"],
+        "periodic-snapshot-tasks": my_periodic_snapshot_tasks,
+        "auto": replication_task["auto"],
+        "only-matching-schedule": replication_task["only_matching_schedule"],
+        "allow-from-scratch": replication_task["allow_from_scratch"],
+        "hold-pending-snapshots": replication_task["hold_pending_snapshots"],
+        "retention-policy": replication_task["retention_policy"].lower(),
+        "dedup": replication_task["dedup"],
+        "large-block": replication_task["large_block"],
+        "embed": replication_task["embed"],
+        "compressed": replication_task["compressed"],
+        "retries": replication_task["retries"],
+        "logging-level": (replication_task["logging_level"] or "NOTSET").lower(),
+    }
+
+    if replication_task["naming_schema"]:
+        definition["naming-schema"] = replication_task["naming_schema"]
+    if replication_task["also_include_naming_schema"]:
+        definition["also-include-naming-schema"] = replication_task["also_include_naming_schema"]
+    # Use snapshots created by legacy periodic snapshot tasks
+    for periodic_snapshot_task in replication_task["periodic_snapshot_tasks"]:
+        if periodic_snapshot_task["id"] in legacy_periodic_snapshot_tasks_ids:
+            definition.setdefault("also-include-naming-schema", [])
+            definition["also-include-naming-schema"].append(periodic_snapshot_task["naming_schema"])
+    if my_schedule is not None:
+        definition["schedule"] = zettarepl_schedule(my_schedule)
+    if replication_task["restrict_schedule"] is not None:
+        definition["restrict-schedule"] = zettarepl_schedule(replication_task["restrict_schedule"])
+    if replication_task["lifetime_value"] is not None and replication_task["lifetime_unit"] is not None:
+        definition["lifetime"] = lifetime_iso8601(replication_task["lifetime_value"],
+                                                  replication_task["lifetime_unit"])
+    if replication_task["compression"] is not None:
+        definition["compression"] = replication_task["compression"]
+    if replication_task["speed_limit"] is not None:
+        definition["speed-limit"] = replication_task["speed_limit"]
+
+    return definition
+
+
+DEFINITION_TASKS_KEYS = ("periodic-snapshot-tasks", "replication-tasks")
+
+
+def definition_diff(old, new):
+    """
+    Returns changes that turn definition `old` into `new`: new `timezone` (if it has changed) and added or changed
+    tasks (removed tasks are `None`).
+    """
+    diff = {}
+
+    if old["timezone"] != new["timezone"]:
+        diff["timezone"] = new["timezone"]
+
+    for key in DEFINITION_TASKS_KEYS:
+        changes = {id: task for id, task in new[key].items() if old[key].get(id) != task}
+        changes.update({id: None for id in old[key].keys() - new[key].keys()})
+        if changes:
+            diff[key] = changes
+
+    return diff
+
+
+def apply_definition_diff(definition, diff):
+    definition = dict(definition)
+
+    if "timezone" in diff:
+        definition["timezone"] = diff["timezone"]
+
+    for key in DEFINITION_TASKS_KEYS:
+        if key in diff:
+            tasks = dict(definition[key])
+            for id, task in diff[key].items():
+                if task is None:
+                    tasks.pop(id, None)
+                else:
+                    tasks[id] = task
+            definition[key] = tasks
+
+    return definition
+
+
+class DefinitionBuilder:
+    """
+    Zettarepl definition assembled from cached per-task fragments so a datastore change only has to recompute the
+    tasks it has touched and a pool event only has to recompute which tasks are on hold.
+    """
+
+    def __init__(self, timezone, pools):
+        self.timezone = timezone
+        self.pools = pools
+        # id -> (dataset, definition)
+        self.periodic_snapshot_tasks = {}
+        self.legacy_periodic_snapshot_tasks_ids = set()
+        # id -> (datasets that must be available, ids of bound periodic snapshot tasks, definition)
+        self.replication_tasks = {}
+
+    def set_periodic_snapshot_task(self, periodic_snapshot_task):
+        self.remove_periodic_snapshot_task(periodic_snapshot_task["id"])
+
+        if periodic_snapshot_task["legacy"]:
+            self.legacy_periodic_snapshot_tasks_ids.add(periodic_snapshot_task["id"])
+        elif periodic_snapshot_task["enabled"]:
+            self.periodic_snapshot_tasks[periodic_snapshot_task["id"]] = (
+                periodic_snapshot_task["dataset"],
+                periodic_snapshot_task_definition(periodic_snapshot_task),
+            )
+
+    def remove_periodic_snapshot_task(self, id):
+        self.periodic_snapshot_tasks.pop(id, None)
+        self.legacy_periodic_snapshot_tasks_ids.discard(id)
+
+    def set_replication_task(self, replication_task, transport):
+        """
+        `transport` is only used (and only has to be defined) for enabled non-legacy replication tasks.
+        """
+        self.remove_replication_task(replication_task["id"])
+
+        if replication_task["transport"] == "LEGACY" or not replication_task["enabled"]:
+            return
+
+        if replication_task["direction"] == "PUSH":
+            datasets = replication_task["source_datasets"]
+        else:
+            datasets = [replication_task["target_dataset"]]
+
+        self.replication_tasks[replication_task["id"]] = (
+            datasets,
+            {periodic_snapshot_task["id"] for periodic_snapshot_task in replication_task["periodic_snapshot_tasks"]},
+            replication_task_definition(replication_task, transport, self.legacy_periodic_snapshot_tasks_ids),
+        )
+
+    def remove_replication_task(self, id):
+        self.replication_tasks.pop(id, None)
+
+    def replication_tasks_using(self, periodic_snapshot_tasks_ids):
+        periodic_snapshot_tasks_ids = set(periodic_snapshot_tasks_ids)
+        return [
+            id
+            for id, (datasets, bound_periodic_snapshot_tasks_ids, definition) in self.replication_tasks.items()
+            if bound_periodic_snapshot_tasks_ids & periodic_snapshot_tasks_ids
+        ]
+
+    def definition(self):
+        hold_tasks = {}
+
+        periodic_snapshot_tasks = {}
+        for id, (dataset, definition) in sorted(self.periodic_snapshot_tasks.items()):
+            reason = hold_task_reason(self.pools, dataset)
+            if reason:
+                hold_tasks[f"periodic_snapshot_task_{id}"] = reason
+                continue
+
+            periodic_snapshot_tasks[f"task_{id}"] = definition
+
+        replication_tasks = {}
+        for id, (datasets, bound_periodic_snapshot_tasks_ids, definition) in sorted(self.replication_tasks.items()):
+            reason = next(filter(None, (hold_task_reason(self.pools, dataset) for dataset in datasets)), None)
+            if reason:
+                hold_tasks[f"replication_task_{id}"] = reason
+                continue
+
+            replication_tasks[f"task_{id}"] = definition
+
+        definition = {
+            "timezone": self.timezone,
+            "periodic-snapshot-tasks": periodic_snapshot_tasks,
+            "replication-tasks": replication_tasks,
+        }
+
+        return definition, hold_tasks
+
+
 class ReplicationTaskLog:
     def __init__(self, task_id, log):
         self.task_id = task_id
@@ -202,12 +429,20 @@ class ZettareplProcess:
 
         while self.zettarepl is not None:
             command, args = self.command_queue.get()
-            if command == "timezone":
-                self.zettarepl.scheduler.tz_clock.timezone = pytz.timezone(args)
-            if command == "tasks":
-                definition = Definition.from_data(args, raise_on_error=False)
-                self.observer_queue.put(DefinitionErrors(definition.errors))
-                self.zettarepl.set_tasks(definition.tasks)
+            if command == "update_tasks":
+                # Only changes are sent to us
+                self.definition = apply_definition_diff(self.definition, args)
+                if "timezone" in args:
+                    self.zettarepl.scheduler.tz_clock.timezone = pytz.timezone(args["timezone"])
+                if any(key in args for key in DEFINITION_TASKS_KEYS):
+                    try:
+                        definition = Definition.from_data(self.definition, raise_on_error=False)
+                    except Exception:
+                        logger.error("Unhandled exception while parsing definition", exc_info=True)
+                        continue
+
+                    self.observer_queue.put(DefinitionErrors(definition.errors))
+                    self.zettarepl.set_tasks(definition.tasks)
             if command == "run_task":
                 class_name, task_id = args
                 for task in self.zettarepl.tasks:
@@ -240,23 +475,21 @@ class ZettareplService(Service):
         self.queue = None
         self.process = None
         self.zettarepl = None
+        # Per-task definition fragments (built on first use)
+        self.definition_builder = None
+        self.definition_lock = asyncio.Lock()
+        # Definition zettarepl process is running with
+        self.definition = None
+        # `transport = LEGACY` replication tasks as of last definition build
+        self.legacy_replication_tasks = None
 
     def is_running(self):
         return self.process is not None and self.process.is_alive()
 
     def get_state(self):
-        jobs = {}
-        for j in self.middleware.call_sync("core.get_jobs", [("method", "=", "replication.run")], {"order_by": ["id"]}):
-            try:
-                task_id = int(j["arguments"][0])
-            except (IndexError, ValueError):
-                continue
-
-            jobs[f"replication_task_{task_id}"] = j
-
         state = {
             k: (
-                dict(v, job=jobs.get(k), last_snapshot=self.last_snapshot.get(k))
+                dict(v, job=self._replication_task_job(k), last_snapshot=self.last_snapshot.get(k))
                 if k.startswith("replication_task_")
                 else dict(v)
             )
@@ -275,13 +508,30 @@ class ZettareplService(Service):
 
         return state
 
-    def start(self):
+    def _replication_task_job(self, key):
         try:
-            definition, hold_tasks = self.middleware.call_sync("zettarepl.get_definition")
-        except Exception as e:
-            self.logger.error("Error generating zettarepl definition", exc_info=True)
-            raise CallError(f"Internal error: {e!r}")
+            task_id = int(key[len("replication_task_"):])
+        except ValueError:
+            return None
 
+        return self.middleware.jobs.index.get("replication.run", task_id)
+
+    async def start(self):
+        async with self.definition_lock:
+            try:
+                if self.definition_builder is None:
+                    self.definition_builder = await self._build_definition()
+
+                definition, hold_tasks = self.definition_builder.definition()
+            except Exception as e:
+                self.definition_builder = None
+                self.legacy_replication_tasks = None
+                self.logger.error("Error generating zettarepl definition", exc_info=True)
+                raise CallError(f"Internal error: {e!r}")
+
+            await self.middleware.run_in_thread(self._start, definition, hold_tasks)
+
+    def _start(self, definition, hold_tasks):
         with self.lock:
             if not self.is_running():
                 self.queue = multiprocessing.Queue()
@@ -291,6 +541,7 @@ class ZettareplService(Service):
                                             self.queue, self.observer_queue)
                 )
                 self.process.start()
+                self.definition = definition
 
                 if self.observer_queue_reader is None:
                     self.observer_queue_reader = start_daemon_thread(target=self._observer_queue_reader)
@@ -308,23 +559,82 @@ class ZettareplService(Service):
                     os.kill(self.process.pid, signal.SIGKILL)
 
                 self.process = None
+                self.definition = None
+
+    async def update_timezone(self, timezone):
+        async def update(builder):
+            builder.timezone = timezone
+            return builder
+
+        await self._update_definition(update)
+
+    async def update_tasks(self):
+        """
+        Rebuilds the whole definition. Prefer `update_periodic_snapshot_tasks`, `update_replication_tasks` or
+        `update_pools` when it is known what has changed.
+        """
+        async def update(builder):
+            return await self._build_definition()
+
+        await self._update_definition(update)
+
+    async def update_periodic_snapshot_tasks(self, ids):
+        """
+        Recomputes definitions of periodic snapshot tasks `ids` (that were created, updated or deleted) and of
+        replication tasks bound to them.
+        """
+        async def update(builder):
+            return await self._update_periodic_snapshot_tasks(builder, ids)
+
+        await self._update_definition(update)
+
+    async def update_replication_tasks(self, ids):
+        """
+        Recomputes definitions of replication tasks `ids` (that were created, updated or deleted).
+        """
+        async def update(builder):
+            return await self._update_replication_tasks(builder, ids)
+
+        await self._update_definition(update)
+
+    async def update_pools(self):
+        """
+        Recomputes which tasks are on hold after a pool was imported, exported, locked or unlocked.
+        """
+        async def update(builder):
+            builder.pools = await self._pools()
+            return builder
+
+        await self._update_definition(update)
+
+    async def _update_definition(self, update):
+        async with self.definition_lock:
+            try:
+                if self.definition_builder is None:
+                    self.definition_builder = await self._build_definition()
+                else:
+                    self.definition_builder = await update(self.definition_builder)
 
-    def update_timezone(self, timezone):
-        if self.queue:
-            self.queue.put(("timezone", timezone))
+                definition, hold_tasks = self.definition_builder.definition()
+            except Exception:
+                # Cached fragments might be inconsistent now
+                self.definition_builder = None
+                self.legacy_replication_tasks = None
+                self.logger.error("Error generating zettarepl definition", exc_info=True)
+                return
 
-    def update_tasks(self):
-        try:
-            definition, hold_tasks = self.middleware.call_sync("zettarepl.get_definition")
-        except Exception:
-            self.logger.error("Error generating zettarepl definition", exc_info=True)
-            return
+            await self.middleware.run_in_thread(self._update_process, definition, hold_tasks)
 
+    def _update_process(self, definition, hold_tasks):
         if self._is_empty_definition(definition):
-            self.middleware.call_sync("zettarepl.stop")
+            self.stop()
         else:
-            self.middleware.call_sync("zettarepl.start")
-            self.queue.put(("tasks", definition))
+            self._start(definition, hold_tasks)
+
+            diff = definition_diff(self.definition, definition)
+            if diff:
+                self.queue.put(("update_tasks", diff))
+                self.definition = definition
 
         self.hold_tasks = hold_tasks
 
@@ -443,151 +753,109 @@ class ZettareplService(Service):
         return errors
 
     async def get_definition(self):
-        timezone = (await self.middleware.call("system.general.config"))["timezone"]
+        definition, hold_tasks = (await self._build_definition()).definition()
+
+        # Test if does not cause exceptions
+        Definition.from_data(definition, raise_on_error=False)
 
-        pools = {pool["name"]: pool for pool in await self.middleware.call("pool.query")}
+        return definition, hold_tasks
 
-        hold_tasks = {}
+    async def get_legacy_replication_tasks(self):
+        if self.legacy_replication_tasks is None:
+            return await self.middleware.call("replication.query", [["transport", "=", "LEGACY"]],
+                                              {"extra": {"job_state": False}})
 
-        periodic_snapshot_tasks = {}
-        for periodic_snapshot_task in await self.middleware.call("pool.snapshottask.query", [["enabled", "=", True],
-                                                                                             ["legacy", "=", False]]):
-            hold_task_reason = self._hold_task_reason(pools, periodic_snapshot_task["dataset"])
-            if hold_task_reason:
-                hold_tasks[f"periodic_snapshot_task_{periodic_snapshot_task['id']}"] = hold_task_reason
-                continue
+        return self.legacy_replication_tasks
 
-            periodic_snapshot_tasks[f"task_{periodic_snapshot_task['id']}"] = {
-                "dataset": periodic_snapshot_task["dataset"],
+    async def _build_definition(self):
+        builder = DefinitionBuilder((await self.middleware.call("system.general.config"))["timezone"],
+                                    await self._pools())
 
-                "recursive": periodic_snapshot_task["recursive"],
-                "exclude": periodic_snapshot_task["exclude"],
+        replication_tasks = await self.middleware.call("replication.query", [], {"extra": {"job_state": False}})
+        # Must be known before querying periodic snapshot tasks as it defines which of them are legacy
+        self.legacy_replication_tasks = [replication_task for replication_task in replication_tasks
+                                         if replication_task["transport"] == "LEGACY"]
 
-                "lifetime": lifetime_iso8601(periodic_snapshot_task["lifetime_value"],
-                                             periodic_snapshot_task["lifetime_unit"]),
+        for periodic_snapshot_task in await self.middleware.call("pool.snapshottask.query"):
+            builder.set_periodic_snapshot_task(periodic_snapshot_task)
 
-                "naming-schema": periodic_snapshot_task["naming_schema"],
+        transports = {}
+        for replication_task in replication_tasks:
+            builder.set_replication_task(replication_task,
+                                         await self._replication_task_transport(replication_task, transports))
 
-                "schedule": zettarepl_schedule(periodic_snapshot_task["schedule"]),
+        return builder
 
-                "allow-empty": periodic_snapshot_task["allow_empty"],
-            }
+    async def _update_periodic_snapshot_tasks(self, builder, ids):
+        ids = list(ids)
 
-        replication_tasks = {}
-        legacy_periodic_snapshot_tasks_ids = {
-            periodic_snapshot_task["id"]
-            for periodic_snapshot_task in await self.middleware.call("pool.snapshottask.query", [["legacy", "=", True]])
+        periodic_snapshot_tasks = {
+            periodic_snapshot_task["id"]: periodic_snapshot_task
+            for periodic_snapshot_task in await self.middleware.call("pool.snapshottask.query", [["id", "in", ids]])
         }
-        for replication_task in await self.middleware.call("replication.query", [["transport", "!=", "LEGACY"],
-                                                                                 ["enabled", "=", True]]):
-            if replication_task["direction"] == "PUSH":
-                hold = False
-                for source_dataset in replication_task["source_datasets"]:
-                    hold_task_reason = self._hold_task_reason(pools, source_dataset)
-                    if hold_task_reason:
-                        hold_tasks[f"replication_task_{replication_task['id']}"] = hold_task_reason
-                        hold = True
-                        break
-                if hold:
-                    continue
-
-            if replication_task["direction"] == "PULL":
-                hold_task_reason = self._hold_task_reason(pools, replication_task["target_dataset"])
-                if hold_task_reason:
-                    hold_tasks[f"replication_task_{replication_task['id']}"] = hold_task_reason
-                    continue
-
-            my_periodic_snapshot_tasks = [f"task_{periodic_snapshot_task['id']}"
-                                          for periodic_snapshot_task in replication_task["periodic_snapshot_tasks"]
-                                          if periodic_snapshot_task["id"] not in legacy_periodic_snapshot_tasks_ids]
-            my_schedule = replication_task["schedule"]
-
-            # All my periodic snapshot tasks are legacy
-            if (
-                    replication_task["direction"] == "PUSH" and
-                    replication_task["auto"] and
-                    replication_task["periodic_snapshot_tasks"] and
-                    not my_periodic_snapshot_tasks
-            ):
-                my_schedule = replication_task["periodic_snapshot_tasks"][0]["schedule"]
-
-            definition = {
-                "direction": replication_task["direction"].lower(),
-                "transport": await self._define_transport(
-                    replication_task["transport"],
-                    (replication_task["ssh_credentials"] or {}).get("id"),
-                    replication_task["netcat_active_side"],
-                    replication_task["netcat_active_side_listen_address"],
-                    replication_task["netcat_active_side_port_min"],
-                    replication_task["netcat_active_side_port_max"],
-                    replication_task["netcat_passive_side_connect_address"],
-                ),
-                "source-dataset": replication_task["source_datasets"],
-                "target-dataset": replication_task["target_dataset"],
-                "recursive": replication_task["recursive"],
-                "exclude": replication_task_exclude(replication_task["source_datasets"],
-                                                    replication_task["recursive"],
-                                                    replication_task["exclude"]),
-                "properties": replication_task["properties"],
-                "periodic-snapshot-tasks": my_periodic_snapshot_tasks,
-                "auto": replication_task["auto"],
-                "only-matching-schedule": replication_task["only_matching_schedule"],
-                "allow-from-scratch": replication_task["allow_from_scratch"],
-                "hold-pending-snapshots": replication_task["hold_pending_snapshots"],
-                "retention-policy": replication_task["retention_policy"].lower(),
-                "dedup": replication_task["dedup"],
-                "large-block": replication_task["large_block"],
-                "embed": replication_task["embed"],
-                "compressed": replication_task["compressed"],
-                "retries": replication_task["retries"],
-                "logging-level": (replication_task["logging_level"] or "NOTSET").lower(),
-            }
-
-            if replication_task["naming_schema"]:
-                definition["naming-schema"] = replication_task["naming_schema"]
-            if replication_task["also_include_naming_schema"]:
-                definition["also-include-naming-schema"] = replication_task["also_include_naming_schema"]
-            # Use snapshots created by legacy periodic snapshot tasks
-            for periodic_snapshot_task in replication_task["periodic_snapshot_tasks"]:
-                if periodic_snapshot_task["id"] in legacy_periodic_snapshot_tasks_ids:
-                    definition.setdefault("also-include-naming-schema", [])
-                    definition["also-include-naming-schema"].append(periodic_snapshot_task["naming_schema"])
-            if my_schedule is not None:
-                definition["schedule"] = zettarepl_schedule(my_schedule)
-            if replication_task["restrict_schedule"] is not None:
-                definition["restrict-schedule"] = zettarepl_schedule(replication_task["restrict_schedule"])
-            if replication_task["lifetime_value"] is not None and replication_task["lifetime_unit"] is not None:
-                definition["lifetime"] = lifetime_iso8601(replication_task["lifetime_value"],
-                                                          replication_task["lifetime_unit"])
-            if replication_task["compression"] is not None:
-                definition["compression"] = replication_task["compression"]
-            if replication_task["speed_limit"] is not None:
-                definition["speed-limit"] = replication_task["speed_limit"]
-
-            replication_tasks[f"task_{replication_task['id']}"] = definition
-
-        definition = {
-            "timezone": timezone,
-            "periodic-snapshot-tasks": periodic_snapshot_tasks,
-            "replication-tasks": replication_tasks,
+        for id in ids:
+            if id in periodic_snapshot_tasks:
+                builder.set_periodic_snapshot_task(periodic_snapshot_tasks[id])
+            else:
+                builder.remove_periodic_snapshot_task(id)
+
+        # Replication tasks definitions include their periodic snapshot tasks (and whether they are legacy)
+        replication_tasks_ids = builder.replication_tasks_using(ids)
+        if replication_tasks_ids:
+            return await self._update_replication_tasks(builder, replication_tasks_ids)
+
+        return builder
+
+    async def _update_replication_tasks(self, builder, ids):
+        ids = list(ids)
+
+        replication_tasks = {
+            replication_task["id"]: replication_task
+            for replication_task in await self.middleware.call("replication.query", [["id", "in", ids]],
+                                                               {"extra": {"job_state": False}})
         }
 
-        # Test if does not cause exceptions
-        Definition.from_data(definition, raise_on_error=False)
+        legacy_replication_tasks_ids = {replication_task["id"]
+                                        for replication_task in self.legacy_replication_tasks or []}
+        if any(
+            id in legacy_replication_tasks_ids or replication_tasks.get(id, {}).get("transport") == "LEGACY"
+            for id in ids
+        ):
+            # Legacy replication tasks define which periodic snapshot tasks are legacy
+            return await self._build_definition()
+
+        transports = {}
+        for id in ids:
+            if id in replication_tasks:
+                builder.set_replication_task(
+                    replication_tasks[id], await self._replication_task_transport(replication_tasks[id], transports),
+                )
+            else:
+                builder.remove_replication_task(id)
 
-        return definition, hold_tasks
+        return builder
 
-    def _hold_task_reason(self, pools, dataset):
-        pool = dataset.split("/")[0]
+    async def _replication_task_transport(self, replication_task, transports):
+        if replication_task["transport"] == "LEGACY" or not replication_task["enabled"]:
+            return None
 
-        if pool not in pools:
-            return f"Pool {pool} does not exist"
+        # Many replication tasks usually share a few SSH credentials
+        key = (
+            replication_task["transport"],
+            (replication_task["ssh_credentials"] or {}).get("id"),
+            replication_task["netcat_active_side"],
+            replication_task["netcat_active_side_listen_address"],
+            replication_task["netcat_active_side_port_min"],
+            replication_task["netcat_active_side_port_max"],
+            replication_task["netcat_passive_side_connect_address"],
+        )
+        if key not in transports:
+            transports[key] = await self._define_transport(*key)
 
-        if pools[pool]["status"] == "OFFLINE":
-            return f"Pool {pool} is offline"
+        return transports[key]
 
-        if not pools[pool]["is_decrypted"]:
-            return f"Pool {pool} is locked"
+    async def _pools(self):
+        return {pool["name"]: pool for pool in await self.middleware.call("pool.query")}
 
     @asynccontextmanager
     async def _get_zettarepl_shell(self, transport, ssh_credentials):
@@ -785,7 +1053,11 @@ class ZettareplService(Service):
 
 
 async def pool_configuration_change(middleware, *args, **kwargs):
-    await middleware.call("zettarepl.update_tasks")
+    await middleware.call("zettarepl.update_pools")
+
+
+# Loading replication state and starting zettarepl does not depend on other plugins
+setup_depends = ['system']
 
 
 async def setup(middleware):
@@ -14,7 +14,7 @@ from middlewared.alert.base import (
 )
 from middlewared.schema import Dict, List, Str, Bool, accepts
 from middlewared.service import (
-    CallError, CRUDService, ValidationError, ValidationErrors, filterable, job,
+    CallError, CRUDService, ValidationError, ValidationErrors, filterable, job, process_pool_lane,
 )
 from middlewared.utils import filter_list, filter_getattrs, start_daemon_thread
 from middlewared.validators import ReplicationSnapshotNamingSchema
@@ -424,6 +424,7 @@ class ZFSDatasetService(CRUDService):
         return sum([[deepcopy(ds)] + self.flatten_datasets(ds['children']) for ds in datasets], [])
 
     @filterable
+    @process_pool_lane('long')
     def query(self, filters=None, options=None):
         """
         In `query-options` we can provide `extra` arguments which control which data should be retrieved
@@ -669,6 +670,7 @@ class ZFSSnapshot(CRUDService):
         process_pool = True
 
     @filterable
+    @process_pool_lane('long')
     def query(self, filters=None, options=None):
         """
         Query all ZFS Snapshots with `query-filters` and `query-options`.
@@ -0,0 +1,159 @@
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from middlewared.plugins.cache import (
+    approximate_size, CacheService, LRUCache, CACHE_MAX_ENTRIES, CACHE_NAMESPACE_DEFAULT,
+    CACHE_NAMESPACE_DSCACHE, CACHE_NAMESPACE_STATE,
+)
+
+
+def test__lru_cache__evicts_least_recently_used():
+    cache = LRUCache("test", max_entries=3)
+    for key in "abc":
+        cache.put(key, key)
+
+    cache.get("a")
+    cache.put("d", "d")
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert sorted(cache.entries.keys()) == ["a", "c", "d"]
+    assert cache.evictions == 1
+
+
+def test__lru_cache__evicts_by_size():
+    cache = LRUCache("test", max_bytes=approximate_size("x" * 1000) * 2)
+    cache.put("a", "x" * 1000)
+    cache.put("b", "x" * 1000)
+    cache.put("c", "x" * 1000)
+
+    assert sorted(cache.entries.keys()) == ["b", "c"]
+    assert cache.bytes == approximate_size("x" * 1000) * 2
+
+
+def test__lru_cache__keeps_oversized_entry():
+    cache = LRUCache("test", max_bytes=10)
+    cache.put("a", "x" * 1000)
+
+    assert cache.get("a") == "x" * 1000
+
+
+def test__lru_cache__expiration():
+    cache = LRUCache("test")
+    with patch("middlewared.plugins.cache.time.monotonic", Mock(return_value=100)):
+        cache.put("a", 1, 10)
+        cache.put("b", 2)
+
+    with patch("middlewared.plugins.cache.time.monotonic", Mock(return_value=111)):
+        with pytest.raises(KeyError):
+            cache.get("a")
+
+        assert cache.get("b") == 2
+
+    assert cache.__encode__()["expirations"] == 1
+    assert cache.__encode__()["misses"] == 1
+    assert cache.__encode__()["hits"] == 1
+
+
+def test__lru_cache__evict_expired():
+    cache = LRUCache("test")
+    with patch("middlewared.plugins.cache.time.monotonic", Mock(return_value=100)):
+        cache.put("a", "x" * 100, 10)
+        cache.put("b", 2)
+
+    with patch("middlewared.plugins.cache.time.monotonic", Mock(return_value=111)):
+        cache.evict_expired()
+
+    assert list(cache.entries.keys()) == ["b"]
+    assert cache.bytes == approximate_size(2)
+
+
+@pytest.mark.timeout(30)
+def test__lru_cache__get_or_put_single_flight():
+    cache = LRUCache("test")
+    calls = []
+    results = []
+
+    def method():
+        calls.append(None)
+        time.sleep(0.2)
+        return "value"
+
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_put("key", 0, method)))
+        for i in range(50)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ["value"] * 50
+    assert cache.loads == 1
+    assert cache.coalesced + cache.hits == 49
+    assert cache.loading == {}
+
+
+@pytest.mark.timeout(30)
+def test__lru_cache__get_or_put_error_is_shared():
+    cache = LRUCache("test")
+    errors = []
+
+    def method():
+        time.sleep(0.2)
+        raise ValueError("error")
+
+    def target():
+        try:
+            cache.get_or_put("key", 0, method)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=target) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 5
+    assert "key" not in cache
+    assert cache.loading == {}
+    assert cache.get_or_put("key", 0, lambda: 1) == 1
+
+
+def test__cache_service__namespaces():
+    cache = CacheService(Mock())
+    cache.put("key", 1)
+    cache.put("key", 2, 0, "other")
+
+    assert cache.get("key") == 1
+    assert cache.get("key", "other") == 2
+    assert cache.pop("key", "other") == 2
+    assert not cache.has_key("key", "other")  # noqa: W601
+    assert {i["namespace"]: i["entries"] for i in cache.stats()} == {"default": 1, "other": 0}
+
+
+def test__cache_service__unbounded_namespaces():
+    cache = CacheService(Mock())
+    cache.put("update.applied", True, 0, CACHE_NAMESPACE_STATE)
+    cache.put("AD_cache", {"users": {}, "groups": {}}, 0, CACHE_NAMESPACE_DSCACHE)
+    for i in range(CACHE_MAX_ENTRIES + 1):
+        cache.put(f"key{i}", "x" * 1000)
+        cache.put(f"key{i}", "x" * 1000, 0, CACHE_NAMESPACE_STATE)
+        cache.put(f"key{i}", "x" * 1000, 0, CACHE_NAMESPACE_DSCACHE)
+
+    assert cache.get("update.applied", CACHE_NAMESPACE_STATE) is True
+    assert cache.get("AD_cache", CACHE_NAMESPACE_DSCACHE) == {"users": {}, "groups": {}}
+
+    stats = {i["namespace"]: i for i in cache.stats()}
+    assert stats[CACHE_NAMESPACE_DEFAULT]["evictions"] == 1
+    assert stats[CACHE_NAMESPACE_DEFAULT]["max_entries"] == CACHE_MAX_ENTRIES
+    assert stats[CACHE_NAMESPACE_DEFAULT]["bytes"] > 0
+    for namespace in (CACHE_NAMESPACE_STATE, CACHE_NAMESPACE_DSCACHE):
+        assert stats[namespace]["evictions"] == 0
+        # Sizes of values are not computed for unbounded namespaces
+        assert stats[namespace]["bytes"] == 0
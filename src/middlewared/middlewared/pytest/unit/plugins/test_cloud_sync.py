@@ -1,8 +1,16 @@
-from unittest.mock import Mock
+import asyncio
+import io
+import json
+import subprocess
+from unittest.mock import Mock, patch
 
 import pytest
 
-from middlewared.plugins.cloud_sync import get_dataset_recursive, FsLockManager, lsjson_error_excerpt
+from middlewared.plugins.cloud_sync import (
+    get_dataset_recursive, FsLockManager, lsjson_error_excerpt, rclone_check_progress, RcloneStats,
+    read_transfer_summaries, write_transfer_summary,
+)
+from middlewared.utils import Popen
 
 
 def test__get_dataset_recursive_1():
@@ -203,3 +211,130 @@ def test__fs_lock_manager_3():
 ])
 def test__lsjson_error_excerpt(error, excerpt):
     assert lsjson_error_excerpt(error) == excerpt
+
+
+def rclone_stats(bytes, transfers, elapsed, transferring):
+    return {
+        "bytes": bytes, "checks": 0, "deletedDirs": 0, "deletes": 0, "elapsedTime": elapsed, "errors": 0,
+        "eta": 1, "fatalError": False, "renames": 0, "retryError": False, "speed": 5242880,
+        "totalBytes": 20971520, "totalChecks": 0, "totalTransfers": 3, "transferTime": elapsed,
+        "transferring": transferring, "transfers": transfers,
+    }
+
+
+def rclone_transfer(name, size, bytes):
+    return {"bytes": bytes, "eta": 1, "group": "global_stats", "name": name, "percentage": int(bytes * 100 / size),
+            "size": size, "speed": 5242880, "speedAvg": 4194304}
+
+
+# Recorded `rclone -v --stats 1s --use-json-log sync` output (stats `msg` shortened)
+RCLONE_OUTPUT = [
+    {"level": "info", "msg": "Transferred: 0 / 20 MBytes, 0%", "source": "accounting/stats.go:395",
+     "stats": rclone_stats(0, 0, 0.5, [rclone_transfer("big.bin", 10485760, 0)]),
+     "time": "2020-10-20T12:00:00.500000+00:00"},
+    {"level": "info", "msg": "Copied (new)", "object": "small.txt", "objectType": "*local.Object",
+     "source": "operations/operations.go:440", "time": "2020-10-20T12:00:00.700000+00:00"},
+    {"level": "info", "msg": "Transferred: 5 / 20 MBytes, 25%", "source": "accounting/stats.go:395",
+     "stats": rclone_stats(5242880, 1, 1.0, [rclone_transfer("big.bin", 10485760, 5242880)]),
+     "time": "2020-10-20T12:00:01.000000+00:00"},
+    {"level": "error", "msg": "Failed to copy: failed to open source object: path/restricted_content/",
+     "object": "restricted.pdf", "objectType": "*dropbox.Object", "source": "operations/copy.go:290",
+     "time": "2020-10-20T12:00:01.500000+00:00"},
+    {"level": "info", "msg": "Copied (new)", "object": "big.bin", "objectType": "*local.Object",
+     "source": "operations/operations.go:440", "time": "2020-10-20T12:00:02.000000+00:00"},
+    {"level": "info", "msg": "Transferred: 20 / 20 MBytes, 100%", "source": "accounting/stats.go:395",
+     "stats": rclone_stats(20971520, 2, 2.0, []),
+     "time": "2020-10-20T12:00:02.000000+00:00"},
+]
+
+
+@pytest.fixture()
+def fake_rclone(tmpdir):
+    output = tmpdir / "rclone.log"
+    output.write("".join(json.dumps(record) + "\n" for record in RCLONE_OUTPUT) + "panic: not a log record\n")
+
+    rclone = tmpdir / "rclone"
+    rclone.write(f"#!/bin/sh\ncat {output} >&2\n")
+    rclone.chmod(0o755)
+
+    return str(rclone)
+
+
+def run_check_progress(rclone, stats, **kwargs):
+    job = Mock(internal_data={}, logs_fd=io.BytesIO())
+
+    async def run():
+        proc = await Popen([rclone], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        await rclone_check_progress(job, proc, stats, **kwargs)
+        await proc.wait()
+
+    asyncio.get_event_loop().run_until_complete(run())
+    return job
+
+
+def test__rclone_stats():
+    stats = RcloneStats()
+    for record in RCLONE_OUTPUT:
+        stats.feed(record)
+
+    assert stats.progress() == (100, "20.00 MiB / 20.00 MiB, 5.00 MiB/s, 2 / 3 files, ETA 1s")
+    summary = stats.summary()
+    assert summary["bytes"] == 20971520
+    assert summary["transfers"] == 2
+    assert summary["average_speed"] == 10485760
+    assert summary["files"] == [
+        {"name": "small.txt", "action": "Copied (new)", "size": None, "speed": None},
+        {"name": "big.bin", "action": "Copied (new)", "size": 10485760, "speed": 4194304},
+    ]
+    assert summary["error_messages"] == [
+        {"name": "restricted.pdf", "message": "Failed to copy: failed to open source object: path/restricted_content/"},
+    ]
+    # Job result only carries counters
+    assert stats.counters() == {k: v for k, v in summary.items() if k not in ("files", "files_omitted", "error_messages")}
+
+
+def test__rclone_stats__files_limit():
+    stats = RcloneStats()
+    stats.FILES_LIMIT = 1
+    for record in RCLONE_OUTPUT:
+        stats.feed(record)
+
+    assert [file["name"] for file in stats.summary()["files"]] == ["small.txt"]
+    assert stats.summary()["files_omitted"] == 1
+
+
+@pytest.mark.timeout(30)
+def test__rclone_check_progress(fake_rclone):
+    stats = RcloneStats()
+    job = run_check_progress(fake_rclone, stats, progress_interval=0)
+
+    assert [call[0][0] for call in job.set_progress.call_args_list] == [0, 25, 100]
+    assert job.internal_data["dropbox__restricted_content"] is True
+
+    logs = job.logs_fd.getvalue().decode()
+    assert "2020-10-20T12:00:00.700000+00:00 INFO  : small.txt: Copied (new)\n" in logs
+    assert "panic: not a log record\n" in logs
+    assert "Dropbox sync failed due to restricted content" in logs
+
+
+@pytest.mark.timeout(30)
+def test__rclone_check_progress__rate_limited(fake_rclone):
+    stats = RcloneStats()
+    job = run_check_progress(fake_rclone, stats, progress_interval=3600)
+
+    # First stats record and the final state only
+    assert [call[0][0] for call in job.set_progress.call_args_list] == [0, 100]
+    assert len(stats.files) == 2
+
+
+def test__transfer_summaries(tmpdir):
+    with patch("middlewared.plugins.cloud_sync.TRANSFER_SUMMARIES_PATH", str(tmpdir / "cloudsync")):
+        with patch("middlewared.plugins.cloud_sync.TRANSFER_SUMMARIES_KEEP", 2):
+            assert read_transfer_summaries(1) == []
+
+            for i in range(3):
+                write_transfer_summary(1, {"job_id": i})
+            write_transfer_summary(2, {"job_id": 10})
+
+            assert read_transfer_summaries(1) == [{"job_id": 2}, {"job_id": 1}]
+            assert read_transfer_summaries(2) == [{"job_id": 10}]
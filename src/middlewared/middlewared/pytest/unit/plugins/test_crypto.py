@@ -0,0 +1,133 @@
+import datetime
+from unittest.mock import Mock, patch
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from OpenSSL import crypto
+import pytest
+
+from middlewared.plugins.crypto import (
+    CA_TYPE_INTERMEDIATE, CA_TYPE_INTERNAL, CERT_TYPE_INTERNAL, CertificateService, CryptoKeyService,
+)
+
+CERTIFICATES_COUNT = 500
+
+
+def generate_certificate(common_name, key, issuer_name, issuer_key, serial):
+    now = datetime.datetime.utcnow()
+    certificate = x509.CertificateBuilder().subject_name(
+        x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    ).issuer_name(
+        issuer_name
+    ).public_key(
+        key.public_key()
+    ).serial_number(
+        serial
+    ).not_valid_before(
+        now
+    ).not_valid_after(
+        now + datetime.timedelta(days=365)
+    ).sign(issuer_key, hashes.SHA256(), default_backend())
+    return certificate.public_bytes(serialization.Encoding.PEM).decode()
+
+
+def row(id, name, type, certificate, signedby=None):
+    return {
+        "id": id,
+        "name": name,
+        "type": type,
+        "certificate": certificate,
+        "privatekey": None,
+        "CSR": None,
+        "signedby": signedby,
+        "acme": None,
+    }
+
+
+@pytest.fixture(scope="module")
+def pki():
+    root_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    root_name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "root")])
+    intermediate_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    intermediate_name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "intermediate")])
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+
+    root = row(1, "root", CA_TYPE_INTERNAL, generate_certificate("root", root_key, root_name, root_key, 1))
+    intermediate = row(2, "intermediate", CA_TYPE_INTERMEDIATE,
+                       generate_certificate("intermediate", intermediate_key, root_name, root_key, 2), {"id": 1})
+    certificates = [
+        row(i, f"cert{i}", CERT_TYPE_INTERNAL,
+            generate_certificate(f"cert{i}", key, intermediate_name, intermediate_key, 100 + i), {"id": 2})
+        for i in range(1, CERTIFICATES_COUNT + 1)
+    ]
+    return [root, intermediate], certificates
+
+
+@pytest.mark.asyncio
+async def test__cert_extend__resolves_chain_from_context(pki):
+    cas, certificates = pki
+
+    middleware = Mock()
+    cryptokey = CryptoKeyService(middleware)
+    datastore_queries = []
+
+    async def call(method, *args):
+        if method == "datastore.query":
+            datastore_queries.append(args[0])
+            return {
+                "system.certificateauthority": cas,
+                "system.certificate": certificates,
+            }[args[0]]
+
+        return getattr(cryptokey, method.split(".")[1])(*args)
+
+    middleware.call = call
+
+    service = CertificateService(middleware)
+    with patch.object(cryptokey, "parse_certificate", wraps=cryptokey.parse_certificate) as parse_certificate:
+        with patch("middlewared.plugins.crypto.os.makedirs"):
+            context = await service.cert_extend_context()
+            extended = [await service.cert_extend(dict(certificate), context) for certificate in certificates]
+            extended_cas = [await service.cert_extend(dict(ca), context) for ca in cas]
+
+    # Each certificate authority is fetched once no matter how many certificates it signed
+    assert datastore_queries == ["system.certificateauthority", "system.certificate"]
+    # Each PEM is parsed once
+    assert parse_certificate.call_count == CERTIFICATES_COUNT + len(cas)
+
+    cert = extended[0]
+    assert cert["common"] == "cert1"
+    assert cert["signedby"]["name"] == "intermediate"
+    assert cert["signedby"]["signedby"]["name"] == "root"
+    assert cert["chain_list"] == [certificates[0]["certificate"], cas[1]["certificate"], cas[0]["certificate"]]
+    assert cert["parsed"]
+
+    # Results do not share signing CA dicts
+    assert cert["signedby"] is not extended[1]["signedby"]
+
+    assert [ca["signed_certificates"] for ca in extended_cas] == [0, CERTIFICATES_COUNT]
+
+
+def test__load_certificate__cached(pki):
+    cas, certificates = pki
+
+    cryptokey = CryptoKeyService(Mock())
+    with patch("middlewared.plugins.crypto.crypto.load_certificate", wraps=crypto.load_certificate) as load_certificate:
+        first = cryptokey.load_certificate(certificates[0]["certificate"])
+        first["san"].append("DNS:modified")
+        second = cryptokey.load_certificate(certificates[0]["certificate"])
+
+    assert load_certificate.call_count == 1
+    assert second["common"] == "cert1"
+    assert second["san"] == []
+    assert second["from"] and second["until"]
+
+
+def test__load_certificate__invalid():
+    cryptokey = CryptoKeyService(Mock())
+
+    assert cryptokey.load_certificate("invalid") == {}
+    assert cryptokey.load_certificate("invalid") == {}
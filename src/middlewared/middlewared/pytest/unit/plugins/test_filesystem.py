@@ -0,0 +1,98 @@
+import io
+import os
+import threading
+from unittest.mock import call, Mock, patch
+
+import pytest
+
+from middlewared.plugins.filesystem import FilesystemService
+
+PERMS = ["READ_DATA", "WRITE_DATA", "APPEND_DATA", "READ_NAMED_ATTRS", "WRITE_NAMED_ATTRS", "EXECUTE", "DELETE_CHILD",
+         "READ_ATTRIBUTES", "WRITE_ATTRIBUTES", "DELETE", "READ_ACL", "WRITE_ACL", "WRITE_OWNER", "SYNCHRONIZE"]
+FLAGS = ["FILE_INHERIT", "DIRECTORY_INHERIT", "NO_PROPAGATE_INHERIT", "INHERIT_ONLY", "INHERITED"]
+
+
+class FakeACL:
+    """
+    `bsd.acl.ACL` that keeps ACLs in memory (tmpfs does not support NFSv4 ACLs)
+    """
+
+    acls = {}
+    applied = []
+
+    def __init__(self, file=None, fd=None):
+        self.entries = [] if file is None and fd is None else list(self.acls.get(self._key(file, fd), []))
+
+    def __getstate__(self):
+        return self.entries
+
+    def __setstate__(self, entries):
+        if not entries:
+            raise OSError("Invalid argument")
+
+        self.entries = entries
+
+    def strip(self):
+        self.entries = []
+
+    def apply(self, file=None, fd=None):
+        self.acls[self._key(file, fd)] = self.entries
+        self.applied.append((self._key(file, fd), self.entries))
+
+    def _key(self, file, fd):
+        st = os.stat(file) if fd is None else os.fstat(fd)
+        return st.st_dev, st.st_ino
+
+
+@pytest.fixture()
+def tree(tmpdir):
+    for i in range(3):
+        (tmpdir / f"dir{i}").mkdir()
+        for j in range(3):
+            (tmpdir / f"dir{i}" / f"file{j}").write("")
+
+    return str(tmpdir)
+
+
+@pytest.fixture()
+def service():
+    with patch.object(FilesystemService, "_common_perm_path_validate", Mock()):
+        yield FilesystemService(Mock())
+
+
+def job():
+    return Mock(aborted=threading.Event(), logs_fd=io.BytesIO())
+
+
+def test__filesystem_chown__recursive_changes_root(service, tree):
+    uid, gid = os.getuid(), os.getgid()
+
+    with patch("os.chown", wraps=os.chown) as chown:
+        service.chown(job(), {"path": tree, "uid": uid, "gid": gid, "options": {"recursive": True}})
+
+    assert call(tree, uid, gid) in chown.call_args_list
+    # Root and 3 directories with 3 files each
+    assert chown.call_count == 1 + 3 + 3 * 3
+
+
+def test__filesystem_setacl__recursive_without_inheritable_entries(service, tree):
+    FakeACL.acls = {}
+    FakeACL.applied = []
+
+    dacl = [
+        {
+            "tag": tag,
+            "id": None,
+            "type": "ALLOW",
+            "perms": {perm: tag == "owner@" for perm in PERMS},
+            "flags": {flag: False for flag in FLAGS},
+        }
+        for tag in ("owner@", "everyone@")
+    ]
+
+    with patch("middlewared.plugins.filesystem.acl.ACL", FakeACL):
+        service.setacl(job(), {"path": tree, "dacl": dacl, "options": {"recursive": True}})
+
+    # Descendants inherit nothing so their ACLs are stripped instead of failing on an empty ACL
+    assert len(FakeACL.applied) == 1 + 3 + 3 * 3
+    assert all(entries == [] for key, entries in FakeACL.applied[1:])
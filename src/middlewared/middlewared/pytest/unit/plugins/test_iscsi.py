@@ -0,0 +1,164 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from middlewared.plugins.iscsi import iSCSITargetExtentService, iSCSITargetService
+from middlewared.pytest.unit.middleware import Middleware
+
+
+class Datastore:
+    """
+    `datastore.query` of `services.iscsitargetgroups` backed by a sqlite database, counting round trips
+    """
+
+    def __init__(self, targets, groups_per_target=2):
+        self.db = sqlite3.connect(":memory:")
+        self.db.executescript("""
+            CREATE TABLE services_iscsitarget (id INTEGER PRIMARY KEY, iscsi_target_name VARCHAR(120));
+            CREATE TABLE services_iscsitargetgroups (
+                id INTEGER PRIMARY KEY,
+                iscsi_target_id INTEGER REFERENCES services_iscsitarget (id),
+                iscsi_target_portalgroup_id INTEGER,
+                iscsi_target_initiatorgroup_id INTEGER,
+                iscsi_target_authtype VARCHAR(120),
+                iscsi_target_authgroup INTEGER,
+                iscsi_target_initialdigest VARCHAR(120)
+            );
+            CREATE INDEX services_iscsitargetgroups_target ON services_iscsitargetgroups (iscsi_target_id);
+        """)
+        for i in range(1, targets + 1):
+            self.db.execute("INSERT INTO services_iscsitarget VALUES (?, ?)", (i, f"target{i}"))
+            for j in range(groups_per_target):
+                self.db.execute(
+                    "INSERT INTO services_iscsitargetgroups VALUES (NULL, ?, ?, ?, 'CHAP', 1, 'Auto')",
+                    (i, j + 1, None if j else 1),
+                )
+        self.db.commit()
+        self.queries = 0
+
+    def query(self, name, filters=None, options=None):
+        assert name == "services.iscsitargetgroups"
+        self.queries += 1
+
+        sql = """
+            SELECT g.id, t.id, t.iscsi_target_name, g.iscsi_target_portalgroup_id, g.iscsi_target_initiatorgroup_id,
+                   g.iscsi_target_authtype, g.iscsi_target_authgroup, g.iscsi_target_initialdigest
+            FROM services_iscsitargetgroups g
+            LEFT JOIN services_iscsitarget t ON t.id = g.iscsi_target_id
+        """
+        args = ()
+        if filters:
+            assert filters == [("iscsi_target", "=", filters[0][2])]
+            sql += " WHERE g.iscsi_target_id = ?"
+            args = (filters[0][2],)
+
+        return [
+            {
+                "id": id,
+                "iscsi_target": {"id": target_id, "iscsi_target_name": target_name},
+                "iscsi_target_portalgroup": {"id": portal} if portal else None,
+                "iscsi_target_initiatorgroup": {"id": initiator} if initiator else None,
+                "iscsi_target_authtype": authtype,
+                "iscsi_target_authgroup": authgroup,
+                "iscsi_target_initialdigest": initialdigest,
+            }
+            for id, target_id, target_name, portal, initiator, authtype, authgroup, initialdigest in self.db.execute(
+                sql + " ORDER BY g.id", args,
+            )
+        ]
+
+
+def targets(count):
+    return [{"id": i, "name": f"target{i}", "alias": None, "mode": "iscsi"} for i in range(1, count + 1)]
+
+
+def extend_all(service, rows):
+    async def run():
+        context = await service.extend_context()
+        return [await service.extend(dict(row), context) for row in rows]
+
+    return asyncio.get_event_loop().run_until_complete(run())
+
+
+def test__iscsi_target__extend_context():
+    datastore = Datastore(3)
+    m = Middleware()
+    m["datastore.query"] = datastore.query
+
+    result = extend_all(iSCSITargetService(m), targets(3) + [{"id": 4, "name": "target4", "mode": "fc"}])
+
+    assert datastore.queries == 1
+    assert result[1] == {
+        "id": 2,
+        "name": "target2",
+        "alias": None,
+        "mode": "ISCSI",
+        "groups": [
+            {"portal": 1, "initiator": 1, "auth": 1, "authmethod": "CHAP"},
+            {"portal": 2, "initiator": None, "auth": 1, "authmethod": "CHAP"},
+        ],
+    }
+    assert result[3]["groups"] == []
+
+
+def test__iscsi_extent__extend_context_queries_disks_once():
+    calls = []
+
+    def disk_query(filters=None, options=None):
+        calls.append(filters)
+        return [{"identifier": "{serial}1", "name": "da1"}]
+
+    m = Middleware()
+    m["disk.query"] = disk_query
+
+    result = extend_all(iSCSITargetExtentService(m), [
+        {"type": "DISK", "rpm": "SSD", "path": "{serial}1"},
+        {"type": "DISK", "rpm": "SSD", "path": "zvol/tank/vol"},
+        {"type": "FILE", "rpm": "SSD", "path": "/mnt/tank/file", "filesize": "2KB"},
+    ])
+
+    assert len(calls) == 1
+    assert [extent["disk"] for extent in result] == ["da1", "zvol/tank/vol", None]
+    assert result[2]["filesize"] == 2048
+
+
+@pytest.mark.timeout(120)
+def test__iscsi_target__extend_benchmark():
+    datastore = Datastore(1000)
+    m = Middleware()
+    m["datastore.query"] = datastore.query
+    service = iSCSITargetService(m)
+
+    def per_target():
+        # What `extend` used to do: a groups query for every target
+        async def run():
+            return [
+                await service.extend(target, {"groups": {target["id"]: await m.call(
+                    "datastore.query", "services.iscsitargetgroups", [("iscsi_target", "=", target["id"])],
+                )}})
+                for target in targets(1000)
+            ]
+
+        return asyncio.get_event_loop().run_until_complete(run())
+
+    def batched():
+        return extend_all(service, targets(1000))
+
+    def timed(f):
+        # Best of 5 so this does not fail on a loaded machine
+        timings = []
+        for attempt in range(5):
+            datastore.queries = 0
+            started = time.monotonic()
+            f()
+            timings.append(time.monotonic() - started)
+        return min(timings), datastore.queries
+
+    per_target_time, per_target_queries = timed(per_target)
+    batched_time, batched_queries = timed(batched)
+
+    assert per_target_queries == 1000
+    assert batched_queries == 1
+    assert batched_time < per_target_time
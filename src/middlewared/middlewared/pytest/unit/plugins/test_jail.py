@@ -0,0 +1,56 @@
+import textwrap
+from unittest.mock import Mock, patch
+
+from middlewared.plugins.jail import IOCAGE_SET_UP_CACHE_TTL, JailService, parse_ifconfig_inet, parse_jls
+
+
+JLS_OUTPUT = textwrap.dedent("""\
+    {"__version": "2", "jail-information": {"jail": [
+        {"jid":1,"hostname":"plex","path":"/mnt/tank/iocage/jails/plex/root","name":"ioc-plex","state":"ACTIVE",
+         "cpusetid":2,"ipv4_addrs":["192.168.0.10"],"ipv6_addrs":[]},
+        {"jid":3,"hostname":"nextcloud","path":"/mnt/tank/iocage/jails/nextcloud_1/root","name":"ioc-nextcloud_1",
+         "state":"ACTIVE","cpusetid":4,"ipv4_addrs":[],"ipv6_addrs":[]}
+    ]}}
+""")
+
+IFCONFIG_OUTPUT = textwrap.dedent("""\
+    epair0b: flags=8843<UP,BROADCAST,RUNNING,SIMPLEX,MULTICAST> metric 0 mtu 1500
+    \toptions=8<VLAN_MTU>
+    \tinet 192.168.0.127 netmask 0xffffff00 broadcast 192.168.0.255
+""")
+
+
+def test__parse_jls():
+    jails = parse_jls(JLS_OUTPUT)
+
+    assert sorted(jails.keys()) == ["ioc-nextcloud_1", "ioc-plex"]
+    assert jails["ioc-plex"]["jid"] == 1
+    assert jails["ioc-plex"]["ipv4_addrs"] == ["192.168.0.10"]
+    assert jails["ioc-nextcloud_1"]["jid"] == 3
+
+
+def test__parse_jls__no_jails():
+    assert parse_jls('{"__version": "2", "jail-information": {"jail": []}}') == {}
+
+
+def test__parse_ifconfig_inet():
+    assert parse_ifconfig_inet(IFCONFIG_OUTPUT) == "192.168.0.127"
+
+
+def test__jail_service__iocage_set_up_cache_expires():
+    middleware = Mock()
+    middleware.call_sync.return_value = []
+    service = JailService(middleware)
+
+    with patch("middlewared.plugins.jail.time.monotonic", Mock(return_value=0)):
+        assert service.iocage_set_up() is False
+
+    # Pool with iocage datasets imported without any hook (i.e. on failover)
+    middleware.call_sync.return_value = [{"name": "tank", "children": [{"name": "tank/iocage"}]}]
+    with patch("middlewared.plugins.jail.time.monotonic", Mock(return_value=IOCAGE_SET_UP_CACHE_TTL / 2)):
+        assert service.iocage_set_up() is False
+
+    with patch("middlewared.plugins.jail.time.monotonic", Mock(return_value=IOCAGE_SET_UP_CACHE_TTL + 1)):
+        assert service.iocage_set_up() is True
+
+    assert middleware.call_sync.call_count == 2
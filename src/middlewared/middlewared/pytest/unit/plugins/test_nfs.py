@@ -1,6 +1,11 @@
+import asyncio
+import time
+
 from mock import ANY, Mock, patch
+import pytest
 
-from middlewared.plugins.nfs import SharingNFSService
+from middlewared.plugins.nfs import ExportsIndex, HostnameCache, SharingNFSService, setup as nfs_setup
+from middlewared.pytest.unit.middleware import Middleware
 
 
 def test__sharing_nfs_service__validate_paths__same_filesystem():
@@ -147,3 +152,182 @@ def test__sharing_nfs_service__validate_hosts_and_networks__fs_is_already_export
         )
 
         verrors.add.assert_called_once_with("sharingnfs_update.networks", ANY)
+
+
+class FakeResolver:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, hostname):
+        self.calls.append(hostname)
+        await asyncio.sleep(self.delay)
+        if hostname.startswith("unknown"):
+            return None
+        return "10.%d.%d.%d" % tuple(map(int, hostname.split("-")[1:]))
+
+
+@pytest.mark.asyncio
+async def test__hostname_cache():
+    now = [0]
+    resolver = FakeResolver(delay=0.01)
+    cache = HostnameCache(resolver, ttl=300, negative_ttl=30, clock=lambda: now[0])
+
+    result = await asyncio.gather(cache.get("host-1-2-3"), cache.get("host-1-2-3"), cache.get("unknown"))
+    assert result == ["10.1.2.3", "10.1.2.3", None]
+    # Concurrent lookups of the same hostname are merged
+    assert resolver.calls == ["host-1-2-3", "unknown"]
+
+    now[0] = 60
+    assert await cache.get_many(["host-1-2-3", "unknown"]) == {"host-1-2-3": "10.1.2.3", "unknown": None}
+    # Negative result has expired
+    assert resolver.calls == ["host-1-2-3", "unknown", "unknown"]
+
+    now[0] = 400
+    await cache.get("host-1-2-3")
+    assert resolver.calls[-1] == "host-1-2-3"
+
+
+def test__exports_index():
+    shares = [
+        {"id": 1, "paths": ["/mnt/data/a"]},
+        {"id": 2, "paths": ["/mnt/data/b"]},
+        {"id": 3, "paths": ["/mnt/other"]},
+        {"id": 4, "paths": ["/mnt/missing"]},
+    ]
+
+    def stat(path):
+        return Mock(st_dev={"/mnt/data/a": 1, "/mnt/data/b": 1, "/mnt/other": 2}[path])
+
+    index = ExportsIndex(shares, stat)
+
+    assert [share["id"] for share in index.shares(1)] == [1, 2]
+    assert [share["id"] for share in index.shares(1, exclude_id=2)] == [1]
+    assert index.shares(3) == []
+
+
+def test__exports_index__retries_shares_that_failed_to_stat():
+    devices = {"/mnt/data/a": 1}
+
+    def stat(path):
+        return Mock(st_dev=devices[path])
+
+    index = ExportsIndex([{"id": 1, "paths": ["/mnt/data/a"]}, {"id": 2, "paths": ["/mnt/locked/b"]}], stat)
+    assert [share["id"] for share in index.shares(2)] == []
+
+    # Pool was unlocked
+    devices["/mnt/locked/b"] = 2
+    assert [share["id"] for share in index.shares(2)] == [2]
+    assert index.unresolved == []
+
+
+def test__sharing_nfs_service__validate_hosts_and_networks__does_not_stat():
+    def stat(path):
+        raise AssertionError("Candidate shares are already known to export the same dataset")
+
+    with patch("middlewared.plugins.nfs.os.stat", stat):
+        verrors = Mock()
+
+        SharingNFSService(Mock()).validate_hosts_and_networks(
+            [{"paths": ["/mnt/data/a"], "hosts": [], "networks": ["192.168.0.0/24"], "alldirs": False}],
+            {"paths": ["/mnt/data/b"], "hosts": [], "networks": ["192.168.0.0/24"], "alldirs": False},
+            "sharingnfs_update",
+            verrors,
+            {},
+        )
+
+        verrors.add.assert_called_once_with("sharingnfs_update.networks.0", ANY)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("hook", ["pool.post_lock", "pool.post_unlock", "pool.post_export"])
+async def test__sharing_nfs__pool_hooks_invalidate_exports_index(hook):
+    m = Middleware()
+    m["pool.dataset.register_attachment_delegate"] = Mock()
+    m.register_hook = Mock()
+    service = SharingNFSService(m)
+    service.exports_index = ExportsIndex([])
+    m["sharing.nfs.invalidate_exports_index"] = service.invalidate_exports_index
+
+    await nfs_setup(m)
+    hooks = {call[0][0]: call[0][1] for call in m.register_hook.call_args_list}
+    await hooks[hook](m, pool={"name": "tank"})
+
+    assert service.exports_index is None
+
+
+def fake_shares(count, devices, hosts_per_share):
+    return [
+        {
+            "id": i,
+            "paths": [f"/mnt/tank/dataset{i % devices}/share{i}"],
+            "hosts": [f"host-{i // 256}-{i % 256}-{j}" for j in range(hosts_per_share)],
+            "networks": [],
+            "alldirs": False,
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test__sharing_nfs_service__validation_benchmark():
+    count, devices = 200, 40
+    shares = fake_shares(count, devices, 3)
+
+    def stat(path):
+        return Mock(st_dev=int(path.split("/")[3][len("dataset"):]))
+
+    m = Middleware()
+    m["sharing.nfs.query"] = m._query_filter(shares)
+    service = SharingNFSService(m)
+    resolver = FakeResolver(delay=0.001)
+    service.hostname_cache = HostnameCache(resolver)
+
+    async def validate_naive(data, old):
+        # What `validate` used to do: resolve hostnames of all other shares on every edit
+        naive_resolver = FakeResolver(delay=0.001)
+        other_shares = [share for share in shares if share["id"] != old["id"]]
+        dns_cache = await HostnameCache(naive_resolver).get_many(
+            sum([share["hosts"] for share in other_shares], []) + data["hosts"]
+        )
+        verrors = Mock()
+        service.validate_hosts_and_networks(other_shares, data, "sharingnfs_update", verrors, dns_cache)
+        return verrors, len(naive_resolver.calls)
+
+    async def validate_indexed(data, old):
+        other_shares = await service.candidate_shares(data, old)
+        dns_cache = await service.resolve_hostnames(
+            sum([share["hosts"] for share in other_shares], []) + data["hosts"]
+        )
+        verrors = Mock()
+        service.validate_hosts_and_networks(other_shares, data, "sharingnfs_update", verrors, dns_cache)
+        return verrors
+
+    edits = [dict(shares[i], hosts=shares[i]["hosts"] + [shares[i + devices]["hosts"][0]]) for i in range(10)]
+
+    with patch("middlewared.plugins.nfs.os.stat", stat):
+        started = time.monotonic()
+        naive_calls = 0
+        for data in edits:
+            verrors, calls = await validate_naive(data, data)
+            naive_calls += calls
+            verrors.add.assert_called_once_with("sharingnfs_update.hosts.3", ANY)
+        naive_time = time.monotonic() - started
+
+        started = time.monotonic()
+        for data in edits:
+            verrors = await validate_indexed(data, data)
+            verrors.add.assert_called_once_with("sharingnfs_update.hosts.3", ANY)
+        indexed_time = time.monotonic() - started
+
+        # Validating the same edits again does not hit the resolver at all
+        indexed_calls = len(resolver.calls)
+        for data in edits:
+            await validate_indexed(data, data)
+        assert len(resolver.calls) == indexed_calls
+
+    # Only hosts of shares exporting the same dataset are resolved
+    assert naive_calls == len(edits) * count * 3
+    assert indexed_calls <= len(edits) * (count // devices) * 3
+    assert indexed_time < naive_time
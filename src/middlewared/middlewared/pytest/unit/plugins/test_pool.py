@@ -1,8 +1,9 @@
 import textwrap
+from unittest.mock import Mock
 
 import pytest
 
-from middlewared.plugins.pool import parse_lsof
+from middlewared.plugins.pool import parse_lsof, PoolService
 
 
 @pytest.mark.parametrize("lsof,dirs,result", [
@@ -41,3 +42,22 @@ from middlewared.plugins.pool import parse_lsof
 ])
 def test__parse_lsof(lsof, dirs, result):
     assert parse_lsof(lsof, dirs) == result
+
+
+@pytest.mark.asyncio
+async def test__pool__get_current_import_disk_job__ignores_history():
+    job = Mock(method="pool.import_disk")
+    job.__encode__ = Mock(return_value={"id": 5, "method": "pool.import_disk", "state": "SUCCESS"})
+    other = Mock(method="pool.export")
+    m = Mock()
+    m.jobs.all.return_value = {4: other, 5: job}
+    # Finished jobs from previous runs are only available through `core.get_jobs`
+    m.call.side_effect = AssertionError("core.get_jobs must not be called")
+
+    service = PoolService(m)
+    service.dismissed_import_disk_jobs = set()
+
+    assert (await service.get_current_import_disk_job())["id"] == 5
+
+    await service.dismiss_current_import_disk_job()
+    assert await service.get_current_import_disk_job() is None
@@ -0,0 +1,75 @@
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+
+from middlewared.plugins import pwenc
+
+
+@pytest.fixture()
+def secret_path(tmpdir):
+    path = str(tmpdir / "pwenc_secret")
+    with open(path, "wb") as f:
+        f.write(os.urandom(pwenc.PWENC_BLOCK_SIZE))
+
+    pwenc.reset_secret_cache()
+    with patch("middlewared.plugins.pwenc.PWENC_FILE_SECRET", path):
+        yield path
+    pwenc.reset_secret_cache()
+
+
+def test__pwenc__secret_is_cached(secret_path):
+    encrypted = pwenc.encrypt("password")
+
+    with patch("builtins.open", side_effect=AssertionError("Secret must not be read again")):
+        assert pwenc.decrypt(encrypted) == "password"
+
+
+def test__pwenc__secret_cache_is_invalidated_on_change(secret_path):
+    encrypted = pwenc.encrypt("password")
+
+    with open(secret_path, "wb") as f:
+        f.write(os.urandom(pwenc.PWENC_BLOCK_SIZE))
+    os.utime(secret_path, ns=(0, 0))
+
+    assert pwenc.decrypt(encrypted) != "password"
+    assert pwenc.decrypt(pwenc.encrypt("password")) == "password"
+
+
+def test__pwenc__decrypt_with_secret(secret_path):
+    encrypted = pwenc.encrypt("password")
+    secret = pwenc.PWEncService.get_secret()
+
+    with patch("middlewared.plugins.pwenc.PWEncService.get_secret", side_effect=AssertionError()):
+        assert pwenc.decrypt(encrypted, secret=secret) == "password"
+        assert pwenc.decrypt("", secret=secret) == ""
+
+
+def test__pwenc__bulk_decrypt_benchmark(secret_path):
+    # 200 disks `passwd` field
+    encrypted = [pwenc.encrypt(f"password{i}") for i in range(200)]
+
+    def read_secret():
+        with open(secret_path, "rb") as f:
+            return f.read()
+
+    def uncached():
+        # What every `pwenc.decrypt` call used to do (without the middleware call dispatch)
+        with patch("middlewared.plugins.pwenc.PWEncService.get_secret", read_secret):
+            return [pwenc.decrypt(value) for value in encrypted]
+
+    def bulk():
+        secret = pwenc.PWEncService.get_secret()
+        return [pwenc.decrypt(value, secret=secret) for value in encrypted]
+
+    def timed(f):
+        # Best of 5 so this does not fail on a loaded machine
+        timings = []
+        for attempt in range(5):
+            started = time.monotonic()
+            assert f() == [f"password{i}" for i in range(200)]
+            timings.append(time.monotonic() - started)
+        return min(timings)
+
+    assert timed(bulk) < timed(uncached)
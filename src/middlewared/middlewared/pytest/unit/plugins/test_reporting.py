@@ -0,0 +1,69 @@
+import json
+import subprocess
+from unittest.mock import Mock, patch
+
+from middlewared.plugins.reporting import export_batch, prefix_rrd_args, RRD_PLUGINS
+
+
+def test__prefix_rrd_args():
+    assert prefix_rrd_args([
+        "DEF:if_octets_rx=/var/db/collectd/rrd/localhost/interface-em0/if_octets.rrd:rx:AVERAGE",
+        "DEF:if_octets_tx=/var/db/collectd/rrd/localhost/interface-em0/if_octets.rrd:tx:AVERAGE",
+        "CDEF:cif_octets_rx=if_octets_rx,8,*",
+        "CDEF:overlap=cif_octets_rx,if_octets_tx,LT,cif_octets_rx,if_octets_tx,IF",
+        "XPORT:cif_octets_rx:if_octets_rx",
+        "XPORT:overlap:overlap",
+    ], "g1_") == [
+        "DEF:g1_if_octets_rx=/var/db/collectd/rrd/localhost/interface-em0/if_octets.rrd:rx:AVERAGE",
+        "DEF:g1_if_octets_tx=/var/db/collectd/rrd/localhost/interface-em0/if_octets.rrd:tx:AVERAGE",
+        "CDEF:g1_cif_octets_rx=g1_if_octets_rx,8,*",
+        "CDEF:g1_overlap=g1_cif_octets_rx,g1_if_octets_tx,LT,g1_cif_octets_rx,g1_if_octets_tx,IF",
+        "XPORT:g1_cif_octets_rx:if_octets_rx",
+        "XPORT:g1_overlap:overlap",
+    ]
+
+
+def test__export_batch():
+    middleware = Mock()
+    load = RRD_PLUGINS["load"](middleware)
+    uptime = RRD_PLUGINS["uptime"](middleware)
+
+    xport = {
+        "meta": {
+            "start": 1000,
+            "end": 1020,
+            "step": 10,
+            "legend": ["shortterm", "midterm", "longterm", "uptime"],
+        },
+        "data": [
+            [1.0, 2.0, 3.0, 100],
+            [3.0, None, 1.0, 110],
+        ],
+    }
+
+    with patch("middlewared.plugins.reporting.subprocess.run") as run:
+        run.return_value = subprocess.CompletedProcess([], 0, json.dumps(xport).encode(), b"")
+
+        load_data, uptime_data = export_batch([(load, None), (uptime, None)], "end-1h", "now")
+
+    assert run.call_count == 1
+    assert [arg for arg in run.call_args[0][0] if arg.startswith("XPORT:")] == [
+        "XPORT:g0_load_shortterm:load_shortterm",
+        "XPORT:g0_load_midterm:load_midterm",
+        "XPORT:g0_load_longterm:load_longterm",
+        "XPORT:g1_cuptime_value:uptime_value",
+    ]
+
+    assert load_data["name"] == "load"
+    assert load_data["legend"] == ["shortterm", "midterm", "longterm"]
+    assert load_data["data"] == [[1.0, 2.0, 3.0], [3.0, None, 1.0]]
+    assert load_data["aggregations"] == {
+        "min": [1.0, 2.0, 1.0],
+        "mean": [2.0, 2.0, 2.0],
+        "max": [3.0, 2.0, 3.0],
+    }
+
+    assert uptime_data["name"] == "uptime"
+    assert uptime_data["legend"] == ["uptime"]
+    assert uptime_data["data"] == [[100], [110]]
+    assert uptime_data["step"] == 10
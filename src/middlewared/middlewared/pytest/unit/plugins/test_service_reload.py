@@ -0,0 +1,176 @@
+import asyncio
+import os
+import textwrap
+from unittest.mock import patch
+
+from asynctest import CoroutineMock, Mock
+import pytest
+
+from middlewared.plugins.service import Coalescer, ServiceService
+from middlewared.pytest.unit.middleware import Middleware
+from middlewared.schema import resolve_methods, Schemas
+from middlewared.service import CoreService, CRUDService
+
+
+class AsyncMiddleware(Middleware):
+    async def call(self, name, *args):
+        result = self[name](*args)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+
+class ShareService(CRUDService):
+    async def create(self, data):
+        await self._service_change("fakesvc", "reload")
+        return data
+
+
+@pytest.fixture()
+def rc(tmpdir):
+    """
+    Fake `service(8)` with a fake rc script that logs its invocations.
+    """
+    log = str(tmpdir / "log")
+    script = str(tmpdir / "fakesvc")
+    with open(script, "w") as f:
+        f.write(textwrap.dedent(f"""\
+            #!/bin/sh
+            echo "$1" >> {log}
+            sleep 0.2
+        """))
+    os.chmod(script, 0o755)
+
+    def invocations():
+        if not os.path.exists(log):
+            return []
+        with open(log) as f:
+            return f.read().split()
+
+    real_system = ServiceService._system
+
+    async def _system(self, cmd):
+        return await real_system(self, cmd.replace("/usr/sbin/service fakesvc", script))
+
+    with patch.object(ServiceService, "_system", _system):
+        with patch.object(ServiceService, "started", CoroutineMock(return_value=True)):
+            yield invocations
+
+
+@pytest.fixture()
+def middleware():
+    m = AsyncMiddleware()
+    service = ServiceService(m)
+    resolve_methods(Schemas(), [service.start, service.reload, service.restart])
+    m["service.reload"] = service.reload
+    m["service.restart"] = service.restart
+    m["service.query"] = Mock(return_value={"state": "RUNNING"})
+    m["etc.generate"] = Mock()
+    m["share.create"] = ShareService(m).create
+    return m
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.asyncio
+async def test__service_reload__concurrent_requests_are_merged(rc, middleware):
+    results = await asyncio.gather(*[middleware.call("service.reload", "fakesvc", {}) for i in range(20)])
+
+    assert results == [True] * 20
+    assert rc() == ["onereload"]
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.asyncio
+async def test__service_reload__not_delayed_outside_of_scope(rc, middleware):
+    with patch("middlewared.plugins.service.RELOAD_DEBOUNCE", 60):
+        assert await asyncio.wait_for(middleware.call("service.reload", "fakesvc", {}), 10) is True
+
+    assert rc() == ["onereload"]
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.asyncio
+async def test__service_reload__request_during_reload_runs_again(rc, middleware):
+    first = asyncio.ensure_future(middleware.call("service.reload", "fakesvc", {}))
+    await asyncio.sleep(0.2)
+    # First reload is running and might have missed the change that caused these requests
+    await asyncio.gather(*[middleware.call("service.reload", "fakesvc", {}) for i in range(5)])
+    await first
+
+    assert rc() == ["onereload", "onereload"]
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.asyncio
+async def test__core_bulk__service_changes_are_applied_once(rc, middleware):
+    job = Mock()
+    statuses = await CoreService(middleware).bulk(job, "share.create", [[{"name": f"share{i}"}] for i in range(50)])
+
+    assert statuses == [{"result": {"name": f"share{i}"}, "error": None} for i in range(50)]
+    assert rc() == ["onereload"]
+    assert middleware["etc.generate"].call_count == 1
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.asyncio
+async def test__core_bulk__failed_service_change_is_reported(rc, middleware):
+    ServiceService.started.return_value = False
+
+    statuses = await CoreService(middleware).bulk(Mock(), "share.create", [[{}], [{}]])
+
+    assert [status["error"] for status in statuses] == [
+        "service.reload fakesvc (if running) failed: [ESERVICESTARTFAILURE] The fakesvc service failed to start",
+    ] * 2
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.asyncio
+async def test__core_bulk__deferred_service_restart_result_is_reported(rc, middleware):
+    ServiceService.started.return_value = False
+
+    statuses = await CoreService(middleware).bulk(Mock(), "service.restart", [["fakesvc", {}]] * 3)
+
+    assert statuses == [{"result": False, "error": None}] * 3
+    assert rc() == ["forcestop", "onerestart"]
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.asyncio
+async def test__coalescer__failure_is_reported_to_all_requests():
+    coalescer = Coalescer()
+    calls = []
+
+    async def fail():
+        calls.append(None)
+        raise ValueError("failed")
+
+    results = await asyncio.gather(*[coalescer.run("key", fail) for i in range(3)], return_exceptions=True)
+
+    assert [str(result) for result in results] == ["failed"] * 3
+    assert len(calls) == 1
+    assert coalescer.__encode__() == {"runs": 1, "requests": 3, "pending": 0, "running": 0}
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.asyncio
+async def test__core_bulk__service_change_after_scope_ended_is_run(rc, middleware):
+    released = asyncio.Event()
+    tasks = []
+
+    class BackgroundShareService(CRUDService):
+        async def create(self, data):
+            async def restart():
+                await released.wait()
+                await self._service_change("fakesvc", "restart")
+
+            # Fire-and-forget task still sees the scope of the call that created it
+            tasks.append(asyncio.ensure_future(restart()))
+            return data
+
+    middleware["share.create"] = BackgroundShareService(middleware).create
+
+    await CoreService(middleware).bulk(Mock(), "share.create", [[{}]])
+    released.set()
+    await asyncio.gather(*tasks)
+
+    assert "onerestart" in rc()
@@ -0,0 +1,64 @@
+import io
+import tarfile
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from middlewared.plugins.system import SystemHealthProducer, write_debug_tar
+
+
+class FakeSystemHealthProducer(SystemHealthProducer):
+    samples = 0
+
+    def cp_time(self):
+        return [0, 0, 0, 0, 0]
+
+    def sample(self, cp_diff):
+        self.samples += 1
+        return {"sample": self.samples}
+
+
+@pytest.mark.timeout(30)
+def test__system_health_producer__shared():
+    producer = FakeSystemHealthProducer(Mock(), 0.1)
+    threads = threading.active_count()
+
+    received = [[] for i in range(300)]
+    callbacks = [lambda fields, received=received[i]: received.append(fields) for i in range(300)]
+    for callback in callbacks:
+        producer.subscribe(callback)
+
+    time.sleep(0.55)
+
+    # A single sampling thread serves all subscribers
+    assert threading.active_count() == threads + 1
+    assert 3 <= producer.samples <= 6
+    assert all(producer.samples - 1 <= len(i) <= producer.samples for i in received)
+
+    for callback in callbacks:
+        producer.unsubscribe(callback)
+
+    time.sleep(0.2)
+
+    assert threading.active_count() == threads
+    assert producer.thread is None
+
+
+def test__write_debug_tar__streams_members():
+    output = io.BytesIO()
+
+    def members():
+        yield "a.txz", 65536, io.BytesIO(b"a" * 65536)
+        # First member is already written when the second one becomes available
+        assert len(output.getvalue()) >= 65536 - tarfile.RECORDSIZE
+        yield "b.txz", 2, io.BytesIO(b"bb")
+
+    write_debug_tar(output, members())
+
+    output.seek(0)
+    with tarfile.open(fileobj=output) as tar:
+        assert tar.getnames() == ["a.txz", "b.txz"]
+        assert tar.extractfile("a.txz").read() == b"a" * 65536
+        assert tar.extractfile("b.txz").read() == b"bb"
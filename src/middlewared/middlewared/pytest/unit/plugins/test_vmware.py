@@ -0,0 +1,167 @@
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+import pytest
+from pyVmomi import vim
+
+from middlewared.plugins.vmware import VMWARE_SNAPSHOT_CONCURRENCY, VMWareService
+
+
+class FakeTask:
+    def __init__(self, action):
+        self.action = action
+
+
+class FakeSnapshot:
+    def __init__(self, vm):
+        self.vm = vm
+
+    def RemoveSnapshot_Task(self, removeChildren):
+        return FakeTask(lambda: setattr(self.vm, "snapshot", None))
+
+
+class FakeVM:
+    def __init__(self, name, datastores, power_state="poweredOn", passthrough=False):
+        self.name = name
+        self.datastore = [datastore_ref(datastores[0])]
+        devices = [
+            SimpleNamespace(backing=SimpleNamespace(fileName=f"[{datastore}] {name}/{name}.vmdk",
+                                                    datastore=datastore_ref(datastore)))
+            for datastore in datastores
+        ]
+        if passthrough:
+            devices.append(vim.VirtualPCIPassthrough())
+        self.config = SimpleNamespace(uuid=f"uuid-{name}", hardware=SimpleNamespace(device=devices))
+        self.summary = SimpleNamespace(runtime=SimpleNamespace(powerState=power_state))
+        self.snapshot = None
+        self.snapshots_created = 0
+
+    def CreateSnapshot_Task(self, name, description, memory, quiesce):
+        def create():
+            self.snapshots_created += 1
+            self.snapshot = SimpleNamespace(rootSnapshotList=[
+                SimpleNamespace(name=name, snapshot=FakeSnapshot(self), childSnapshotList=[]),
+            ])
+
+        return FakeTask(create)
+
+
+class FakeServiceInstance:
+    def __init__(self, vms):
+        self.vms = vms
+        self.content = SimpleNamespace(
+            rootFolder=object(),
+            viewManager=SimpleNamespace(
+                CreateContainerView=lambda root, types, recursive: SimpleNamespace(view=vms, Destroy=lambda: None),
+            ),
+            searchIndex=SimpleNamespace(
+                FindByUuid=lambda datacenter, uuid, vm_search: {vm.config.uuid: vm for vm in vms}.get(uuid),
+            ),
+            sessionManager=SimpleNamespace(currentSession=object()),
+        )
+
+    def RetrieveContent(self):
+        return self.content
+
+
+def datastore_ref(name):
+    return SimpleNamespace(info=SimpleNamespace(name=name))
+
+
+def mapping(id, datastore):
+    return {
+        "id": id,
+        "hostname": "vcenter",
+        "username": "root",
+        "password": "password",
+        "filesystem": "tank/vms",
+        "datastore": datastore,
+    }
+
+
+@pytest.fixture
+def vsphere():
+    vms = (
+        [FakeVM(f"vm{i}", ["ds1"]) for i in range(30)] +
+        [FakeVM(f"vm{i}", ["ds2"]) for i in range(30, 40)] +
+        [
+            FakeVM("both", ["ds1", "ds2"]),
+            FakeVM("off", ["ds1"], power_state="poweredOff"),
+            FakeVM("passthrough", ["ds1"], passthrough=True),
+        ]
+    )
+    si = FakeServiceInstance(vms)
+
+    concurrency = {"running": 0, "max": 0}
+    lock = threading.Lock()
+
+    def wait_for_task(task):
+        with lock:
+            concurrency["running"] += 1
+            concurrency["max"] = max(concurrency["max"], concurrency["running"])
+        time.sleep(0.01)
+        task.action()
+        with lock:
+            concurrency["running"] -= 1
+
+    middleware = Mock()
+    middleware.call_sync.side_effect = lambda method, *args: {
+        "vmware.query": [mapping(1, "ds1"), mapping(2, "ds2")],
+    }.get(method)
+
+    with patch("middlewared.plugins.vmware.connect") as connect:
+        connect.SmartConnect.return_value = si
+        with patch("middlewared.plugins.vmware.VimTask.WaitForTask", wait_for_task):
+            yield SimpleNamespace(service=VMWareService(middleware), si=si, vms=vms, connect=connect,
+                                  concurrency=concurrency)
+
+
+def test__snapshot__reuses_session(vsphere):
+    context = vsphere.service.snapshot_begin("tank/vms", False)
+
+    # Both mappings point to the same host
+    assert vsphere.connect.SmartConnect.call_count == 1
+    assert vsphere.connect.Disconnect.call_count == 0
+
+    assert 1 < vsphere.concurrency["max"] <= VMWARE_SNAPSHOT_CONCURRENCY
+    vms = {vm.name: vm for vm in vsphere.vms}
+    assert all(vm.snapshots_created == 1 for name, vm in vms.items() if name not in ("off", "passthrough"))
+    assert vms["off"].snapshots_created == 0
+    assert vms["passthrough"].snapshots_created == 0
+
+    ds1, ds2 = context["vmsnapobjs"]
+    assert len(ds1["snapvms"]) == 32
+    assert ds1["snapvmskips"] == ["uuid-passthrough"]
+    assert ds1["snapvmfails"] == []
+    assert len(ds2["snapvms"]) == 11
+    assert set(context["timings"].keys()) == {"login", "index", "snapshot"}
+
+    vsphere.service.snapshot_end(context)
+
+    assert vsphere.connect.SmartConnect.call_count == 1
+    vsphere.connect.Disconnect.assert_called_once_with(vsphere.si)
+    assert all(vm.snapshot is None for vm in vsphere.vms)
+    assert vsphere.service.snapshot_sessions == {}
+
+
+def test__snapshot_end__expired_session(vsphere):
+    context = vsphere.service.snapshot_begin("tank/vms", False)
+
+    vsphere.si.content.sessionManager.currentSession = None
+
+    vsphere.service.snapshot_end(context)
+
+    assert vsphere.connect.SmartConnect.call_count == 2
+    assert all(vm.snapshot is None for vm in vsphere.vms)
+
+
+def test__snapshot__failed_vm(vsphere):
+    vms = {vm.name: vm for vm in vsphere.vms}
+    vms["vm0"].CreateSnapshot_Task = Mock(side_effect=vim.fault.TaskInProgress())
+
+    context = vsphere.service.snapshot_begin("tank/vms", False)
+
+    assert context["vmsnapobjs"][0]["snapvmfails"] == [["uuid-vm0", "vm0"]]
+    assert not context["vmsynced"]
@@ -0,0 +1,343 @@
+import asyncio
+import queue
+from unittest.mock import Mock, patch
+
+import pytest
+
+from middlewared.plugins.zettarepl import apply_definition_diff, definition_diff, ZettareplService
+from middlewared.pytest.unit.middleware import Middleware
+from middlewared.utils import filter_list
+
+SCHEDULE = {"minute": "0", "hour": "*", "dom": "*", "month": "*", "dow": "*", "begin": "00:00", "end": "23:59"}
+
+
+class FakeProcess:
+    def __init__(self, name, target):
+        self.definition = target.definition
+        self.alive = False
+
+    def start(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def terminate(self):
+        self.alive = False
+
+    def join(self, timeout=None):
+        pass
+
+
+class Tasks:
+    """
+    Fake pools, periodic snapshot tasks and replication tasks, counting rows returned by their queries
+    """
+
+    def __init__(self, pools, periodic_snapshot_tasks_per_pool):
+        self.pools = {
+            name: {"name": name, "status": "ONLINE", "is_decrypted": True}
+            for name in pools
+        }
+
+        self.periodic_snapshot_tasks = {}
+        self.replication_tasks = {}
+        for pool in pools:
+            for i in range(periodic_snapshot_tasks_per_pool):
+                periodic_snapshot_task = self.add_periodic_snapshot_task(f"{pool}/dataset{i}")
+                # Every other periodic snapshot task is replicated
+                if i % 2 == 0:
+                    self.add_replication_task([periodic_snapshot_task["id"]])
+
+        self.queries = []
+
+    def add_periodic_snapshot_task(self, dataset, **kwargs):
+        id = len(self.periodic_snapshot_tasks) + 1
+        self.periodic_snapshot_tasks[id] = dict({
+            "id": id,
+            "dataset": dataset,
+            "recursive": False,
+            "exclude": [],
+            "lifetime_value": 2,
+            "lifetime_unit": "WEEK",
+            "naming_schema": "auto-%Y-%m-%d_%H-%M",
+            "schedule": dict(SCHEDULE),
+            "allow_empty": True,
+            "enabled": True,
+        }, **kwargs)
+        return self.periodic_snapshot_tasks[id]
+
+    def add_replication_task(self, periodic_snapshot_tasks, **kwargs):
+        id = len(self.replication_tasks) + 1
+        self.replication_tasks[id] = dict({
+            "id": id,
+            "direction": "PUSH",
+            "transport": "SSH",
+            "ssh_credentials": {"id": 1},
+            "netcat_active_side": None,
+            "netcat_active_side_listen_address": None,
+            "netcat_active_side_port_min": None,
+            "netcat_active_side_port_max": None,
+            "netcat_passive_side_connect_address": None,
+            "source_datasets": [self.periodic_snapshot_tasks[periodic_snapshot_tasks[0]]["dataset"]],
+            "target_dataset": f"backup/{id}",
+            "recursive": False,
+            "exclude": [],
+            "properties": True,
+            "periodic_snapshot_tasks": periodic_snapshot_tasks,
+            "naming_schema": [],
+            "also_include_naming_schema": [],
+            "auto": True,
+            "schedule": None,
+            "restrict_schedule": None,
+            "only_matching_schedule": False,
+            "allow_from_scratch": False,
+            "hold_pending_snapshots": False,
+            "retention_policy": "SOURCE",
+            "lifetime_value": None,
+            "lifetime_unit": None,
+            "compression": None,
+            "speed_limit": None,
+            "dedup": False,
+            "large_block": True,
+            "embed": False,
+            "compressed": True,
+            "retries": 5,
+            "logging_level": None,
+            "enabled": True,
+        }, **kwargs)
+        return self.replication_tasks[id]
+
+    def pool_query(self, filters=None, options=None):
+        self.queries.append(("pool", len(self.pools)))
+        return [dict(pool) for pool in self.pools.values()]
+
+    def periodic_snapshot_task_query(self, filters=None, options=None):
+        legacy_datasets = {replication_task["source_datasets"][0]
+                           for replication_task in self.replication_tasks.values()
+                           if replication_task["transport"] == "LEGACY"}
+        result = filter_list([
+            dict(periodic_snapshot_task, legacy=periodic_snapshot_task["dataset"] in legacy_datasets)
+            for periodic_snapshot_task in self.periodic_snapshot_tasks.values()
+        ], filters, options)
+        self.queries.append(("periodic_snapshot_task", len(result)))
+        return result
+
+    def replication_query(self, filters=None, options=None):
+        result = filter_list([
+            dict(replication_task, periodic_snapshot_tasks=[
+                dict(self.periodic_snapshot_tasks[id]) for id in replication_task["periodic_snapshot_tasks"]
+                if id in self.periodic_snapshot_tasks
+            ])
+            for replication_task in self.replication_tasks.values()
+        ], filters, options)
+        self.queries.append(("replication", len(result)))
+        return result
+
+    def keychaincredential_get_of_type(self, id, type):
+        self.queries.append(("keychaincredential", 1))
+        if type == "SSH_CREDENTIALS":
+            return {"id": id, "attributes": {"host": "backup", "port": 22, "username": "root", "private_key": 2,
+                                             "remote_host_key": "ssh-rsa KEY", "connect_timeout": 10}}
+        return {"id": id, "attributes": {"private_key": "PRIVATE KEY"}}
+
+    def rows(self, kind):
+        return sum(rows for query, rows in self.queries if query == kind)
+
+
+@pytest.fixture()
+def zettarepl():
+    def make(tasks):
+        m = Middleware()
+        m.debug_level = "DEBUG"
+        m.log_handler = "console"
+        m["system.general.config"] = lambda: {"timezone": "UTC"}
+        m["pool.query"] = tasks.pool_query
+        m["pool.snapshottask.query"] = tasks.periodic_snapshot_task_query
+        m["replication.query"] = tasks.replication_query
+        m["keychaincredential.get_of_type"] = tasks.keychaincredential_get_of_type
+        return ZettareplService(m)
+
+    with patch("middlewared.plugins.zettarepl.multiprocessing.Process", FakeProcess):
+        with patch("middlewared.plugins.zettarepl.multiprocessing.Queue", queue.Queue):
+            with patch("middlewared.plugins.zettarepl.start_daemon_thread", Mock()):
+                yield make
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+def commands(service):
+    result = []
+    while not service.queue.empty():
+        result.append(service.queue.get_nowait())
+    return result
+
+
+def full_definition(service):
+    return run(service._build_definition()).definition()
+
+
+def test__definition_diff():
+    old = {
+        "timezone": "UTC",
+        "periodic-snapshot-tasks": {"task_1": {"dataset": "a"}, "task_2": {"dataset": "b"}},
+        "replication-tasks": {"task_1": {"auto": True}},
+    }
+    new = {
+        "timezone": "Europe/Kiev",
+        "periodic-snapshot-tasks": {"task_1": {"dataset": "a"}, "task_3": {"dataset": "c"}},
+        "replication-tasks": {"task_1": {"auto": False}},
+    }
+
+    diff = definition_diff(old, new)
+
+    assert diff == {
+        "timezone": "Europe/Kiev",
+        "periodic-snapshot-tasks": {"task_2": None, "task_3": {"dataset": "c"}},
+        "replication-tasks": {"task_1": {"auto": False}},
+    }
+    assert apply_definition_diff(old, diff) == new
+    assert definition_diff(new, new) == {}
+
+
+def test__zettarepl__start_builds_definition_once(zettarepl):
+    tasks = Tasks(["tank", "data", "backup"], 100)
+    service = zettarepl(tasks)
+
+    run(service.start())
+
+    definition = service.process.definition
+    assert len(definition["periodic-snapshot-tasks"]) == 300
+    assert len(definition["replication-tasks"]) == 150
+    assert definition["replication-tasks"]["task_1"]["periodic-snapshot-tasks"] == ["task_1"]
+    assert definition["replication-tasks"]["task_1"]["transport"]["hostname"] == "backup"
+    # SSH transport is only defined once for all the replication tasks that share credentials
+    assert tasks.rows("keychaincredential") == 2
+    assert (definition, service.hold_tasks) == full_definition(service)
+
+
+def test__zettarepl__update_periodic_snapshot_tasks(zettarepl):
+    tasks = Tasks(["tank", "data", "backup"], 100)
+    service = zettarepl(tasks)
+    run(service.start())
+    tasks.queries = []
+
+    tasks.periodic_snapshot_tasks[1]["naming_schema"] = "manual-%Y-%m-%d_%H-%M"
+    tasks.periodic_snapshot_tasks[2]["enabled"] = False
+    tasks.add_periodic_snapshot_task("tank/new")
+    run(service.update_periodic_snapshot_tasks([1, 2, 301]))
+
+    # Only changed tasks and replication tasks bound to them are queried
+    assert tasks.rows("periodic_snapshot_task") == 3
+    assert tasks.rows("replication") == 1
+    assert tasks.rows("pool") == 0
+    assert commands(service) == [("update_tasks", {
+        "periodic-snapshot-tasks": {
+            "task_1": service.definition["periodic-snapshot-tasks"]["task_1"],
+            "task_2": None,
+            "task_301": service.definition["periodic-snapshot-tasks"]["task_301"],
+        },
+    })]
+    assert service.definition["periodic-snapshot-tasks"]["task_1"]["naming-schema"] == "manual-%Y-%m-%d_%H-%M"
+    assert (service.definition, service.hold_tasks) == full_definition(service)
+
+
+def test__zettarepl__update_replication_tasks(zettarepl):
+    tasks = Tasks(["tank", "data"], 100)
+    service = zettarepl(tasks)
+    run(service.start())
+    tasks.queries = []
+
+    tasks.replication_tasks[1]["retries"] = 10
+    del tasks.replication_tasks[2]
+    run(service.update_replication_tasks([1, 2]))
+
+    assert tasks.rows("replication") == 1
+    assert tasks.rows("periodic_snapshot_task") == 0
+    assert commands(service) == [("update_tasks", {
+        "replication-tasks": {
+            "task_1": service.definition["replication-tasks"]["task_1"],
+            "task_2": None,
+        },
+    })]
+    assert (service.definition, service.hold_tasks) == full_definition(service)
+
+
+def test__zettarepl__legacy_replication_task_rebuilds_definition(zettarepl):
+    tasks = Tasks(["tank", "data"], 100)
+    service = zettarepl(tasks)
+    run(service.start())
+    tasks.queries = []
+
+    tasks.add_replication_task([3], transport="LEGACY", ssh_credentials=None)
+    run(service.update_replication_tasks([101]))
+
+    # Periodic snapshot task 3 is legacy now and replication task 2 includes its snapshots
+    assert tasks.rows("periodic_snapshot_task") == 200
+    assert "task_3" not in service.definition["periodic-snapshot-tasks"]
+    assert service.definition["replication-tasks"]["task_2"]["periodic-snapshot-tasks"] == []
+    assert service.definition["replication-tasks"]["task_2"]["also-include-naming-schema"] == [
+        "auto-%Y-%m-%d_%H-%M",
+    ]
+    assert [task["id"] for task in run(service.get_legacy_replication_tasks())] == [101]
+    assert (service.definition, service.hold_tasks) == full_definition(service)
+
+
+def test__zettarepl__update_pools(zettarepl):
+    tasks = Tasks(["tank", "data", "backup"], 100)
+    service = zettarepl(tasks)
+    run(service.start())
+    tasks.queries = []
+
+    tasks.pools["data"]["is_decrypted"] = False
+    run(service.update_pools())
+
+    # Pool events do not query tasks
+    assert [query for query, rows in tasks.queries] == ["pool"]
+    [(command, diff)] = commands(service)
+    assert set(diff) == {"periodic-snapshot-tasks", "replication-tasks"}
+    assert len(diff["periodic-snapshot-tasks"]) == 100
+    assert len(diff["replication-tasks"]) == 50
+    assert all(task is None for key in diff for task in diff[key].values())
+    assert service.hold_tasks["periodic_snapshot_task_101"] == "Pool data is locked"
+    assert service.hold_tasks["replication_task_51"] == "Pool data is locked"
+
+    tasks.pools["data"]["is_decrypted"] = True
+    run(service.update_pools())
+
+    [(command, diff)] = commands(service)
+    assert len(diff["periodic-snapshot-tasks"]) == 100
+    assert service.hold_tasks == {}
+    assert (service.definition, service.hold_tasks) == full_definition(service)
+
+
+def test__zettarepl__update_pools__stops_when_nothing_to_run(zettarepl):
+    tasks = Tasks(["tank"], 10)
+    service = zettarepl(tasks)
+    run(service.start())
+
+    del tasks.pools["tank"]
+    run(service.update_pools())
+
+    assert not service.is_running()
+    assert service.hold_tasks["periodic_snapshot_task_1"] == "Pool tank does not exist"
+
+    tasks.pools["tank"] = {"name": "tank", "status": "ONLINE", "is_decrypted": True}
+    run(service.update_pools())
+
+    assert service.is_running()
+    assert len(service.process.definition["periodic-snapshot-tasks"]) == 10
+
+
+def test__zettarepl__update_timezone(zettarepl):
+    tasks = Tasks(["tank"], 10)
+    service = zettarepl(tasks)
+    run(service.start())
+    tasks.queries = []
+
+    run(service.update_timezone("Europe/Kiev"))
+
+    assert tasks.queries == []
+    assert commands(service) == [("update_tasks", {"timezone": "Europe/Kiev"})]
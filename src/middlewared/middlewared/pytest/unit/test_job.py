@@ -0,0 +1,202 @@
+import asyncio
+import time
+
+from asynctest import Mock
+import pytest
+
+from middlewared.job import Job, JobLogsFile, JobsQueue
+
+
+def create_job(middleware, lock=None, lock_queue_size=None, progress_interval=1, args=None, index=False,
+               history_result=True):
+    return Job(middleware, "test.job", None, None, args or [], {
+        "lock": lock,
+        "lock_queue_size": lock_queue_size,
+        "logs": False,
+        "process": False,
+        "pipes": [],
+        "check_pipes": False,
+        "transient": True,
+        "progress_interval": progress_interval,
+        "index": index,
+        "history_result": history_result,
+    }, None)
+
+
+@pytest.mark.asyncio
+async def test__jobs_queue__lock_fifo():
+    middleware = Mock()
+    queue = JobsQueue(middleware)
+
+    job1 = queue.add(create_job(middleware, "lock"))
+    job2 = queue.add(create_job(middleware, "lock"))
+    job3 = queue.add(create_job(middleware))
+    job4 = queue.add(create_job(middleware, "lock"))
+
+    assert await queue.next() is job1
+    assert await queue.next() is job3
+    assert not queue.queue
+
+    assert queue.locks()["lock"].__encode__()["waiting"] == [job2.id, job4.id]
+
+    queue.release_lock(job1)
+    assert await queue.next() is job2
+    queue.release_lock(job2)
+    assert await queue.next() is job4
+    queue.release_lock(job4)
+
+    assert queue.locks() == {}
+
+
+@pytest.mark.asyncio
+async def test__jobs_queue__idle_lock_keeps_stats():
+    middleware = Mock()
+    queue = JobsQueue(middleware)
+
+    for i in range(2):
+        job1 = queue.add(create_job(middleware, "lock"))
+        job2 = queue.add(create_job(middleware, "lock"))
+        assert await queue.next() is job1
+        queue.release_lock(job1)
+        assert await queue.next() is job2
+        queue.release_lock(job2)
+
+        assert queue.locks() == {}
+
+    [lock] = queue.locks_encoded()
+    assert lock["name"] == "lock"
+    assert lock["running"] is None
+    assert lock["queue_depth"] == 0
+    assert lock["max_queue_depth"] == 1
+    assert lock["acquired_count"] == 4
+
+
+@pytest.mark.asyncio
+async def test__jobs_queue__lock_queue_size():
+    middleware = Mock()
+    queue = JobsQueue(middleware)
+
+    job1 = queue.add(create_job(middleware, "lock", 1))
+    assert await queue.next() is job1
+
+    job2 = queue.add(create_job(middleware, "lock", 1))
+    assert queue.add(create_job(middleware, "lock", 1)) is job2
+
+    assert queue.locks()["lock"].__encode__()["queue_depth"] == 1
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.asyncio
+async def test__jobs_queue__stress():
+    middleware = Mock()
+    queue = JobsQueue(middleware)
+    queue.deque.maxlen = 20000
+
+    jobs = [queue.add(create_job(middleware, f"lock{i % 5}")) for i in range(10000)]
+    assert {lock["queue_depth"] for lock in [i.__encode__() for i in queue.locks().values()]} == {1999}
+
+    start = time.monotonic()
+    scheduled = []
+    running = [await queue.next() for i in range(5)]
+    while running:
+        job = running.pop(0)
+        scheduled.append(job)
+        queue.release_lock(job)
+        if queue.queue:
+            running.append(await queue.next())
+
+    assert sorted(scheduled, key=lambda job: job.id) == jobs
+    assert all(
+        [job.id for job in scheduled if job.options["lock"] == f"lock{i}"] ==
+        [job.id for job in jobs if job.options["lock"] == f"lock{i}"]
+        for i in range(5)
+    )
+    # Scheduling must not scan the whole queue on every job completion
+    assert time.monotonic() - start < 5
+
+
+@pytest.mark.asyncio
+async def test__jobs_index__running_job_takes_precedence():
+    middleware = Mock()
+    queue = JobsQueue(middleware)
+
+    job1 = queue.add(create_job(middleware, args=[1], index=True))
+    queue.index.started(job1)
+    job2 = queue.add(create_job(middleware, args=[1], index=True))
+    job3 = queue.add(create_job(middleware, args=[2], index=True))
+    queue.add(create_job(middleware, args=[{"unhashable": True}], index=True))
+    queue.add(create_job(middleware, args=[3]))
+
+    assert queue.index.get("test.job", 1)["id"] == job1.id
+    assert queue.index.get("test.job", 2)["id"] == job3.id
+    assert queue.index.get("test.job", 3) is None
+
+    queue.index.finished(job1)
+    assert queue.index.get("test.job", 1)["id"] == job2.id
+
+
+@pytest.mark.asyncio
+async def test__jobs_index__load_from_history():
+    middleware = Mock()
+    queue = JobsQueue(middleware)
+
+    job = queue.add(create_job(middleware, args=[1], index=True))
+    queue.index.load({"id": job.id - 1, "method": "test.job", "arguments": [1], "state": "SUCCESS"})
+    queue.index.load({"id": job.id - 1, "method": "test.job", "arguments": [2], "state": "FAILED"})
+
+    assert queue.index.get("test.job", 1)["id"] == job.id
+    assert queue.index.get("test.job", 2)["state"] == "FAILED"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("history_result", [True, False])
+async def test__jobs_queue__store_history_result(history_result):
+    middleware = Mock()
+
+    async def run_in_thread(method, *args):
+        return method(*args)
+
+    middleware.run_in_thread = run_in_thread
+    history = Mock(last_id=Mock(return_value=0))
+    queue = JobsQueue(middleware, history)
+
+    job = create_job(middleware, history_result=history_result)
+    job.result = {"privatekey": "secret"}
+    await queue.store_history(job)
+
+    stored = history.add.call_args[0][0]
+    assert stored["result"] == ({"privatekey": "secret"} if history_result else None)
+
+
+@pytest.mark.asyncio
+async def test__job__set_progress_coalesced():
+    middleware = Mock()
+    job = create_job(middleware, progress_interval=0.1)
+
+    def sent_progress():
+        return [
+            call[2]["fields"]["progress"]["percent"]
+            for call in middleware.send_event.mock_calls
+            if call[1][0] == "core.get_jobs_progress" and call[1][1] == "CHANGED"
+        ]
+
+    for i in range(100):
+        job.set_progress(i)
+
+    assert sent_progress() == [0]
+
+    await asyncio.sleep(0.2)
+
+    assert sent_progress() == [0, 99]
+
+
+def test__job_logs_file__lines(tmpdir):
+    logs = JobLogsFile(str(tmpdir / "1.log"))
+    logs.write(b"a\nb\n")
+    logs.write(b"c")
+    assert logs.lines == 3
+    logs.write(b"\n")
+    assert logs.lines == 3
+    logs.close()
+
+    assert (tmpdir / "1.log").read() == "a\nb\nc\n"
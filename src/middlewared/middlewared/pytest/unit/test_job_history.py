@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+import os
+import stat
+
+from middlewared.job_history import JobHistory
+
+
+def encoded_job(id, method, state="SUCCESS", time_finished=None, logs_path=None):
+    time_finished = time_finished or datetime.now()
+    return {
+        "id": id,
+        "method": method,
+        "arguments": [id],
+        "logs_path": logs_path,
+        "logs_excerpt": None,
+        "progress": {"percent": 100, "description": None, "extra": None},
+        "result": None,
+        "error": None,
+        "exception": None,
+        "exc_info": None,
+        "state": state,
+        "time_started": time_finished - timedelta(seconds=1),
+        "time_finished": time_finished,
+    }
+
+
+def test__job_history__query(tmpdir):
+    history = JobHistory(str(tmpdir / "jobs.db"))
+    for i in range(1, 11):
+        history.add(encoded_job(i, "cloudsync.sync" if i % 2 else "replication.run", "FAILED" if i == 3 else "SUCCESS"))
+
+    assert history.last_id() == 10
+    assert [job["id"] for job in history.query([("method", "=", "cloudsync.sync")])] == [1, 3, 5, 7, 9]
+    assert [job["id"] for job in history.query([("method", "=", "cloudsync.sync"), ("state", "=", "FAILED")])] == [3]
+    assert [job["id"] for job in history.query([("id", "in", [2, 4])], exclude_ids={4})] == [2]
+
+    job = history.query([("id", "=", 1)])[0]
+    assert job["arguments"] == [1]
+    assert isinstance(job["time_finished"], datetime)
+
+    # Filters that can't be evaluated by the database are left for the caller
+    assert len(history.query([("arguments", "rin", 1)])) == 10
+
+
+def test__job_history__query_limit(tmpdir):
+    history = JobHistory(str(tmpdir / "jobs.db"))
+    for i in range(1, 101):
+        history.add(encoded_job(i, "cloudsync.sync" if i % 2 else "replication.run"))
+
+    def query(filters, options, exclude_ids=None):
+        return [job["id"] for job in history.query(filters, exclude_ids=exclude_ids, options=options)]
+
+    assert query([], {"order_by": ["-id"], "limit": 3}) == [98, 99, 100]
+    assert query([], {"order_by": ["-id"], "offset": 2, "limit": 3}) == [96, 97, 98, 99, 100]
+    assert query([("method", "=", "cloudsync.sync")], {"limit": 2}) == [1, 3]
+    assert query([], {"get": True}) == [1]
+    # Excluded (in-memory) jobs do not shrink the result
+    assert query([], {"order_by": ["-id"], "limit": 3}, exclude_ids={99, 100}) == [96, 97, 98]
+
+    # Jobs can't be limited unless the database evaluates all filters and orders them
+    assert len(query([("arguments", "rin", 1)], {"limit": 3})) == 100
+    assert len(query([], {"order_by": ["time_finished"], "limit": 3})) == 100
+    assert len(query([], {"count": True, "limit": 3})) == 100
+
+
+def test__job_history__permissions(tmpdir):
+    path = tmpdir / "middlewared" / "jobs.db"
+    JobHistory(str(path))
+
+    assert stat.S_IMODE(os.stat(str(tmpdir / "middlewared")).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(str(path)).st_mode) == 0o600
+
+
+def test__job_history__prune(tmpdir):
+    history = JobHistory(str(tmpdir / "jobs.db"), max_entries=3, max_age=3600)
+    for i in range(1, 6):
+        logs_path = tmpdir / f"{i}.log"
+        logs_path.write("log")
+        history.add(encoded_job(i, "cloudsync.sync", logs_path=str(logs_path)))
+    history.add(encoded_job(6, "cloudsync.sync", time_finished=datetime.now() - timedelta(hours=2)))
+
+    history.prune()
+
+    assert [job["id"] for job in history.query()] == [3, 4, 5]
+    assert not (tmpdir / "1.log").exists()
+    assert (tmpdir / "5.log").exists()
@@ -0,0 +1,70 @@
+import time
+
+from middlewared.metrics import CallMetrics, LATENCY_BUCKETS, UNKNOWN_METHOD
+from middlewared.schema import accepts, Str
+
+
+class AuthService:
+    @accepts(Str("username"), Str("password", private=True))
+    def login(self, username, password):
+        pass
+
+
+login = AuthService().login
+
+
+def dump_args(args, method=None, method_name=None):
+    return [method.accepts[i].dump(arg) for i, arg in enumerate(args) if i < len(method.accepts)]
+
+
+def test__call_metrics__histogram():
+    metrics = CallMetrics(dump_args)
+    metrics.observe("auth.login", "coroutine", 0.002, False, ["root", "secret"], login)
+    metrics.observe("auth.login", "coroutine", 0.2, True, ["root", "secret"], login)
+    metrics.observe("auth.login", "websocket", 0.3, False, ["root", "secret"], login)
+
+    methods = {(m["method"], m["path"]): m for m in metrics.__encode__()["methods"]}
+    coroutine = methods[("auth.login", "coroutine")]
+    assert coroutine["count"] == 2
+    assert coroutine["errors"] == 1
+    assert coroutine["max"] == 0.2
+    assert {b["le"]: b["count"] for b in coroutine["histogram"] if b["count"]} == {0.005: 1, 0.5: 1}
+    assert len(coroutine["histogram"]) == len(LATENCY_BUCKETS) + 1
+    assert methods[("auth.login", "websocket")]["count"] == 1
+
+    assert metrics.__encode__()["slow_calls"] == []
+
+
+def test__call_metrics__slow_calls_are_redacted():
+    metrics = CallMetrics(dump_args, slow_call_threshold=1, slow_calls_size=2)
+    for i in range(3):
+        metrics.observe("auth.login", "io_thread", 1.5 + i, False, [f"user{i}", "secret"], login)
+
+    slow_calls = metrics.__encode__()["slow_calls"]
+    assert [call["arguments"] for call in slow_calls] == [["user1", "********"], ["user2", "********"]]
+    assert slow_calls[0]["duration"] == 2.5
+
+
+def test__call_metrics__unknown_methods_share_a_bucket():
+    metrics = CallMetrics(dump_args, slow_call_threshold=1)
+    for i in range(100):
+        metrics.observe(f"no.such_method{i}", "websocket", 0.001, True, ["secret"], None)
+    metrics.observe("no.such_method", "websocket", 2, True, ["secret"], None)
+
+    methods = metrics.__encode__()["methods"]
+    assert [(m["method"], m["count"]) for m in methods] == [(UNKNOWN_METHOD, 101)]
+    assert metrics.__encode__()["slow_calls"][0]["method"] == UNKNOWN_METHOD
+    assert metrics.__encode__()["slow_calls"][0]["arguments"] == []
+
+
+def test__call_metrics__overhead():
+    metrics = CallMetrics(dump_args)
+    count = 100000
+
+    started = time.monotonic()
+    for i in range(count):
+        metrics.observe("pool.query", "coroutine", 0.0001, False, [], login)
+    overhead = (time.monotonic() - started) / count
+
+    # Generous bound so this does not fail on a loaded machine, typically it is around 1 microsecond
+    assert overhead < 10e-6
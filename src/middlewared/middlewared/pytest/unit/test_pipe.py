@@ -0,0 +1,74 @@
+import threading
+
+from asynctest import Mock
+import pytest
+
+from middlewared.pipe import Pipe
+
+CHUNK = b"x" * 1048576
+COUNT = 64
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.asyncio
+async def test__pipe__read_async():
+    pipe = Pipe(Mock())
+
+    def write():
+        for i in range(COUNT):
+            pipe.w.write(CHUNK)
+        pipe.w.close()
+
+    threading.Thread(target=write, daemon=True).start()
+
+    size = 0
+    while True:
+        read = await pipe.read_async(1048576)
+        if read == b"":
+            break
+        size += len(read)
+
+    assert size == len(CHUNK) * COUNT
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.asyncio
+async def test__pipe__write_async():
+    pipe = Pipe(Mock())
+    sizes = []
+
+    def read():
+        size = 0
+        while True:
+            read = pipe.r.read(1048576)
+            if read == b"":
+                break
+            size += len(read)
+        sizes.append(size)
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+
+    for i in range(COUNT):
+        await pipe.write_async(CHUNK)
+    pipe.w.close()
+
+    thread.join()
+    assert sizes == [len(CHUNK) * COUNT]
+
+
+@pytest.mark.parametrize("allow_source_file", [True, False])
+def test__pipe__send_file(tmpdir, allow_source_file):
+    path = tmpdir / "file"
+    path.write("contents")
+
+    pipe = Pipe(Mock(), allow_source_file)
+    pipe.send_file(str(path))
+    pipe.w.close()
+
+    if allow_source_file:
+        assert pipe.source_file == str(path)
+        assert pipe.r.read() == b""
+    else:
+        assert pipe.source_file is None
+        assert pipe.r.read() == b"contents"
@@ -0,0 +1,64 @@
+import pytest
+
+django = pytest.importorskip("django")
+
+from django.conf import settings  # noqa
+
+if not settings.configured:
+    settings.configure(
+        DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+        # Models need an installed app for reverse relations to be resolved
+        INSTALLED_APPS=["django.contrib.contenttypes"],
+    )
+    django.setup()
+
+from django.db import connection, models  # noqa
+from django.test.utils import CaptureQueriesContext  # noqa
+
+from middlewared.utils import django_queryset_prefetch_related  # noqa
+
+ROWS = 1200
+
+
+class Extent(models.Model):
+    name = models.CharField(max_length=120)
+
+    class Meta:
+        app_label = "contenttypes"
+
+
+class Target(models.Model):
+    name = models.CharField(max_length=120)
+    extent = models.ForeignKey(Extent, on_delete=models.CASCADE, related_name="primary_targets")
+    extents = models.ManyToManyField(Extent, related_name="targets")
+
+    class Meta:
+        app_label = "contenttypes"
+
+
+@pytest.fixture(scope="module")
+def targets():
+    with connection.schema_editor() as editor:
+        editor.create_model(Extent)
+        editor.create_model(Target)
+
+    Extent.objects.bulk_create([Extent(id=i + 1, name=f"extent{i}") for i in range(ROWS)])
+    Target.objects.bulk_create([Target(id=i + 1, name=f"target{i}", extent_id=i + 1) for i in range(ROWS)])
+    through = Target.extents.through
+    through.objects.bulk_create([through(target_id=i + 1, extent_id=i + 1) for i in range(ROWS)])
+
+    return Target.objects.all().order_by("id")
+
+
+def test__django_queryset_prefetch_related(targets):
+    with CaptureQueriesContext(connection) as ctx:
+        result = [
+            (target.name, target.extent.name, [extent.name for extent in target.extents.all()])
+            for target in django_queryset_prefetch_related(targets, ["extent", "extents"], chunk_size=500)
+        ]
+
+    assert result == [(f"target{i}", f"extent{i}", [f"extent{i}"]) for i in range(ROWS)]
+    # A query for targets and two queries per chunk of 500 rows
+    assert len(ctx.captured_queries) == 1 + 2 * 3
+    # Each query stays under sqlite limit of 999 variables
+    assert all(query["sql"].count(",") < 999 for query in ctx.captured_queries)
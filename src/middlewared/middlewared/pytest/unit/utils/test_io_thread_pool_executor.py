@@ -0,0 +1,134 @@
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+import middlewared.logger  # noqa: F401 (adds `Logger.trace`)
+from middlewared.utils.io_thread_pool_executor import IoThreadPoolExecutor
+
+
+def wait(executor, futures):
+    concurrent.futures.wait(futures, timeout=10)
+    assert all(future.done() for future in futures)
+    return [future.result() for future in futures]
+
+
+class Concurrency:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def __call__(self, delay):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(delay)
+        with self.lock:
+            self.running -= 1
+
+
+@pytest.mark.timeout(30)
+def test__io_thread_pool_executor__reuses_idle_worker():
+    executor = IoThreadPoolExecutor("test", 4)
+
+    threads = [executor.submit(threading.current_thread).result(timeout=10) for i in range(10)]
+
+    assert len(set(threads)) == 1
+    assert executor.__encode__()["workers"] == 4
+    assert executor.__encode__()["idle_workers"] == 4
+
+
+@pytest.mark.timeout(30)
+def test__io_thread_pool_executor__max_workers():
+    executor = IoThreadPoolExecutor("test", 0, max_workers=2)
+    concurrency = Concurrency()
+
+    wait(executor, [executor.submit(concurrency, 0.2) for i in range(6)])
+
+    assert concurrency.max_running == 2
+    stats = executor.__encode__()
+    assert stats["peak_workers"] == 2
+    assert stats["saturated"] == 4
+    assert stats["max_queued"] == 4
+    assert stats["queued"] == 0
+    assert stats["wait_time_max"] >= 0.4
+
+
+@pytest.mark.timeout(30)
+def test__io_thread_pool_executor__caller_quota():
+    executor = IoThreadPoolExecutor("test", 0, max_workers=10, max_workers_per_caller=2)
+    concurrency = Concurrency()
+
+    slow = [executor.submit(concurrency, 0.2) for i in range(6)]
+    started = time.monotonic()
+    executor.submit(sum, [1, 2]).result(timeout=10)
+    # Other caller does not wait for the burst
+    assert time.monotonic() - started < 0.2
+
+    callers = {caller["caller"]: caller for caller in executor.__encode__()["callers"]}
+    assert callers["Concurrency"] == {"caller": "Concurrency", "running": 2, "queued": 4}
+
+    wait(executor, slow)
+
+    assert concurrency.max_running == 2
+    assert executor.__encode__()["throttled"] == 4
+    assert executor.__encode__()["callers"] == []
+
+
+@pytest.mark.timeout(30)
+def test__io_thread_pool_executor__round_robin():
+    executor = IoThreadPoolExecutor("test", 0, max_workers=1)
+    order = []
+
+    def a(i):
+        time.sleep(0.01)
+        order.append(f"a{i}")
+
+    def b(i):
+        order.append(f"b{i}")
+
+    wait(executor, [executor.submit(a, i) for i in range(3)] + [executor.submit(b, i) for i in range(2)])
+
+    assert order == ["a0", "a1", "b0", "a2", "b1"]
+
+
+@pytest.mark.timeout(30)
+def test__io_thread_pool_executor__nested_calls_do_not_deadlock():
+    executor = IoThreadPoolExecutor("test", 0, max_workers=1, max_workers_per_caller=1)
+
+    def outer():
+        return executor.submit(sum, [1, 2]).result(timeout=10)
+
+    assert executor.submit(outer).result(timeout=10) == 3
+    assert executor.__encode__()["over_limit"] == 1
+
+
+@pytest.mark.timeout(30)
+def test__io_thread_pool_executor__shrinks_idle_workers():
+    executor = IoThreadPoolExecutor("test", 1, idle_timeout=0.1)
+
+    wait(executor, [executor.submit(time.sleep, 0.1) for i in range(5)])
+    assert executor.__encode__()["peak_workers"] == 5
+
+    time.sleep(0.5)
+    assert executor.__encode__()["workers"] == 1
+    assert executor.submit(sum, [1, 2]).result(timeout=10) == 3
+
+
+@pytest.mark.timeout(60)
+def test__io_thread_pool_executor__submit_latency():
+    count = 10000
+
+    def throughput(executor):
+        started = time.monotonic()
+        wait(executor, [executor.submit(sum, [i]) for i in range(count)])
+        return count / (time.monotonic() - started)
+
+    ours = throughput(IoThreadPoolExecutor("test", 20, max_workers=200, max_workers_per_caller=50))
+    stdlib = throughput(concurrent.futures.ThreadPoolExecutor(20))
+
+    # Generous bound so this does not fail on a loaded machine, typically it is about half of `ThreadPoolExecutor`
+    # (that does not track workers or callers)
+    assert ours > stdlib / 5
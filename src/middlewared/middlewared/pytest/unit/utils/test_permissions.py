@@ -0,0 +1,229 @@
+import os
+import threading
+import time
+
+import pytest
+
+from middlewared.utils.permissions import inherited_acls, PermissionsWalker
+
+
+def flags(**kwargs):
+    return {
+        "FILE_INHERIT": False,
+        "DIRECTORY_INHERIT": False,
+        "NO_PROPAGATE_INHERIT": False,
+        "INHERIT_ONLY": False,
+        "INHERITED": False,
+        **kwargs,
+    }
+
+
+def ace(tag, **kwargs):
+    return {"tag": tag, "id": None, "type": "ALLOW", "perms": {"READ_DATA": True}, "flags": flags(**kwargs)}
+
+
+@pytest.fixture()
+def tree(tmpdir):
+    # Prefer tmpfs so the benchmark does not measure the disk
+    base = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else str(tmpdir)
+    root = os.path.join(base, f"perm_walker_{os.getpid()}_{threading.get_ident()}")
+
+    def make(dirs, files, depth=1):
+        os.makedirs(root)
+        paths = [root]
+        for i in range(dirs):
+            path = os.path.join(paths[i % len(paths)] if depth > 1 else root, f"dir{i}")
+            os.mkdir(path)
+            paths.append(path)
+            for j in range(files):
+                open(os.path.join(path, f"file{j}"), "w").close()
+        return root
+
+    yield make
+
+    if os.path.exists(root):
+        for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+            for name in filenames:
+                os.unlink(os.path.join(dirpath, name))
+            for name in dirnames:
+                path = os.path.join(dirpath, name)
+                if os.path.islink(path):
+                    os.unlink(path)
+                else:
+                    os.rmdir(path)
+        os.rmdir(root)
+
+
+def test__inherited_acls():
+    acls = inherited_acls([
+        ace("owner@", FILE_INHERIT=True, DIRECTORY_INHERIT=True),
+        ace("group@", FILE_INHERIT=True),
+        ace("everyone@", DIRECTORY_INHERIT=True, NO_PROPAGATE_INHERIT=True),
+        ace("USER"),
+    ])
+
+    assert [(e["tag"], e["flags"]) for e in acls[(False, True)]] == [
+        ("owner@", flags(INHERITED=True)),
+        ("group@", flags(INHERITED=True)),
+    ]
+    assert [(e["tag"], e["flags"]) for e in acls[(True, True)]] == [
+        ("owner@", flags(FILE_INHERIT=True, DIRECTORY_INHERIT=True, INHERITED=True)),
+        ("group@", flags(FILE_INHERIT=True, INHERIT_ONLY=True, INHERITED=True)),
+        ("everyone@", flags(INHERITED=True)),
+    ]
+    assert [e["tag"] for e in acls[(True, False)]] == ["owner@", "group@"]
+
+
+@pytest.mark.timeout(60)
+def test__permissions_walker__walks_tree(tree):
+    root = tree(20, 5, depth=3)
+    os.symlink("/", os.path.join(root, "dir0", "link"))
+
+    applied = {}
+    lock = threading.Lock()
+
+    def apply(entry, depth):
+        with lock:
+            applied[os.path.relpath(entry.path, root)] = depth
+
+    walker = PermissionsWalker(root, apply, workers=4).run()
+
+    assert walker.processed == len(applied) == 20 + 20 * 5 + 1
+    assert walker.failed == 0
+    assert applied["dir0"] == 1
+    assert applied["dir0/file0"] == 2
+    assert applied["dir0/link"] == 2
+    assert not any(path.startswith("dir0/link/") for path in applied)
+
+
+@pytest.mark.timeout(60)
+def test__permissions_walker__errors_are_batched(tree):
+    root = tree(10, 10)
+    batches = []
+
+    def apply(entry, depth):
+        if entry.name == "file3":
+            raise OSError("Operation not permitted")
+
+    walker = PermissionsWalker(root, apply, workers=4, errors=batches.append, errors_batch_size=4).run()
+
+    assert walker.failed == 10
+    assert walker.processed == 100
+    assert sum(len(batch) for batch in batches) == 10
+    assert len(batches) < 10
+    assert all(error == "Operation not permitted" for batch in batches for path, error in batch)
+
+
+@pytest.mark.timeout(60)
+def test__permissions_walker__abort(tree):
+    root = tree(50, 20)
+    aborted = threading.Event()
+
+    def apply(entry, depth):
+        if entry.name == "file10":
+            aborted.set()
+
+    walker = PermissionsWalker(root, apply, workers=4, aborted=aborted.is_set).run()
+
+    assert walker.processed < 50 * 20
+
+
+@pytest.mark.timeout(60)
+def test__permissions_walker__progress(tree):
+    root = tree(20, 10)
+    progress = []
+
+    def apply(entry, depth):
+        time.sleep(0.001)
+
+    walker = PermissionsWalker(
+        root, apply, workers=2, progress=lambda *args: progress.append(args), progress_interval=0.05,
+    ).run()
+
+    assert progress
+    assert all(processed <= walker.processed for processed, files_per_second in progress)
+    assert all(files_per_second > 0 for processed, files_per_second in progress)
+
+
+@pytest.mark.timeout(120)
+def test__permissions_walker__benchmark(tree):
+    root = tree(500, 100, depth=4)
+
+    def apply(entry, depth):
+        with entry.open() as fd:
+            os.fchmod(fd, 0o770 if entry.is_dir else 0o660)
+
+    def sequential():
+        processed = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in dirnames + filenames:
+                path = os.path.join(dirpath, name)
+                os.chmod(path, 0o770 if name in dirnames else 0o660, follow_symlinks=False)
+                processed += 1
+        return processed
+
+    started = time.monotonic()
+    assert sequential() == 500 * 101
+    sequential_time = time.monotonic() - started
+
+    started = time.monotonic()
+    walker = PermissionsWalker(root, apply, workers=8).run()
+    walker_time = time.monotonic() - started
+
+    assert walker.processed == 500 * 101
+    # Generous bound so this does not fail on a loaded machine. Python-level work is serialized by the GIL, the
+    # walker gains on filesystems where metadata operations block (i.e. ZFS on disks) which a tmpfs does not show.
+    assert walker_time < sequential_time * 3
+
+
+@pytest.fixture()
+def outside(tmpdir):
+    path = tmpdir / "outside"
+    path.mkdir()
+    for name in ("secret", "subdir_secret"):
+        (path / name).write("")
+        os.chmod(str(path / name), 0o600)
+    return str(path)
+
+
+def chmod(entry, depth):
+    with entry.open() as fd:
+        os.fchmod(fd, 0o777)
+
+
+@pytest.mark.timeout(60)
+def test__permissions_walker__file_swapped_for_symlink(tree, outside):
+    root = tree(5, 5)
+
+    def apply(entry, depth):
+        if entry.name == "file3":
+            # Replaced between the directory listing and the change
+            os.rename(entry.path, entry.path + ".orig")
+            os.symlink(os.path.join(outside, "secret"), entry.path)
+
+        chmod(entry, depth)
+
+    walker = PermissionsWalker(root, apply, workers=4).run()
+
+    assert walker.failed == 5
+    assert os.stat(os.path.join(outside, "secret")).st_mode & 0o777 == 0o600
+
+
+@pytest.mark.timeout(60)
+def test__permissions_walker__directory_swapped_for_symlink(tree, outside):
+    root = tree(5, 5)
+
+    def apply(entry, depth):
+        if entry.name == "dir0":
+            # Replaced before the walker descends into it
+            os.rename(entry.path, entry.path + ".orig")
+            os.symlink(outside, entry.path)
+            return
+
+        chmod(entry, depth)
+
+    walker = PermissionsWalker(root, apply, workers=4).run()
+
+    # Listing `dir0` fails instead of following the symlink
+    assert walker.failed == 1
+    assert all(os.stat(os.path.join(outside, name)).st_mode & 0o777 == 0o600 for name in os.listdir(outside))
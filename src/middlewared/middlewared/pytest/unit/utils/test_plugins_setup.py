@@ -0,0 +1,157 @@
+import ast
+import asyncio
+import os
+import time
+
+import pytest
+
+from middlewared.utils.plugins_setup import PluginsSetup, setup_dependencies, setup_order
+
+PLUGINS_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "..", "plugins")
+
+
+def plugins_setup_depends():
+    """
+    Reads `setup` and `setup_depends` declarations of the real plugins tree without importing it (plugins import
+    FreeBSD-only modules).
+    """
+    plugins = {}
+    for filename in sorted(os.listdir(PLUGINS_DIR)):
+        if not filename.endswith(".py") or filename == "__init__.py":
+            continue
+
+        with open(os.path.join(PLUGINS_DIR, filename)) as f:
+            tree = ast.parse(f.read())
+
+        has_setup = False
+        declared = None
+        for node in tree.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == "setup":
+                has_setup = True
+            if isinstance(node, ast.Assign) and any(
+                isinstance(target, ast.Name) and target.id == "setup_depends" for target in node.targets
+            ):
+                declared = ast.literal_eval(node.value)
+
+        if has_setup:
+            plugins[filename[:-3]] = declared
+
+    return plugins
+
+
+def test__plugins_setup__real_plugins_graph_is_acyclic():
+    plugins = plugins_setup_depends()
+    assert "system" in plugins
+
+    for name, declared in plugins.items():
+        for dep in declared or []:
+            assert dep in plugins, f"{name} depends on {dep} which does not have setup"
+
+    depends = setup_dependencies(plugins)
+    order = setup_order(depends)
+
+    assert sorted(order) == sorted(plugins)
+    assert order[0] == "system"
+    assert order.index("alert") < min(order.index(name) for name, declared in plugins.items() if declared is None)
+    # Slow setups do not wait for each other (or for setups of the plugins that did not declare dependencies)
+    for name in ("zettarepl", "cache", "disk", "ipmi", "network"):
+        assert depends[name] == {"system"}, name
+
+
+def test__setup_order__cycle():
+    with pytest.raises(ValueError) as e:
+        setup_order(setup_dependencies({"a": ["b"], "b": ["c"], "c": ["a"], "d": []}))
+
+    assert "a, b, c" in str(e.value)
+
+
+def test__setup_dependencies__undeclared_setups_keep_load_order():
+    depends = setup_dependencies({
+        "system": [],
+        "zettarepl": None,
+        "alert": None,
+        "network": [],
+        "disk": None,
+    })
+
+    assert depends == {
+        "system": set(),
+        "zettarepl": {"system", "alert"},
+        "alert": {"system"},
+        "network": set(),
+        "disk": {"system", "alert", "zettarepl"},
+    }
+    assert setup_order(depends)[:2] == ["network", "system"]
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.asyncio
+async def test__plugins_setup__runs_declared_setups_concurrently():
+    finished = []
+
+    def setup_func(name, delay):
+        async def setup(middleware):
+            await asyncio.sleep(delay)
+            finished.append(name)
+
+        return setup
+
+    def sync_setup(middleware):
+        finished.append("sync")
+
+    plugins_setup = PluginsSetup([
+        ("system", setup_func("system", 0.1), []),
+        ("alert", setup_func("alert", 0.1), ["system"]),
+        ("zettarepl", setup_func("zettarepl", 0.3), None),
+        ("disk", setup_func("disk", 0.3), None),
+        ("sync", sync_setup, None),
+        ("unscheduled_reboot_alert", setup_func("unscheduled_reboot_alert", 0.1), ["zettarepl", "missing"]),
+        ("network", setup_func("network", 0.5), []),
+    ])
+
+    started = time.monotonic()
+    await plugins_setup.run(None)
+
+    # Sequential run would take 1.4 seconds
+    assert time.monotonic() - started < 1.2
+    assert finished[:2] == ["system", "alert"]
+    # Setups that did not declare dependencies run one after another in load order
+    assert finished.index("zettarepl") < finished.index("disk") < finished.index("sync")
+    assert finished[-1] == "sync"
+
+    profile = {setup["name"]: setup for setup in plugins_setup.__encode__()["setups"]}
+    assert profile["unscheduled_reboot_alert"]["depends"] == ["zettarepl"]
+    assert profile["disk"]["depends"] == ["alert", "system", "zettarepl"]
+    assert profile["network"]["started"] == pytest.approx(0, abs=0.1)
+    assert profile["zettarepl"]["started"] == pytest.approx(0.2, abs=0.1)
+    assert profile["disk"]["started"] == pytest.approx(0.5, abs=0.1)
+    assert profile["unscheduled_reboot_alert"]["started"] == pytest.approx(0.5, abs=0.1)
+    assert {name for name, setup in profile.items() if setup["critical"]} == {
+        "system", "alert", "zettarepl", "disk", "sync",
+    }
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.asyncio
+async def test__plugins_setup__failure():
+    called = []
+
+    async def failing(middleware):
+        raise ValueError("failed")
+
+    async def setup(middleware):
+        called.append(None)
+
+    plugins_setup = PluginsSetup([
+        ("system", failing, []),
+        ("alert", setup, ["system"]),
+        ("independent", setup, []),
+    ])
+
+    with pytest.raises(ValueError):
+        await plugins_setup.run(None)
+
+    assert len(called) == 1
+    profile = {setup["name"]: setup for setup in plugins_setup.__encode__()["setups"]}
+    assert profile["system"]["error"] == "ValueError('failed')"
+    assert profile["alert"]["started"] is None
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import pytest
+
+from middlewared.utils.process_pool import ProcessPool
+
+
+async def timed(coro):
+    started = time.monotonic()
+    await coro
+    return time.monotonic() - started
+
+
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test__process_pool__short_calls_are_not_starved():
+    pool = ProcessPool("test", None, max_workers=2, long_max_workers=1)
+    pool.start()
+    # Warm up both workers
+    await asyncio.gather(*[pool.run("short", time.sleep, 0.1) for i in range(2)])
+
+    slow = [asyncio.ensure_future(pool.run("long", time.sleep, 0.5)) for i in range(4)]
+    await asyncio.sleep(0.05)
+    fast = await asyncio.gather(*[timed(pool.run("short", sum, [1, 2, 3])) for i in range(20)])
+    await asyncio.gather(*slow)
+
+    # Long calls only ever occupy one worker so short calls do not wait for them
+    assert max(fast) < 0.4
+
+    stats = pool.__encode__()["lanes"]
+    assert stats["long"]["completed"] == 4
+    # First long call is dispatched immediately
+    assert stats["long"]["max_queue_depth"] == 3
+    assert stats["long"]["wait_time_max"] >= 1.0
+    assert stats["short"]["completed"] == 22
+    assert stats["short"]["running"] == stats["long"]["running"] == 0
+
+
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test__process_pool__cancel_waiting_call():
+    pool = ProcessPool("test", None, max_workers=1)
+
+    running = asyncio.ensure_future(pool.run("long", time.sleep, 0.5))
+    await asyncio.sleep(0.05)
+    waiting = asyncio.ensure_future(pool.run("long", time.sleep, 0.5))
+    await asyncio.sleep(0.05)
+    waiting.cancel()
+    await running
+
+    assert not pool.waiting["long"]
+    assert await pool.run("short", sum, [1, 2]) == 3
+
+
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test__process_pool__configure():
+    pool = ProcessPool("test", None, max_workers=2)
+    pool.start()
+
+    pool.configure(max_workers=4)
+
+    assert pool.executor._max_workers == 4
+    assert pool.long_max_workers == 3
+    assert await pool.run("short", sum, [1, 2]) == 3
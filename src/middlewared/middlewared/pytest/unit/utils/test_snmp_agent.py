@@ -0,0 +1,133 @@
+import io
+import os
+import signal
+import time
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from middlewared.utils.snmp_agent import (
+    get_datasets, get_zfs_arc_miss_percent, DatasetsThread, ZilstatThread, fill_dataset_table, invalidate_on_signal,
+)
+
+
+def dataset(name, type, **properties):
+    return SimpleNamespace(
+        type=SimpleNamespace(name=type),
+        properties={
+            "name": SimpleNamespace(value=name),
+            **{k: SimpleNamespace(rawvalue=str(v)) for k, v in properties.items()},
+        },
+    )
+
+
+class FakeZFS:
+    def __init__(self, datasets):
+        self.datasets = datasets
+
+    @property
+    def pools(self):
+        return [SimpleNamespace(root_dataset=SimpleNamespace(children_recursive=list(self.datasets)))]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test__get_datasets():
+    zfs = FakeZFS([
+        dataset("tank/data", "FILESYSTEM", used=4096, available=8192),
+        dataset("tank/zvol", "VOLUME", volsize=2 ** 50, used=2 ** 44, available=2 ** 45),
+        dataset("tank/data@snap", "SNAPSHOT"),
+    ])
+
+    datasets, zvols = get_datasets(zfs)
+
+    assert datasets == [("tank/data", 4096, 3, 1, 2)]
+    # Values are scaled to fit Integer32
+    assert zvols == [("tank/zvol", 2 ** 20, 2 ** 30, 2 ** 24, 2 ** 25)]
+
+
+def test__get_zfs_arc_miss_percent():
+    assert get_zfs_arc_miss_percent({"kstat.zfs.misc.arcstats.hits": 75, "kstat.zfs.misc.arcstats.misses": 25}) == 25
+    assert get_zfs_arc_miss_percent({"kstat.zfs.misc.arcstats.hits": 0, "kstat.zfs.misc.arcstats.misses": 0}) == 0
+
+
+def test__datasets_thread__rebuilds_when_stale_and_polled():
+    clock = Clock()
+    zfs = FakeZFS([dataset("tank/data", "FILESYSTEM", used=4096, available=4096)])
+    thread = DatasetsThread(lambda: zfs, ttl=10, active_period=600, clock=clock)
+
+    assert thread.needs_rebuild()
+    thread.rebuild(zfs)
+    assert thread.get_snapshot()[0] == 1
+    assert not thread.needs_rebuild()
+
+    # Stale snapshot is not rebuilt unless agent is being polled
+    clock.now = 20
+    assert not thread.needs_rebuild()
+    thread.polled()
+    assert thread.needs_rebuild()
+    assert thread.event.is_set()
+
+    thread.rebuild(zfs)
+    # Agent was not polled for a long time
+    clock.now = 1000
+    assert not thread.needs_rebuild()
+
+
+def test__datasets_thread__sighup_invalidates_snapshot():
+    zfs = FakeZFS([dataset("tank/data", "FILESYSTEM", used=4096, available=4096)])
+    thread = DatasetsThread(lambda: zfs, ttl=3600)
+    previous_handler = signal.getsignal(signal.SIGHUP)
+    invalidate_on_signal(thread)
+    try:
+        thread.start()
+        for i in range(100):
+            if thread.get_snapshot()[0] == 1:
+                break
+            time.sleep(0.01)
+        assert [row[0] for row in thread.get_snapshot()[1]] == ["tank/data"]
+
+        zfs.datasets.append(dataset("tank/new", "FILESYSTEM", used=4096, available=4096))
+        os.kill(os.getpid(), signal.SIGHUP)
+        for i in range(100):
+            if thread.get_snapshot()[0] == 2:
+                break
+            time.sleep(0.01)
+        assert [row[0] for row in thread.get_snapshot()[1]] == ["tank/data", "tank/new"]
+    finally:
+        signal.signal(signal.SIGHUP, previous_handler)
+
+
+def test__zilstat_thread():
+    output = "header\n" + "".join(f"0 0 0 0 0 0 {ops}\n" for ops in range(1, 13)) + "garbage\n"
+    proc = Mock(stdout=io.StringIO(output))
+    proc.poll.side_effect = lambda: None if proc.stdout.tell() < len(output) else 0
+    popen = Mock(return_value=proc)
+    thread = ZilstatThread(popen=popen)
+
+    thread.run()
+
+    assert popen.call_args[0][0] == ["/usr/local/bin/zilstat", "1"]
+    assert thread.get_ops(1) == 12
+    assert thread.get_ops(5) == 12 + 11 + 10 + 9 + 8
+    assert thread.get_ops(10) == sum(range(3, 13))
+
+
+def test__fill_dataset_table():
+    agent = Mock()
+    agent.Integer32 = lambda v: ("Integer32", v)
+    agent.DisplayString = lambda v: ("DisplayString", v)
+    table = Mock()
+
+    fill_dataset_table(agent, table, [("tank/a", 4096, 3, 1, 2), ("tank/b", 4096, 6, 2, 4)])
+
+    table.clear.assert_called_once_with()
+    assert [c[0][0] for c in table.addRow.call_args_list] == [[("Integer32", 1)], [("Integer32", 2)]]
+    row = table.addRow.return_value
+    assert row.setRowCell.call_args_list[5][0] == (2, ("DisplayString", "tank/b"))
+    assert row.setRowCell.call_args_list[9][0] == (6, ("Integer32", 4))
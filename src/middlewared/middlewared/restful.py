@@ -586,16 +586,11 @@ class Resource(object):
             })
             await resp.prepare(req)
 
-            loop = asyncio.get_event_loop()
-
-            def do_copy():
-                while True:
-                    read = download_pipe.r.read(1048576)
-                    if read == b'':
-                        break
-                    asyncio.run_coroutine_threadsafe(resp.write(read), loop=loop).result()
-
-            await self.middleware.run_in_thread(do_copy)
+            while True:
+                read = await download_pipe.read_async(1048576)
+                if read == b'':
+                    break
+                await resp.write(read)
 
             await resp.drain()
             return resp
@@ -2,6 +2,7 @@ from collections import defaultdict, namedtuple
 from functools import wraps
 
 import asyncio
+import contextvars
 import errno
 import inspect
 import json
@@ -18,6 +19,7 @@ from middlewared.schema import accepts, Bool, Dict, Int, List, Ref, Str
 from middlewared.service_exception import CallException, CallError, ValidationError, ValidationErrors  # noqa
 from middlewared.utils import filter_list
 from middlewared.utils.debug import get_frame_details, get_threads_stacks
+from middlewared.utils.process_pool import LANES
 from middlewared.logger import Logger
 from middlewared.job import Job
 from middlewared.pipe import Pipes
@@ -35,8 +37,18 @@ def item_method(fn):
     return fn
 
 
-def job(lock=None, lock_queue_size=None, logs=False, process=False, pipes=None, check_pipes=True, transient=False):
-    """Flag method as a long running job."""
+def job(
+    lock=None, lock_queue_size=None, logs=False, process=False, pipes=None, check_pipes=True, transient=False,
+    progress_interval=1, index=False, history_result=True,
+):
+    """Flag method as a long running job.
+
+    `progress_interval` is the minimum interval (in seconds) between job progress events sent to clients.
+    More frequent `job.set_progress` calls are coalesced, final job state is always sent.
+
+    `index` keeps track of the latest job for each value of the first argument (i.e. task id), see `JobsIndex`.
+
+    `history_result=False` does not store job result in on-disk job history (i.e. when it contains private keys)."""
     def check_job(fn):
         fn._job = {
             'lock': lock,
@@ -46,6 +58,9 @@ def job(lock=None, lock_queue_size=None, logs=False, process=False, pipes=None,
             'pipes': pipes or [],
             'check_pipes': check_pipes,
             'transient': transient,
+            'progress_interval': progress_interval,
+            'index': index,
+            'history_result': history_result,
         }
         return fn
     return check_job
@@ -142,6 +157,20 @@ def threaded(pool):
     return m
 
 
+def process_pool_lane(lane):
+    """
+    Sets process pool priority lane (`short` or `long`) of a method of a service that runs in a process pool.
+    By default, jobs run in `long` lane and plain methods run in `short` lane.
+    """
+    if lane not in LANES:
+        raise ValueError(f'Invalid process pool lane: {lane!r}')
+
+    def m(fn):
+        fn._process_pool_lane = lane
+        return fn
+    return m
+
+
 def no_auth_required(fn):
     """Authentication is not required to use the given method."""
     fn._no_auth_required = True
@@ -191,6 +220,9 @@ class ServiceBase(type):
       - datastore_extend: datastore `extend` option used in common `query` method
       - datastore_prefix: datastore `prefix` option used in helper methods
       - datastore_filters: datastore default filters to be used in `query` method
+      - datastore_prefetch_related: fetch foreign keys and many to many fields with a query per relation
+        instead of a query per row in `query` method
+      - datastore_encrypted_fields: fields encrypted with `pwenc` that are decrypted by datastore (before `extend`)
       - service: system service `name` option used by `SystemServiceService`
       - service_model: system service datastore model option used by `SystemServiceService` (`service` if used if not provided)
       - service_verb: verb to be used on update (default to `reload`)
@@ -200,7 +232,7 @@ class ServiceBase(type):
       - private: whether or not the service is deemed private
       - verbose_name: human-friendly singular name for the service
       - thread_pool: thread pool to use for threaded methods
-      - process_pool: process pool to run service methods
+      - process_pool: process pool to run service methods (`True` for the default pool or a pool name)
 
     """
 
@@ -223,6 +255,8 @@ class ServiceBase(type):
             'datastore_extend': None,
             'datastore_extend_context': None,
             'datastore_filters': None,
+            'datastore_prefetch_related': False,
+            'datastore_encrypted_fields': None,
             'service': None,
             'service_model': None,
             'service_verb': 'reload',
@@ -256,8 +290,85 @@ class Service(object, metaclass=ServiceBase):
         self.middleware = middleware
 
 
+# Set by `ServiceActionsScope` for the calls made in its scope
+service_actions_scope = contextvars.ContextVar('service_actions_scope', default=None)
+
+
+class DeferredResult:
+    """
+    Returned by the calls made in `ServiceActionsScope` instead of the result of the action they deferred (it is
+    truthy so callers checking the result go on). The real result is reported when the scope ends.
+    """
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return '<deferred>'
+
+
+DEFERRED = DeferredResult()
+
+
+class ServiceActionsScope:
+    """
+    Defers service changes (rc.conf generation and service reload/restart) requested by the calls made in its scope
+    so each of them only runs once when the scope ends, no matter how many calls requested it.
+
+    `caller` identifies the call that is currently running in the scope. When the scope ends `report` lists every
+    action that was run with `callers` that requested it, its `result` and `error` if it failed.
+    """
+
+    def __init__(self):
+        self.caller = None
+        self.actions = {}
+        self.report = []
+        self.token = None
+        self.closed = False
+
+    def defer(self, action, func, *args):
+        """
+        Returns `False` if the scope has already ended (tasks created in the scope still see it), the caller must run
+        the action itself then.
+        """
+        if self.closed:
+            return False
+
+        deferred = self.actions.get(action)
+        if deferred is None:
+            deferred = self.actions[action] = {'func': func, 'args': args, 'callers': []}
+
+        if self.caller is not None and self.caller not in deferred['callers']:
+            deferred['callers'].append(self.caller)
+
+        return True
+
+    async def __aenter__(self):
+        self.token = service_actions_scope.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        service_actions_scope.reset(self.token)
+        self.closed = True
+
+        for action, deferred in list(self.actions.items()):
+            result = error = None
+            try:
+                result = await deferred['func'](*deferred['args'])
+            except Exception as e:
+                error = str(e)
+
+            self.report.append({'action': action, 'callers': deferred['callers'], 'result': result, 'error': error})
+
+        self.actions = {}
+
+
 class ServiceChangeMixin:
     async def _service_change(self, service, verb):
+        scope = service_actions_scope.get()
+        if scope is not None and scope.defer(f'service.{verb} {service} (if running)', self._service_change, service,
+                                             verb):
+            return
 
         svc_state = (await self.middleware.call(
             'service.query',
@@ -295,6 +406,7 @@ class ConfigService(ServiceChangeMixin, Service):
         options['extend'] = self._config.datastore_extend
         options['extend_context'] = self._config.datastore_extend_context
         options['prefix'] = self._config.datastore_prefix
+        options['encrypted_fields'] = self._config.datastore_encrypted_fields or []
         return await self._get_or_insert(self._config.datastore, options)
 
     async def update(self, data):
@@ -330,7 +442,8 @@ class SystemServiceService(ConfigService):
             f'services.{self._config.service_model or self._config.service}', {
                 'extend': self._config.datastore_extend,
                 'extend_context': self._config.datastore_extend_context,
-                'prefix': self._config.datastore_prefix
+                'prefix': self._config.datastore_prefix,
+                'encrypted_fields': self._config.datastore_encrypted_fields or [],
             }
         )
 
@@ -373,6 +486,8 @@ class CRUDService(ServiceChangeMixin, Service):
         options['extend'] = self._config.datastore_extend
         options['extend_context'] = self._config.datastore_extend_context
         options['prefix'] = self._config.datastore_prefix
+        options['encrypted_fields'] = self._config.datastore_encrypted_fields or []
+        options['prefetch_related'] = self._config.datastore_prefetch_related
 
         # In case we are extending which may transform the result in numerous ways
         # we can only filter the final result.
@@ -478,12 +593,98 @@ class CoreService(Service):
 
     @filterable
     def get_jobs(self, filters=None, options=None):
-        """Get the long running jobs."""
-        jobs = filter_list([
-            i.__encode__() for i in list(self.middleware.jobs.all().values())
-        ], filters, options)
+        """
+        Get the long running jobs.
+
+        Finished jobs are kept in an on-disk history so they can also be queried after they were
+        removed from memory (or after middleware restart).
+        """
+        jobs = filter_list(self.middleware.jobs.query(filters, options), filters, options)
         return jobs
 
+    @filterable
+    def get_job_locks(self, filters=None, options=None):
+        """
+        Get the job shared locks currently in use, along with their queue depth
+        and wait time statistics (in seconds). Statistics of idle locks are kept as well.
+        """
+        return filter_list(self.middleware.jobs.locks_encoded(), filters, options)
+
+    @accepts()
+    def get_metrics(self):
+        """
+        Get per-method call counts and latency histograms (in seconds) split by execution path
+        (`coroutine`, `thread_pool`, `io_thread`, `process_pool`, `job` and `websocket` for the whole
+        websocket call) and the most recent calls that took longer than a second.
+
+        Arguments of slow calls have private fields redacted. Websocket calls of methods that do not exist are all
+        recorded as `<unknown>`.
+        """
+        return self.middleware.metrics.__encode__()
+
+    @accepts()
+    def get_startup_profile(self):
+        """
+        Get plugins setup timings (in seconds) of the last middlewared start.
+
+        Setups run concurrently as soon as setups they depend on are finished. Setups of plugins that do not declare
+        their dependencies run one after another in load order. `started` is relative to the beginning
+        of plugins setup. Setups marked as `critical` are on the chain that finished last and determine how long the
+        whole plugins setup took, others ran concurrently with them.
+        """
+        if self.middleware.plugins_setup is None:
+            return None
+
+        return self.middleware.plugins_setup.__encode__()
+
+    @accepts()
+    def get_io_thread_pool(self):
+        """
+        Get io thread pool saturation statistics: worker counts, calls queued because all workers were busy
+        (`saturated`) or because the method already had too many calls running (`throttled`), queue wait time
+        (in seconds) and calls running or queued per method.
+        """
+        return self.middleware.run_in_thread_executor.__encode__()
+
+    @filterable
+    def get_process_pools(self, filters=None, options=None):
+        """
+        Get the worker process pools along with per-lane queue depth, wait time and run time
+        statistics (in seconds).
+        """
+        return filter_list([
+            i.__encode__() for i in self.middleware.get_process_pools().values()
+        ], filters, options)
+
+    @accepts(
+        Str('name'),
+        Dict(
+            'process-pool-configure',
+            Int('max_workers'),
+            Int('long_max_workers'),
+        ),
+    )
+    def process_pool_configure(self, name, data):
+        """
+        Change sizing of worker process pool `name`.
+
+        `long_max_workers` is the number of workers that can be occupied by long running calls (jobs and methods
+        marked as such) at the same time. The remaining workers are reserved for short calls.
+        """
+        pool = self.middleware.get_process_pools().get(name)
+        if pool is None:
+            raise CallError(f'Process pool {name!r} does not exist', errno.ENOENT)
+
+        verrors = ValidationErrors()
+        for k, v in data.items():
+            if v < 1:
+                verrors.add(f'process-pool-configure.{k}', 'Must be greater than 0')
+        if verrors:
+            raise verrors
+
+        pool.configure(**data)
+        return pool.__encode__()
+
     @accepts(Int('id'))
     @job()
     def job_wait(self, job, id):
@@ -708,7 +909,7 @@ class CoreService(Service):
 
         Returns the job id and the URL for download.
         """
-        job = await self.middleware.call(method, *args, pipes=Pipes(output=self.middleware.pipe()))
+        job = await self.middleware.call(method, *args, pipes=Pipes(output=self.middleware.pipe(True)))
         token = await self.middleware.call('auth.generate_token', 300, {'filename': filename, 'job': job.id})
         self.middleware.fileapp.register_job(job.id)
         return job.id, f'/_download/{job.id}?auth_token={token}'
@@ -836,28 +1037,44 @@ class CoreService(Service):
         Result will be the message returned by the method being called,
         or a string of an error, in which case the error key will be the
         exception
+
+        Service reloads/restarts requested by the calls are only run once,
+        after all the calls. If one of them fails, its error is reported for
+        the calls that requested it. Calls of `service.reload` and
+        `service.restart` themselves get the result of that single run.
         """
         statuses = []
         progress_step = 100 / len(params)
         current_progress = 0
 
-        for p in params:
-            try:
-                msg = await self.middleware.call(method, *p)
-                error = None
-
-                if isinstance(msg, Job):
-                    job = msg
-                    msg = await msg.wait()
-
-                    if job.error:
-                        error = job.error
-
-                statuses.append({"result": msg, "error": error})
-            except Exception as e:
-                statuses.append({"result": None, "error": str(e)})
-
-            current_progress += progress_step
-            job.set_progress(current_progress)
+        # Service changes requested by the calls are only applied once, after all of them
+        async with ServiceActionsScope() as scope:
+            for i, p in enumerate(params):
+                scope.caller = i
+                try:
+                    msg = await self.middleware.call(method, *p)
+                    error = None
+
+                    if isinstance(msg, Job):
+                        job = msg
+                        msg = await msg.wait()
+
+                        if job.error:
+                            error = job.error
+
+                    statuses.append({"result": msg, "error": error})
+                except Exception as e:
+                    statuses.append({"result": None, "error": str(e)})
+
+                current_progress += progress_step
+                job.set_progress(current_progress)
+
+        for action in scope.report:
+            for i in action['callers']:
+                if statuses[i]['result'] is DEFERRED:
+                    # The call itself was the deferred action (i.e. `service.restart`)
+                    statuses[i]['result'] = action['result']
+                if action['error'] and statuses[i]['error'] is None:
+                    statuses[i]['error'] = f'{action["action"]} failed: {action["error"]}'
 
         return statuses
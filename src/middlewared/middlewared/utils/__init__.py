@@ -25,6 +25,8 @@ if '/usr/local/lib' not in sys.path:
 
 BUILDTIME = None
 VERSION = None
+# sqlite allows at most 999 variables in a query
+DJANGO_PREFETCH_CHUNK_SIZE = 500
 
 
 def bisect(condition, iterable):
@@ -39,8 +41,28 @@ def bisect(condition, iterable):
     return a, b
 
 
+def django_queryset_prefetch_related(qs, lookups, chunk_size=DJANGO_PREFETCH_CHUNK_SIZE):
+    """
+    Iterate over `qs` fetching related objects of `lookups` with a query per relation for every `chunk_size` rows.
+    Chunks keep the number of SQL variables of each related objects query under sqlite limit.
+    """
+    from django.db.models import prefetch_related_objects
+
+    chunk = []
+    for obj in qs:
+        chunk.append(obj)
+        if len(chunk) == chunk_size:
+            prefetch_related_objects(chunk, *lookups)
+            yield from chunk
+            chunk = []
+
+    if chunk:
+        prefetch_related_objects(chunk, *lookups)
+        yield from chunk
+
+
 def django_modelobj_serialize(middleware, obj, extend=None, extend_context=None, extend_context_value=None,
-                              field_prefix=None, select=None):
+                              field_prefix=None, select=None, encrypted_fields=None, decrypt=None):
     from django.db.models.fields.related import ForeignKey, ManyToManyField
     from freenasUI.contrib.IPAddressField import (
         IPAddressField, IP4AddressField, IP6AddressField
@@ -74,6 +96,9 @@ def django_modelobj_serialize(middleware, obj, extend=None, extend_context=None,
                 data[name].append(django_modelobj_serialize(middleware, o))
         else:
             data[name] = value
+    for name in encrypted_fields or []:
+        if name in data:
+            data[name] = decrypt(data[name])
     if extend:
         if extend_context:
             data = middleware.call_sync(extend, data, extend_context_value)
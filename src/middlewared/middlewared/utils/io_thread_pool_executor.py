@@ -1,14 +1,27 @@
+from collections import deque
 from concurrent.futures import _base
+import contextvars
+import functools
 import itertools
 import logging
-import queue
-import random
 import threading
+import time
 
 from bsd.threading import set_thread_name
 
 logger = logging.getLogger(__name__)
 
+# Set in worker threads. Coroutines scheduled from a worker thread (i.e. by `call_sync`) inherit it so calls made by
+# a method that is already running in a worker thread can be recognized.
+in_io_thread = contextvars.ContextVar('in_io_thread', default=False)
+
+
+def caller_key(fn):
+    while isinstance(fn, functools.partial):
+        fn = fn.func
+
+    return getattr(fn, '__qualname__', None) or type(fn).__qualname__
+
 
 class WorkItem(object):
     def __init__(self, future, fn, args, kwargs):
@@ -17,6 +30,9 @@ class WorkItem(object):
         self.args = args
         self.kwargs = kwargs
 
+        self.key = caller_key(fn)
+        self.submitted_at = time.monotonic()
+
     def run(self):
         if not self.future.set_running_or_notify_cancel():
             return
@@ -32,100 +48,238 @@ class WorkItem(object):
 
 
 class Worker:
-    def __init__(self, name, executor):
+    def __init__(self, name, executor, work_item):
         self.name = name
         self.executor = executor
 
-        self.busy = False
+        # Work items are handed to the worker directly by the executor
+        self.work_item = work_item
+        self.event = threading.Event()
 
         self.thread = threading.Thread(name=self.name, daemon=True, target=self._target)
         self.thread.start()
 
     def _target(self):
         set_thread_name(self.name)
+        in_io_thread.set(True)
         try:
-            while True:
-                work_item = self.executor.get_work_item(self)
-                if work_item is None:
-                    return
+            work_item = self.work_item
+            if work_item is None:
+                work_item = self.executor.wait_for_work_item(self)
 
+            while work_item is not None:
                 work_item.run()
-                del work_item
+                work_item = self.executor.get_work_item(self, work_item)
         except Exception:
             logger.critical("Exception in worker", exc_info=True)
         finally:
             self.executor.remove_worker(self)
 
     def __repr__(self):
-        return f"<Worker {self.name}{' busy' if self.busy else ''}>"
+        return f"<Worker {self.name}{' busy' if self.work_item is not None else ''}>"
 
 
 class IoThreadPoolExecutor(_base.Executor):
-    def __init__(self, thread_name_prefix, min_workers):
+    """
+    Thread pool for blocking calls.
+
+    Idle workers are kept in a stack so a free worker is found in O(1) and the most recently used (warm) workers are
+    reused first while the ones at the bottom time out after `idle_timeout` seconds and exit (down to `min_workers`).
+
+    The pool grows on demand up to `max_workers`. One caller (function) can only have `max_workers_per_caller` calls
+    running at once so a burst of calls to one method can't monopolize the pool. Calls over these limits are queued,
+    queued calls of different callers are run in a round-robin fashion.
+
+    Calls submitted from the worker threads (i.e. a method that is already running in a worker thread calls another
+    one using `call_sync`) are not subject to the limits: their caller is waiting for them, so queueing them could
+    deadlock the pool.
+    """
+
+    def __init__(self, thread_name_prefix, min_workers, max_workers=None, max_workers_per_caller=None,
+                 idle_timeout=5.0):
         self.thread_name_prefix = thread_name_prefix
         self.counter = itertools.count()
 
-        self.work_queue = queue.Queue()
-
         self.min_workers = min_workers
-        self.workers = []
-        self.workers_busy_lock = threading.Lock()
-        for i in range(self.min_workers):
-            self._start_worker()
+        self.max_workers = max_workers
+        self.max_workers_per_caller = max_workers_per_caller
+        self.idle_timeout = idle_timeout
+
+        self.lock = threading.Lock()
+        self.workers = set()
+        self.idle = []
+        # caller -> running calls count
+        self.running = {}
+        # caller -> deque of queued work items
+        self.queued = {}
+        # Callers that have queued work items and are below their quota
+        self.ready = deque()
+
+        self.peak_workers = 0
+        self.submitted = 0
+        self.queued_count = 0
+        self.max_queued = 0
+        self.saturated = 0
+        self.throttled = 0
+        self.over_limit = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+        with self.lock:
+            for i in range(self.min_workers):
+                self.idle.append(self._start_worker(None))
 
     def submit(self, fn, *args, **kwargs):
         future = _base.Future()
         work_item = WorkItem(future, fn, args, kwargs)
 
-        self.work_queue.put(work_item)
+        with self.lock:
+            self.submitted += 1
 
-        start_worker = False
-        with self.workers_busy_lock:
-            if not any([not worker.busy for worker in self.workers]):
-                logger.trace("Starting new worker in namespace %r because there are no free workers",
-                             self.thread_name_prefix)
-                start_worker = True
-        if start_worker:
-            self._start_worker()
+            if in_io_thread.get():
+                if not self._has_free_worker():
+                    self.over_limit += 1
+                self._run(work_item)
+            elif not self._below_quota(work_item.key):
+                self.throttled += 1
+                self._enqueue(work_item)
+            elif not self._has_free_worker():
+                logger.trace("Queueing call in namespace %r because there are %d busy workers",
+                             self.thread_name_prefix, len(self.workers))
+                self.saturated += 1
+                self._enqueue(work_item)
+            else:
+                self._run(work_item)
 
         return future
 
-    def _start_worker(self):
-        worker = Worker(f'{self.thread_name_prefix}-{next(self.counter)}', self)
-        self.workers.append(worker)
+    def _has_free_worker(self):
+        return bool(self.idle) or self.max_workers is None or len(self.workers) < self.max_workers
 
-    def get_work_item(self, worker):
-        with self.workers_busy_lock:
-            worker.busy = False
+    def _below_quota(self, key):
+        return self.max_workers_per_caller is None or self.running.get(key, 0) < self.max_workers_per_caller
 
-        while True:
-            timeout = None
-            free_workers = sum([1 for worker in self.workers if not worker.busy])
-            if free_workers > self.min_workers:
-                logger.trace("Will probably need to shutdown %r because there are %d free workers",
-                             worker, free_workers)
-                timeout = random.uniform(4.0, 6.0)
-
-            try:
-                work_item = self.work_queue.get(True, timeout)
-            except queue.Empty:
-                with self.workers_busy_lock:
-                    free_workers = sum([1 for worker in self.workers if not worker.busy])
-                    if free_workers > self.min_workers:
-                        logger.trace("Shutting down %r because there are %d free workers", worker, free_workers)
-                        self.remove_worker(worker)
-                        return None
-
-                # Else, other worker has been shut down and now the number of workers is correct, let's run another
-                # iteration of this (now, probably with infinite timeout)
-            else:
-                with self.workers_busy_lock:
-                    worker.busy = True
+    def _enqueue(self, work_item):
+        queue = self.queued.get(work_item.key)
+        if queue is None:
+            queue = self.queued[work_item.key] = deque()
+            if self._below_quota(work_item.key):
+                self.ready.append(work_item.key)
+        queue.append(work_item)
+
+        self.queued_count += 1
+        self.max_queued = max(self.max_queued, self.queued_count)
+
+    def _dequeue(self):
+        while self.ready:
+            key = self.ready.popleft()
+            queue = self.queued.get(key)
+            if queue is None:
+                # Calls made from worker threads can take a caller over its quota and make it appear here twice
+                continue
+
+            work_item = queue.popleft()
+            self.queued_count -= 1
+
+            if not queue:
+                del self.queued[key]
 
+            self._account(work_item)
+
+            if queue and self._below_quota(key):
+                self.ready.append(key)
+
+            return work_item
+
+    def _account(self, work_item):
+        self.running[work_item.key] = self.running.get(work_item.key, 0) + 1
+
+        wait_time = time.monotonic() - work_item.submitted_at
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def _run(self, work_item):
+        self._account(work_item)
+
+        if self.idle:
+            worker = self.idle.pop()
+            worker.work_item = work_item
+            worker.event.set()
+        else:
+            self._start_worker(work_item)
+
+    def _start_worker(self, work_item):
+        worker = Worker(f'{self.thread_name_prefix}-{next(self.counter)}', self, work_item)
+        self.workers.add(worker)
+        self.peak_workers = max(self.peak_workers, len(self.workers))
+        return worker
+
+    def get_work_item(self, worker, finished_work_item):
+        with self.lock:
+            key = finished_work_item.key
+            self.running[key] -= 1
+            if not self.running[key]:
+                del self.running[key]
+
+            if (
+                self.max_workers_per_caller is not None and key in self.queued and
+                self.running.get(key, 0) == self.max_workers_per_caller - 1
+            ):
+                # It was at its quota and now it is not
+                self.ready.append(key)
+
+            work_item = self._dequeue()
+            if work_item is not None:
                 return work_item
 
+            worker.work_item = None
+            worker.event.clear()
+            self.idle.append(worker)
+
+        return self.wait_for_work_item(worker)
+
+    def wait_for_work_item(self, worker):
+        while True:
+            worker.event.wait(self.idle_timeout)
+
+            with self.lock:
+                if worker.work_item is not None:
+                    return worker.work_item
+
+                if len(self.workers) > self.min_workers:
+                    logger.trace("Shutting down %r because there are %d free workers", worker, len(self.idle))
+                    self.idle.remove(worker)
+                    self.workers.discard(worker)
+                    return None
+
     def remove_worker(self, worker):
-        try:
-            self.workers.remove(worker)
-        except ValueError:
-            pass
+        with self.lock:
+            self.workers.discard(worker)
+
+    def __encode__(self):
+        with self.lock:
+            return {
+                'workers': len(self.workers),
+                'idle_workers': len(self.idle),
+                'busy_workers': len(self.workers) - len(self.idle),
+                'peak_workers': self.peak_workers,
+                'min_workers': self.min_workers,
+                'max_workers': self.max_workers,
+                'max_workers_per_caller': self.max_workers_per_caller,
+                'submitted': self.submitted,
+                'queued': self.queued_count,
+                'max_queued': self.max_queued,
+                'saturated': self.saturated,
+                'throttled': self.throttled,
+                'over_limit': self.over_limit,
+                'wait_time_avg': self.wait_time_total / self.submitted if self.submitted else 0.0,
+                'wait_time_max': self.wait_time_max,
+                'callers': sorted([
+                    {
+                        'caller': key,
+                        'running': self.running.get(key, 0),
+                        'queued': len(self.queued.get(key, ())),
+                    }
+                    for key in set(self.running) | set(self.queued)
+                ], key=lambda caller: (-caller['running'], -caller['queued'], caller['caller'])),
+            }
@@ -0,0 +1,307 @@
+import contextlib
+import errno
+import logging
+import os
+import stat
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+INHERITANCE_FLAGS = ('FILE_INHERIT', 'DIRECTORY_INHERIT', 'NO_PROPAGATE_INHERIT', 'INHERIT_ONLY')
+
+
+def inherited_acls(acl):
+    """
+    Computes ACLs that NFSv4 inheritance rules give to descendants of a directory with `acl` (a list of ACEs as
+    returned by `bsd.acl.ACL.__getstate__`).
+
+    Returns `{(is_dir, is_child): acl}` where `is_child` means that the entry is an immediate child of the directory
+    (`NO_PROPAGATE_INHERIT` entries are only inherited by immediate children).
+    """
+    result = {}
+    for is_dir in (False, True):
+        for is_child in (False, True):
+            inherited = []
+            for ace in acl:
+                flags = ace['flags']
+                if flags.get('NO_PROPAGATE_INHERIT') and not is_child:
+                    continue
+
+                if is_dir:
+                    if not (flags.get('DIRECTORY_INHERIT') or flags.get('FILE_INHERIT')):
+                        continue
+                elif not flags.get('FILE_INHERIT'):
+                    continue
+
+                new_flags = dict(flags, INHERITED=True)
+                if not is_dir or flags.get('NO_PROPAGATE_INHERIT'):
+                    # Entry is not inherited any further
+                    for flag in INHERITANCE_FLAGS:
+                        new_flags[flag] = False
+                elif flags.get('DIRECTORY_INHERIT'):
+                    new_flags['INHERIT_ONLY'] = False
+                else:
+                    # `FILE_INHERIT` entry only applies to files in the directory, the directory only passes it on
+                    new_flags['INHERIT_ONLY'] = True
+
+                inherited.append(dict(ace, flags=new_flags))
+
+            result[(is_dir, is_child)] = inherited
+
+    return result
+
+
+class PermissionsEntry:
+    """
+    Directory entry found by `PermissionsWalker`.
+
+    Entries are only ever accessed relative to the descriptor of their parent directory (`dir_fd`) and without
+    following symbolic links so an entry that is replaced with a symbolic link while the walk is running can not
+    redirect changes outside of the tree. `path` is only meant for reporting.
+    """
+
+    __slots__ = ('dir_fd', 'name', 'path', 'is_dir', 'is_file', 'is_symlink')
+
+    def __init__(self, dir_fd, name, path, is_dir, is_file, is_symlink):
+        self.dir_fd = dir_fd
+        self.name = name
+        self.path = path
+        self.is_dir = is_dir
+        self.is_file = is_file
+        self.is_symlink = is_symlink
+
+    @contextlib.contextmanager
+    def open(self):
+        """
+        Opens a regular file or a directory. Fails (instead of following it) if the entry has been replaced with a
+        symbolic link.
+        """
+        flags = os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK | os.O_CLOEXEC
+        if self.is_dir:
+            flags |= os.O_DIRECTORY
+
+        fd = os.open(self.name, flags, dir_fd=self.dir_fd)
+        try:
+            mode = os.fstat(fd).st_mode
+            if not (stat.S_ISDIR(mode) or stat.S_ISREG(mode)):
+                raise OSError(errno.EINVAL, 'Not a regular file or a directory')
+
+            yield fd
+        finally:
+            os.close(fd)
+
+    def chown(self, uid, gid):
+        os.chown(self.name, uid, gid, dir_fd=self.dir_fd, follow_symlinks=False)
+
+
+class _Directory:
+    """
+    Open directory descriptor, shared by the directory listing and by its pending subdirectories.
+    """
+
+    __slots__ = ('fd', 'refs')
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.refs = 1
+
+
+class PermissionsWalker:
+    """
+    Calls `apply(entry, depth)` for every `PermissionsEntry` below `path` (`path` itself is not included, its
+    immediate children have `depth` 1).
+
+    Directories are listed by a bounded pool of `workers` threads. Mount points (i.e. child datasets) are not
+    entered unless `traverse` is set. Symbolic links are passed to `apply` but never followed. Subdirectories are
+    opened relative to their parent directory descriptor with `O_NOFOLLOW` so the walk never leaves the tree.
+
+    `progress(processed, files_per_second)` is called at most every `progress_interval` seconds. Failures (both
+    listing directories and `apply` calls) are collected as `(path, error)` and passed to `errors(batch)` in batches
+    of `errors_batch_size`. The walk stops as soon as `aborted()` returns `True`.
+    """
+
+    def __init__(self, path, apply, workers=8, traverse=False, progress=None, progress_interval=1.0, errors=None,
+                 errors_batch_size=100, aborted=None):
+        self.path = path
+        self.apply = apply
+        self.workers = workers
+        self.traverse = traverse
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.errors = errors
+        self.errors_batch_size = errors_batch_size
+        self.aborted = aborted or (lambda: False)
+
+        self.cv = threading.Condition()
+        # Directories to list, as `(parent, name, path, depth)`
+        self.pending = []
+        # Directories that are being listed
+        self.listing = 0
+        self.stopped = False
+
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.errors_batch = []
+        self.started_at = None
+        self.progress_at = None
+
+    def run(self):
+        self.started_at = self.progress_at = time.monotonic()
+
+        root = _Directory(os.open(self.path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC))
+        self.root_dev = os.fstat(root.fd).st_dev
+        self.pending.append((root, None, self.path, 1))
+
+        threads = [
+            threading.Thread(name=f'perm_walker-{i}', daemon=True, target=self._worker)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Aborted walk leaves directories that were not listed
+        with self.cv:
+            for parent, name, path, depth in self.pending:
+                self._release(parent)
+            self.pending = []
+
+        with self.lock:
+            self._flush_errors()
+
+        return self
+
+    @property
+    def files_per_second(self):
+        elapsed = time.monotonic() - self.started_at
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def _worker(self):
+        while True:
+            with self.cv:
+                while not self.pending and self.listing and not self.stopped:
+                    self.cv.wait()
+
+                if self.stopped or not self.pending:
+                    # Either aborted or all the directories were listed
+                    self.stopped = True
+                    self.cv.notify_all()
+                    return
+
+                parent, name, path, depth = self.pending.pop()
+                self.listing += 1
+
+            directory = None
+            try:
+                directory = self._open_directory(parent, name, path)
+            except OSError as e:
+                self._account(0, [(path, str(e))])
+            finally:
+                with self.cv:
+                    self._release(parent)
+
+            directories = []
+            if directory is not None:
+                try:
+                    directories = self._process_directory(directory, path, depth)
+                except Exception:
+                    logger.error('Unhandled exception while walking %r', path, exc_info=True)
+
+            with self.cv:
+                self.listing -= 1
+                if directory is not None:
+                    directory.refs += len(directories)
+                    self._release(directory)
+                self.pending.extend((directory, name, path, depth) for name, path, depth in directories)
+                self.cv.notify_all()
+
+    def _open_directory(self, parent, name, path):
+        if name is None:
+            # Root directory, `run` has already opened it
+            parent.refs += 1
+            return parent
+
+        fd = os.open(name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC, dir_fd=parent.fd)
+        if not self.traverse and os.fstat(fd).st_dev != self.root_dev:
+            # Mount point appeared after the directory was listed
+            os.close(fd)
+            return None
+
+        return _Directory(fd)
+
+    def _release(self, directory):
+        # Must be called with `self.cv` held
+        directory.refs -= 1
+        if directory.refs == 0:
+            os.close(directory.fd)
+
+    def _process_directory(self, directory, path, depth):
+        directories = []
+        processed = 0
+        errors = []
+        try:
+            with os.scandir(directory.fd) as it:
+                for dir_entry in it:
+                    if self.aborted():
+                        self._stop()
+                        break
+
+                    entry_path = os.path.join(path, dir_entry.name)
+                    is_dir = False
+                    try:
+                        is_dir = dir_entry.is_dir(follow_symlinks=False)
+                        if (
+                            is_dir and not self.traverse and
+                            dir_entry.stat(follow_symlinks=False).st_dev != self.root_dev
+                        ):
+                            continue
+
+                        self.apply(PermissionsEntry(
+                            directory.fd, dir_entry.name, entry_path, is_dir, dir_entry.is_file(follow_symlinks=False),
+                            dir_entry.is_symlink(),
+                        ), depth)
+                    except Exception as e:
+                        errors.append((entry_path, str(e)))
+                    else:
+                        processed += 1
+
+                    if is_dir:
+                        directories.append((dir_entry.name, entry_path, depth + 1))
+        except OSError as e:
+            errors.append((path, str(e)))
+
+        self._account(processed, errors)
+        return directories
+
+    def _stop(self):
+        with self.cv:
+            self.stopped = True
+            self.cv.notify_all()
+
+    def _account(self, processed, errors):
+        with self.lock:
+            self.processed += processed
+            self.failed += len(errors)
+            self.errors_batch.extend(errors)
+            if len(self.errors_batch) >= self.errors_batch_size:
+                self._flush_errors()
+
+            if self.progress is not None:
+                now = time.monotonic()
+                if now - self.progress_at >= self.progress_interval:
+                    self.progress_at = now
+                    self._call(self.progress, self.processed, self.files_per_second)
+
+    def _flush_errors(self):
+        if self.errors_batch and self.errors is not None:
+            self._call(self.errors, self.errors_batch)
+        self.errors_batch = []
+
+    def _call(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            logger.warning('Error in permissions walker callback %r', callback, exc_info=True)
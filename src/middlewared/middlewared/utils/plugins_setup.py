@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+# Plugins that do not declare `setup_depends` are set up after these. `system` configures timezone (see #72131) and
+# `alert` has to be loaded before other plugins can issue one-shot alerts during their initialization.
+DEFAULT_SETUP_DEPENDS = ('system', 'alert')
+
+
+def setup_dependencies(setup_depends):
+    """
+    Takes a dict of plugin name to its declared `setup_depends` (`None` if it did not declare any) in plugins load
+    order and returns a dict of plugin name to set of plugins that have to be set up before it.
+
+    Plugins that did not declare `setup_depends` might rely on plugins that were set up before them so they keep being
+    set up one after another in load order (after `DEFAULT_SETUP_DEPENDS`). Only plugins that declare their
+    dependencies are set up concurrently.
+
+    Dependencies on plugins that do not have `setup` (or are not loaded at all) are ignored.
+    """
+    depends = {}
+    previous = None
+    for name, declared in setup_depends.items():
+        if declared is None:
+            if name in DEFAULT_SETUP_DEPENDS:
+                declared = DEFAULT_SETUP_DEPENDS[:DEFAULT_SETUP_DEPENDS.index(name)]
+            else:
+                declared = DEFAULT_SETUP_DEPENDS + ((previous,) if previous else ())
+                previous = name
+
+        depends[name] = {dep for dep in declared if dep in setup_depends and dep != name}
+
+    return depends
+
+
+def setup_order(depends):
+    """
+    Returns plugin names sorted so that each plugin comes after all of its dependencies.
+
+    :raises ValueError: dependency graph has a cycle
+    """
+    order = []
+    remaining = {name: set(deps) for name, deps in depends.items()}
+    while remaining:
+        ready = sorted(name for name, deps in remaining.items() if not deps)
+        if not ready:
+            raise ValueError(f'Plugins setup dependency cycle between: {", ".join(sorted(remaining))}')
+
+        for name in ready:
+            remaining.pop(name)
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+        order.extend(ready)
+
+    return order
+
+
+class PluginSetup:
+    def __init__(self, name, func, depends):
+        self.name = name
+        self.func = func
+        self.depends = depends
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.critical = False
+
+    def __encode__(self, started):
+        return {
+            'name': self.name,
+            'depends': sorted(self.depends),
+            'started': self.started - started if self.started is not None else None,
+            'duration': self.finished - self.started if self.finished is not None else None,
+            'error': self.error,
+            'critical': self.critical,
+        }
+
+
+class PluginsSetup:
+    """
+    Runs plugins `setup` functions honoring their `setup_depends` declarations. Setups that do not depend on each other
+    run concurrently, setups of plugins that did not declare `setup_depends` run one after another in load order.
+
+    Records when each setup started and how long it took. Setups on the critical path (the chain of dependencies that
+    finished last) are marked as `critical`: these are the ones that delay boot, the others run in their shadow.
+    """
+
+    def __init__(self, setup_funcs):
+        """
+        :param setup_funcs: list of (plugin name, setup function, declared `setup_depends` or `None`) in plugins load
+            order
+        """
+        depends = setup_dependencies({name: declared for name, func, declared in setup_funcs})
+        self.order = setup_order(depends)
+        funcs = {name: func for name, func, declared in setup_funcs}
+        self.setups = {name: PluginSetup(name, funcs[name], depends[name]) for name in self.order}
+
+        self.started = None
+        self.finished = None
+
+    async def run(self, middleware, on_start=None):
+        """
+        :param on_start: called with (plugin name, number of setups started so far, total setups count) right before
+            each setup is run
+        :raises: first exception raised by a setup function (in dependency order). Setups depending on the failed one
+            are not run, independent setups are run to completion anyway.
+        """
+        self.started = time.monotonic()
+        counter = 0
+        tasks = {}
+
+        async def run_setup(setup):
+            nonlocal counter
+
+            for dep in setup.depends:
+                await tasks[dep]
+
+            counter += 1
+            if on_start:
+                on_start(setup.name, counter, len(self.setups))
+
+            setup.started = time.monotonic()
+            try:
+                call = setup.func(middleware)
+                # Allow setup to be a coroutine
+                if asyncio.iscoroutinefunction(setup.func):
+                    await call
+            except Exception as e:
+                setup.error = repr(e)
+                raise
+            finally:
+                setup.finished = time.monotonic()
+
+        for name in self.order:
+            tasks[name] = asyncio.ensure_future(run_setup(self.setups[name]))
+
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        self.finished = time.monotonic()
+
+        self._mark_critical_path()
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    def _mark_critical_path(self):
+        finished = [setup for setup in self.setups.values() if setup.finished is not None]
+        while finished:
+            setup = max(finished, key=lambda setup: setup.finished)
+            setup.critical = True
+            finished = [self.setups[dep] for dep in setup.depends if self.setups[dep].finished is not None]
+
+    def __encode__(self):
+        return {
+            'duration': self.finished - self.started if self.finished is not None else None,
+            'setups': [setup.__encode__(self.started) for setup in self.setups.values()],
+        }
@@ -0,0 +1,191 @@
+import asyncio
+from collections import deque
+import concurrent.futures
+import concurrent.futures.process
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LANES = ('short', 'long')
+
+
+class LaneStats:
+    def __init__(self):
+        self.running = 0
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.run_time_total = 0.0
+        self.run_time_max = 0.0
+
+    def __encode__(self, queue_depth):
+        return {
+            'running': self.running,
+            'queue_depth': queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'completed': self.completed,
+            'wait_time_avg': self.wait_time_total / self.completed if self.completed else 0.0,
+            'wait_time_max': self.wait_time_max,
+            'run_time_avg': self.run_time_total / self.completed if self.completed else 0.0,
+            'run_time_max': self.run_time_max,
+        }
+
+
+class ProcessPool:
+    """
+    Named pool of worker processes.
+
+    Calls are put into one of two priority lanes: `short` (i.e. quick queries) and `long` (i.e. jobs or heavy queries).
+    Calls from `long` lane may occupy at most `long_max_workers` workers so there is always a worker left for `short`
+    calls. When a worker becomes free, waiting `short` calls are dispatched first.
+
+    Calls are only handed to the underlying `ProcessPoolExecutor` when a worker is free so its internal queue is always
+    empty, the scheduling is done here.
+    """
+
+    def __init__(self, name, initializer, max_workers=5, long_max_workers=None):
+        self.name = name
+        self.initializer = initializer
+        self.max_workers = max_workers
+        self.long_max_workers = long_max_workers or max(max_workers - 1, 1)
+
+        self.executor = None
+        self.restarts = 0
+
+        self.waiting = {lane: deque() for lane in LANES}
+        self.stats = {lane: LaneStats() for lane in LANES}
+
+    def start(self):
+        """
+        Starts worker processes so they load all the plugins (and their imports) before the first call.
+        """
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=self.initializer,
+            )
+            self.executor._start_queue_management_thread()
+
+    def configure(self, max_workers=None, long_max_workers=None):
+        """
+        Changes pool sizing. Calls already running on old workers will be finished, new calls will go to the new
+        workers.
+        """
+        resize = max_workers is not None and max_workers != self.max_workers
+        if max_workers is not None:
+            self.max_workers = max_workers
+        if long_max_workers is not None or resize:
+            self.long_max_workers = long_max_workers or max(self.max_workers - 1, 1)
+        self.long_max_workers = min(self.long_max_workers, self.max_workers)
+
+        if resize and self.executor is not None:
+            self._restart()
+
+        self._dispatch()
+
+    def _restart(self):
+        executor = self.executor
+        self.executor = None
+        # `shutdown(wait=False)` races with executor queue management thread, wait for the old workers to finish their
+        # calls in a separate thread instead
+        threading.Thread(target=executor.shutdown, daemon=True).start()
+        self.start()
+
+    async def run(self, lane, method, *args, **kwargs):
+        if lane not in LANES:
+            raise ValueError(f'Invalid process pool lane: {lane!r}')
+
+        await self._acquire(lane)
+        started = time.monotonic()
+        try:
+            retries = 2
+            for i in range(retries):
+                executor = self._executor()
+                try:
+                    return await asyncio.get_event_loop().run_in_executor(
+                        executor, functools.partial(method, *args, **kwargs),
+                    )
+                except concurrent.futures.process.BrokenProcessPool:
+                    if i == retries - 1:
+                        raise
+
+                    if self.executor is executor:
+                        logger.warning('Process pool %r is broken, restarting', self.name)
+                        self.restarts += 1
+                        self._restart()
+        finally:
+            stats = self.stats[lane]
+            run_time = time.monotonic() - started
+            stats.run_time_total += run_time
+            stats.run_time_max = max(stats.run_time_max, run_time)
+            stats.completed += 1
+            self._release(lane)
+
+    def _executor(self):
+        if self.executor is None:
+            self.start()
+        return self.executor
+
+    async def _acquire(self, lane):
+        stats = self.stats[lane]
+        future = asyncio.get_event_loop().create_future()
+        queued_at = time.monotonic()
+        self.waiting[lane].append(future)
+        stats.max_queue_depth = max(stats.max_queue_depth, len(self.waiting[lane]))
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                try:
+                    self.waiting[lane].remove(future)
+                except ValueError:
+                    pass
+            else:
+                # Worker was already assigned to us
+                self._release(lane)
+            raise
+
+        wait_time = time.monotonic() - queued_at
+        stats.wait_time_total += wait_time
+        stats.wait_time_max = max(stats.wait_time_max, wait_time)
+
+    def _release(self, lane):
+        self.stats[lane].running -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.running() < self.max_workers:
+            if self.waiting['short']:
+                lane = 'short'
+            elif self.waiting['long'] and self.stats['long'].running < self.long_max_workers:
+                lane = 'long'
+            else:
+                break
+
+            future = self.waiting[lane].popleft()
+            if future.done():
+                continue
+
+            self.stats[lane].running += 1
+            future.set_result(None)
+
+    def running(self):
+        return sum(stats.running for stats in self.stats.values())
+
+    def __encode__(self):
+        return {
+            'name': self.name,
+            'max_workers': self.max_workers,
+            'long_max_workers': self.long_max_workers,
+            'restarts': self.restarts,
+            'lanes': {
+                lane: self.stats[lane].__encode__(len(self.waiting[lane]))
+                for lane in LANES
+            },
+        }
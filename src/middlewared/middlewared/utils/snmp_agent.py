@@ -0,0 +1,188 @@
+from collections import deque
+import os
+import signal
+import subprocess
+import threading
+import time
+
+__all__ = ["calculate_allocation_units", "get_zfs_arc_miss_percent", "get_datasets", "DatasetsThread",
+           "ZilstatThread", "fill_dataset_table", "invalidate_on_signal"]
+
+
+def calculate_allocation_units(*args):
+    allocation_units = 4096
+    while True:
+        values = tuple(map(lambda arg: int(arg / allocation_units), args))
+        if all(v < 2 ** 31 for v in values):
+            break
+
+        allocation_units *= 2
+
+    return allocation_units, values
+
+
+def get_zfs_arc_miss_percent(kstat):
+    arc_hits = kstat["kstat.zfs.misc.arcstats.hits"]
+    arc_misses = kstat["kstat.zfs.misc.arcstats.misses"]
+    arc_read = arc_hits + arc_misses
+    if arc_read > 0:
+        hit_percent = float(100 * arc_hits / arc_read)
+        miss_percent = 100 - hit_percent
+        return miss_percent
+    return 0
+
+
+def get_datasets(zfs):
+    """
+    Walks every pool's datasets and returns `(datasets, zvols)` rows of
+    `(name, allocation_units, size, used, available)`.
+    """
+    datasets = []
+    zvols = []
+    for zpool in zfs.pools:
+        for dataset in zpool.root_dataset.children_recursive:
+            if dataset.type.name == "FILESYSTEM":
+                used = int(dataset.properties["used"].rawvalue)
+                available = int(dataset.properties["available"].rawvalue)
+                allocation_units, (size, used, available) = calculate_allocation_units(
+                    used + available, used, available,
+                )
+                datasets.append((dataset.properties["name"].value, allocation_units, size, used, available))
+            if dataset.type.name == "VOLUME":
+                allocation_units, (volsize, used, available) = calculate_allocation_units(
+                    int(dataset.properties["volsize"].rawvalue),
+                    int(dataset.properties["used"].rawvalue),
+                    int(dataset.properties["available"].rawvalue),
+                )
+                zvols.append((dataset.properties["name"].value, allocation_units, volsize, used, available))
+
+    return datasets, zvols
+
+
+class DatasetsThread(threading.Thread):
+    """
+    Keeps a snapshot of dataset and zvol table rows.
+
+    Walking every dataset is expensive on systems with many datasets so it is only done when the snapshot was
+    invalidated (pools were imported/exported or the agent received SIGHUP) or when it is older than `ttl` seconds
+    and the agent was polled within the last `active_period` seconds. Table walks are served from the snapshot.
+
+    `zfs_factory` returns the object datasets are walked on (i.e. `libzfs.ZFS`).
+    """
+
+    def __init__(self, zfs_factory, ttl=10, active_period=600, clock=time.monotonic):
+        super().__init__()
+
+        self.daemon = True
+
+        self.zfs_factory = zfs_factory
+        self.ttl = ttl
+        self.active_period = active_period
+        self.clock = clock
+
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.invalidated = True
+        self.last_poll_at = None
+        self.built_at = None
+        self.generation = 0
+        self.datasets = []
+        self.zvols = []
+
+    def polled(self):
+        self.last_poll_at = self.clock()
+        if self.needs_rebuild():
+            self.event.set()
+
+    def invalidate(self):
+        self.invalidated = True
+        self.event.set()
+
+    def needs_rebuild(self):
+        if self.invalidated or self.built_at is None:
+            return True
+
+        now = self.clock()
+        return (
+            self.last_poll_at is not None and now - self.last_poll_at < self.active_period and
+            now - self.built_at >= self.ttl
+        )
+
+    def rebuild(self, zfs):
+        self.invalidated = False
+        datasets, zvols = get_datasets(zfs)
+        with self.lock:
+            self.datasets = datasets
+            self.zvols = zvols
+            self.built_at = self.clock()
+            self.generation += 1
+
+    def get_snapshot(self):
+        with self.lock:
+            return self.generation, self.datasets, self.zvols
+
+    def run(self):
+        zfs = self.zfs_factory()
+        while True:
+            if self.needs_rebuild():
+                try:
+                    self.rebuild(zfs)
+                except Exception as e:
+                    print(f"Failed to get datasets: {e!r}")
+
+            self.event.wait(self.ttl)
+            self.event.clear()
+
+
+def invalidate_on_signal(datasets_thread, signum=signal.SIGHUP):
+    signal.signal(signum, lambda signum, frame: datasets_thread.invalidate())
+
+
+class ZilstatThread(threading.Thread):
+    """
+    Runs a single `zilstat` process sampling every second and derives ZIL operations count for longer windows by
+    summing the last 1-second samples.
+    """
+
+    def __init__(self, windows=(1, 5, 10), popen=subprocess.Popen):
+        super().__init__()
+
+        self.daemon = True
+
+        self.popen = popen
+        self.lock = threading.Lock()
+        self.samples = deque([0], maxlen=max(windows))
+
+    def run(self):
+        zilstatproc = self.popen(
+            ["/usr/local/bin/zilstat", "1"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=os.setsid,
+        )
+        zilstatproc.stdout.readline().strip()
+        while zilstatproc.poll() is None:
+            output = zilstatproc.stdout.readline().strip().split()
+            if len(output) < 7:
+                continue
+
+            self.add_sample(int(output[6]))
+
+    def add_sample(self, ops):
+        with self.lock:
+            self.samples.append(ops)
+
+    def get_ops(self, window):
+        with self.lock:
+            return sum(list(self.samples)[-window:])
+
+
+def fill_dataset_table(agent, table, rows):
+    table.clear()
+    for i, (name, allocation_units, size, used, available) in enumerate(rows):
+        row = table.addRow([agent.Integer32(i + 1)])
+        row.setRowCell(2, agent.DisplayString(name))
+        row.setRowCell(3, agent.Integer32(allocation_units))
+        row.setRowCell(4, agent.Integer32(size))
+        row.setRowCell(5, agent.Integer32(used))
+        row.setRowCell(6, agent.Integer32(available))